@@ -0,0 +1,524 @@
+# -*- coding: utf-8 -*-
+'''
+@author:     look
+
+@copyright:  1999-2020 Alibaba.com. All rights reserved.
+
+@license:    Apache Software License 2.0
+
+@contact:    390125133@qq.com
+'''
+'''
+设备端采集agent：把一个shell脚本推到 /data/local/tmp，在手机上按亚秒级间隔读
+/proc/stat、/proc/<pid>/stat、smaps_rollup、/proc/net/dev 和电池电流，写到分段的环形文件里，
+PC端按采集间隔一次性拉回新增的分段，一次adb命令取回几十个样本，不再每个指标每次采集一个来回
+
+配置 agent=true 时 CpuCollector、MemInfoPackageCollector、TrafficCollecor（/proc/net/dev 方式）、PowerCollector
+改用agent的数据，csv 格式不变，行数按 agent_interval 变多
+'''
+import os
+import sys
+import time
+import queue
+import tempfile
+import threading
+
+BaseDir=os.path.dirname(__file__)
+sys.path.append(os.path.join(BaseDir,'../..'))
+
+from mobileperf.common.log import logger
+
+AGENT_SCRIPT_PATH = "/data/local/tmp/mobileperf_agent.sh"
+AGENT_DIR = "/data/local/tmp/mobileperf_agent"
+
+# 设备端脚本，只用 mksh/toybox 内置的 read、echo、case，每个样本基本不fork进程
+# 记录格式，每个样本以 T 行开始:
+#   T <uptime秒> <cpu核数>
+#   C <user> <nice> <system> <idle> <iowait> <irq> <softirq> <steal>      /proc/stat 第一行，单位jiffies
+#   R <MemTotal:|MemAvailable:> <kB>
+#   P <包名> <pid> <utime> <stime>                                         /proc/<pid>/stat
+#   M <包名> <pid> <pss kB>                                                /proc/<pid>/smaps_rollup，需要root
+#   Q <包名> <pid> <iface>: <rx_bytes> ...                                 /proc/<pid>/net/dev
+#   N <iface>: <rx_bytes> ...                                              /proc/net/dev
+#   B <电量> <电压uV> <温度0.1C> <电流uA>                                  /sys/class/power_supply/battery
+# 每 seg_ticks 个样本换一个分段文件 seg.<序号>，只保留最近 keep 个，PC端来不及拉取时丢弃最旧的
+AGENT_SCRIPT = r'''# mobileperf agent
+cmd=$1
+dir=$2
+case $cmd in
+run)
+    interval=$3
+    seg_ticks=$4
+    keep=$5
+    old_ifs=$IFS
+    IFS=,
+    pkgs=$(echo $6)
+    IFS=$old_ifs
+    mkdir -p $dir
+    rm -f $dir/seg.*
+    echo $$ > $dir/pid
+    # ps 的行里可能有 * 等字符，下面不再需要通配
+    set -f
+    ncpu=0
+    while read -r k rest; do
+        case $k in cpu[0-9]*) ncpu=$((ncpu+1));; esac
+    done < /proc/stat
+    bat=/sys/class/power_supply/battery
+    seq=0
+    tick=0
+    pids=""
+    echo $seq > $dir/cur
+    while [ -f $dir/pid ]; do
+        if [ $((tick % 10)) -eq 0 ]; then
+            # 老版本toolbox没有pidof，用ps找进程名完全相同的进程；toybox的ps要加-A才列出所有进程，
+            # toolbox会把-A当作进程名过滤，只输出表头
+            plist=$(ps -A 2>/dev/null)
+            case $plist in *"
+"*) ;; *) plist=$(ps 2>/dev/null);; esac
+            pids=""
+            IFS='
+'
+            for line in $plist; do
+                IFS=$old_ifs
+                for p in $pkgs; do
+                    case $line in *" $p")
+                        case $pids in *" $p:"*) ;; *) set -- $line; pids="$pids $p:$2";; esac
+                    esac
+                done
+            done
+            IFS=$old_ifs
+        fi
+        {
+            read -r up rest < /proc/uptime
+            echo "T $up $ncpu"
+            read -r c user nice sys idle iow irq sirq steal rest < /proc/stat
+            echo "C $user $nice $sys $idle $iow $irq $sirq $steal"
+            while read -r k v rest; do
+                case $k in MemTotal:|MemAvailable:) echo "R $k $v";; esac
+            done < /proc/meminfo
+            for e in $pids; do
+                p=${e%%:*}
+                pid=${e#*:}
+                [ -z "$pid" ] && continue
+                if [ -r /proc/$pid/stat ]; then
+                    read -r s < /proc/$pid/stat
+                    s=${s##*) }
+                    set -- $s
+                    echo "P $p $pid ${12} ${13}"
+                fi
+                if [ -r /proc/$pid/smaps_rollup ]; then
+                    while read -r k v rest; do
+                        if [ "$k" = "Pss:" ]; then echo "M $p $pid $v"; break; fi
+                    done < /proc/$pid/smaps_rollup
+                fi
+                while read -r line; do
+                    case $line in wlan0:*|rmnet0:*) echo "Q $p $pid $line";; esac
+                done < /proc/$pid/net/dev
+            done
+            while read -r line; do
+                case $line in wlan0:*|rmnet0:*) echo "N $line";; esac
+            done < /proc/net/dev
+            if [ -r $bat/current_now ]; then
+                read -r cap < $bat/capacity
+                read -r vol < $bat/voltage_now
+                read -r tmp < $bat/temp
+                read -r cur < $bat/current_now
+                echo "B $cap $vol $tmp $cur"
+            fi
+        } >> $dir/seg.$seq 2>/dev/null
+        tick=$((tick+1))
+        if [ $((tick % seg_ticks)) -eq 0 ]; then
+            seq=$((seq+1))
+            echo $seq > $dir/cur
+            rm -f $dir/seg.$((seq-keep))
+        fi
+        # 老版本sleep不支持小数
+        sleep $interval 2>/dev/null || sleep 1
+    done
+    ;;
+pull)
+    s=$3
+    read -r cur < $dir/cur
+    while [ $s -lt $cur ]; do
+        if [ -f $dir/seg.$s ]; then
+            echo "S $s"
+            cat $dir/seg.$s
+            rm -f $dir/seg.$s
+        else
+            echo "L $s"
+        fi
+        s=$((s+1))
+    done
+    echo "E $cur"
+    ;;
+stop)
+    if [ -f $dir/pid ]; then
+        read -r pid < $dir/pid
+        rm -f $dir/pid
+        # 正在sleep的agent直接结束，不等下一轮检查pid文件
+        [ -n "$pid" ] && kill -0 $pid 2>/dev/null && kill $pid 2>/dev/null
+    fi
+    ;;
+power)
+    # 高频采集电池电流电压，直接输出到stdout: <uptime秒> <电流uA> <电压uV>
+    interval=$2
+    bat=/sys/class/power_supply/battery
+    while read -r cur < $bat/current_now; do
+        read -r vol < $bat/voltage_now
+        read -r up rest < /proc/uptime
+        echo "$up $cur $vol"
+        sleep $interval 2>/dev/null || sleep 1
+    done
+    ;;
+esac
+'''
+
+
+def deploy_agent_script(adb):
+    '''把agent脚本推到设备上
+    '''
+    script_file = os.path.join(tempfile.gettempdir(), "mobileperf_agent_%d.sh" % os.getpid())
+    # 设备端是sh，换行只能是 \n
+    with open(script_file, "w", encoding="utf-8", newline="\n") as f:
+        f.write(AGENT_SCRIPT)
+    try:
+        adb.push_file(script_file, AGENT_SCRIPT_PATH)
+    finally:
+        os.remove(script_file)
+
+
+def device_clock_offset(adb, clock):
+    '''
+    用一次 cat /proc/uptime 的往返中点对齐设备uptime和PC时间
+    :param clock: PC时钟，如 session.clock
+    :return: PC时间 - 设备uptime，取不到时返回None
+    '''
+    before = clock()
+    out = adb.run_shell_cmd("cat /proc/uptime")
+    after = clock()
+    try:
+        return (before + after) / 2.0 - float(out.split()[0])
+    except (IndexError, ValueError, AttributeError):
+        logger.warning("sync device clock failed: %s" % out)
+        return None
+
+
+class AgentSample(object):
+    '''agent的一个样本
+    '''
+    def __init__(self, uptime, ncpu):
+        self.uptime = uptime
+        self.ncpu = ncpu
+        # PC时间戳，拉取时按设备uptime换算
+        self.timestamp = None
+        self.cpu = None
+        self.meminfo = {}
+        # {包名: (pid, utime, stime)}
+        self.procs = {}
+        # {包名: (pid, pss kB)}
+        self.pss = {}
+        # {包名: (pid, /proc/pid/net/dev 的行)}
+        self.pid_net = {}
+        # /proc/net/dev 中 wlan0 rmnet0 的行
+        self.net = []
+        # (电量, 电压uV, 温度0.1C, 电流uA)
+        self.battery = None
+
+    def net_dev(self):
+        return "\n".join(self.net)
+
+    def pid_net_dev(self, package):
+        return "\n".join(line for pid, line in self.pid_net.get(package, []))
+
+
+def _net_line(line):
+    # wlan0:123 这样冒号后没有空格的统一加上，与 NetDevInfo 的解析一致
+    return line.replace(":", ": ", 1)
+
+
+def parse_agent_output(out):
+    '''
+    解析 pull 的输出
+    :return: (样本列表, 丢失的分段数, 设备端当前分段序号)，输出不完整时序号为None
+    '''
+    samples = []
+    lost = 0
+    cur = None
+    sample = None
+    for line in out.splitlines():
+        items = line.split()
+        if not items:
+            continue
+        tag = items[0]
+        try:
+            if tag == "T":
+                sample = AgentSample(float(items[1]), int(items[2]))
+                samples.append(sample)
+            elif tag == "S":
+                sample = None
+            elif tag == "L":
+                lost += 1
+            elif tag == "E":
+                cur = int(items[1])
+            elif sample is None:
+                continue
+            elif tag == "C":
+                sample.cpu = [int(v) for v in items[1:9]]
+            elif tag == "R":
+                sample.meminfo[items[1].rstrip(":")] = int(items[2])
+            elif tag == "P":
+                sample.procs[items[1]] = (items[2], int(items[3]), int(items[4]))
+            elif tag == "M":
+                sample.pss[items[1]] = (items[2], int(items[3]))
+            elif tag == "Q":
+                sample.pid_net.setdefault(items[1], []).append((items[2], _net_line(" ".join(items[3:]))))
+            elif tag == "N":
+                sample.net.append(_net_line(" ".join(items[1:])))
+            elif tag == "B":
+                sample.battery = tuple(int(v) for v in items[1:5])
+        except (IndexError, ValueError):
+            # 设备端写到一半的行
+            logger.debug("bad agent line: %s" % line)
+    # 没有cpu行的是被截断的样本
+    return [s for s in samples if s.cpu], lost, cur
+
+
+class AgentSubscription(object):
+    '''一个collector对agent数据的订阅
+    '''
+    def __init__(self, name, interval):
+        self.name = name
+        self.interval = interval
+        self._queue = queue.Queue()
+
+    def put(self, samples):
+        self._queue.put(samples)
+
+    def drain(self):
+        samples = []
+        while True:
+            try:
+                samples.extend(self._queue.get_nowait())
+            except queue.Empty:
+                return samples
+
+
+class DeviceAgent(object):
+    '''
+    一台设备上的agent，同一设备的collector共用一个，第一个订阅时启动，最后一个取消订阅时停止
+    '''
+    _agents = {}
+    _agents_lock = threading.Lock()
+
+    def __init__(self, device, session, interval=0.2, pull_interval=1.0, ring_kb=2048):
+        '''
+        :param AndroidDevice device: 设备
+        :param Session session: 测试session，包名从这里取
+        :param float interval: 设备端采样间隔，单位秒
+        :param float pull_interval: PC端拉取间隔，单位秒
+        :param int ring_kb: 设备端环形文件的大小上限，单位KB
+        '''
+        self.device = device
+        self.session = session
+        self.interval = interval
+        self.pull_interval = max(pull_interval, interval)
+        self.ring_kb = ring_kb
+        self.packages = list(session.packages)
+        self.subscriptions = []
+        self.next_seq = 0
+        self.clock_offset = 0
+        self.last_pull = None
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def enabled(session):
+        return str(session.config("agent", "")).lower() == "true"
+
+    @staticmethod
+    def get(device, session, interval):
+        '''
+        获取设备的agent，不存在时按 session 配置创建
+        :param float interval: 订阅者的采集间隔，第一个订阅者决定拉取间隔
+        '''
+        with DeviceAgent._agents_lock:
+            key = device.adb.DEVICEID
+            agent = DeviceAgent._agents.get(key)
+            if not agent:
+                agent = DeviceAgent(device, session, float(session.config("agent_interval", 0.2)), interval,
+                                    int(session.config("agent_ring_kb", 2048)))
+                DeviceAgent._agents[key] = agent
+            return agent
+
+    def subscribe(self, name, interval):
+        subscription = AgentSubscription(name, interval)
+        with self._lock:
+            self.subscriptions.append(subscription)
+            if not self._thread:
+                self.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            last = self.subscriptions == [subscription]
+        if last and self._thread:
+            # 最后一个订阅者，停止前最后一次拉取的样本也交给它
+            self.stop()
+        with self._lock:
+            if subscription in self.subscriptions:
+                self.subscriptions.remove(subscription)
+        with DeviceAgent._agents_lock:
+            if not self.subscriptions and DeviceAgent._agents.get(self.device.adb.DEVICEID) is self:
+                del DeviceAgent._agents[self.device.adb.DEVICEID]
+
+    @property
+    def healthy(self):
+        '''最近3个拉取周期内拉取成功过
+        '''
+        return self.last_pull is not None and time.time() - self.last_pull < 3 * self.pull_interval + 5
+
+    def _seg_ticks(self):
+        return max(1, int(round(self.pull_interval / self.interval)))
+
+    def _keep_segments(self):
+        # 按每个样本约 150 字节 + 每个包 200 字节估算
+        sample_bytes = 150 + 200 * len(self.packages)
+        return max(4, int(self.ring_kb * 1024 / (sample_bytes * self._seg_ticks())))
+
+    def _sync_clock(self):
+        offset = device_clock_offset(self.device.adb, self.session.clock)
+        self.clock_offset = offset if offset is not None else self.session.clock() - time.monotonic()
+
+    def _su_prefix(self):
+        capability = self.device.adb.get_capability()
+        if not capability.shell_root and capability.su_root:
+            # smaps_rollup 和其他应用的 /proc 需要root
+            return "su 0 "
+        return ""
+
+    def _agent_cmd(self, cmd):
+        '''
+        用su启动时agent目录和文件属于root，停止、拉取和清理都要用和启动相同的身份执行
+        '''
+        return '"%s%s"' % (self._su_prefix(), cmd)
+
+    def _launch_cmd(self):
+        return self._agent_cmd("nohup sh %s run %s %s %d %d %s > /dev/null 2>&1 &" % (
+            AGENT_SCRIPT_PATH, AGENT_DIR, self.interval, self._seg_ticks(), self._keep_segments(),
+            ",".join(self.packages)))
+
+    def deploy(self):
+        deploy_agent_script(self.device.adb)
+
+    def start(self):
+        logger.info("start device agent, interval %ss, pull every %ss" % (self.interval, self.pull_interval))
+        self.deploy()
+        self._sync_clock()
+        self.device.adb.run_shell_cmd(self._agent_cmd("sh %s stop %s" % (AGENT_SCRIPT_PATH, AGENT_DIR)))
+        self.device.adb.run_shell_cmd(self._launch_cmd())
+        self.next_seq = 0
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._pull_thread, name="device_agent")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        logger.info("stop device agent")
+        self._stop_event.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=self.pull_interval + 5)
+        self._thread = None
+        self.device.adb.run_shell_cmd(self._agent_cmd("sh %s stop %s" % (AGENT_SCRIPT_PATH, AGENT_DIR)))
+        self.device.adb.run_shell_cmd(self._agent_cmd("rm -rf %s" % AGENT_DIR))
+
+    def pull(self):
+        '''
+        拉取设备端新完成的分段
+        :return: 样本列表，拉取失败返回None
+        '''
+        out = self.device.adb.run_shell_cmd(self._agent_cmd("sh %s pull %s %d" % (AGENT_SCRIPT_PATH, AGENT_DIR, self.next_seq)),
+                                            timeout=self.pull_interval * 2 + 5)
+        if not out:
+            return None
+        samples, lost, cur = parse_agent_output(out)
+        if cur is None:
+            return None
+        if cur < self.next_seq:
+            # 设备重启或agent被重新拉起，序号从0开始
+            logger.warning("device agent restarted, seq %d -> %d" % (self.next_seq, cur))
+            self._sync_clock()
+        self.next_seq = cur
+        for sample in samples:
+            sample.timestamp = sample.uptime + self.clock_offset
+        metrics = self.session.metrics
+        metrics.inc("agent_samples", len(samples))
+        if lost:
+            metrics.inc("agent_lost_segments", lost)
+            logger.warning("device agent ring overrun, %d segments lost" % lost)
+        self.last_pull = time.time()
+        return samples
+
+    def _pull_thread(self):
+        ticker = self.session.ticker("agent_pull", self.pull_interval, self._stop_event)
+        while True:
+            if ticker.next() is None:
+                break
+            try:
+                samples = self.pull()
+            except Exception as e:
+                logger.error("device agent pull failed: %s" % e)
+                samples = None
+            if samples is None:
+                ticker.fail("agent pull failed", self.device.adb.is_offline())
+                continue
+            ticker.ok()
+            if samples:
+                with self._lock:
+                    subscriptions = list(self.subscriptions)
+                for subscription in subscriptions:
+                    subscription.put(samples)
+        # 停止前把已完成的分段取回
+        try:
+            samples = self.pull()
+            if samples:
+                with self._lock:
+                    subscriptions = list(self.subscriptions)
+                for subscription in subscriptions:
+                    subscription.put(samples)
+        except Exception as e:
+            logger.debug("device agent final pull failed: %s" % e)
+
+    def collect(self, name, interval, stop_event, end_time, on_samples, on_gap):
+        '''
+        collector 的agent采集循环，代替原来每个节拍执行一次adb命令
+        :param str name: collector名
+        :param float interval: collector的采集间隔，每个节拍处理这段时间内agent的所有样本
+        :param threading.Event stop_event: collector的停止信号
+        :param float end_time: 超时时间
+        :param on_samples: 回调 on_samples(samples)，写这批样本的数据
+        :param on_gap: 回调 on_gap(collection_time)，agent拉取中断时写数据断点
+        '''
+        subscription = self.subscribe(name, interval)
+        ticker = self.session.ticker(name, interval, stop_event)
+        try:
+            while time.time() < end_time:
+                collection_time = ticker.next()
+                if collection_time is None:
+                    break
+                samples = subscription.drain()
+                if samples:
+                    ticker.ok()
+                    try:
+                        on_samples(samples)
+                    except Exception as e:
+                        logger.error("%s handle agent samples failed: %s" % (name, e))
+                elif not self.healthy and self.last_pull is not None:
+                    if ticker.fail("device agent not responding", self.device.adb.is_offline()):
+                        on_gap(collection_time)
+        finally:
+            self.unsubscribe(subscription)
+            # stop 时剩下的样本也写掉
+            samples = subscription.drain()
+            if samples:
+                on_samples(samples)
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+'''
+@author:     look
+
+@copyright:  1999-2020 Alibaba.com. All rights reserved.
+
+@license:    Apache Software License 2.0
+
+@contact:    390125133@qq.com
+'''
+'''
+按前台页面归因：current_activity.csv 由页面监控线程按自己的节拍写入，和其他数据不在同一时刻采集，
+用页面变化时刻建一个有序的区间索引，把 cpuinfo、meminfo、fps、traffic、fd、thread 的每个采样点
+归到采样时刻所在的页面，汇总出每个页面的cpu、pss增长、帧率、卡顿率和流量
+'''
+import os
+import sys
+import csv
+import json
+import bisect
+import statistics
+
+BaseDir=os.path.dirname(__file__)
+sys.path.append(os.path.join(BaseDir,'../..'))
+
+from mobileperf.common.log import logger
+from mobileperf.common.utils import TimeUtils
+from mobileperf.common import stats
+from mobileperf.android.globaldata import Session
+
+USAGE = '''用法: python3 mobileperf/android/attribution.py 结果目录'''
+
+UNKNOWN = "unknown"
+
+SUMMARY_TITLE = ["activity", "duration(s)", "visits", "cpu_mean%", "cpu_p95%", "pss_mean(MB)", "pss_delta(MB)",
+                 "fps_median", "jank_rate%", "traffic(KB)", "fd_mean", "thread_mean"]
+
+
+class ActivityTimeline(object):
+    '''
+    前台页面的区间索引：相邻的相同页面合并成一个区间 [start, end)，按开始时间排序，用二分查找定位
+    '''
+
+    def __init__(self, samples):
+        '''
+        :param list samples: [(时间戳, 页面)]，页面为空表示没取到
+        '''
+        self.starts = []
+        self.ends = []
+        self.activities = []
+        samples = sorted(samples, key=lambda sample: sample[0])
+        for timestamp, activity in samples:
+            activity = activity if activity else UNKNOWN
+            if self.activities and self.activities[-1] == activity:
+                self.ends[-1] = timestamp
+                continue
+            if self.ends:
+                # 上一个页面持续到这个页面第一次被采集到
+                self.ends[-1] = timestamp
+            self.starts.append(timestamp)
+            self.ends.append(timestamp)
+            self.activities.append(activity)
+        if len(samples) > 1:
+            # 最后一次采集到的页面再持续一个采集间隔
+            self.ends[-1] += statistics.median([after[0] - before[0] for before, after in zip(samples, samples[1:])])
+
+    def __len__(self):
+        return len(self.starts)
+
+    def index_at(self, timestamp):
+        '''timestamp 所在区间的下标，在第一个页面之前或最后一次采集之后返回 -1
+        '''
+        index = bisect.bisect_right(self.starts, timestamp) - 1
+        if index < 0 or (index == len(self.starts) - 1 and timestamp > self.ends[index]):
+            return -1
+        return index
+
+    def activity_at(self, timestamp):
+        index = self.index_at(timestamp)
+        return self.activities[index] if index >= 0 else UNKNOWN
+
+    def durations(self):
+        '''每个页面的累计停留时长和进入次数
+        '''
+        result = {}
+        for start, end, activity in zip(self.starts, self.ends, self.activities):
+            total = result.setdefault(activity, [0, 0])
+            total[0] += end - start
+            total[1] += 1
+        return result
+
+
+def read_samples(csv_file, value_names):
+    '''
+    读取csv的时间和指定列，多包的表按 Session.row_to_values 的规则把各包的同名列相加
+    断点行（除时间外为空）和解析失败的行跳过，同一时刻的多行（fd_num.csv 每个包一行）合并相加
+    :param list value_names: 列名，如 pid_cpu%
+    :return: [(时间戳, {列名: 值})]，按时间排序
+    '''
+    if not os.path.exists(csv_file):
+        return []
+    merged = {}
+    with open(csv_file, "r", encoding="utf-8", errors="ignore") as f:
+        reader = csv.reader(f)
+        title = None
+        for row in reader:
+            if not row:
+                continue
+            if row[0] in ("datetime", "datatime"):
+                # 每次启动测试都会追加一行表头
+                title = row
+                continue
+            if not title:
+                continue
+            try:
+                timestamp = TimeUtils.getTimeStamp(row[0], TimeUtils.NormalFormatter)
+            except ValueError:
+                continue
+            values = merged.setdefault(timestamp, {})
+            for key, value in Session.row_to_values(title[1:], row[1:]).items():
+                for name in value_names:
+                    if key == name or key.endswith(":" + name):
+                        try:
+                            values[name] = values.get(name, 0) + float(value)
+                        except ValueError:
+                            pass
+    return sorted((timestamp, values) for timestamp, values in merged.items() if values)
+
+
+class ActivityAttribution(object):
+    '''
+    读取结果目录中的csv，按前台页面汇总，结果写到 activity_summary.csv 和 activity_summary.json
+    '''
+
+    def __init__(self, csv_dir):
+        self.csv_dir = csv_dir
+        self.timeline = ActivityTimeline(self._read_activities())
+
+    def _path(self, name):
+        return os.path.join(self.csv_dir, name)
+
+    def _read_activities(self):
+        samples = []
+        activity_file = self._path("current_activity.csv")
+        if not os.path.exists(activity_file):
+            return samples
+        with open(activity_file, "r", encoding="utf-8", errors="ignore") as f:
+            for row in csv.reader(f):
+                if len(row) < 2 or row[0] == "datetime":
+                    continue
+                try:
+                    samples.append((TimeUtils.getTimeStamp(row[0], TimeUtils.NormalFormatter), row[1]))
+                except ValueError:
+                    continue
+        return samples
+
+    def _by_activity(self, samples, name):
+        '''每个采样点的值归到采样时刻的页面
+        '''
+        result = {}
+        for timestamp, values in samples:
+            if name in values:
+                result.setdefault(self.timeline.activity_at(timestamp), []).append(values[name])
+        return result
+
+    def _deltas_by_activity(self, samples, name, clamp=False):
+        '''
+        累计值（流量）或状态值（pss）相邻两次采样的差值，归到两次采样中点所在的页面
+        :param bool clamp: 计数器在进程重启后从0开始，负的差值按0算
+        '''
+        result = {}
+        points = [(timestamp, values[name]) for timestamp, values in samples if name in values]
+        for (before, before_value), (after, after_value) in zip(points, points[1:]):
+            delta = after_value - before_value
+            if clamp and delta < 0:
+                delta = 0
+            activity = self.timeline.activity_at((before + after) / 2.0)
+            result[activity] = result.get(activity, 0) + delta
+        return result
+
+    def _jank_rate(self, samples):
+        '''卡顿帧数占总帧数的比例，帧数 = fps * 与上一次采样的间隔
+        '''
+        frames = {}
+        janks = {}
+        points = [(timestamp, values) for timestamp, values in samples if "fps" in values]
+        for (before, _), (after, values) in zip(points, points[1:]):
+            activity = self.timeline.activity_at(after)
+            frames[activity] = frames.get(activity, 0) + values["fps"] * (after - before)
+            janks[activity] = janks.get(activity, 0) + values.get("jank", 0)
+        return {activity: janks[activity] * 100.0 / frames[activity] for activity in frames if frames[activity]}
+
+    def summarize(self):
+        '''
+        :return: [[SUMMARY_TITLE 对应的值]]，按平均cpu从高到低，没有页面数据时返回空列表
+        '''
+        if not len(self.timeline):
+            logger.info("no current_activity.csv in %s, skip activity attribution" % self.csv_dir)
+            return []
+        cpu = self._by_activity(read_samples(self._path("cpuinfo.csv"), ["pid_cpu%"]), "pid_cpu%")
+        mem_samples = read_samples(self._path("meminfo.csv"), ["pid_pss(MB)"])
+        pss = self._by_activity(mem_samples, "pid_pss(MB)")
+        pss_delta = self._deltas_by_activity(mem_samples, "pid_pss(MB)")
+        fps_samples = read_samples(self._path("fps.csv"), ["fps", "jank"])
+        fps = self._by_activity(fps_samples, "fps")
+        jank_rate = self._jank_rate(fps_samples)
+        # dev方式的流量在 traffic.csv，xt_qtaguid 方式在 traffics_uid.csv，都是从测试开始的累计值
+        traffic_samples = read_samples(self._path("traffic.csv"), ["pid_total(KB)"])
+        traffic_name = "pid_total(KB)"
+        if not traffic_samples:
+            traffic_samples = read_samples(self._path("traffics_uid.csv"), ["uid_total(KB)"])
+            traffic_name = "uid_total(KB)"
+        traffic = self._deltas_by_activity(traffic_samples, traffic_name, clamp=True)
+        fd = self._by_activity(read_samples(self._path("fd_num.csv"), ["fd_num"]), "fd_num")
+        thread = self._by_activity(read_samples(self._path("thread_num.csv"), ["thread_num"]), "thread_num")
+
+        def mean(values):
+            return round(statistics.mean(values), 2) if values else ""
+
+        def rounded(value, digits=2):
+            return round(value, digits) if value is not None else ""
+
+        durations = self.timeline.durations()
+        activities = set(durations) | set(cpu) | set(pss) | set(fps) | set(traffic)
+        rows = []
+        for activity in activities:
+            duration, visits = durations.get(activity, (0, 0))
+            rows.append([activity, round(duration, 1), visits,
+                         mean(cpu.get(activity)), rounded(stats.percentile(cpu.get(activity, []), 95)),
+                         mean(pss.get(activity)), rounded(pss_delta.get(activity)),
+                         rounded(statistics.median(fps[activity]) if fps.get(activity) else None),
+                         rounded(jank_rate.get(activity)), rounded(traffic.get(activity)),
+                         mean(fd.get(activity)), mean(thread.get(activity))])
+        rows.sort(key=lambda row: (-(row[3] if row[3] != "" else -1), -row[1]))
+        return rows
+
+    def save(self):
+        '''写 activity_summary.csv（报告中的汇总表）和 activity_summary.json（web接口）
+        '''
+        rows = self.summarize()
+        if not rows:
+            return rows
+        with open(self._path("activity_summary.csv"), "w", encoding="utf-8") as f:
+            writer = csv.writer(f, lineterminator='\n')
+            writer.writerow(SUMMARY_TITLE)
+            writer.writerows(rows)
+        with open(self._path("activity_summary.json"), "w", encoding="utf-8") as f:
+            json.dump({"title": SUMMARY_TITLE, "activities": [dict(zip(SUMMARY_TITLE, row)) for row in rows]},
+                      f, indent=2, ensure_ascii=False)
+        logger.info("activity attribution of %d activities saved in %s" % (len(rows), self.csv_dir))
+        return rows
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(USAGE)
+        sys.exit(2)
+    for row in [SUMMARY_TITLE] + ActivityAttribution(sys.argv[1]).save():
+        print("\t".join(str(value) for value in row))
@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+'''
+@author:     look
+
+@copyright:  1999-2020 Alibaba.com. All rights reserved.
+
+@license:    Apache Software License 2.0
+
+@contact:    390125133@qq.com
+'''
+'''
+版本对比：第一个结果目录是基线，其余每个目录和基线比较，用各次测试的 metric_summary.json（采集时流式计算的
+DDSketch）做 Mann-Whitney U 检验，不需要重新读csv，多天的测试也能很快出结果；有 activity_summary.json 时
+再按页面对比。变化超过阈值且显著的判为劣化（regression）或优化（improvement）
+同一个参数中用逗号连接多个目录表示合并为一组，如基线取最近3次测试
+'''
+import os
+import sys
+import csv
+import json
+import math
+
+BaseDir=os.path.dirname(__file__)
+sys.path.append(os.path.join(BaseDir,'../..'))
+
+from mobileperf.common.log import logger
+from mobileperf.common.utils import FileUtils
+from mobileperf.common.sketch import SketchSink, SUMMARY_JSON
+
+USAGE = '''用法: python3 mobileperf/android/compare.py [--package 包名] [--threshold 0.1] [--alpha 0.05]
+        [--metrics cpuinfo,meminfo] [--output compare.csv] 基线目录 对比目录 [对比目录 ...]
+目录可以是完整路径，指定 --package 时也可以只写 results/<包名>/ 下的时间戳目录名'''
+
+COMPARE_TITLE = ["candidate", "scope", "metric", "column", "baseline_n", "candidate_n", "baseline_mean",
+                 "candidate_mean", "delta_mean%", "baseline_p50", "candidate_p50", "baseline_p95", "candidate_p95",
+                 "delta_p95%", "p_value", "verdict"]
+
+REGRESSION = "regression"
+IMPROVEMENT = "improvement"
+OK = "ok"
+
+# 值越大越好的列，其余列值越大越差
+HIGHER_IS_BETTER = ("fps", "fps_median", "free_ram(MB)", "idle%")
+# 老的结果目录没有 metric_summary.json 时从csv计算，这些csv不是采集数据
+NON_METRIC_CSV = ("tool_metrics.csv", "collector_health.csv", "current_activity.csv", "metric_summary.csv",
+                  "activity_summary.csv", "energy_activity.csv", "launch_bench.csv", "launch_summary.csv")
+# activity_summary 中对比的列
+ACTIVITY_COLUMNS = ("cpu_mean%", "cpu_p95%", "pss_mean(MB)", "pss_delta(MB)", "fps_median", "jank_rate%",
+                    "traffic(KB)")
+
+
+def mann_whitney(baseline, candidate):
+    '''
+    两个 DDSketch 的 Mann-Whitney U 检验，同一个桶内的值按相等处理（秩取平均并做结的修正），正态近似
+    采集数据是时间序列，相邻样本并不独立，p值偏乐观，所以判定时还要求变化幅度超过阈值
+    :return: (双侧p值, 对比组大于基线的概率)，数据不足时返回 (None, None)
+    '''
+    n1, n2 = baseline.count, candidate.count
+    if n1 < 2 or n2 < 2:
+        return None, None
+    groups = {}
+
+    def collect(sketch, index):
+        # 按数值从小到大排序的键：负数的桶号越大值越小
+        for key, count in sketch.negative_bins.items():
+            groups.setdefault((0, -key), [0, 0])[index] += count
+        if sketch.zero_count:
+            groups.setdefault((1, 0), [0, 0])[index] += sketch.zero_count
+        for key, count in sketch.bins.items():
+            groups.setdefault((2, key), [0, 0])[index] += count
+
+    collect(baseline, 0)
+    collect(candidate, 1)
+    total = n1 + n2
+    seen = 0
+    rank_sum = 0.0
+    ties = 0.0
+    for key in sorted(groups):
+        count1, count2 = groups[key]
+        tied = count1 + count2
+        rank_sum += count2 * (seen + (tied + 1) / 2.0)
+        ties += tied ** 3 - tied
+        seen += tied
+    u = rank_sum - n2 * (n2 + 1) / 2.0
+    mean = n1 * n2 / 2.0
+    variance = n1 * n2 / 12.0 * ((total + 1) - ties / (total * (total - 1)))
+    if variance <= 0:
+        return 1.0, 0.5
+    z = (abs(u - mean) - 0.5) / math.sqrt(variance)
+    return math.erfc(max(z, 0) / math.sqrt(2)), u / (n1 * n2)
+
+
+def relative_delta(baseline, candidate):
+    '''相对变化，百分比'''
+    if baseline in (None, "") or candidate in (None, ""):
+        return None
+    if baseline == 0:
+        return 0.0 if candidate == 0 else None
+    return round((candidate - baseline) * 100.0 / abs(baseline), 2)
+
+
+def verdict(column, delta, p_value, threshold, alpha):
+    '''
+    :param float delta: 相对变化百分比
+    :param float p_value: 没有分布数据（如页面汇总）时为None，只看阈值
+    '''
+    if delta is None:
+        return "n/a"
+    if abs(delta) < threshold * 100 or (p_value is not None and p_value >= alpha):
+        return OK
+    worse = delta < 0 if column.split(":")[-1] in HIGHER_IS_BETTER else delta > 0
+    return REGRESSION if worse else IMPROVEMENT
+
+
+class RunSummary(object):
+    '''一次或合并的多次测试的汇总数据
+    '''
+
+    def __init__(self, run_dirs):
+        self.run_dirs = run_dirs
+        self.name = ",".join(os.path.basename(os.path.normpath(run_dir)) for run_dir in run_dirs)
+        self.summaries = {}
+        self.activities = {}
+        for run_dir in run_dirs:
+            for name, summary in self.load_summaries(run_dir).items():
+                if name in self.summaries:
+                    self.summaries[name].merge(summary)
+                else:
+                    self.summaries[name] = summary
+            self._load_activities(run_dir)
+
+    @staticmethod
+    def load_summaries(run_dir):
+        '''
+        读取 metric_summary.json，老的结果目录没有时从csv计算一次并保存，下次直接读取
+        '''
+        json_file = os.path.join(run_dir, SUMMARY_JSON)
+        if os.path.exists(json_file):
+            return SketchSink.load(json_file)
+        logger.info("no %s in %s, build it from csv" % (SUMMARY_JSON, run_dir))
+        sink = SketchSink(run_dir)
+        for file_name in sorted(os.listdir(run_dir)):
+            if not file_name.endswith(".csv") or file_name in NON_METRIC_CSV:
+                continue
+            metric = file_name[:-len(".csv")]
+            with open(os.path.join(run_dir, file_name), "r", encoding="utf-8", errors="ignore") as f:
+                title = None
+                for row in csv.reader(f):
+                    if not row:
+                        continue
+                    if row[0] in ("datetime", "datatime"):
+                        title = row
+                    elif title:
+                        sink(metric, None, title, row)
+        sink.save()
+        return sink.summaries
+
+    def _load_activities(self, run_dir):
+        '''合并多次测试的页面汇总，按停留时长加权平均
+        '''
+        json_file = os.path.join(run_dir, "activity_summary.json")
+        if not os.path.exists(json_file):
+            return
+        with open(json_file, "r", encoding="utf-8") as f:
+            for row in json.load(f).get("activities", []):
+                merged = self.activities.setdefault(row["activity"], {"duration(s)": 0})
+                weight = row.get("duration(s)") or 0
+                total = merged["duration(s)"] + weight
+                for column in ACTIVITY_COLUMNS:
+                    value = row.get(column)
+                    if value in (None, ""):
+                        continue
+                    if column not in merged or not total:
+                        merged[column] = value
+                    else:
+                        merged[column] = (merged[column] * merged["duration(s)"] + value * weight) / total
+                merged["duration(s)"] = total
+
+
+class RunComparator(object):
+
+    def __init__(self, baseline_dirs, candidate_groups, threshold=0.1, alpha=0.05, metrics=None):
+        '''
+        :param list baseline_dirs: 基线的结果目录，多个时合并
+        :param list candidate_groups: [[结果目录]]，每组和基线对比
+        :param float threshold: 相对变化阈值，0.1 表示10%
+        :param float alpha: 显著性水平
+        :param list metrics: 只对比这些数据，如 cpuinfo meminfo，为空时对比全部
+        '''
+        self.baseline = RunSummary(baseline_dirs)
+        self.candidates = [RunSummary(dirs) for dirs in candidate_groups]
+        self.threshold = threshold
+        self.alpha = alpha
+        self.metrics = metrics
+
+    def compare(self):
+        '''
+        :return: [[COMPARE_TITLE 对应的值]]
+        '''
+        rows = []
+        for candidate in self.candidates:
+            rows.extend(self._compare_metrics(candidate))
+            rows.extend(self._compare_activities(candidate))
+        return rows
+
+    def _compare_metrics(self, candidate):
+        rows = []
+        for name in sorted(set(self.baseline.summaries) & set(candidate.summaries)):
+            metric, column = name.split("/", 1)
+            if self.metrics and metric not in self.metrics:
+                continue
+            base = self.baseline.summaries[name]
+            current = candidate.summaries[name]
+            p_value, _ = mann_whitney(base.sketch, current.sketch)
+            base_result = base.summary()
+            current_result = current.summary()
+            delta_mean = relative_delta(base_result["mean"], current_result["mean"])
+            rows.append([candidate.name, "all", metric, column, base_result["count"], current_result["count"],
+                         base_result["mean"], current_result["mean"], delta_mean,
+                         base_result["p50"], current_result["p50"], base_result["p95"], current_result["p95"],
+                         relative_delta(base_result["p95"], current_result["p95"]),
+                         round(p_value, 6) if p_value is not None else "",
+                         verdict(column, delta_mean, p_value, self.threshold, self.alpha)])
+        return rows
+
+    def _compare_activities(self, candidate):
+        if self.metrics and "activity_summary" not in self.metrics:
+            return []
+        rows = []
+        for activity in sorted(set(self.baseline.activities) & set(candidate.activities)):
+            base = self.baseline.activities[activity]
+            current = candidate.activities[activity]
+            for column in ACTIVITY_COLUMNS:
+                if column not in base or column not in current:
+                    continue
+                delta = relative_delta(base[column], current[column])
+                rows.append([candidate.name, activity, "activity_summary", column, "", "",
+                             round(base[column], 2), round(current[column], 2), delta, "", "", "", "", "", "",
+                             verdict(column, delta, None, self.threshold, self.alpha)])
+        return rows
+
+    @staticmethod
+    def regressions(rows):
+        return [row for row in rows if row[-1] == REGRESSION]
+
+
+def resolve_run_dir(name, package=None):
+    '''完整路径直接返回，否则在 results/<包名>/ 下查找
+    '''
+    if os.path.isdir(name):
+        return name
+    if package:
+        run_dir = os.path.join(FileUtils.get_top_dir(), "results", package, name)
+        if os.path.isdir(run_dir):
+            return run_dir
+    raise ValueError("result dir not found: %s" % name)
+
+
+def format_table(rows, only_changed=False):
+    lines = ["%-20s %-24s %-10s %-36s %10s %10s %9s %10s %10s %12s" % (
+        "candidate", "scope", "metric", "column", "base_mean", "cur_mean", "delta%", "p_value", "delta_p95%", "verdict")]
+    for row in rows:
+        if only_changed and row[-1] == OK:
+            continue
+        lines.append("%-20s %-24s %-10s %-36s %10s %10s %9s %10s %10s %12s" % (
+            row[0][-20:], row[1][-24:], row[2][:10], row[3][-36:], row[6], row[7], row[8], row[14], row[13], row[15]))
+    return "\n".join(lines)
+
+
+def main(argv):
+    options = {"--package": None, "--threshold": "0.1", "--alpha": "0.05", "--metrics": None, "--output": None}
+    positional = []
+    i = 0
+    while i < len(argv):
+        if argv[i] in options and i + 1 < len(argv):
+            options[argv[i]] = argv[i + 1]
+            i += 1
+        elif argv[i].startswith("--"):
+            print(USAGE)
+            return 2
+        else:
+            positional.append(argv[i])
+        i += 1
+    if len(positional) < 2:
+        print(USAGE)
+        return 2
+    try:
+        groups = [[resolve_run_dir(name, options["--package"]) for name in arg.split(",") if name]
+                  for arg in positional]
+    except ValueError as e:
+        print(e)
+        print(USAGE)
+        return 2
+    metrics = options["--metrics"].split(",") if options["--metrics"] else None
+    comparator = RunComparator(groups[0], groups[1:], float(options["--threshold"]), float(options["--alpha"]),
+                               metrics)
+    rows = comparator.compare()
+    print(format_table(rows))
+    if options["--output"]:
+        with open(options["--output"], "w", encoding="utf-8") as f:
+            writer = csv.writer(f, lineterminator='\n')
+            writer.writerow(COMPARE_TITLE)
+            writer.writerows(rows)
+    regressions = RunComparator.regressions(rows)
+    for row in regressions:
+        print("REGRESSION %s %s %s/%s %s%%" % (row[0], row[1], row[2], row[3], row[8]))
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -21,10 +21,11 @@ from datetime import datetime
 BaseDir=os.path.dirname(__file__)
 sys.path.append(os.path.join(BaseDir,'../..'))
 
-from mobileperf.android.tools.androiddevice import AndroidDevice
 from mobileperf.common.utils import TimeUtils,FileUtils
 from mobileperf.common.log import logger
-from mobileperf.android.globaldata import RuntimeData
+from mobileperf.common.scheduler import gap_row, command_budget
+from mobileperf.android.globaldata import Session
+from mobileperf.android.agent import DeviceAgent
 
 class DeviceCpuinfo(object):
     pass
@@ -74,6 +75,13 @@ class PckCpuinfo(object):
         # self.sum_procs_cpurate()
 
 
+    @staticmethod
+    def filter_patterns(packages):
+        '''
+        设备端过滤top输出时保留的行：整机cpu行（8.0以下 User x%，8.0及以上 x%cpu）、含PID的表头和各包名的行
+        '''
+        return ["User ", "%cpu", "PID"] + list(packages)
+
     def _parse_package(self):
         '''
         解析top命令中的包的cpu信息
@@ -242,25 +250,29 @@ class CpuCollector(object):
     '''
     通过top命令搜集cpu信息的一个类
     '''
-    def __init__(self, device, packages, interval=1, timeout=24*60*60):
+    def __init__(self, device, packages, interval=1, timeout=24*60*60, session=None):
         '''
 
         :param device: 具体的设备实例
         :param packages: 应用的包名列表
         :param interval: 数据采集的频率
         :param timeout: 采集的超时，超过这个时间，任务会停止采集,默认是24个小时
+        :param session: 测试上下文，为空时使用全局的RuntimeData
         '''
         self.device = device
+        self.session = session if session else Session.default()
         self.packages = packages
         self._interval = interval
         self._timeout = timeout
         self._stop_event = threading.Event()
         self.cpu_list = []
+        # top -d 本身要等一个采集间隔，超过间隔加上命令超时时间还没返回就结束top
+        self._cmd_timeout = command_budget(interval)
         self.sdkversion = self.get_sdkversion()
         # top可能会有进程名显示不全的问题 加-b即可
-        self.top_cmd = 'top -b -n 1 -d %d' % self._interval
-        ret = self.device.adb.run_shell_cmd(self.top_cmd)
-        if ret and 'Invalid argument "-b"' in ret:
+        if self.device.adb.get_capability().top_b:
+            self.top_cmd = 'top -b -n 1 -d %d' % self._interval
+        else:
             logger.debug("top -b not support")
             self.top_cmd = 'top -n 1 -d %d' % self._interval
         logger.debug("sdk version : " +str(self.sdkversion))
@@ -293,30 +305,53 @@ class CpuCollector(object):
 
         if hasattr(self, "_top_pipe"):
             if self._top_pipe.poll() == None:#查看top进程是否仍然存在，如果还存在，就结束掉
-                self._top_pipe.terminate()
+                self.device.adb.kill_process_tree(self._top_pipe)
 
     def _top_cpuinfo(self):
-        self._top_pipe = self.device.adb.run_shell_cmd(self.top_cmd, sync=False)
-        out = self._top_pipe.stdout.read()
-        error = self._top_pipe.stderr.read()
+        self._top_pipe = self.device.adb.run_filtered_shell_cmd(self.top_cmd, PckCpuinfo.filter_patterns(self.packages),
+                                                                sync=False)
+        # 异步命令没有超时，用定时器结束卡住的top，read随之返回
+        timeout = self._interval + self._cmd_timeout
+        killed = []
+        def _kill_top(pipe):
+            killed.append(True)
+            self.device.adb.kill_process_tree(pipe)
+        timer = threading.Timer(timeout, _kill_top, (self._top_pipe,))
+        timer.daemon = True
+        timer.start()
+        try:
+            out = self._top_pipe.stdout.read()
+            error = self._top_pipe.stderr.read()
+        finally:
+            timer.cancel()
+        self.session.metrics.inc("adb_bytes_read", len(out) + len(error))
+        self.session.metrics.inc("adb_bytes_read:shell top", len(out) + len(error))
+        if killed:
+            self.session.metrics.inc("adb_timeouts")
+            self.session.metrics.inc("adb_timeouts:shell top")
+            logger.warning("top timeout after %ss, killed" % timeout)
+            return
         if error:
             logger.error("into cpuinfos error : "+str(error))
             return
         out = str(out,"utf-8")
         out.replace('\r','')
-        top_file = os.path.join(RuntimeData.package_save_path, 'top.txt')
+        top_file = os.path.join(self.session.package_save_path, 'top.txt')
         with open(top_file, "a+",encoding="utf-8") as writer:
             writer.write(TimeUtils.getCurrentTime() + " top info:\n")
             writer.write(out + "\n\n")
         #避免文件过大，超过100M清理
         if FileUtils.get_FileSize(top_file)>100:
             os.remove(top_file)
-        return PckCpuinfo(self.packages, out, self.sdkversion)
+        before = time.time()
+        cpu_info = PckCpuinfo(self.packages, out, self.sdkversion)
+        self.session.metrics.record_parse("cpu", len(out), time.time() - before)
+        return cpu_info
 
     def get_max_freq(self):
         out = self.device.adb.run_shell_cmd("cat /sys/devices/system/cpu/cpu0/cpufreq/scaling_max_freq")
         out.replace('\r', '')
-        max_freq_file = os.path.join(RuntimeData.package_save_path, 'scaling_max_freq.txt')
+        max_freq_file = os.path.join(self.session.package_save_path, 'scaling_max_freq.txt')
         with open(max_freq_file, "a+",encoding="utf-8") as writer:
             writer.write(TimeUtils.getCurrentTime() + " scaling_max_freq:\n")
             writer.write(out + "\n\n")
@@ -328,7 +363,7 @@ class CpuCollector(object):
         '''
         end_time = time.time() + self._timeout
         cpu_title = ["datetime", "device_cpu_rate%", "user%", "system%","idle%"]
-        cpu_file = os.path.join(RuntimeData.package_save_path, 'cpuinfo.csv')
+        cpu_file = os.path.join(self.session.package_save_path, 'cpuinfo.csv')
         for i in range(0, len(self.packages)):
             cpu_title.extend(["package", "pid", "pid_cpu%"])
         if len(self.packages) > 1:
@@ -338,8 +373,16 @@ class CpuCollector(object):
                 csv.writer(df, lineterminator='\n').writerow(cpu_title)
         except RuntimeError as e:
             logger.error(e)
+        if DeviceAgent.enabled(self.session):
+            self._collect_cpu_from_agent(cpu_file, cpu_title, end_time)
+            return
+        # top -d 本身会等待一个采集间隔，命令耗时基本等于间隔，只要没有错过下一个周期就立即发起下一次
+        ticker = self.session.ticker("cpu", self._interval, self._stop_event)
         while not self._stop_event.is_set() and time.time() < end_time:
             try:
+                collection_time = ticker.next()
+                if collection_time is None:
+                    break
                 logger.debug("---------------cpuinfos, into _collect_package_cpu_thread loop thread is : " + str(threading.current_thread().name))
                 before = time.time()
                 #为了cpu值的准确性，将采集的时间间隔放在top命令中了
@@ -349,8 +392,13 @@ class CpuCollector(object):
                 logger.debug("  ============== time consume for cpu info : "+str(time_consume))
                 if cpu_info == None or cpu_info.source == '' or not cpu_info.package_list:
                     logger.debug("cpuinfos, can't get cpu info, continue")
+                    # 连续失败时退避，不再立即重试；数据从这里断开时写入断点
+                    if ticker.fail("can't get cpu info", self.device.adb.is_offline()):
+                        with open(cpu_file, 'a+', encoding="utf-8") as df:
+                            csv.writer(df, lineterminator='\n').writerow(gap_row(collection_time, len(cpu_title)))
                     continue
-                self.cpu_list.extend([TimeUtils.getCurrentTime(), str(cpu_info.device_cpu_rate), cpu_info.user_rate, cpu_info.system_rate,cpu_info.idle_rate])
+                ticker.ok()
+                self.cpu_list.extend([TimeUtils.formatTimeStamp(collection_time), str(cpu_info.device_cpu_rate), cpu_info.user_rate, cpu_info.system_rate,cpu_info.idle_rate])
                 for i in range(0, len(self.packages)):
                     if len(cpu_info.package_list)==len(self.packages):
                         self.cpu_list.extend([cpu_info.package_list[i]["package"],cpu_info.package_list[i]["pid"],cpu_info.package_list[i]["pid_cpu"]])
@@ -361,41 +409,94 @@ class CpuCollector(object):
                 try:
                     with open(cpu_file, 'a+',encoding="utf-8") as df:
                         csv.writer(df, lineterminator='\n').writerow(self.cpu_list)
-                        del self.cpu_list[:]
                 except RuntimeError as e:
                     logger.error(e)
+                self.session.emit("cpuinfo", collection_time, cpu_title, self.cpu_list)
+                del self.cpu_list[:]
 
                 # self.get_max_freq()
-                delta_inter = self._interval - time_consume
-                if delta_inter > 0:
-                    time.sleep(delta_inter)
             except Exception as e:
                 logger.error("an exception hanpend in cpu thread , reason unkown!, e:")
                 logger.error(e)
                 s = traceback.format_exc()
                 logger.debug(s)#将堆栈信息打印到log中
-                if self.cpu_queue:
-                    self.cpu_queue.task_done()
+                ticker.fail(str(e), self.device.adb.is_offline())
         logger.debug("stop event is set or timeout")
 
+    def _agent_cpu_row(self, prev, sample):
+        '''
+        两个agent样本之间的cpu占用，按8.0以上top的口径，100%为一个核
+        :return: 与 cpuinfo.csv 表头对应的一行，两次样本间隔过短时返回None
+        '''
+        total = sum(sample.cpu) - sum(prev.cpu)
+        if total <= 0:
+            return None
+        scale = 100.0 * sample.ncpu / total
+        user_rate = round((sample.cpu[0] - prev.cpu[0]) * scale, 2)
+        system_rate = round((sample.cpu[2] - prev.cpu[2]) * scale, 2)
+        idle_rate = round((sample.cpu[3] - prev.cpu[3]) * scale, 2)
+        row = [TimeUtils.formatTimeStamp(sample.timestamp), str(round(user_rate + system_rate, 2)), user_rate,
+               system_rate, idle_rate]
+        total_pid_cpu = 0
+        for package in self.packages:
+            proc = sample.procs.get(package)
+            old = prev.procs.get(package)
+            pid_cpu = ""
+            # pid 变了说明进程重启过，这一个样本没有增量
+            if proc and old and proc[0] == old[0]:
+                pid_cpu = round((proc[1] + proc[2] - old[1] - old[2]) * scale, 2)
+                total_pid_cpu += pid_cpu
+            row.extend([package, proc[0] if proc else "", pid_cpu])
+        if len(self.packages) > 1:
+            row.append(round(total_pid_cpu, 2))
+        return row
+
+    def _collect_cpu_from_agent(self, cpu_file, cpu_title, end_time):
+        '''
+        设备端agent模式，每个采集间隔处理一批亚秒级样本，每个样本写一行
+        '''
+        agent = DeviceAgent.get(self.device, self.session, self._interval)
+        last = []
+
+        def on_samples(samples):
+            rows = []
+            for sample in samples:
+                if last:
+                    row = self._agent_cpu_row(last[0], sample)
+                    if row:
+                        rows.append(row)
+                        self.session.emit("cpuinfo", sample.timestamp, cpu_title, row)
+                last[:] = [sample]
+            with open(cpu_file, 'a+', encoding="utf-8") as df:
+                csv.writer(df, lineterminator='\n').writerows(rows)
+
+        def on_gap(collection_time):
+            del last[:]
+            with open(cpu_file, 'a+', encoding="utf-8") as df:
+                csv.writer(df, lineterminator='\n').writerow(gap_row(collection_time, len(cpu_title)))
+
+        agent.collect("cpu", self._interval, self._stop_event, end_time, on_samples, on_gap)
+        logger.debug("cpu agent collect stop")
+
 class CpuMonitor(object):
     '''
     cpu 监控器
     '''
-    def __init__(self, device_id, packages, interval=5,timeout=24 * 60 * 60):
-        self.device = AndroidDevice(device_id)
+    def __init__(self, device_id, packages, interval=5,timeout=24 * 60 * 60, session=None):
+        self.session = session if session else Session.default()
+        self.device = self.session.get_device(device_id)
         self.packages = packages
-        self.cpu_collector = CpuCollector(self.device, packages, interval,timeout)
+        self.cpu_collector = CpuCollector(self.device, packages, interval,timeout, self.session)
 
     def start(self,start_time):
         '''
         启动一个cpu监控器，监控cpu信息
         :return:
         '''
-        if not RuntimeData.package_save_path:
-            RuntimeData.package_save_path = os.path.join(os.path.abspath(os.path.join(os.getcwd(), "../..")),'results', self.packages[0], start_time)
-            if not os.path.exists(RuntimeData.package_save_path):
-                os.makedirs(RuntimeData.package_save_path)
+        if not self.session.package_save_path:
+            self.session.package_save_path = os.path.join(os.path.abspath(os.path.join(os.getcwd(), "../..")),'results', self.packages[0], start_time)
+            if not os.path.exists(self.session.package_save_path):
+                os.makedirs(self.session.package_save_path)
         self.start_time = start_time
         self.cpu_collector.start(start_time)
         logger.debug("INFO: CpuMonitor has started...")
@@ -0,0 +1,239 @@
+#encoding:utf-8
+'''
+@author:     look
+
+@copyright:  1999-2020 Alibaba.com. All rights reserved.
+
+@license:    Apache Software License 2.0
+
+@contact:    390125133@qq.com
+'''
+'''
+多设备调度：一个调度进程负责发现设备，为每台设备拉起一个独立的测试进程
+StartUp 依赖 RuntimeData 全局变量，一个进程只能测一台设备，所以按设备做进程隔离
+用法: python mobileperf/android/devicefarm.py [--max N] [--watch] [serialnum ...]
+'''
+import os
+import sys
+import json
+import time
+import multiprocessing
+
+BaseDir=os.path.dirname(__file__)
+sys.path.append(os.path.join(BaseDir,'../..'))
+
+from mobileperf.common.log import logger
+from mobileperf.common.utils import TimeUtils,FileUtils
+from mobileperf.android.tools.androiddevice import ADB
+
+try:
+    from mobileperf.android.web.web_server import get_or_start_web_server
+    WEB_SERVER_AVAILABLE = True
+except Exception:
+    WEB_SERVER_AVAILABLE = False
+
+
+def _run_session(serialnum, cpu_set=None):
+    '''子进程入口，一台设备一个完整的 StartUp 测试流程
+    '''
+    if cpu_set and hasattr(os, "sched_setaffinity"):
+        try:
+            os.sched_setaffinity(0, cpu_set)
+        except Exception as e:
+            logger.debug("set cpu affinity failed: %s" % e)
+    from mobileperf.android.startup import StartUp
+    startup = StartUp(device_id=serialnum, result_tag=serialnum, start_web=False)
+    try:
+        startup.run()
+    except KeyboardInterrupt:
+        logger.info("session %s interrupted by user" % serialnum)
+        startup.stop()
+
+
+class DeviceSession(object):
+    '''调度进程中记录的单台设备测试状态
+    '''
+    WAITING = "waiting"
+    RUNNING = "running"
+    FINISHED = "finished"
+    FAILED = "failed"
+
+    def __init__(self, serialnum):
+        self.serialnum = serialnum
+        self.process = None
+        self.state = DeviceSession.WAITING
+        self.start_time = None
+        self.end_time = None
+        self.exitcode = None
+        self.cpu_set = None
+        self.slot = None
+
+    def to_dict(self):
+        return {"serialnum": self.serialnum,
+                "pid": self.process.pid if self.process else None,
+                "state": self.state,
+                "start_time": self.start_time,
+                "end_time": self.end_time,
+                "exitcode": self.exitcode,
+                "cpu_set": sorted(self.cpu_set) if self.cpu_set else None}
+
+
+class DeviceFarm(object):
+    '''
+    设备农场调度器：通过 ADB.list_device 发现设备，每台设备一个测试进程
+    同时运行的测试进程数不超过 max_sessions，启动时错峰，避免所有设备同一时刻打满 adb 和PC cpu
+    '''
+    def __init__(self, device_ids=None, max_sessions=None, poll_interval=10, start_interval=3, watch=False):
+        '''
+        :param list device_ids: 指定测试的设备列表，为空则测试所有连接的设备
+        :param int max_sessions: 最多同时运行的测试进程数，默认为PC的cpu核数
+        :param int poll_interval: 设备发现和状态汇总的间隔，单位秒
+        :param int start_interval: 相邻两个测试进程启动的间隔，单位秒
+        :param bool watch: 为True时持续发现新接入的设备，否则所有测试结束后退出
+        '''
+        self.device_ids = device_ids if device_ids else []
+        self.cpu_count = multiprocessing.cpu_count()
+        self.max_sessions = max_sessions if max_sessions else self.cpu_count
+        self.poll_interval = poll_interval
+        self.start_interval = start_interval
+        self.watch = watch
+        self.sessions = {}
+        # 空闲的cpu槽位，启动时取一个，进程结束时归还，避免和仍在运行的进程分到相同的核
+        self.free_slots = set(range(self.max_sessions))
+        self.last_start = 0
+        self.status_file = os.path.join(FileUtils.get_top_dir(), 'results', 'device_farm_status.json')
+
+    def discover(self):
+        '''发现新设备，为其建立等待中的 session
+        '''
+        connected = ADB.list_device()
+        for serialnum in connected:
+            if self.device_ids and serialnum not in self.device_ids:
+                continue
+            if serialnum not in self.sessions:
+                logger.info("device farm: found device %s" % serialnum)
+                self.sessions[serialnum] = DeviceSession(serialnum)
+        return connected
+
+    def _cpu_set(self, slot):
+        '''按槽位给测试进程分配cpu核，尽量让各进程均匀分布在所有核上
+        '''
+        cores_per_session = max(1, self.cpu_count // self.max_sessions)
+        first = (slot * cores_per_session) % self.cpu_count
+        return set((first + i) % self.cpu_count for i in range(cores_per_session))
+
+    def _running_sessions(self):
+        return [s for s in self.sessions.values() if s.state == DeviceSession.RUNNING]
+
+    def _start_session(self, session):
+        session.slot = min(self.free_slots)
+        self.free_slots.discard(session.slot)
+        session.cpu_set = self._cpu_set(session.slot)
+        session.process = multiprocessing.Process(target=_run_session, name="mobileperf-%s" % session.serialnum,
+                                                  args=(session.serialnum, session.cpu_set))
+        session.process.start()
+        session.state = DeviceSession.RUNNING
+        session.start_time = TimeUtils.getCurrentTime()
+        self.last_start = time.time()
+        logger.info("device farm: start session for %s, pid %d" % (session.serialnum, session.process.pid))
+
+    def _reap(self):
+        for session in self._running_sessions():
+            if not session.process.is_alive():
+                session.process.join(timeout=1)
+                session.exitcode = session.process.exitcode
+                session.state = DeviceSession.FINISHED if session.exitcode == 0 else DeviceSession.FAILED
+                session.end_time = TimeUtils.getCurrentTime()
+                self.free_slots.add(session.slot)
+                logger.info("device farm: session %s %s, exitcode %s" % (session.serialnum, session.state, session.exitcode))
+
+    def _schedule(self):
+        for session in self.sessions.values():
+            if session.state != DeviceSession.WAITING:
+                continue
+            if len(self._running_sessions()) >= self.max_sessions or not self.free_slots:
+                break
+            if time.time() - self.last_start < self.start_interval:
+                break
+            self._start_session(session)
+
+    def status(self):
+        '''汇总所有设备的测试状态
+        '''
+        summary = {}
+        for state in (DeviceSession.WAITING, DeviceSession.RUNNING, DeviceSession.FINISHED, DeviceSession.FAILED):
+            summary[state] = len([s for s in self.sessions.values() if s.state == state])
+        return {"update_time": TimeUtils.getCurrentTime(),
+                "max_sessions": self.max_sessions,
+                "summary": summary,
+                "sessions": [s.to_dict() for s in self.sessions.values()]}
+
+    def save_status(self):
+        status = self.status()
+        FileUtils.makedir(os.path.dirname(self.status_file))
+        with open(self.status_file, "w", encoding="utf-8") as f:
+            json.dump(status, f, indent=2)
+        logger.info("device farm status: %s" % status["summary"])
+        return status
+
+    def _is_all_done(self):
+        if self.watch or not self.sessions:
+            return False
+        return all(s.state in (DeviceSession.FINISHED, DeviceSession.FAILED) for s in self.sessions.values())
+
+    def run(self):
+        if WEB_SERVER_AVAILABLE:
+            try:
+                get_or_start_web_server(port=5000)
+            except Exception as e:
+                logger.debug(f"Auto start web server skipped: {e}")
+        last_discover = 0
+        try:
+            while True:
+                if time.time() - last_discover >= self.poll_interval:
+                    self.discover()
+                    last_discover = time.time()
+                    self.save_status()
+                self._reap()
+                self._schedule()
+                if self._is_all_done():
+                    break
+                time.sleep(1)
+        except KeyboardInterrupt:
+            logger.info("device farm: interrupted, wait sessions to generate reports...")
+        self.stop()
+
+    def stop(self, timeout=120):
+        '''等待所有测试进程结束，Ctrl+C 时子进程会收到同样的信号并生成报告
+        '''
+        end_time = time.time() + timeout
+        for session in self._running_sessions():
+            try:
+                session.process.join(timeout=max(0, end_time - time.time()))
+            except KeyboardInterrupt:
+                break
+        for session in self._running_sessions():
+            if session.process.is_alive():
+                logger.warning("device farm: session %s not exit, terminate it" % session.serialnum)
+                session.process.terminate()
+        self._reap()
+        self.save_status()
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    args = sys.argv[1:]
+    max_sessions = None
+    watch = False
+    device_ids = []
+    i = 0
+    while i < len(args):
+        if args[i] == "--max" and i + 1 < len(args):
+            max_sessions = int(args[i + 1])
+            i += 1
+        elif args[i] == "--watch":
+            watch = True
+        else:
+            device_ids.append(args[i])
+        i += 1
+    DeviceFarm(device_ids, max_sessions, watch=watch).run()
@@ -20,22 +20,23 @@ import traceback
 BaseDir=os.path.dirname(__file__)
 sys.path.append(os.path.join(BaseDir,'../..'))
 from mobileperf.common.log import logger
-from mobileperf.android.tools.androiddevice import AndroidDevice
-from mobileperf.android.globaldata import RuntimeData
+from mobileperf.android.globaldata import Session
 from mobileperf.common.utils import TimeUtils
 
 class DeviceMonitor(object):
     '''
     一个监控类，监控手机中的一些状态变化，目前监控应用是否卸载，获取前台正在活动的activity
     '''
-    def __init__(self, device_id, packagename, interval = 1.0,main_activity=[],activity_list=[],event=None,activity_queue = None):
+    def __init__(self, device_id, packagename, interval = 1.0,main_activity=[],activity_list=[],event=None,activity_queue = None, session=None):
         ''''
         :param list main_activity 指定模块的主入口
         :param list activity_list : 限制默认范围的activity列表，默认为空，则不限制
         :param float interval: 监控间隔时间，单位秒，默认为1秒
+        :param Session session: 测试上下文，为空时使用全局的RuntimeData
         '''
         self.uninstall_flag = event
-        self.device = AndroidDevice(device_id)
+        self.session = session if session else Session.default()
+        self.device = self.session.get_device(device_id)
         self.packagename = packagename
         self.interval = interval
         self.main_activity = main_activity
@@ -66,18 +67,26 @@ class DeviceMonitor(object):
 
     def _activity_monitor_thread(self):
         activity_title = ("datetime", "current_activity")
-        self.activity_file = os.path.join(RuntimeData.package_save_path, 'current_activity.csv')
+        self.activity_file = os.path.join(self.session.package_save_path, 'current_activity.csv')
         try:
             with open(self.activity_file, 'a+') as af:
                 csv.writer(af, lineterminator='\n').writerow(activity_title)
         except Exception as e:
             logger.error("file not found: " + str(self.activity_file))
 
+        ticker = self.session.ticker("activity", self.interval, self.stop_event)
         while not self.stop_event.is_set():
             try:
+                collection_time = ticker.next()
+                if collection_time is None:
+                    break
                 before = time.time()
                 self.current_activity = self.device.adb.get_current_activity()
-                collection_time = time.time()
+                if self.device.adb.is_offline():
+                    # 设备离线时不记录也不拉起应用，等设备恢复
+                    ticker.fail("device offline", True)
+                    continue
+                ticker.ok()
                 activity_list = [collection_time, self.current_activity]
                 if self.activity_queue:
                     logger.debug("activity monitor thread activity_list: " + str(activity_list))
@@ -105,9 +114,9 @@ class DeviceMonitor(object):
                 
                 # 记录当前 Activity 到文件
                 if self.current_activity:
-                    activity_tuple=(TimeUtils.getCurrentTime(),self.current_activity)
+                    activity_tuple=(TimeUtils.formatTimeStamp(collection_time),self.current_activity)
                 else:
-                    activity_tuple=(TimeUtils.getCurrentTime(),"")
+                    activity_tuple=(TimeUtils.formatTimeStamp(collection_time),"")
                 # 写文件
                 try:
                     with open(self.activity_file, 'a+',encoding="utf-8") as writer:
@@ -115,11 +124,9 @@ class DeviceMonitor(object):
                         writer_p.writerow(activity_tuple)
                 except RuntimeError as e:
                     logger.error(e)
+                self.session.emit("current_activity", collection_time, activity_title, activity_tuple)
                 time_consume = time.time() - before
-                delta_inter = self.interval - time_consume
                 logger.debug("get app activity time consumed: " + str(time_consume))
-                if delta_inter > 0 :
-                    time.sleep(delta_inter)
             except Exception as e:
                 s = traceback.format_exc()
                 logger.debug(s)  # 将堆栈信息打印到log中
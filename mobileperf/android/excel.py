@@ -9,6 +9,8 @@
 @contact:    juncheng.cjc@outlook.com
 '''
 import csv,os,sys
+import math
+import datetime
 
 BaseDir=os.path.dirname(__file__)
 sys.path.append(os.path.join(BaseDir,'../..'))
@@ -16,14 +18,59 @@ from mobileperf.android.globaldata import RuntimeData
 from mobileperf.extlib import xlsxwriter
 from mobileperf.common.log import logger
 
+# 时间列的列名，内容是 TimeUtils.NormalFormatter 格式的时间
+TIME_COLUMNS = ("datetime", "datatime")
+# 时间列单元格和图表时间轴的格式
+DATE_FORMAT = 'yyyy-mm-dd hh:mm:ss'
+AXIS_DATE_FORMAT = 'mm-dd hh:mm:ss'
+# Excel 1900日期系统的0点，1900-03-01之后的日期序列数是距这一天的天数
+EXCEL_EPOCH = datetime.date(1899, 12, 30).toordinal()
+# 日期字符串到天数的缓存，一次测试只有几个不同的日期
+_excel_days = {}
+
+
+def to_excel_date(s):
+    '''
+    "%Y-%m-%d %H-%M-%S" 格式的时间转为Excel日期序列数（天数，小数部分是一天内的时间），不是这个格式的原样返回
+    按位置切分，日期部分查缓存，比 strptime 快一个数量级
+    '''
+    if len(s) != 19 or s[10] != ' ':
+        return s
+    try:
+        days = _excel_days.get(s[:10])
+        if days is None:
+            days = datetime.date(int(s[0:4]), int(s[5:7]), int(s[8:10])).toordinal() - EXCEL_EPOCH
+            _excel_days[s[:10]] = days
+        # 保留8位小数（不到1毫秒），xml中的数字更短
+        return round(days + (int(s[11:13]) * 3600 + int(s[14:16]) * 60 + int(s[17:19])) / 86400.0, 8)
+    except ValueError:
+        return s
+
+
+def to_number(s):
+    '''能转成数字的单元格按数字写入excel，否则原样写字符串
+    '''
+    try:
+        value = float(s)
+    except ValueError:
+        return s
+    # nan、inf 不能作为数字写入xlsx
+    return value if math.isfinite(value) else s
+
+
 class Excel(object):
 
-    def __init__(self, excel_file):
+    def __init__(self, excel_file, compress_level=None):
+        '''
+        各部分的xml直接写入xlsx的zip条目，不经过临时文件
+        :param int compress_level: deflate压缩级别，1最快，9最小，None为zlib默认
+        '''
         self.excel_file = excel_file
-        self.workbook = xlsxwriter.Workbook(excel_file)
+        self.workbook = xlsxwriter.Workbook(excel_file, {'streaming': True, 'compress_level': compress_level})
         self.color_list = ["blue", "green", "red", "yellow","purple"]
+        self.date_format = self.workbook.add_format({'num_format': DATE_FORMAT})
 
-    def add_sheet(self, sheet_name, x_axis, y_axis, headings, lines):
+    def add_sheet(self, sheet_name, x_axis, y_axis, headings, lines, chart_type='line'):
         worksheet = self.workbook.add_worksheet(sheet_name)
         worksheet.write_row('A1', headings)
         for i, line in enumerate(lines, 2):
@@ -31,7 +78,7 @@ class Excel(object):
         columns = len(headings)
         rows = len(lines)
         if columns > 1 and rows > 1:
-            chart = self.workbook.add_chart({'type': 'line'})
+            chart = self.workbook.add_chart({'type': chart_type})
             for j in range(1, columns):
                 chart.add_series({'name':       [sheet_name, 0, j],
                                   'categories': [sheet_name, 1, 0, rows, 0],
@@ -41,10 +88,86 @@ class Excel(object):
             chart.set_y_axis({'name': y_axis})
             worksheet.insert_chart('B3', chart, {'x_scale': 2, 'y_scale': 2})
     
+    @staticmethod
+    def read_csv(csv_file):
+        '''
+        读取csv，表头以外的数字转为float，不依赖workbook，可以在子进程中并行执行
+        第一列是时间列时转为Excel日期序列数，跳过中途追加的相同表头，图表的时间轴需要整列都是日期
+        包名、页面名这类重复的字符串共用一个对象，减少内存和子进程返回结果的序列化大小
+        :return: [[单元格]]，第一行是表头
+        '''
+        lines = []
+        strings = {}
+        with open(csv_file, 'r', encoding='utf-8', errors='ignore') as f:
+            reader = csv.reader(f)
+            header = next(reader, None)
+            if header is None:
+                return lines
+            lines.append(header)
+            has_time = bool(header) and header[0] in TIME_COLUMNS
+            for line in reader:
+                if line == header:
+                    continue
+                row = []
+                for i, value in enumerate(line):
+                    if i == 0 and has_time:
+                        row.append(to_excel_date(value))
+                        continue
+                    value = to_number(value)
+                    if value.__class__ is str:
+                        value = strings.setdefault(value, value)
+                    row.append(value)
+                lines.append(row)
+        return lines
+
+    def csv_to_table(self, csv_file, sheet_name):
+        '''
+        把csv原样存成一个不画图的sheet，用于汇总表
+        '''
+        return self.lines_to_table(self.read_csv(csv_file), sheet_name)
+
+    @staticmethod
+    def column_types(lines):
+        '''
+        按每列第一个非空数据推断 read_csv 结果的列类型，float 为 number，其他为 string，全空的列为 None
+        类型不符的单元格（如中途追加的表头行）write_rows 会逐个按 write 写入
+        '''
+        types = []
+        for line in lines[1:]:
+            for i, value in enumerate(line):
+                if i >= len(types):
+                    types.append(None)
+                if types[i] is None and value != '':
+                    types[i] = 'number' if isinstance(value, float) else 'string'
+            if types and None not in types:
+                break
+        return types
+
+    def write_lines(self, worksheet, lines):
+        '''
+        表头逐个写，数据按列类型整块写入，时间列设置日期格式
+        :return: 第一列是否是转换成日期的时间列
+        '''
+        if not lines:
+            return False
+        col_types = self.column_types(lines)
+        worksheet.write_row(0, 0, lines[0])
+        worksheet.write_rows(1, 0, lines[1:], col_types)
+        is_date = bool(lines[0]) and lines[0][0] in TIME_COLUMNS and col_types[:1] == ['number']
+        if is_date:
+            worksheet.set_column(0, 0, 20, self.date_format)
+        return is_date
+
+    def lines_to_table(self, lines, sheet_name):
+        worksheet = self.workbook.add_worksheet(sheet_name)
+        self.write_lines(worksheet, lines)
+        worksheet.set_column(0, 1, 30)
+        return worksheet
+
     def save(self):
         self.workbook.close()
 
-    def csv_to_xlsx(self, csv_file, sheet_name, x_axis,y_axis, y_fields=[]):
+    def csv_to_xlsx(self, csv_file, sheet_name, x_axis,y_axis, y_fields=[], chart_type='line', y2_axis=None, y2_fields=[]):
         '''
         把csv的数据存到excel中，并画曲线
         csv_file csv 文件路径 表格名
@@ -52,31 +175,27 @@ class Excel(object):
         x_axis 横轴名 和 表中做横轴字段名
         y_axis 纵轴名
         y_fields 纵轴表中数据字段名 ，可以多个
+        chart_type 图表类型，汇总表（如各页面能耗）用 column
+        y2_axis y2_fields 右侧纵轴名和字段名，单位不同的数据画在同一张图上对照，如内存压力和pss
         '''
         filename = os.path.splitext(os.path.basename(csv_file))[0]
+        return self.lines_to_xlsx(filename, self.read_csv(csv_file), sheet_name, x_axis, y_axis, y_fields, chart_type,
+                                  y2_axis, y2_fields)
+
+    def lines_to_xlsx(self, filename, lines, sheet_name, x_axis, y_axis, y_fields=[], chart_type='line', y2_axis=None,
+                      y2_fields=[]):
+        '''
+        把 read_csv 读出的数据写到名为 filename 的sheet中并画曲线，参数同 csv_to_xlsx
+        '''
         logger.debug("filename:"+filename)
         worksheet = self.workbook.add_worksheet(filename)  # 创建一个sheet表格
-        with open(csv_file, 'r') as f:
-            read = csv.reader(f)
-            # 行数
-            l = 0
-            # 表头
-            headings = []
-            for line in read:
-                # print(line)
-                r = 0
-                for i in line:
-                    # print(i)
-                    if self.is_number(i):
-                        worksheet.write(l, r, float(i))  # 一个一个将单元格数据写入
-                    else:
-                        worksheet.write(l, r,i)
-                    r = r + 1
-                if l==0:
-                    headings=line
-                l = l + 1
-                # 列数
-            columns = len(headings)
+        is_date = self.write_lines(worksheet, lines)
+        # 行数
+        l = len(lines)
+        # 表头
+        headings = lines[0] if lines else []
+        # 列数
+        columns = len(headings)
         # 求出展示数据索引
         indexs=[]
         # 求出系列名所在索引
@@ -87,7 +206,7 @@ class Excel(object):
         logger.debug("series_index")
         logger.debug(series_index)
         if columns > 1 and l>2:
-            chart = self.workbook.add_chart({'type': 'line'})
+            chart = self.workbook.add_chart({'type': chart_type})
             # 画图
             i =0
             for index in indexs:
@@ -107,11 +226,29 @@ class Excel(object):
                         'values': [filename, 1, index, l - 1, index],
                         'line': {'color': self.color_list[index % len(self.color_list)]}
                     })
+            # 右侧纵轴的数据，多包时系列名用前面最近的 package 列的包名
+            for index in [i for i, v in enumerate(headings) if v in y2_fields]:
+                packages = [i for i in series_index if i < index]
+                chart.add_series({
+                    'name': [filename, 1, packages[-1]] if packages else [filename, 0, index],
+                    'categories': [filename, 1, 0, l - 1, 0],
+                    'values': [filename, 1, index, l - 1, index],
+                    'line': {'color': self.color_list[index % len(self.color_list)], 'dash_type': 'dash'},
+                    'y2_axis': True
+                })
+            if y2_axis and y2_fields:
+                chart.set_y2_axis({'name': y2_axis})
             # 图表名
             chart.set_title ({'name':sheet_name})
-            chart.set_x_axis({'name': x_axis})
+            if is_date:
+                # 按时间比例的横轴，断点和采集间隔不均匀时曲线不会变形
+                chart.set_x_axis({'name': x_axis, 'date_axis': True, 'num_format': AXIS_DATE_FORMAT,
+                                  'num_font': {'rotation': -45}})
+            else:
+                chart.set_x_axis({'name': x_axis})
             chart.set_y_axis({'name': y_axis})
             worksheet.insert_chart('L3', chart, {'x_scale': 2, 'y_scale': 2})
+        return worksheet
 
 
     def is_number(self,s):
@@ -19,16 +19,18 @@ import traceback
 BaseDir=os.path.dirname(__file__)
 sys.path.append(os.path.join(BaseDir,'../..'))
 
-from mobileperf.android.tools.androiddevice import AndroidDevice
 from mobileperf.common.utils import TimeUtils
 from mobileperf.common.log import logger
-from mobileperf.android.globaldata import RuntimeData
+from mobileperf.common.scheduler import gap_row, command_budget
+from mobileperf.android.globaldata import Session
 
 class FdInfoPackageCollector(object):
-    def __init__(self, device, pacakgename, interval=1.0, timeout =24 * 60 * 60,fd_queue = None):
+    def __init__(self, device, pacakgename, interval=1.0, timeout =24 * 60 * 60,fd_queue = None, session=None):
         self.device = device
+        self.session = session if session else Session.default()
         self.packagename = pacakgename
         self._interval = interval
+        self._cmd_timeout = command_budget(interval)
         self._timeout = timeout
         self._stop_event = threading.Event()
         self.fd_queue = fd_queue
@@ -49,28 +51,28 @@ class FdInfoPackageCollector(object):
             if self.fd_queue:
                 self.fd_queue.task_done()
 
-    def get_process_fd(self, process):
+    def get_process_fd(self, process, collection_time=None):
         pid = self.device.adb.get_pid_from_pck(self.packagename)
         if pid is None:
             return []
         
-        global old_pid
         # pid发生变化 ，更新old_pid,这个时间间隔长
-        if None == RuntimeData.old_pid or RuntimeData.old_pid!=pid:
-            RuntimeData.old_pid = pid
+        if None == self.session.old_pid or self.session.old_pid!=pid:
+            self.session.old_pid = pid
         
-        collection_time = time.time()
+        if collection_time is None:
+            collection_time = self.session.clock()
         logger.debug("collection time in fd info is : " + str(collection_time))
         
         # 先尝试直接获取（适用于adb root或Android 6.0及以下）
-        out = self.device.adb.run_shell_cmd('ls /proc/%s/fd 2>/dev/null | wc -l' % pid)
+        out = self.device.adb.run_shell_cmd('ls /proc/%s/fd 2>/dev/null | wc -l' % pid, timeout=self._cmd_timeout)
         if out and out.strip().isdigit():
             fd_num = int(out.strip())
             logger.debug(f"FD count (direct access): {fd_num}")
             return [collection_time,self.packagename,pid,fd_num]
         
         # 如果直接获取失败，尝试使用su权限
-        out = self.device.adb.run_shell_cmd('su 0 sh -c "ls /proc/%s/fd 2>/dev/null | wc -l"' % pid)
+        out = self.device.adb.run_shell_cmd('su 0 sh -c "ls /proc/%s/fd 2>/dev/null | wc -l"' % pid, timeout=self._cmd_timeout)
         if out and out.strip().isdigit():
             fd_num = int(out.strip())
             logger.debug(f"FD count (via su): {fd_num}")
@@ -82,7 +84,7 @@ class FdInfoPackageCollector(object):
     def _collect_fd_thread(self, start_time):
         end_time = time.time() + self._timeout
         fd_list_titile = ("datatime", "packagename", "pid", "fd_num")
-        fd_file = os.path.join(RuntimeData.package_save_path, 'fd_num.csv')
+        fd_file = os.path.join(self.session.package_save_path, 'fd_num.csv')
         try:
             with open(fd_file, 'a+') as df:
                 csv.writer(df, lineterminator='\n').writerow(fd_list_titile)
@@ -92,17 +94,26 @@ class FdInfoPackageCollector(object):
         except RuntimeError as e:
             logger.error(e)
 
+        ticker = self.session.ticker("fd", self._interval, self._stop_event)
         while not self._stop_event.is_set() and time.time() < end_time:
             try:
+                collection_time = ticker.next()
+                if collection_time is None:
+                    break
                 before = time.time()
                 logger.debug("-----------into _collect_fd_thread loop, thread is : " + str(threading.current_thread().name))
 
                 # 获取pakagename的fd信息
-                fd_pck_info = self.get_process_fd(self.packagename)
+                fd_pck_info = self.get_process_fd(self.packagename, collection_time)
                 current_time = TimeUtils.getCurrentTime()
                 if not fd_pck_info:
+                    # 进程不在或设备离线，退避后再试
+                    if ticker.fail("can't get fd", self.device.adb.is_offline()):
+                        with open(fd_file, 'a+', encoding="utf-8") as df:
+                            csv.writer(df, lineterminator='\n').writerow(gap_row(collection_time, len(fd_list_titile)))
                     continue
                 else:
+                    ticker.ok()
                     logger.debug(
                         "current time: " + current_time + ", processname: " +fd_pck_info[1]+ ", pid: " + str(fd_pck_info[2]) +
                         " fd num: " + str(fd_pck_info[3]))
@@ -112,30 +123,30 @@ class FdInfoPackageCollector(object):
                     try:
                         with open(fd_file, 'a+',encoding="utf-8") as fd_writer:
                             writer_p = csv.writer(fd_writer, lineterminator='\n')
-                            fd_pck_info[0] = current_time
+                            fd_pck_info[0] = TimeUtils.formatTimeStamp(collection_time)
                             writer_p.writerow(fd_pck_info)
                     except RuntimeError as e:
                         logger.error(e)
+                self.session.emit("fd_num", collection_time, fd_list_titile, fd_pck_info)
 
                 after = time.time()
                 time_consume = after - before
-                delta_inter = self._interval - time_consume
                 logger.debug("time_consume  for fd infos: " + str(time_consume))
-                if delta_inter > 0:
-                    time.sleep(delta_inter)
             except:
                 logger.error("an exception hanpend in fdinfo thread, reason unkown!")
                 s = traceback.format_exc()
                 logger.debug(s)
+                ticker.fail("exception", self.device.adb.is_offline())
                 if self.fd_queue:
                     self.fd_queue.task_done()
 
 class FdMonitor(object):
-    def __init__(self, device_id, packagename, interval = 1.0,timeout=24*60*60, fd_queue = None):
-        self.device = AndroidDevice(device_id)
+    def __init__(self, device_id, packagename, interval = 1.0,timeout=24*60*60, fd_queue = None, session=None):
+        self.session = session if session else Session.default()
+        self.device = self.session.get_device(device_id)
         if not packagename:
             packagename = self.device.adb.get_foreground_process()
-        self.fd_package_collector = FdInfoPackageCollector(self.device, packagename, interval, timeout,fd_queue)
+        self.fd_package_collector = FdInfoPackageCollector(self.device, packagename, interval, timeout,fd_queue,self.session)
 
     def start(self,start_time):
         self.start_time = start_time
@@ -25,17 +25,86 @@ BaseDir=os.path.dirname(__file__)
 sys.path.append(os.path.join(BaseDir,'../..'))
 
 from mobileperf.common.basemonitor import Monitor
-from mobileperf.android.tools.androiddevice import AndroidDevice
 from mobileperf.common.log import logger
 from mobileperf.common.utils import TimeUtils
-from mobileperf.android.globaldata import RuntimeData
+from mobileperf.common.scheduler import command_budget
+from mobileperf.android.globaldata import Session
+
+NANOSECONDS_PER_SECOND = 1e9
+# If a fence associated with a frame is still pending when we query the
+# latency data, SurfaceFlinger gives the frame a timestamp of INT64_MAX.
+# Since we only care about completed frames, we will ignore any timestamps
+# with this value.
+PENDING_FENCE_TIMESTAMP = (1 << 63) - 1
+
+
+def parse_gfxinfo_framestats(results, focus_window):
+    '''解析 dumpsys gfxinfo package_name framestats 中 focus_window 窗口的帧数据
+    :return: [[INTENDED_VSYNC, VSYNC, FRAME_COMPLETED], ...] 单位秒，输出为空时返回None
+    '''
+    results = results.replace("\r\n","\n").splitlines()
+    if not len(results):
+        return None
+    timestamps = []
+    isHaveFoundWindow = False
+    PROFILEDATA_line = 0
+    for line in results:
+        if not isHaveFoundWindow:
+            if "Window" in line and focus_window in line:
+                isHaveFoundWindow = True
+        if not isHaveFoundWindow:
+            continue
+        if "PROFILEDATA" in line:
+            PROFILEDATA_line +=1
+        fields = line.split(",")
+        if fields and '0' == fields[0]:
+# 获取INTENDED_VSYNC VSYNC FRAME_COMPLETED时间 利用VSYNC计算fps jank
+            timestamp = [int(fields[1]),int(fields[2]),int(fields[13])]
+            if timestamp[1] == PENDING_FENCE_TIMESTAMP:
+                continue
+            timestamp = [_timestamp / NANOSECONDS_PER_SECOND for _timestamp in timestamp]
+            timestamps.append(timestamp)
+#       如果到了下一个窗口，退出
+        if 2 == PROFILEDATA_line:
+            break
+    return timestamps
+
+
+def parse_surfaceflinger_latency(results):
+    '''解析 dumpsys SurfaceFlinger --latency 的输出
+    :return: (refresh_period, [[A, B, C], ...]) 单位秒，无数据时返回 (None, None)
+    '''
+    results = results.replace("\r\n","\n").splitlines()
+    if not len(results):
+        return (None, None)
+    if not results[0].isdigit():
+        return (None, None)
+    try:
+        refresh_period = int(results[0]) / NANOSECONDS_PER_SECOND
+    except Exception as e:
+        logger.exception(e)
+        return (None, None)
+    timestamps = []
+    for line in results[1:]:
+        fields = line.split()
+        if len(fields) != 3:
+            continue
+        timestamp = [int(fields[0]),int(fields[1]),int(fields[2])]
+        if timestamp[1] == PENDING_FENCE_TIMESTAMP:
+            continue
+        timestamp = [_timestamp / NANOSECONDS_PER_SECOND for _timestamp in timestamp]
+        timestamps.append(timestamp)
+    return (refresh_period, timestamps)
+
 
 class SurfaceStatsCollector(object):
     '''Collects surface stats for a SurfaceView from the output of SurfaceFlinger
     '''
-    def __init__(self, device, frequency,package_name,fps_queue,jank_threshold,use_legacy = False):
+    def __init__(self, device, frequency,package_name,fps_queue,jank_threshold,use_legacy = False, session=None):
         self.device = device
+        self.session = session if session else Session.default()
         self.frequency = frequency
+        self._cmd_timeout = command_budget(frequency)
         self.package_name = package_name
         self.jank_threshold = jank_threshold /1000.0    # 内部的时间戳是秒为单位
         self.use_legacy_method = use_legacy
@@ -50,7 +119,9 @@ class SurfaceStatsCollector(object):
     def start(self,start_time):
         '''打开SurfaceStatsCollector
         '''
-        if not self.use_legacy_method and self._clear_surfaceflinger_latency_data():
+        # 设备不支持 --latency 时不用再执行一次输出整个 dumpsys SurfaceFlinger 的命令
+        if not self.use_legacy_method and self.device.adb.get_capability().sf_latency \
+                and self._clear_surfaceflinger_latency_data():
             try:
                 self.focus_window = self.get_focus_activity()
                 # 如果self.focus_window里包含字符'$'，必须将其转义
@@ -195,7 +266,7 @@ class SurfaceStatsCollector(object):
     def _calculator_thread(self,start_time):
         '''处理surfaceflinger数据
         '''
-        fps_file = os.path.join(RuntimeData.package_save_path, 'fps.csv')
+        fps_file = os.path.join(self.session.package_save_path, 'fps.csv')
         if self.use_legacy_method:
             fps_title = ['datetime', 'fps']
         else:
@@ -225,6 +296,7 @@ class SurfaceStatsCollector(object):
                         fps = 60
                     self.surface_before = data
                     logger.debug('FPS:%2s'%fps)
+                    collect_time = self.session.clock()
                     tmp_list = [TimeUtils.getCurrentTimeUnderline(),fps]
                     try:
                         with open(fps_file, 'a+',encoding="utf-8") as f:
@@ -232,6 +304,7 @@ class SurfaceStatsCollector(object):
                             csv.writer(f, lineterminator='\n').writerow(tmp_list)
                     except RuntimeError as e:
                         logger.exception(e)
+                    self.session.emit("fps", collect_time, fps_title, tmp_list)
                 else:
                     refresh_period = data[0]
                     timestamps = data[1]
@@ -250,10 +323,10 @@ class SurfaceStatsCollector(object):
                                 csv.writer(f, lineterminator='\n').writerow(tmp_list)
                         except RuntimeError as e:
                             logger.exception(e)
+                    self.session.emit("fps", collect_time, fps_title, fps_list)
                 time_consume = time.time() - before
-                delta_inter = self.frequency - time_consume
-                if delta_inter > 0:
-                    time.sleep(delta_inter)
+                # 采集线程已按节拍入队，这里处理完立即取下一条，不再等待
+                self.session.metrics.observe("loop:fps_calculator", time_consume * 1000)
             except:
                 logger.error("an exception hanpend in fps _calculator_thread ,reason unkown!")
                 s = traceback.format_exc()
@@ -270,9 +343,12 @@ class SurfaceStatsCollector(object):
                 则用dumpsys gfxinfo package_name framestats           
         '''
         is_first = True
+        ticker = self.session.ticker("fps", self.frequency, self.stop_event)
         while not self.stop_event.is_set():
             try:
-                before = time.time()
+                collection_time = ticker.next()
+                if collection_time is None:
+                    break
                 if self.use_legacy_method:
                     surface_state = self._get_surface_stats_legacy()
                     if surface_state:
@@ -284,7 +360,11 @@ class SurfaceStatsCollector(object):
                         # activity发生变化，旧的activity不存时，取的时间戳为空，
                         self.focus_window = self.get_focus_activity()
                         logger.debug("refresh_period is None or timestamps is None")
+                        # 页面切换时取不到数据是正常的，只有设备离线时才退避
+                        if self.device.adb.is_offline():
+                            ticker.fail("device offline", True)
                         continue
+                    ticker.ok()
     #                计算不重复的帧
                     timestamps += [timestamp for timestamp in new_timestamps
                                                  if timestamp[1] > self.last_timestamp]
@@ -303,11 +383,8 @@ class SurfaceStatsCollector(object):
                             self.focus_window = cur_focus_window
                             continue
                     logger.debug(timestamps)
-                    self.data_queue.put((refresh_period, timestamps,time.time()))
-                    time_consume = time.time() - before
-                    delta_inter = self.frequency - time_consume
-                    if delta_inter > 0:
-                        time.sleep(delta_inter)
+                    self.data_queue.put((refresh_period, timestamps, collection_time))
+                    self.session.metrics.set_gauge("queue_depth:fps", self.data_queue.qsize())
             except:
                 logger.error("an exception hanpend in fps _collector_thread , reason unkown!")
                 s = traceback.format_exc()
@@ -385,79 +462,28 @@ class SurfaceStatsCollector(object):
 # Google Pixel 2 Android8.0 dumpsys SurfaceFlinger --latency window 结果
 # C:\Users\luke01>adb -s HT7B81A05143 shell dumpsys SurfaceFlinger --latency window_name
 # 16666666
-        refresh_period = None
-        timestamps = []
-        nanoseconds_per_second = 1e9
-        pending_fence_timestamp = (1 << 63) - 1
         if self.device.adb.get_sdk_version() >= 26:
             results = self.device.adb.run_shell_cmd(
-                'dumpsys SurfaceFlinger --latency %s'%self.focus_window)
+                'dumpsys SurfaceFlinger --latency %s'%self.focus_window, timeout=self._cmd_timeout)
             results = results.replace("\r\n","\n").splitlines()
             if not results or len(results) == 0:
                 logger.warning("SurfaceFlinger latency data is empty, skipping...")
                 return (None, None)
-            refresh_period = int(results[0]) / nanoseconds_per_second
-            results = self.device.adb.run_shell_cmd('dumpsys gfxinfo %s framestats'%self.package_name)
+            refresh_period = int(results[0]) / NANOSECONDS_PER_SECOND
+            results = self.device.adb.run_shell_cmd('dumpsys gfxinfo %s framestats'%self.package_name, timeout=self._cmd_timeout)
 #             logger.debug(results)
 #        把dumpsys gfxinfo package_name framestats的结果封装成   dumpsys SurfaceFlinger --latency的结果
 # 方便后面计算fps jank统一处理
-            results = results.replace("\r\n","\n").splitlines()
-            if not len(results):
+            timestamps = parse_gfxinfo_framestats(results, self.focus_window)
+            if timestamps is None:
                 return (None, None)
-            isHaveFoundWindow = False
-            PROFILEDATA_line = 0
-            for line in results:
-                if not isHaveFoundWindow:
-                    if "Window" in line and self.focus_window in line:
-                        isHaveFoundWindow = True
-#                         logger.debug("Window line:"+line)
-                if not isHaveFoundWindow:
-                    continue
-                if "PROFILEDATA" in line:
-                    PROFILEDATA_line +=1
-                fields = []
-                fields = line.split(",")
-                if fields and '0' == fields[0]:
-#                     logger.debug(line)
-# 获取INTENDED_VSYNC VSYNC FRAME_COMPLETED时间 利用VSYNC计算fps jank
-                    timestamp = [int(fields[1]),int(fields[2]),int(fields[13])]
-                    if timestamp[1] == pending_fence_timestamp:
-                        continue
-                    timestamp = [_timestamp / nanoseconds_per_second for _timestamp in timestamp]
-                    timestamps.append(timestamp)
-#               如果到了下一个窗口，退出
-                if 2 == PROFILEDATA_line:
-                    break
+            return (refresh_period, timestamps)
         else:
             results = self.device.adb.run_shell_cmd(
-                'dumpsys SurfaceFlinger --latency %s'%self.focus_window)
-            results = results.replace("\r\n","\n").splitlines()
+                'dumpsys SurfaceFlinger --latency %s'%self.focus_window, timeout=self._cmd_timeout)
             logger.debug("dumpsys SurfaceFlinger --latency result:")
             logger.debug(results)
-            if not len(results):
-                return (None, None)
-            if not results[0].isdigit():
-                return (None, None)
-            try:
-                refresh_period = int(results[0]) / nanoseconds_per_second
-            except Exception as e:
-                logger.exception(e)
-                return (None, None)
-            # If a fence associated with a frame is still pending when we query the
-            # latency data, SurfaceFlinger gives the frame a timestamp of INT64_MAX.
-            # Since we only care about completed frames, we will ignore any timestamps
-            # with this value.
-
-            for line in results[1:]:
-                fields = line.split()
-                if len(fields) != 3:
-                    continue
-                timestamp = [int(fields[0]),int(fields[1]),int(fields[2])]
-                if timestamp[1] == pending_fence_timestamp:
-                    continue
-                timestamp = [_timestamp / nanoseconds_per_second for _timestamp in timestamp]
-                timestamps.append(timestamp)
-        return (refresh_period, timestamps)
+            return parse_surfaceflinger_latency(results)
 
     def _get_surface_stats_legacy(self):
         """Legacy method (before JellyBean), returns the current Surface index
@@ -483,7 +509,7 @@ class SurfaceStatsCollector(object):
 
 class FPSMonitor(Monitor):
     '''FPS监控器'''
-    def __init__(self, device_id, package_name = None,frequency=1.0,timeout =24 * 60 * 60,fps_queue=None,jank_threshold=166, use_legacy = False):
+    def __init__(self, device_id, package_name = None,frequency=1.0,timeout =24 * 60 * 60,fps_queue=None,jank_threshold=166, use_legacy = False, session=None):
         '''构造器
         
         :param str device_id: 设备id
@@ -491,25 +517,27 @@ class FPSMonitor(Monitor):
         :param int jank_threshold: 计算jank值的阈值，单位毫秒，默认10个时钟周期，166ms
         :param bool use_legacy: 当指定该参数为True时总是使用page_flip统计帧率，此时反映的是全屏内容的刷新帧率。
                     当不指定该参数时，对4.1以上的系统将统计当前获得焦点的Activity的刷新帧率
+        :param Session session: 测试上下文，为空时使用全局的RuntimeData
         '''
         self.use_legacy = use_legacy
         self.frequency = frequency  # 取样频率
         self.jank_threshold = jank_threshold
-        self.device = AndroidDevice(device_id)
+        self.session = session if session else Session.default()
+        self.device = self.session.get_device(device_id)
         self.timeout = timeout
         if not package_name:
             package_name = self.device.adb.get_foreground_process()
         self.package = package_name
-        self.fpscollector = SurfaceStatsCollector(self.device, self.frequency, package_name,fps_queue,self.jank_threshold, self.use_legacy)
+        self.fpscollector = SurfaceStatsCollector(self.device, self.frequency, package_name,fps_queue,self.jank_threshold, self.use_legacy, self.session)
 
 
     def start(self,start_time):
         '''启动FPSMonitor日志监控器 
         '''
-        if not RuntimeData.package_save_path:
-            RuntimeData.package_save_path = os.path.join(os.path.abspath(os.path.join(os.getcwd(), "../..")),'results', self.package, start_time)
-            if not os.path.exists(RuntimeData.package_save_path):
-                os.makedirs(RuntimeData.package_save_path)
+        if not self.session.package_save_path:
+            self.session.package_save_path = os.path.join(os.path.abspath(os.path.join(os.getcwd(), "../..")),'results', self.package, start_time)
+            if not os.path.exists(self.session.package_save_path):
+                os.makedirs(self.session.package_save_path)
         self.start_time = start_time
         self.fpscollector.start(start_time)
         logger.debug('FPS monitor has start!')
@@ -1,29 +1,248 @@
-# -*- coding: utf-8 -*-
-'''
-@author:     look
-
-@copyright:  1999-2020 Alibaba.com. All rights reserved.
-
-@license:    Apache Software License 2.0
-
-@contact:    390125133@qq.com
-'''
-import threading
-
-# 记录运行时需要共享的全局变量
-class RuntimeData():
-    # 记录pid变更前的pid
-    old_pid = None
-    packages = None
-    package_save_path = None
-    start_time = None
-    exit_event = threading.Event()
-    top_dir = None
-    config_dic = {}
-    
-    # Web控制相关：用于跟踪当前运行的测试实例
-    current_startup = None  # 当前运行的StartUp实例
-    current_startup_thread = None  # 运行StartUp的线程
-    test_status = "stopped"  # 测试状态: "stopped", "running", "stopping"
-    test_start_time = None  # 测试启动时间
-    test_lock = threading.Lock()  # 用于保护测试实例的线程锁
\ No newline at end of file
+# -*- coding: utf-8 -*-
+'''
+@author:     look
+
+@copyright:  1999-2020 Alibaba.com. All rights reserved.
+
+@license:    Apache Software License 2.0
+
+@contact:    390125133@qq.com
+'''
+import os
+import csv
+import threading
+import time
+
+from mobileperf.common.log import logger
+from mobileperf.common.metrics import MetricsRegistry, default_registry
+from mobileperf.common.scheduler import DeadlineTicker, CollectorHealth
+from mobileperf.common.utils import TimeUtils
+
+# 记录运行时需要共享的全局变量
+class RuntimeData():
+    # 记录pid变更前的pid
+    old_pid = None
+    packages = None
+    package_save_path = None
+    start_time = None
+    exit_event = threading.Event()
+    top_dir = None
+    config_dic = {}
+
+    # Web控制相关：用于跟踪当前运行的测试实例
+    current_startup = None  # 当前运行的StartUp实例
+    current_startup_thread = None  # 运行StartUp的线程
+    test_status = "stopped"  # 测试状态: "stopped", "running", "stopping"
+    test_start_time = None  # 测试启动时间
+    test_lock = threading.Lock()  # 用于保护测试实例的线程锁
+
+
+class Session(object):
+    '''
+    一次测试的上下文：设备、包名、结果路径、配置、时钟和数据输出
+    各monitor通过session获取这些信息，多个session可以在同一个进程中并存，共用一个解释器和web服务
+    '''
+    def __init__(self, device_id=None, packages=None, package_save_path=None, config_dic=None,
+                 start_time=None, exit_event=None):
+        '''
+        :param str device_id: 设备序列号
+        :param list packages: 测试的包名列表
+        :param str package_save_path: 结果保存目录
+        :param dict config_dic: config.conf 解析出的配置项
+        :param str start_time: 测试开始时间，格式 TimeUtils.UnderLineFormatter
+        :param threading.Event exit_event: 测试退出信号
+        '''
+        self.device_id = device_id
+        self.packages = packages if packages else []
+        self.package_save_path = package_save_path
+        self.config_dic = config_dic if config_dic is not None else {}
+        self.start_time = start_time
+        self.exit_event = exit_event if exit_event else threading.Event()
+        # 记录pid变更前的pid
+        self.old_pid = None
+        # 采集时间统一从这里取，回放或测试时可以替换
+        self.clock = time.time
+        # 数据输出，每采集一行数据回调一次 sink(metric, timestamp, title, row)
+        self.sinks = []
+        # 工具自身的指标：adb耗时、采集循环耗时等
+        self.metrics = MetricsRegistry()
+        # 各collector采集节拍的共同原点，保证相同间隔的数据在同一时刻采集
+        self.epoch = time.monotonic()
+        # 开始启动monitor的时刻（单调时钟），用于统计各数据的首次采集耗时
+        self.run_begin = None
+        self._first_samples = set()
+        self._devices = {}
+        self._lock = threading.Lock()
+
+    def get_device(self, device_id=None):
+        '''同一个session内同一台设备共用一个AndroidDevice，避免每个monitor重复建立adb状态
+        '''
+        from mobileperf.android.tools.androiddevice import AndroidDevice
+        device_id = device_id if device_id else self.device_id
+        with self._lock:
+            device = self._devices.get(device_id)
+            if not device:
+                device = AndroidDevice(device_id)
+                if device.adb:
+                    device.adb.session = self
+                self._devices[device_id] = device
+            return device
+
+    def set_device(self, device_id, device):
+        '''指定某个设备id使用的设备对象，如回放录制数据的 ReplayDevice
+        '''
+        with self._lock:
+            if device.adb:
+                device.adb.session = self
+            self._devices[device_id] = device
+
+    def ticker(self, name, interval, stop_event=None):
+        '''
+        创建collector循环的节拍器，同一session的节拍相位对齐
+        :param str name: collector名
+        :param float interval: 采集间隔，单位秒
+        :param threading.Event stop_event: collector的停止信号
+        :rtype: DeadlineTicker
+        '''
+        health = CollectorHealth(name, interval, on_change=self._health_changed)
+        return DeadlineTicker(name, interval, self.epoch, stop_event, lambda: self.clock(), self.metrics, health)
+
+    def _health_changed(self, name, old_state, state, reason):
+        '''collector状态变化记到 collector_health.csv，数据断开的时间段可以据此对照
+        '''
+        logger.warning("collector %s %s -> %s %s" % (name, old_state, state, reason))
+        self.metrics.set_gauge("health:%s" % name, state)
+        self.metrics.inc("health_%s:%s" % (state, name))
+        if not self.package_save_path:
+            return
+        try:
+            health_file = os.path.join(self.package_save_path, "collector_health.csv")
+            is_new = not os.path.exists(health_file)
+            with open(health_file, "a+", encoding="utf-8") as f:
+                writer = csv.writer(f, lineterminator='\n')
+                if is_new:
+                    writer.writerow(["datetime", "collector", "from", "to", "reason"])
+                writer.writerow([TimeUtils.formatTimeStamp(self.clock()), name, old_state, state, reason])
+        except Exception as e:
+            logger.error("write collector health failed: %s" % e)
+
+    def config(self, option, default=None):
+        return self.config_dic.get(option, default)
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+
+    def remove_sink(self, sink):
+        if sink in self.sinks:
+            self.sinks.remove(sink)
+
+    def emit(self, metric, timestamp, title, row):
+        '''
+        把采集到的一行数据分发给所有sink
+        :param str metric: 数据名，与csv文件名一致，如 cpuinfo
+        :param float timestamp: 采集时间戳
+        :param list title: csv表头
+        :param list row: 数据行，与表头一一对应
+        '''
+        if metric not in self._first_samples:
+            self._first_samples.add(metric)
+            if self.run_begin is not None:
+                # 从开始启动monitor到这类数据第一次采集到的耗时
+                self.metrics.set_gauge("first_sample(s):%s" % metric, round(time.monotonic() - self.run_begin, 3))
+        for sink in list(self.sinks):
+            try:
+                sink(metric, timestamp, title, row)
+            except Exception as e:
+                logger.error("metric sink error: %s" % e)
+
+    @staticmethod
+    def row_to_values(title, row):
+        '''
+        把一行数据转为 {列名: 值}，多包的表中 package 列后面的列会加上包名前缀，如 com.taobao.taobao:pid_cpu%
+        '''
+        values = {}
+        package = None
+        for name, value in zip(title, row):
+            if name == "package" or name == "packagename":
+                package = value
+                continue
+            key = "%s:%s" % (package, name) if package else name
+            values[key] = value
+        return values
+
+    @staticmethod
+    def default():
+        '''兼容单进程单设备的老用法，属性读写直接落到 RuntimeData 上
+        '''
+        return _global_session
+
+
+class GlobalSession(Session):
+    '''
+    RuntimeData 的session视图，没有显式传入session的monitor都使用它
+    '''
+    def __init__(self):
+        self.device_id = None
+        self.clock = time.time
+        self.sinks = []
+        self.metrics = default_registry
+        self.epoch = time.monotonic()
+        self.run_begin = None
+        self._first_samples = set()
+        self._devices = {}
+        self._lock = threading.Lock()
+
+    def get_device(self, device_id=None):
+        from mobileperf.android.tools.androiddevice import AndroidDevice
+        return AndroidDevice(device_id)
+
+    @property
+    def packages(self):
+        return RuntimeData.packages
+
+    @packages.setter
+    def packages(self, value):
+        RuntimeData.packages = value
+
+    @property
+    def package_save_path(self):
+        return RuntimeData.package_save_path
+
+    @package_save_path.setter
+    def package_save_path(self, value):
+        RuntimeData.package_save_path = value
+
+    @property
+    def config_dic(self):
+        return RuntimeData.config_dic
+
+    @config_dic.setter
+    def config_dic(self, value):
+        RuntimeData.config_dic = value
+
+    @property
+    def start_time(self):
+        return RuntimeData.start_time
+
+    @start_time.setter
+    def start_time(self, value):
+        RuntimeData.start_time = value
+
+    @property
+    def exit_event(self):
+        return RuntimeData.exit_event
+
+    @exit_event.setter
+    def exit_event(self, value):
+        RuntimeData.exit_event = value
+
+    @property
+    def old_pid(self):
+        return RuntimeData.old_pid
+
+    @old_pid.setter
+    def old_pid(self, value):
+        RuntimeData.old_pid = value
+
+
+_global_session = GlobalSession()
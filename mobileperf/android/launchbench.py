@@ -0,0 +1,339 @@
+# -*- coding: utf-8 -*-
+'''
+@author:     look
+
+@copyright:  1999-2020 Alibaba.com. All rights reserved.
+
+@license:    Apache Software License 2.0
+
+@contact:    390125133@qq.com
+'''
+'''
+应用启动耗时基准测试：冷启动、温启动、热启动各重复N次，用 am start -W 的 TotalTime/WaitTime
+和logcat中的 Fully drawn 耗时，剔除离群值后输出均值、中位数、p90、标准差和95%置信区间，
+可以和上一个版本的结果对比，中位数劣化超过阈值时返回非0，用于版本发布卡口
+'''
+import os
+import re
+import sys
+import csv
+import json
+import time
+
+BaseDir=os.path.dirname(__file__)
+sys.path.append(os.path.join(BaseDir,'../..'))
+
+from mobileperf.common.log import logger
+from mobileperf.common.utils import TimeUtils,FileUtils
+from mobileperf.common import stats
+from mobileperf.android.tools.androiddevice import AndroidDevice
+
+USAGE = '''用法: python3 mobileperf/android/launchbench.py serialnum package[/activity] [--iterations 10]
+        [--modes cold,warm,hot] [--settle 3] [--fully-drawn-wait 0] [--output dir]
+        [--baseline launch_summary.json] [--threshold 0.1]'''
+
+COLD = "cold"
+WARM = "warm"
+HOT = "hot"
+MODES = [COLD, WARM, HOT]
+
+KEYCODE_HOME = 3
+KEYCODE_BACK = 4
+
+METRICS = ["total_time(ms)", "wait_time(ms)", "fully_drawn(ms)"]
+RAW_TITLE = ["datetime", "mode", "iteration", "launch_state", "total_time(ms)", "wait_time(ms)", "fully_drawn(ms)",
+             "outlier", "status"]
+SUMMARY_TITLE = ["mode", "metric", "n", "rejected", "mean", "median", "p90", "stdev", "ci95_low", "ci95_high",
+                 "min", "max"]
+
+# 08-28 10:57:30.229  1234  1260 I ActivityTaskManager: Fully drawn com.taobao.taobao/.MainActivity: +1s234ms
+FULLY_DRAWN_RE = re.compile(r"Fully drawn (\S+): \+(?:(\d+)s)?(\d+)ms")
+# events buffer: am_activity_fully_drawn_time: [0,123456,com.taobao.taobao/.MainActivity,1234]
+FULLY_DRAWN_EVENT_RE = re.compile(r"am_activity_fully_drawn_time: \[([^\]]*)\]")
+
+
+def parse_fully_drawn(log, package):
+    '''
+    从 logcat 中取被测包的 reportFullyDrawn 耗时，单位ms，有多条时取最后一条，没有返回None
+    '''
+    result = None
+    for line in log.splitlines():
+        match = FULLY_DRAWN_RE.search(line)
+        if match and match.group(1).startswith(package + "/"):
+            result = int(match.group(2) or 0) * 1000 + int(match.group(3))
+            continue
+        match = FULLY_DRAWN_EVENT_RE.search(line)
+        if match:
+            fields = match.group(1).split(",")
+            if len(fields) >= 4 and fields[2].startswith(package + "/"):
+                try:
+                    result = int(fields[3])
+                except ValueError:
+                    pass
+    return result
+
+
+def to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class LaunchBench(object):
+    '''
+    冷启动：force-stop 杀进程，有root时先 drop_caches 清页缓存，进程和文件缓存都不在
+    温启动：进程还在，按返回键销毁Activity后重新启动
+    热启动：按Home键退到后台，Activity还在，重新拉到前台
+    实际的启动类型以 am start -W 返回的 LaunchState 为准（Android 10以上有），与期望不一致时记在raw数据里
+    '''
+
+    def __init__(self, device_id, package, activity=None, iterations=10, modes=None, settle=3,
+                 fully_drawn_wait=0, save_path=None):
+        '''
+        :param str device_id: 设备序列号
+        :param str package: 包名
+        :param str activity: 启动的Activity，如 .MainActivity，为空时解析launcher Activity
+        :param int iterations: 每种启动方式的次数
+        :param list modes: 启动方式，cold warm hot
+        :param float settle: 每次启动后等待界面稳定的时间，单位秒
+        :param float fully_drawn_wait: 等待应用调用 reportFullyDrawn 的时间，单位秒，0表示不统计
+        :param str save_path: 结果目录
+        '''
+        self.device_id = device_id
+        self.device = AndroidDevice(device_id)
+        self.package = package
+        self.activity = activity
+        self.iterations = iterations
+        self.modes = modes if modes else list(MODES)
+        self.settle = settle
+        self.fully_drawn_wait = fully_drawn_wait
+        if not save_path:
+            save_path = os.path.join(FileUtils.get_top_dir(), 'results', package,
+                                     "launch_" + TimeUtils.getCurrentTimeUnderline())
+        self.save_path = save_path
+        self.rows = []
+        self.summary = {}
+        # 温启动时是否带 --activity-clear-task，见 prepare
+        self.clear_task = False
+
+    def resolve_activity(self):
+        '''
+        没有指定Activity时取包的launcher Activity，Android 7以上支持 cmd package resolve-activity
+        '''
+        if self.activity:
+            if "/" in self.activity:
+                return self.activity
+            return "%s/%s" % (self.package, self.activity)
+        out = self.device.adb.run_shell_cmd("cmd package resolve-activity --brief -c android.intent.category.LAUNCHER %s"
+                                            % self.package)
+        if out:
+            for line in reversed(out.splitlines()):
+                line = line.strip()
+                if line.startswith(self.package + "/"):
+                    return line
+        raise RuntimeError("can't resolve launcher activity of %s, set package/activity" % self.package)
+
+    def drop_caches(self):
+        '''有root时清掉页缓存，冷启动要从存储重新读apk、odex和so
+        '''
+        capability = self.device.adb.get_capability()
+        if capability.shell_root:
+            self.device.adb.run_shell_cmd('"sync; echo 3 > /proc/sys/vm/drop_caches"')
+        elif capability.su_root:
+            self.device.adb.run_shell_cmd('"su 0 sh -c \'sync; echo 3 > /proc/sys/vm/drop_caches\'"')
+        return capability.has_root
+
+    def activity_alive(self):
+        '''被测包是否还有Activity记录
+        '''
+        out = self.device.adb.run_filtered_shell_cmd("dumpsys activity activities", [self.package + "/"])
+        return any("ActivityRecord{" in line for line in (out or "").splitlines())
+
+    def keyevent(self, keycode):
+        self.device.adb.run_shell_cmd("input keyevent %d" % keycode)
+
+    def prepare(self, mode):
+        '''每次启动前把应用置于对应启动方式的状态
+        '''
+        if mode == COLD:
+            self.device.adb.stop_package(self.package)
+            self.drop_caches()
+        elif mode == WARM:
+            # 返回键可能要按多次才能退出应用的Activity栈
+            self.keyevent(KEYCODE_BACK)
+            self.keyevent(KEYCODE_BACK)
+            self.keyevent(KEYCODE_HOME)
+        else:
+            self.keyevent(KEYCODE_HOME)
+        time.sleep(1)
+        if mode == WARM:
+            # Android 12 开始根Activity按返回键只是把任务移到后台，Activity不会销毁，再启动是热启动；
+            # 这时启动带 --activity-clear-task，先结束任务中旧的Activity，进程还在、Activity重新创建，即温启动
+            self.clear_task = self.activity_alive()
+
+    def launch_once(self, activity, mode, iteration):
+        self.prepare(mode)
+        self.device.adb.run_shell_cmd("logcat -b main -b system -b events -c")
+        timestamp = time.time()
+        flags = "--activity-clear-task" if mode == WARM and self.clear_task else ""
+        result = self.device.adb.start_activity(activity, wait=True, flags=flags)
+        total_time = to_int(result.get("TotalTime"))
+        wait_time = to_int(result.get("WaitTime"))
+        launch_state = result.get("LaunchState", "").lower()
+        status = result.get("Status", "ok" if total_time is not None else "")
+        if total_time is None:
+            status = "failed" if not status or status == "ok" else status
+            logger.warning("%s launch %d of %s failed: %s" % (mode, iteration, activity, result))
+        elif launch_state and launch_state != mode:
+            # 如温启动时应用拦截了返回键，实际是热启动
+            status = "state_mismatch"
+        fully_drawn = None
+        if self.fully_drawn_wait and total_time is not None:
+            time.sleep(self.fully_drawn_wait)
+            log = self.device.adb.run_filtered_shell_cmd("logcat -d -b main -b system -b events",
+                                                         ["Fully drawn", "am_activity_fully_drawn_time"])
+            fully_drawn = parse_fully_drawn(log or "", self.package)
+        row = {"datetime": TimeUtils.formatTimeStamp(timestamp), "mode": mode, "iteration": iteration,
+               "launch_state": launch_state, "total_time(ms)": total_time, "wait_time(ms)": wait_time,
+               "fully_drawn(ms)": fully_drawn, "outlier": "", "status": status}
+        logger.info("%s launch %d: TotalTime %s WaitTime %s FullyDrawn %s %s" % (
+            mode, iteration, total_time, wait_time, fully_drawn, launch_state))
+        time.sleep(self.settle)
+        return row
+
+    def run(self):
+        activity = self.resolve_activity()
+        logger.info("launch bench %s, modes %s, %d iterations" % (activity, ",".join(self.modes), self.iterations))
+        if COLD in self.modes and not self.drop_caches():
+            logger.warning("device not rooted, cold launch only kills the process, page cache is kept")
+        for mode in self.modes:
+            if mode != COLD:
+                # 温启动和热启动要求进程已经在，先启动一次不计入结果
+                self.device.adb.start_activity(activity, wait=True)
+                time.sleep(self.settle)
+            for i in range(1, self.iterations + 1):
+                self.rows.append(self.launch_once(activity, mode, i))
+        self.summary = self.summarize(self.rows)
+        self.save()
+        return self.summary
+
+    @staticmethod
+    def summarize(rows):
+        '''
+        按启动方式和指标统计，失败和启动类型不符的不计入，离群值剔除后再统计，被剔除的行标记outlier
+        :return: {mode: {metric: stats.summarize 的结果加 rejected}}
+        '''
+        summary = {}
+        modes = [mode for mode in MODES if any(row["mode"] == mode for row in rows)]
+        for mode in modes:
+            summary[mode] = {}
+            valid = [row for row in rows if row["mode"] == mode and row["status"] == "ok"]
+            for metric in METRICS:
+                samples = [row for row in valid if row[metric] is not None]
+                kept, rejected = stats.reject_outliers([row[metric] for row in samples])
+                for row in samples:
+                    if row[metric] in rejected:
+                        row["outlier"] = ";".join(filter(None, [row["outlier"], metric]))
+                result = stats.summarize(kept)
+                result["rejected"] = len(rejected)
+                summary[mode][metric] = result
+        return summary
+
+    def save(self):
+        FileUtils.makedir(self.save_path)
+        with open(os.path.join(self.save_path, "launch_bench.csv"), "w", encoding="utf-8") as f:
+            writer = csv.writer(f, lineterminator='\n')
+            writer.writerow(RAW_TITLE)
+            for row in self.rows:
+                writer.writerow([row[name] if row[name] is not None else "" for name in RAW_TITLE])
+        with open(os.path.join(self.save_path, "launch_summary.csv"), "w", encoding="utf-8") as f:
+            writer = csv.writer(f, lineterminator='\n')
+            writer.writerow(SUMMARY_TITLE)
+            for mode, metrics in self.summary.items():
+                for metric, result in metrics.items():
+                    writer.writerow([mode, metric] + [result[name] if result[name] is not None else ""
+                                                      for name in SUMMARY_TITLE[2:]])
+        with open(os.path.join(self.save_path, "launch_summary.json"), "w", encoding="utf-8") as f:
+            json.dump({"package": self.package, "activity": self.activity, "iterations": self.iterations,
+                       "device": self.device_id,
+                       "summary": self.summary}, f, indent=2)
+        logger.info("launch bench result saved in %s" % self.save_path)
+
+
+def check_regression(summary, baseline, threshold, metric="total_time(ms)"):
+    '''
+    和基线结果比较中位数，当前中位数超过基线中位数的 1+threshold 倍且置信区间下限也高于基线中位数时判为劣化
+    :param dict summary: LaunchBench.summary
+    :param dict baseline: 基线的 launch_summary.json 中的 summary
+    :return: 劣化描述列表，空表示通过
+    '''
+    failures = []
+    for mode, metrics in summary.items():
+        current = metrics.get(metric, {})
+        base = baseline.get(mode, {}).get(metric, {})
+        if current.get("median") is None or not base.get("median"):
+            continue
+        limit = base["median"] * (1 + threshold)
+        ci_low = current.get("ci95_low")
+        if current["median"] > limit and (ci_low is None or ci_low > base["median"]):
+            failures.append("%s %s median %s > baseline %s * %s" % (mode, metric, current["median"],
+                                                                    base["median"], 1 + threshold))
+    return failures
+
+
+def format_summary(summary):
+    lines = ["%-5s %-16s %4s %4s %9s %9s %9s %9s %21s" % ("mode", "metric", "n", "rej", "mean", "median", "p90",
+                                                          "stdev", "ci95")]
+    for mode, metrics in summary.items():
+        for metric, result in metrics.items():
+            if not result["n"]:
+                continue
+            ci = "%s-%s" % (result["ci95_low"], result["ci95_high"]) if result["ci95_low"] is not None else ""
+            lines.append("%-5s %-16s %4d %4d %9s %9s %9s %9s %21s" % (
+                mode, metric, result["n"], result["rejected"], result["mean"], result["median"], result["p90"],
+                result["stdev"], ci))
+    return "\n".join(lines)
+
+
+def main(argv):
+    options = {"--iterations": "10", "--modes": ",".join(MODES), "--settle": "3", "--fully-drawn-wait": "0",
+               "--output": None, "--baseline": None, "--threshold": "0.1"}
+    positional = []
+    i = 0
+    while i < len(argv):
+        if argv[i] in options and i + 1 < len(argv):
+            options[argv[i]] = argv[i + 1]
+            i += 1
+        elif argv[i].startswith("--"):
+            print(USAGE)
+            return 2
+        else:
+            positional.append(argv[i])
+        i += 1
+    if len(positional) != 2:
+        print(USAGE)
+        return 2
+    serialnum, component = positional
+    package, _, activity = component.partition("/")
+    modes = [mode for mode in options["--modes"].split(",") if mode]
+    if not set(modes) <= set(MODES):
+        print(USAGE)
+        return 2
+    bench = LaunchBench(serialnum, package, activity or None, int(options["--iterations"]), modes,
+                        float(options["--settle"]), float(options["--fully-drawn-wait"]), options["--output"])
+    summary = bench.run()
+    print(format_summary(summary))
+    if options["--baseline"]:
+        with open(options["--baseline"], encoding="utf-8") as f:
+            baseline = json.load(f).get("summary", {})
+        failures = check_regression(summary, baseline, float(options["--threshold"]))
+        if failures:
+            for failure in failures:
+                print("FAIL " + failure)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -19,31 +19,32 @@ import hashlib
 BaseDir=os.path.dirname(__file__)
 sys.path.append(os.path.join(BaseDir,'../..'))
 
-from mobileperf.android.tools.androiddevice import AndroidDevice
 from mobileperf.common.basemonitor import Monitor
 from mobileperf.common.utils import TimeUtils,FileUtils
 from mobileperf.common.utils import ms2s
 from mobileperf.common.log import logger
-from mobileperf.android.globaldata import RuntimeData
+from mobileperf.android.globaldata import RuntimeData, Session
 
 class LogcatMonitor(Monitor):
     '''logcat监控器
     '''
-    def __init__(self, device_id, package=None, dingding_webhook=None, dingding_mobiles=None, **regx_config):
+    def __init__(self, device_id, package=None, dingding_webhook=None, dingding_mobiles=None, session=None, **regx_config):
         '''构造器
         
         :param str device_id: 设备id
         :param list package : 监控的进程列表，列表为空时，监控所有进程
         :param str dingding_webhook: 钉钉webhook地址，用于实时通知异常
         :param list dingding_mobiles: 钉钉通知@的手机号列表，如 ['138xxxx8888', '139xxxx9999']
+        :param Session session: 测试上下文，为空时使用全局的RuntimeData
         :param dict regx_config : 日志匹配配置项{conf_id = regx}，如：AutoMonitor=ur'AutoMonitor.*:(.*), cost=(\d+)'
         '''
         super(LogcatMonitor, self).__init__(**regx_config)
         self.package = package    # 监控的进程列表
         self.device_id = device_id
-        self.device = AndroidDevice(device_id)  # 设备
+        self.session = session if session else Session.default()
+        self.device = self.session.get_device(device_id)  # 设备
         self.running = False    # logcat监控器的启动状态(启动/结束)
-        self.launchtime = LaunchTime(self.device_id, self.package)
+        self.launchtime = LaunchTime(self.device_id, self.package, self.session)
         self.exception_log_list = []
         self.start_time = None
         self.dingding_webhook = dingding_webhook  # 钉钉webhook配置
@@ -66,7 +67,7 @@ class LogcatMonitor(Monitor):
         # https://developer.android.com/studio/command-line/logcat #alternativeBuffers
         # 默认缓冲区 main system crash,输出全部缓冲区
         if not self.running:
-            self.device.adb.start_logcat(RuntimeData.package_save_path, [], ' -b all')
+            self.device.adb.start_logcat(self.session.package_save_path, [], ' -b all')
             time.sleep(1)
             self.running = True
     
@@ -109,16 +110,16 @@ class LogcatMonitor(Monitor):
         
         if matched_tags:
             logger.debug("exception Info: " + log_line)
-            tmp_file = os.path.join(RuntimeData.package_save_path, 'exception.log')
+            tmp_file = os.path.join(self.session.package_save_path, 'exception.log')
             with open(tmp_file, 'a+',encoding="utf-8") as f:
                 f.write(log_line + '\n')
             #     这个路径 空格会有影响
-            process_stack_log_file = os.path.join(RuntimeData.package_save_path, 'process_stack_%s_%s.log' % (
+            process_stack_log_file = os.path.join(self.session.package_save_path, 'process_stack_%s_%s.log' % (
             self.package, TimeUtils.getCurrentTimeUnderline()))
             # 如果进程挂了，pid会变 ，抓变后进程pid的堆栈没有意义
             # self.logmonitor.device.adb.get_process_stack(self.package,process_stack_log_file)
-            if RuntimeData.old_pid:
-                self.device.adb.get_process_stack_from_pid(RuntimeData.old_pid, process_stack_log_file)
+            if self.session.old_pid:
+                self.device.adb.get_process_stack_from_pid(self.session.old_pid, process_stack_log_file)
             
             # 实时钉钉通知：如果异常日志中包含当前测试的包名，立即发送通知
             # 去重策略：使用日志内容的hash作为key，5分钟内相同内容的日志只发送一次通知
@@ -171,7 +172,7 @@ class LogcatMonitor(Monitor):
             
             # 提取时间戳信息，使用带冒号的时间格式
             current_time = time.strftime(TimeUtils.ColonFormatter, time.localtime(time.time()))
-            test_path = RuntimeData.package_save_path if RuntimeData.package_save_path else "未知路径"
+            test_path = self.session.package_save_path if self.session.package_save_path else "未知路径"
             
             # 获取Web服务器地址
             web_server_url = ""
@@ -228,7 +229,8 @@ class LogcatMonitor(Monitor):
 
 class LaunchTime(object):
 
-    def __init__(self,deviceid, packagename = ""):
+    def __init__(self,deviceid, packagename = "", session=None):
+        self.session = session if session else Session.default()
         # 列表的容积应该不用担心，与系统有一定关系，一般存几十万条数据没问题的
         self.launch_list = [("datetime","packagenme/activity","this_time(s)","total_time(s)","launchtype")]
         self.packagename = packagename
@@ -259,7 +261,7 @@ class LaunchTime(object):
             logger.debug("launchtime log:"+log_line)
         if ltag:
             content = []
-            timestamp = time.time()
+            timestamp = self.session.clock()
             content.append(TimeUtils.formatTimeStamp(timestamp))
             temp_list = log_line.split()[-1].replace("[", "").replace("]", "").split(',')[2:5]
             for i in range(len(temp_list)):
@@ -283,7 +285,7 @@ class LaunchTime(object):
     def update_launch_list(self, content,timestamp):
         # if self.packagename in content[1]:
         self.launch_list.append(content)
-        tmp_file = os.path.join(RuntimeData.package_save_path, 'launch_logcat.csv')
+        tmp_file = os.path.join(self.session.package_save_path, 'launch_logcat.csv')
         perf_data = {"task_id":"",'launch_time':[],'cpu':[],"mem":[],
                          'traffic':[], "fluency":[],'power':[],}
         dic = {"time": timestamp,
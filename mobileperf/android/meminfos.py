@@ -21,10 +21,11 @@ from shutil import copyfile,rmtree
 BaseDir=os.path.dirname(__file__)
 sys.path.append(os.path.join(BaseDir,'../..'))
 
-from mobileperf.android.tools.androiddevice import AndroidDevice
 from mobileperf.common.utils import TimeUtils,FileUtils,ZipUtils
 from mobileperf.common.log import logger
-from mobileperf.android.globaldata import RuntimeData
+from mobileperf.common.scheduler import gap_row, command_budget
+from mobileperf.android.globaldata import Session
+from mobileperf.android.agent import DeviceAgent
 
 class MemInfoPackage(object):
     RE_PROCESS = re.compile(r'\*\* MEMINFO in pid (\d+) \[(\S+)] \*\*')
@@ -42,6 +43,9 @@ class MemInfoPackage(object):
     nativeHeap = 0
     system = 0
 
+    # 设备端过滤 dumpsys meminfo <package> 时保留的行，与 _parse 用到的行一致
+    FILTER_PATTERNS = ["MEMINFO in pid", "TOTAL", "Java Heap:", "Native Heap:", "System:"]
+
     def __init__(self,  dump):
         self.dump = dump
         self._parse()
@@ -87,6 +91,8 @@ class MemInfoDevice:
     RE_TOTAL_MEMORY = re.compile(r'Total RAM:\s+([\d,]+)')
     RE_FREE_MEMORY = re.compile(r' Free RAM:\s+([\d,]+)')
     RE_USED_MEMORY = re.compile(r" Used RAM:\s+([\d,]+)")
+    # Total PSS by process: / Total RSS by OOM adjustment: 等分段标题，12以上 RSS 段可能在 PSS 段前面
+    RE_SECTION = re.compile(r'Total (\w+) by ([\w ]+):')
 
     def __init__(self,dump,packages=[]):
         self.totalmem = 0
@@ -99,6 +105,13 @@ class MemInfoDevice:
         self.total_pss = 0
         self._parse()
 
+    @staticmethod
+    def filter_patterns(packages):
+        '''
+        设备端过滤 dumpsys meminfo 时保留的行：总内存、可用内存、已用内存、按进程的分段标题和各包名的进程行
+        '''
+        return ["Total RAM", "Free RAM", "Used RAM", "by process:"] + ["%s (pid" % package for package in packages]
+
 
     def _parse(self):
         '''
@@ -125,10 +138,19 @@ class MemInfoDevice:
             # 111920 kB: com.alibaba.ailabs.tg (pid 16036 / activities)
             RE_PROCESS_MEMORY_2 = re.compile(r"([\d,]+)\s+kB:\s+\d+\s+kB:\s+" + package + "\s+\(pid\s+(\d+)")
             # 243786 kB:       0 kB: com.alibaba.ailabs.tg (pid 16993 / activities)
+            # 没有分段标题时（老版本或过滤后的输出）默认是PSS，只在 Total PSS by process 段里找，跳过 RSS 段和按oom分组的段
+            in_pss = True
             for line in self.dump.splitlines():
+                section = self.RE_SECTION.search(line)
+                if section:
+                    in_pss = section.group(1) == "PSS" and section.group(2) == "process"
+                    continue
+                if not in_pss:
+                    continue
+                # 带SwapPss列时第二列也是 "N kB: 包名"，要先匹配两列的格式，否则会把swap当成pss
                 match = RE_PROCESS_MEMORY.search(line)
                 match2 = RE_PROCESS_MEMORY_2.search(line)
-                if match:
+                if match and not match2:
                     pss = round(float(match.group(1).replace(",", "")) / 1024, 2)
                     mem_dic = {"package": package, "pid": match.group(3), "pss": str(pss)}
                     # self.package_pid_pss_list.append(mem_dic)
@@ -146,15 +168,21 @@ class MemInfoDevice:
             logger.debug(mem_dic)
 
 class MemInfoPackageCollector(object):
-    def __init__(self, device, pacakges, interval=1.0, timeout =24 * 60 * 60, mem_queue = None):
+    def __init__(self, device, pacakges, interval=1.0, timeout =24 * 60 * 60, mem_queue = None, session=None):
         self.device = device
+        self.session = session if session else Session.default()
         self.packages = pacakges
         self._interval = interval
+        # dumpsys meminfo 本身就慢，超时至少给10秒
+        self._cmd_timeout = command_budget(interval, minimum=10)
         self._timeout = timeout
         self._stop_event = threading.Event()
         self.mem_queue = mem_queue
         self.start_time = 0
         self.num = 0
+        # 本次采集读取的字节数和解析耗时
+        self._tick_bytes = 0
+        self._tick_parse = 0
 
 
     def start(self,start_time):
@@ -180,8 +208,9 @@ class MemInfoPackageCollector(object):
         :return:
         '''
         time_old = time.time()
-        out = self.device.adb.run_shell_cmd('dumpsys meminfo')
-        meminfo_file = os.path.join(RuntimeData.package_save_path, 'dumpsys_meminfo.txt')
+        out = self.device.adb.run_filtered_shell_cmd('dumpsys meminfo', MemInfoDevice.filter_patterns(self.packages),
+                                                     timeout=self._cmd_timeout)
+        meminfo_file = os.path.join(self.session.package_save_path, 'dumpsys_meminfo.txt')
         with open(meminfo_file, "a+",encoding="utf-8") as writer:
             writer.write(TimeUtils.getCurrentTime()+" dumpsys meminfo info:\n")
             writer.write(out+"\n\n")
@@ -190,7 +219,11 @@ class MemInfoPackageCollector(object):
         passedtime = time.time() - time_old#测试meminfo这个命令的耗时，执行的时长在400多ms
         logger.debug("dumpsys meminfo time consume:" + str(passedtime))
         out.replace('\r', '')
-        return MemInfoDevice(dump=out,packages=self.packages)
+        before = time.time()
+        mem_info = MemInfoDevice(dump=out,packages=self.packages)
+        self._tick_parse = self._tick_parse + time.time() - before
+        self._tick_bytes = self._tick_bytes + len(out)
+        return mem_info
 
     def _dumpsys_process_meminfo(self,process):
         '''
@@ -199,12 +232,13 @@ class MemInfoPackageCollector(object):
         :return:
         '''
         time_old = time.time()
-        out = self.device.adb.run_shell_cmd('dumpsys meminfo %s' % process)
+        out = self.device.adb.run_filtered_shell_cmd('dumpsys meminfo %s' % process, MemInfoPackage.FILTER_PATTERNS,
+                                                     timeout=self._cmd_timeout)
         # self.num = self.num + 1
         # if self.num % 10 == 0:
         #避免：在windows 无法创建文件名，不能有冒号:
         process_rename = process.replace(":","_")
-        meminfo_file = os.path.join(RuntimeData.package_save_path, 'dumpsys_meminfo_%s.txt'%process_rename)
+        meminfo_file = os.path.join(self.session.package_save_path, 'dumpsys_meminfo_%s.txt'%process_rename)
         with open(meminfo_file, "a+",encoding="utf-8") as writer:
             writer.write(TimeUtils.getCurrentTime()+" dumpsys meminfo package info:\n")
             if out:
@@ -214,7 +248,11 @@ class MemInfoPackageCollector(object):
         passedtime = time.time() - time_old#测试meminfo这个命令的耗时，执行的时长在400多ms
         logger.debug("dumpsys meminfo package time consume:" + str(passedtime))
         out.replace('\r', '')
-        return MemInfoPackage(dump=out)
+        before = time.time()
+        mem_info = MemInfoPackage(dump=out)
+        self._tick_parse = self._tick_parse + time.time() - before
+        self._tick_bytes = self._tick_bytes + len(out)
+        return mem_info
 
     # @profile
     def _collect_memory_thread(self, start_time):
@@ -227,10 +265,10 @@ class MemInfoPackageCollector(object):
             pid_list_titile.extend(["package", "pid"])
         if len(self.packages)>1:
             mem_list_titile.append("total_pss(MB)")
-        mem_file = os.path.join(RuntimeData.package_save_path, 'meminfo.csv')
-        pid_file = os.path.join(RuntimeData.package_save_path, 'pid_change.csv')
+        mem_file = os.path.join(self.session.package_save_path, 'meminfo.csv')
+        pid_file = os.path.join(self.session.package_save_path, 'pid_change.csv')
         for package in self.packages:
-            pss_detail_file = os.path.join(RuntimeData.package_save_path, 'pss_%s.csv'%package.split(".")[-1].replace(":","_"))
+            pss_detail_file = os.path.join(self.session.package_save_path, 'pss_%s.csv'%package.split(".")[-1].replace(":","_"))
             with open(pss_detail_file, 'a+',encoding="utf-8") as df:
                 csv.writer(df, lineterminator='\n').writerow(pss_detail_titile)
         try:
@@ -244,6 +282,13 @@ class MemInfoPackageCollector(object):
                 csv.writer(df, lineterminator='\n').writerow(pid_list_titile)
         except RuntimeError as e:
             logger.error(e)
+        if DeviceAgent.enabled(self.session):
+            # smaps_rollup 只有root才能读其他应用的，没有root还是走 dumpsys meminfo
+            if self.device.adb.get_capability().has_root:
+                self._collect_memory_from_agent(mem_file, pid_file, mem_list_titile, pid_list_titile,
+                                                pss_detail_titile, end_time)
+                return
+            logger.warning("device agent needs root to read smaps_rollup, meminfo use dumpsys")
         starttime_stamp = TimeUtils.getTimeStamp(start_time,"%Y_%m_%d_%H_%M_%S")
         old_package_pid_pss_list = []
         dumpsys_mem_times = 0
@@ -254,27 +299,45 @@ class MemInfoPackageCollector(object):
         # sdcard 卡目录下dump需要打开这个开关
         self.device.adb.run_shell_cmd("setenforce 0")
         first_dump = True
+        ticker = self.session.ticker("meminfo", self._interval, self._stop_event)
         while not self._stop_event.is_set() and time.time() < end_time:
             try:
+                collection_time = ticker.next()
+                if collection_time is None:
+                    break
                 before = time.time()
+                self._tick_bytes = 0
+                self._tick_parse = 0
                 logger.debug("-----------into _collect_mem_thread loop, thread is : " + str(threading.current_thread().name))
-                collection_time = time.time()
                 # # 获取主进程的详细信息
+                got_pss = False
                 for package in self.packages:
                     mem_pck_snapshot = self._dumpsys_process_meminfo(package)
                     if 0 == mem_pck_snapshot.totalPSS:
                         logger.error("package total pss is 0:%s"%package)
                         continue
-                    pss_detail_file = os.path.join(RuntimeData.package_save_path,'pss_%s.csv' % package.split(".")[-1].replace(":","_"))
+                    got_pss = True
+                    pss_detail_file = os.path.join(self.session.package_save_path,'pss_%s.csv' % package.split(".")[-1].replace(":","_"))
                     pss_detail_list= [TimeUtils.formatTimeStamp(collection_time),package,mem_pck_snapshot.pid,mem_pck_snapshot.totalPSS,
                                       mem_pck_snapshot.javaHeap,mem_pck_snapshot.nativeHeap,mem_pck_snapshot.system]
                     with open(pss_detail_file, 'a+',encoding="utf-8") as pss_writer:
                         writer_p = csv.writer(pss_writer, lineterminator='\n')
                         writer_p.writerow(pss_detail_list)
+                    self.session.emit('pss_%s' % package.split(".")[-1].replace(":","_"), collection_time,
+                                      pss_detail_titile, pss_detail_list)
                 #         写到pss_detail表格中
+                if not got_pss:
+                    # 进程都不在或设备离线，退避后再试
+                    if ticker.fail("package total pss is 0", self.device.adb.is_offline()):
+                        for package in self.packages:
+                            pss_detail_file = os.path.join(self.session.package_save_path,'pss_%s.csv' % package.split(".")[-1].replace(":","_"))
+                            with open(pss_detail_file, 'a+',encoding="utf-8") as pss_writer:
+                                csv.writer(pss_writer, lineterminator='\n').writerow(gap_row(collection_time, len(pss_detail_titile)))
+                    continue
+                ticker.ok()
 
                 # 每隔dumpheap_freq分钟， dumpheap一次
-                if (before - starttime_stamp) > RuntimeData.config_dic["dumpheap_freq"] or first_dump:
+                if (before - starttime_stamp) > self.session.config_dic["dumpheap_freq"] or first_dump:
                 #     先清理hprof文件
                     filelist = self.device.adb.list_dir(hprof_path)
                     if filelist:
@@ -284,7 +347,7 @@ class MemInfoPackageCollector(object):
                                     self.device.adb.delete_file(hprof_path+"/" + file)
                 # if (before - starttime_stamp) % 60 < self._interval and "D" in self.device.adb.get_system_version():
                     for package in self.packages:
-                        self.device.adb.dumpheap(package,RuntimeData.package_save_path)
+                        self.device.adb.dumpheap(package,self.session.package_save_path)
                     starttime_stamp = before
                     # self.device.adb.run_shell_cmd("kill -10 %s"%str(mem_pck_snapshot.pid))
                 # dumpsys meminfo 耗时长，可能会导致system server cpu占用变高，降低采集频率
@@ -319,10 +382,10 @@ class MemInfoPackageCollector(object):
                                 pid_change = True
                                 # 确保上次pid也有
                                 if old_package_pid_pss_list[i]["pid"]:
-                                    if package and package in RuntimeData.config_dic["pid_change_focus_package"]:
+                                    if package and package in self.session.config_dic["pid_change_focus_package"]:
                                         # 确保有tombstones文件才提单
                                         self.device.adb.pull_file("/data/vendor/tombstones",
-                                                                  RuntimeData.package_save_path)
+                                                                  self.session.package_save_path)
                     if pid_change:
                         old_package_pid_pss_list = mem_device_snapshot.package_pid_pss_list
                         for i in range(0, len(self.packages)):
@@ -336,6 +399,7 @@ class MemInfoPackageCollector(object):
                                 logger.debug(pid_list)
                         except RuntimeError as e:
                             logger.error(e)
+                        self.session.emit("pid_change", collection_time, pid_list_titile, pid_list)
                     if len(self.packages)>1:
                         gather_list.append(mem_device_snapshot.total_pss)
                     if self.mem_queue:
@@ -350,37 +414,106 @@ class MemInfoPackageCollector(object):
                                 logger.debug(gather_list)
                         except RuntimeError as e:
                             logger.error(e)
+                    self.session.emit("meminfo", collection_time, mem_list_titile, gather_list)
 
+                self.session.metrics.record_parse("meminfo", self._tick_bytes, self._tick_parse)
                 after = time.time()
                 time_consume = after - before
-                delta_inter = self._interval - time_consume
                 logger.info("time consume for meminfos: " + str(time_consume))
-                if delta_inter > 0:
-                    time.sleep(delta_inter)
             except:
                 logger.error("an exception hanpend in meminfo thread, reason unkown!")
                 s = traceback.format_exc()
                 logger.debug(s)
+                ticker.fail("exception", self.device.adb.is_offline())
                 if self.mem_queue:
                     self.mem_queue.task_done()
 
         logger.debug("stop event is set or timeout")
 
+    def _collect_memory_from_agent(self, mem_file, pid_file, mem_list_titile, pid_list_titile, pss_detail_titile, end_time):
+        '''
+        设备端agent模式，pss 取自 smaps_rollup，总内存和可用内存取自 /proc/meminfo，每个样本写一行
+        java_heap native_heap system 只有 dumpsys meminfo 才有，这里留空，也不再定时dumpheap
+        '''
+        agent = DeviceAgent.get(self.device, self.session, self._interval)
+        old_pids = {}
+
+        def pss_file(package):
+            return os.path.join(self.session.package_save_path, 'pss_%s.csv' % package.split(".")[-1].replace(":","_"))
+
+        def on_samples(samples):
+            mem_rows = []
+            pid_rows = []
+            pss_rows = dict((package, []) for package in self.packages)
+            for sample in samples:
+                if not sample.pss or "MemTotal" not in sample.meminfo:
+                    continue
+                datetime = TimeUtils.formatTimeStamp(sample.timestamp)
+                gather_list = [datetime, round(sample.meminfo["MemTotal"] / 1024.0, 2),
+                               round(sample.meminfo.get("MemAvailable", 0) / 1024.0, 2)]
+                total_pss = 0
+                pid_change = False
+                for package in self.packages:
+                    pid, pss = sample.pss.get(package, ("", ""))
+                    if pss != "":
+                        pss = round(pss / 1024.0, 2)
+                        total_pss += pss
+                        pss_detail_list = [datetime, package, pid, pss, "", "", ""]
+                        pss_rows[package].append(pss_detail_list)
+                        self.session.emit('pss_%s' % package.split(".")[-1].replace(":","_"), sample.timestamp,
+                                          pss_detail_titile, pss_detail_list)
+                    gather_list.extend([package, pid, str(pss)])
+                    if pid and old_pids.get(package) != pid:
+                        pid_change = True
+                        old_pids[package] = pid
+                if len(self.packages) > 1:
+                    gather_list.append(round(total_pss, 2))
+                if pid_change:
+                    pid_list = [datetime]
+                    for package in self.packages:
+                        pid_list.extend([package, old_pids.get(package, "")])
+                    pid_rows.append(pid_list)
+                    self.session.emit("pid_change", sample.timestamp, pid_list_titile, pid_list)
+                self.session.emit("meminfo", sample.timestamp, mem_list_titile, gather_list)
+                if self.mem_queue:
+                    self.mem_queue.put([sample.timestamp] + gather_list[1:])
+                else:
+                    mem_rows.append(gather_list)
+            for package, rows in pss_rows.items():
+                if rows:
+                    with open(pss_file(package), 'a+', encoding="utf-8") as pss_writer:
+                        csv.writer(pss_writer, lineterminator='\n').writerows(rows)
+            if mem_rows:
+                with open(mem_file, 'a+', encoding="utf-8") as mem_writer:
+                    csv.writer(mem_writer, lineterminator='\n').writerows(mem_rows)
+            if pid_rows:
+                with open(pid_file, 'a+', encoding="utf-8") as pid_writer:
+                    csv.writer(pid_writer, lineterminator='\n').writerows(pid_rows)
+
+        def on_gap(collection_time):
+            for package in self.packages:
+                with open(pss_file(package), 'a+', encoding="utf-8") as pss_writer:
+                    csv.writer(pss_writer, lineterminator='\n').writerow(gap_row(collection_time, len(pss_detail_titile)))
+
+        agent.collect("meminfo", self._interval, self._stop_event, end_time, on_samples, on_gap)
+        logger.debug("meminfo agent collect stop")
+
 
 class MemMonitor(object):
-    def __init__(self, device_id, packages, interval = 1.0, timeout=24 * 60 * 60, mem_queue = None):
-        self.device = AndroidDevice(device_id, )
+    def __init__(self, device_id, packages, interval = 1.0, timeout=24 * 60 * 60, mem_queue = None, session=None):
+        self.session = session if session else Session.default()
+        self.device = self.session.get_device(device_id)
         if not packages:
             packages = self.device.adb.get_foreground_process().split("#")
         self.packages = packages
         # self.meminfo_collector = MemInfoCollector(self.device, interval)
-        self.meminfo_package_collector = MemInfoPackageCollector(self.device, self.packages, interval, timeout, mem_queue)
+        self.meminfo_package_collector = MemInfoPackageCollector(self.device, self.packages, interval, timeout, mem_queue, self.session)
 
     def start(self,start_time):
-        if not RuntimeData.package_save_path:
-            RuntimeData.package_save_path = os.path.join(os.path.abspath(os.path.join(os.getcwd(), "../..")),'results', self.packages[0], start_time)
-            if not os.path.exists(RuntimeData.package_save_path):
-                os.makedirs(RuntimeData.package_save_path)
+        if not self.session.package_save_path:
+            self.session.package_save_path = os.path.join(os.path.abspath(os.path.join(os.getcwd(), "../..")),'results', self.packages[0], start_time)
+            if not os.path.exists(self.session.package_save_path):
+                os.makedirs(self.session.package_save_path)
         self.start_time = start_time
         # self.meminfo_collector.start(start_time)
         self.meminfo_package_collector.start(start_time)
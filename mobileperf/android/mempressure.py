@@ -0,0 +1,313 @@
+#encoding:utf-8
+'''
+@author:     look
+
+@copyright:  1999-2020 Alibaba.com. All rights reserved.
+
+@license:    Apache Software License 2.0
+
+@contact:    390125133@qq.com
+'''
+'''
+系统内存压力：每个采集周期用一条 grep 读出 /proc/pressure/memory、cpu、io（PSI，4.20以上内核、Android 10以上才有）、
+/proc/vmstat 的 pgmajfault/pswpin/pswpout 和各测试进程 /proc/<pid>/stat 的 majflt，按采集间隔的增量写 pressure.csv，
+同一行带上 meminfo 最近一次采集的剩余内存和各进程pss；logcat 中 lmkd 的查杀记录写 lmkd_kills.csv，
+报告中pss增长与系统内存压力、后台查杀在同一时间轴上对照
+'''
+import csv
+import os
+import re
+import sys
+import threading
+import time
+import traceback
+
+BaseDir=os.path.dirname(__file__)
+sys.path.append(os.path.join(BaseDir,'../..'))
+
+from mobileperf.common.utils import TimeUtils
+from mobileperf.common.log import logger
+from mobileperf.common.scheduler import gap_row, command_budget
+from mobileperf.android.globaldata import Session
+
+PSI_RESOURCES = ["memory", "cpu", "io"]
+VMSTAT_KEYS = ["pgmajfault", "pswpin", "pswpout"]
+# 系统列，PSI的百分比是采集间隔内有任务因为该资源停顿的时间占比（some）和所有任务都停顿的时间占比（full）
+SYSTEM_TITLE = ["datetime", "mem_some%", "mem_full%", "io_some%", "io_full%", "cpu_some%", "pgmajfault", "pswpin",
+                "pswpout", "lmk_kills", "free_ram(MB)"]
+PSI_COLUMNS = [("memory", "some"), ("memory", "full"), ("io", "some"), ("io", "full"), ("cpu", "some")]
+PACKAGE_TITLE = ["package", "pid", "majflt", "pid_pss(MB)"]
+
+
+def pressure_cmd(pids):
+    '''
+    读取PSI、vmstat和进程majflt的命令，一个grep进程，没有的文件（老内核没有PSI）不输出
+    PSI: /proc/pressure/memory:some avg10=0.00 avg60=0.00 avg300=0.00 total=123456
+    vmstat: /proc/vmstat:pgmajfault 1234
+    stat: /proc/<pid>/stat:<pid> (comm) S ...
+    '''
+    files = ["/proc/pressure/%s" % resource for resource in PSI_RESOURCES] + ["/proc/vmstat"]
+    files.extend("/proc/%s/stat" % pid for pid in pids)
+    patterns = " ".join("-e ^%s" % key for key in VMSTAT_KEYS)
+    return "grep -H -e total= %s -e ^[0-9] %s 2>/dev/null" % (patterns, " ".join(files))
+
+
+class PressureSnapshot(object):
+    '''
+    解析 pressure_cmd 的输出
+    psi: {(资源, some/full): 累计停顿us}，没有PSI时为空
+    vmstat: {pgmajfault: 次数, ...}
+    majflt: {pid: 主缺页次数}
+    '''
+    RE_PSI = re.compile(r'/proc/pressure/(\w+):(some|full) .*total=(\d+)')
+    RE_VMSTAT = re.compile(r'/proc/vmstat:(\w+) (\d+)')
+    RE_STAT = re.compile(r'/proc/(\d+)/stat:\d+ \(.*\) (.*)$')
+
+    def __init__(self, source):
+        self.source = source
+        self.psi = {}
+        self.vmstat = {}
+        self.majflt = {}
+        self._parse()
+
+    def _parse(self):
+        for line in self.source.split("\n"):
+            line = line.strip()
+            match = self.RE_PSI.search(line)
+            if match:
+                self.psi[(match.group(1), match.group(2))] = int(match.group(3))
+                continue
+            match = self.RE_VMSTAT.search(line)
+            if match:
+                if match.group(1) in VMSTAT_KEYS:
+                    self.vmstat[match.group(1)] = int(match.group(2))
+                continue
+            match = self.RE_STAT.search(line)
+            if match:
+                # 进程名可能含空格和括号，从最后一个右括号之后数：state ppid ... majflt 是第10个字段
+                fields = match.group(2).split()
+                if len(fields) > 9:
+                    self.majflt[match.group(1)] = int(fields[9])
+
+
+class LmkdKill(object):
+    '''
+    logcat 中 lowmemorykiller 的查杀记录，兼容用户态lmkd和内核lmk驱动的格式：
+    lowmemorykiller: Kill 'com.taobao.taobao' (12345), uid 10123, oom_score_adj 900 to free 80000kB rss, 20000kB swap; reason: ...
+    lowmemorykiller: Kill 'com.taobao.taobao' (12345), uid 10123, oom_adj 906 to free 45240kB
+    lowmemorykiller: Killing 'com.taobao.taobao' (12345) (tgid 12345), adj 906,
+    '''
+    TITLE = ["datetime", "process", "pid", "uid", "oom_score_adj", "rss(KB)", "test_package"]
+    RE_KILL = re.compile(r"Kill(?:ing)? '([^']+)' \((\d+)\)(?: \(tgid \d+\))?(?:, uid (\d+))?,"
+                         r" (?:oom_score_adj|oom_adj|adj) (-?\d+),?(?: +to free (\d+)kB)?")
+
+    @staticmethod
+    def parse(log_line):
+        '''
+        :return: [进程名, pid, uid, oom_score_adj, 释放的rss KB]，不是查杀记录返回None
+        '''
+        if "lowmemorykiller" not in log_line:
+            return None
+        match = LmkdKill.RE_KILL.search(log_line)
+        if not match:
+            return None
+        return [match.group(1), match.group(2), match.group(3) or "", int(match.group(4)),
+                int(match.group(5)) if match.group(5) else ""]
+
+
+class MemPressureCollector(object):
+    def __init__(self, device, packages, interval=1.0, timeout=24 * 60 * 60, session=None):
+        self.device = device
+        self.packages = packages
+        self.session = session if session else Session.default()
+        self._interval = interval
+        self._cmd_timeout = command_budget(interval)
+        self._timeout = timeout
+        self._stop_event = threading.Event()
+        self.pids = {}
+        self.kills = []
+        # 上一行之后的查杀次数，logcat线程累加，采集线程读取后清零
+        self._pending_kills = 0
+        # meminfo 最近一次的值 {列名: 值}
+        self._meminfo = {}
+        self._lock = threading.Lock()
+        self._prev = None
+        self.collect_pressure_thread = None
+
+    def start(self, start_time):
+        logger.debug("INFO: MemPressureCollector start...")
+        # 查杀记录在logcat线程中写，先写好表头
+        with open(os.path.join(self.session.package_save_path, 'lmkd_kills.csv'), 'a+', encoding="utf-8") as writer:
+            csv.writer(writer, lineterminator='\n').writerow(LmkdKill.TITLE)
+        self.session.add_sink(self._on_metric)
+        # 同一session的同一设备共用一个adb对象，LogcatMonitor 读到的每一行都会回调
+        self.device.adb._logcat_handle.append(self.handle_lmkd_kill)
+        self.collect_pressure_thread = threading.Thread(target=self._collect_pressure_thread, name="mem_pressure")
+        self.collect_pressure_thread.start()
+
+    def stop(self):
+        logger.debug("INFO: MemPressureCollector stop...")
+        if self.handle_lmkd_kill in self.device.adb._logcat_handle:
+            self.device.adb._logcat_handle.remove(self.handle_lmkd_kill)
+        self.session.remove_sink(self._on_metric)
+        if self.collect_pressure_thread and self.collect_pressure_thread.is_alive():
+            self._stop_event.set()
+            self.collect_pressure_thread.join(timeout=2)
+            self.collect_pressure_thread = None
+        logger.info("%d lmkd kills during the test" % len(self.kills))
+
+    def _on_metric(self, metric, timestamp, title, row):
+        if metric != "meminfo":
+            return
+        with self._lock:
+            self._meminfo = Session.row_to_values(title[1:], row[1:])
+
+    def handle_lmkd_kill(self, log_line):
+        '''logcat 每一行回调一次，lmkd 的查杀记录写 lmkd_kills.csv
+        '''
+        kill = LmkdKill.parse(log_line)
+        if not kill:
+            return
+        timestamp = self.session.clock()
+        # 测试包的子进程（包名:进程名）也算
+        is_test = any(kill[0] == package or kill[0].startswith(package + ":") for package in self.packages)
+        row = [TimeUtils.formatTimeStamp(timestamp)] + kill + [1 if is_test else 0]
+        if row[-1]:
+            logger.warning("test process killed by lmkd: %s" % log_line)
+        with self._lock:
+            self.kills.append(row)
+            self._pending_kills += 1
+        with open(os.path.join(self.session.package_save_path, 'lmkd_kills.csv'), 'a+', encoding="utf-8") as writer:
+            csv.writer(writer, lineterminator='\n').writerow(row)
+        self.session.emit("lmkd_kills", timestamp, LmkdKill.TITLE, row)
+
+    def _update_pids(self):
+        for package in self.packages:
+            pid = self.device.adb.get_pid_from_pck(package)
+            if pid is None:
+                self.pids.pop(package, None)
+            else:
+                self.pids[package] = str(pid)
+
+    def get_snapshot(self):
+        '''
+        :return: PressureSnapshot，进程重启后 /proc/<pid>/stat 读不到时更新pid再读一次
+        '''
+        if len(self.pids) < len(self.packages):
+            self._update_pids()
+        # 整条命令加双引号，重定向在设备端执行，不被PC端的shell处理
+        out = self.device.adb.run_shell_cmd('"%s"' % pressure_cmd(self.pids.values()), timeout=self._cmd_timeout)
+        if not out:
+            return None
+        before = time.time()
+        snapshot = PressureSnapshot(out)
+        if any(pid not in snapshot.majflt for pid in self.pids.values()):
+            self._update_pids()
+            out = self.device.adb.run_shell_cmd('"%s"' % pressure_cmd(self.pids.values()), timeout=self._cmd_timeout)
+            snapshot = PressureSnapshot(out) if out else snapshot
+        self.session.metrics.record_parse("mem_pressure", len(out), time.time() - before)
+        if not snapshot.vmstat and not snapshot.psi:
+            return None
+        return snapshot
+
+    def _make_row(self, collection_time, snapshot):
+        '''
+        相对上一次采样的增量，和 SYSTEM_TITLE + PACKAGE_TITLE * 包数 对应，第一次采样只有pid和pss
+        '''
+        prev = self._prev
+        pids = dict(self.pids)
+        self._prev = (collection_time, snapshot, pids)
+        with self._lock:
+            kills = self._pending_kills
+            self._pending_kills = 0
+            meminfo = self._meminfo
+        row = [TimeUtils.formatTimeStamp(collection_time)]
+        elapsed = collection_time - prev[0] if prev else 0
+        for key in PSI_COLUMNS:
+            if elapsed > 0 and key in snapshot.psi and key in prev[1].psi:
+                stall = (snapshot.psi[key] - prev[1].psi[key]) / (elapsed * 1e6) * 100
+                row.append(round(min(max(stall, 0), 100), 2))
+            else:
+                row.append("")
+        for key in VMSTAT_KEYS:
+            if prev and key in snapshot.vmstat and key in prev[1].vmstat:
+                row.append(max(snapshot.vmstat[key] - prev[1].vmstat[key], 0))
+            else:
+                row.append("")
+        row.extend([kills, meminfo.get("free_ram(MB)", "")])
+        for package in self.packages:
+            pid = pids.get(package, "")
+            majflt = ""
+            # pid 变了说明进程重启过，这一个样本没有增量
+            if prev and pid and pid == prev[2].get(package) and pid in snapshot.majflt and pid in prev[1].majflt:
+                majflt = max(snapshot.majflt[pid] - prev[1].majflt[pid], 0)
+            row.extend([package, pid, majflt, meminfo.get("%s:pid_pss(MB)" % package, "")])
+        return row
+
+    def _collect_pressure_thread(self):
+        end_time = time.time() + self._timeout
+        title = list(SYSTEM_TITLE)
+        for package in self.packages:
+            title.extend(PACKAGE_TITLE)
+        pressure_file = os.path.join(self.session.package_save_path, 'pressure.csv')
+        with open(pressure_file, 'a+', encoding="utf-8") as writer:
+            csv.writer(writer, lineterminator='\n').writerow(title)
+        ticker = self.session.ticker("mem_pressure", self._interval, self._stop_event)
+        while not self._stop_event.is_set() and time.time() < end_time:
+            try:
+                collection_time = ticker.next()
+                if collection_time is None:
+                    break
+                snapshot = self.get_snapshot()
+                if not snapshot:
+                    # 断开后不跨断点算增量
+                    self._prev = None
+                    if ticker.fail("can't read pressure and vmstat", self.device.adb.is_offline()):
+                        with open(pressure_file, 'a+', encoding="utf-8") as writer:
+                            csv.writer(writer, lineterminator='\n').writerow(gap_row(collection_time, len(title)))
+                    continue
+                ticker.ok()
+                row = self._make_row(collection_time, snapshot)
+                with open(pressure_file, 'a+', encoding="utf-8") as writer:
+                    csv.writer(writer, lineterminator='\n').writerow(row)
+                self.session.emit("pressure", collection_time, title, row)
+            except Exception as e:
+                logger.error("an exception hanpend in mem pressure thread, reason unkown!, e:")
+                logger.error(e)
+                logger.debug(traceback.format_exc())
+                ticker.fail(str(e), self.device.adb.is_offline())
+
+
+class MemPressureMonitor(object):
+    '''
+    系统内存压力监控器：PSI、主缺页、swap和lmkd查杀，lmkd查杀记录来自 LogcatMonitor 读取的logcat
+    '''
+    def __init__(self, device_id, packages, interval=1.0, timeout=24 * 60 * 60, session=None):
+        self.session = session if session else Session.default()
+        self.device = self.session.get_device(device_id)
+        self.packages = packages
+        self.pressure_collector = MemPressureCollector(self.device, packages, interval, timeout, self.session)
+
+    def start(self, start_time):
+        if not self.session.package_save_path:
+            self.session.package_save_path = os.path.join(os.path.abspath(os.path.join(os.getcwd(), "../..")), 'results',
+                                                          self.packages[0], start_time)
+            if not os.path.exists(self.session.package_save_path):
+                os.makedirs(self.session.package_save_path)
+        self.start_time = start_time
+        self.pressure_collector.start(start_time)
+        logger.debug("INFO: MemPressureMonitor has started...")
+
+    def stop(self):
+        self.pressure_collector.stop()
+        logger.debug("INFO: MemPressureMonitor has stopped...")
+
+    def save(self):
+        pass
+
+
+if __name__ == "__main__":
+    monitor = MemPressureMonitor("", ["com.taobao.taobao"], 2)
+    monitor.start(TimeUtils.getCurrentTimeUnderline())
+    time.sleep(20)
+    monitor.stop()
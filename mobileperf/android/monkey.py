@@ -23,7 +23,7 @@ sys.path.append(os.path.join(BaseDir, '../..'))
 from mobileperf.android.tools.androiddevice import AndroidDevice
 from mobileperf.common.utils import TimeUtils,FileUtils
 from mobileperf.common.log import logger
-from mobileperf.android.globaldata import RuntimeData
+from mobileperf.android.globaldata import RuntimeData, Session
 
 try:
     from mobileperf.android.web.web_server import get_or_start_web_server
@@ -37,15 +37,17 @@ class Monkey(object):
     monkey执行器
     '''
 
-    def __init__(self, device_id, package=None,timeout=1200000000):
+    def __init__(self, device_id, package=None,timeout=1200000000, session=None):
         '''构造器
 
         :param str device_id: 设备id
         :param str process : monkey测试的包名
         :param timeout : monkey时长 单位 分钟 默认无穷大
+        :param Session session: 测试上下文，为空时使用全局的RuntimeData
         '''
         self.package = package
-        self.device = AndroidDevice(device_id)  # 设备
+        self.session = session if session else Session.default()
+        self.device = self.session.get_device(device_id)  # 设备
         self.running = False  # monkey监控器的启动状态(启动/结束)
         self.timeout = timeout
         self._stop_event = threading.Event()
@@ -95,7 +97,7 @@ class Monkey(object):
                      '--pct-anyevent 5 '
         
         # 根据配置决定是否添加 --pct-syskeys 0 参数
-        if hasattr(RuntimeData, 'config_dic') and RuntimeData.config_dic.get('monkey_disable_syskeys', True):
+        if self.session.config('monkey_disable_syskeys', True):
             base_monkey_cmd += '--pct-syskeys 0 '
             logger.info("Disabling system keys in Monkey test")
         
@@ -106,7 +108,7 @@ class Monkey(object):
         
         # 执行命令
         self._log_pipe = self.device.adb.run_shell_cmd(self.monkey_cmd, sync=False)
-        self._monkey_thread = threading.Thread(target=self._monkey_thread_func, args=[RuntimeData.package_save_path])
+        self._monkey_thread = threading.Thread(target=self._monkey_thread_func, args=[self.session.package_save_path])
         # self._monkey_thread.setDaemon(True)
         self._monkey_thread.start()
 
@@ -127,8 +129,8 @@ class Monkey(object):
         log_is_none = 0
         logs = []
         logger.debug("monkey_thread_func")
-        if RuntimeData.start_time is None:
-            RuntimeData.start_time = TimeUtils.getCurrentTime()
+        if self.session.start_time is None:
+            self.session.start_time = TimeUtils.getCurrentTime()
         while self.running:
             try:
                 log = self._log_pipe.stdout.readline().strip()
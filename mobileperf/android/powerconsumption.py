@@ -13,6 +13,7 @@
 '''
 import csv
 import os
+import bisect
 import re
 import sys
 import threading
@@ -22,13 +23,14 @@ import traceback
 
 BaseDir=os.path.dirname(__file__)
 sys.path.append(os.path.join(BaseDir,'../..'))
-from mobileperf.android.tools.androiddevice import AndroidDevice
 from mobileperf.common.utils import TimeUtils
 from mobileperf.common.utils import transfer_temp
 from mobileperf.common.utils import mV2V
 from mobileperf.common.utils import uA2mA
 from mobileperf.common.log import logger
-from mobileperf.android.globaldata import RuntimeData
+from mobileperf.common.scheduler import gap_row, command_budget
+from mobileperf.android.globaldata import Session
+from mobileperf.android.agent import DeviceAgent, AGENT_SCRIPT_PATH, deploy_agent_script, device_clock_offset
 
 class DevicePowerInfo(object):
     RE_BATTERY = re.compile(r'level: (\d+) voltage: (\d+) temp: (\d+)')
@@ -65,9 +67,11 @@ class DevicePowerInfo(object):
         return "DevicePowerInfo, " + "level:"+str(self.level) + ", voltage:" + str(self.voltage) + ", temperature:" + str(self.temp) + ", current:" + str(self.current)
 
 class PowerCollector(object):
-    def __init__(self, device, interval=1.0,timeout=24*60 * 60,power_queue = None,):
+    def __init__(self, device, interval=1.0,timeout=24*60 * 60,power_queue = None, session=None):
         self.device = device
+        self.session = session if session else Session.default()
         self._interval = interval
+        self._cmd_timeout = command_budget(interval)
         self._timeout = timeout
         self._stop_event = threading.Event()
         self.power_queue = power_queue
@@ -82,13 +86,13 @@ class PowerCollector(object):
         :return: 返回电池的相关属性，电量，温度，电压，电流等
         '''
         # android 5.0及以上的版本使用该命令获取电池的信息
-        out = self.device.adb.run_shell_cmd("dumpsys batteryproperties")
+        out = self.device.adb.run_shell_cmd("dumpsys batteryproperties", timeout=self._cmd_timeout)
         out.replace('\r', '')
         power_info = None
         if not out or(isinstance(out,str) and ("Can't find service") in out) :
             #4.0到4.4使用该命令获取电池的信息
             logger.debug("get battery info from dumpsys battery")
-            reg = self.device.adb.run_shell_cmd("dumpsys battery")
+            reg = self.device.adb.run_shell_cmd("dumpsys battery", timeout=self._cmd_timeout)
             reg.replace('\r', '')
             power_info = DevicePowerInfo()
             power_dic = self._get_powerinfo_dic(reg)
@@ -105,7 +109,7 @@ class PowerCollector(object):
             power_info = DevicePowerInfo(out)
             if power_info.voltage == '0':#三星的机型上测试会发现这个dump出来的电压，电量，等为0 ，不正确,重新获取下
                 logger.debug(" power info from dumpsys properties is 0, trim it")
-                reg = self.device.adb.run_shell_cmd("dumpsys battery")
+                reg = self.device.adb.run_shell_cmd("dumpsys battery", timeout=self._cmd_timeout)
                 reg.replace('\r', '')
                 power_dic = self._get_powerinfo_dic(reg)
                 power_info.level = power_dic['level']
@@ -117,7 +121,7 @@ class PowerCollector(object):
     def _cat_current(self):
         current = 0
         # cat /sys/class/power_supply/Battery/current_now Android9 上没权限
-        reg = self.device.adb.run_shell_cmd('cat /sys/class/power_supply/battery/current_now')
+        reg = self.device.adb.run_shell_cmd('cat /sys/class/power_supply/battery/current_now', timeout=self._cmd_timeout)
         if isinstance(reg, str) and "No such file or directory"==reg:
             logger.debug("can't get current from file /sys/class/power_supply/battery/current_now")
         elif reg:
@@ -157,7 +161,7 @@ class PowerCollector(object):
         '''
         end_time = time.time() + self._timeout
         power_list_titile = ("datetime","level","voltage(V)","tempreture(C)","current(mA)")
-        power_device_file = os.path.join(RuntimeData.package_save_path, 'powerinfo.csv')
+        power_device_file = os.path.join(self.session.package_save_path, 'powerinfo.csv')
         try:
             with open(power_device_file, 'a+') as df:
                 csv.writer(df, lineterminator='\n').writerow(power_list_titile)
@@ -166,17 +170,26 @@ class PowerCollector(object):
                     self.power_queue.put(power_file_dic)
         except RuntimeError as e:
             logger.error(e)
+        if DeviceAgent.enabled(self.session):
+            self._collect_power_from_agent(power_device_file, power_list_titile, end_time)
+            return
+        ticker = self.session.ticker("power", self._interval, self._stop_event)
         while not self._stop_event.is_set() and time.time() < end_time:
             try:
-                before = time.time()
+                collection_time = ticker.next()
+                if collection_time is None:
+                    break
                 logger.debug("------------into _collect_power_thread loop thread is : " + str(threading.current_thread().name))
                 device_power_info = self._get_battaryproperties()
 
                 if device_power_info.source == '':
-                    logger.debug("can't get power info , break!")
-                    break
+                    logger.debug("can't get power info , retry later")
+                    if ticker.fail("can't get power info", self.device.adb.is_offline()):
+                        with open(power_device_file, 'a+', encoding="utf-8") as writer:
+                            csv.writer(writer, lineterminator='\n').writerow(gap_row(collection_time, len(power_list_titile)))
+                    continue
+                ticker.ok()
                 device_power_info = self.trim_data(device_power_info)#debug
-                collection_time = time.time()
                 logger.debug(" collection time in powerconsumption is : " + str(collection_time))
                 power_tmp_list = [collection_time, device_power_info.level, device_power_info.voltage,
                                        device_power_info.temp, device_power_info.current]
@@ -192,18 +205,47 @@ class PowerCollector(object):
                             writer_p.writerow(power_tmp_list)
                     except RuntimeError as e:
                         logger.error(e)
-
-                after = time.time()
-                time_consume = after - before
-                delta_inter = self._interval - time_consume
-                if delta_inter > 0:
-                    time.sleep(delta_inter)
+                self.session.emit("powerinfo", collection_time, power_list_titile, power_tmp_list)
             except:
                 logger.error("an exception hanpend in powerconsumption thread , reason unkown!")
                 s = traceback.format_exc()
                 logger.debug(s)
+                ticker.fail("exception", self.device.adb.is_offline())
                 if self.power_queue:
                     self.power_queue.task_done()
+    def _collect_power_from_agent(self, power_device_file, power_list_titile, end_time):
+        '''
+        设备端agent模式，电量、电压、温度、电流直接读 /sys/class/power_supply/battery，每个样本写一行
+        '''
+        agent = DeviceAgent.get(self.device, self.session, self._interval)
+
+        def on_samples(samples):
+            rows = []
+            for sample in samples:
+                if not sample.battery:
+                    continue
+                level, voltage, temp, current = sample.battery
+                # voltage_now 单位是uV，少数机型是mV
+                if voltage > 100000:
+                    voltage = voltage / 1000.0
+                power_tmp_list = [sample.timestamp, level, mV2V(voltage), transfer_temp(temp), uA2mA(current)]
+                if self.power_queue:
+                    self.power_queue.put(power_tmp_list)
+                else:
+                    power_tmp_list[0] = TimeUtils.formatTimeStamp(power_tmp_list[0])
+                    rows.append(power_tmp_list)
+                self.session.emit("powerinfo", sample.timestamp, power_list_titile, power_tmp_list)
+            if rows:
+                with open(power_device_file, 'a+', encoding="utf-8") as writer:
+                    csv.writer(writer, lineterminator='\n').writerows(rows)
+
+        def on_gap(collection_time):
+            with open(power_device_file, 'a+', encoding="utf-8") as writer:
+                csv.writer(writer, lineterminator='\n').writerow(gap_row(collection_time, len(power_list_titile)))
+
+        agent.collect("power", self._interval, self._stop_event, end_time, on_samples, on_gap)
+        logger.debug("power agent collect stop")
+
     def trim_data(self, power_info):
         power_info.voltage = mV2V(float(power_info.voltage))
         power_info.temp = transfer_temp(float(power_info.temp))
@@ -224,16 +266,237 @@ class PowerCollector(object):
             if self.power_queue:
                 self.power_queue.task_done()
 
+class EnergyIntegrator(object):
+    '''
+    电流电压样本按梯形积分成能耗，按固定时长分桶汇总
+    电流取绝对值：不同厂商放电电流的符号不同；USB充电时读到的是充电电流，需要断开充电（如无线adb）测试才有意义
+    '''
+    # 两个样本间隔超过这个时长（秒）视为断开，不积分
+    MAX_GAP = 2.0
+
+    def __init__(self, bucket=1.0):
+        '''
+        :param float bucket: 分桶时长，单位秒
+        '''
+        self.bucket = bucket
+        self.total_energy = 0
+        # 已完成的桶 [(开始时间, 积分覆盖的时长, 能耗mWh)]，用于按页面归因
+        self.buckets = []
+        self._prev = None
+        self._current = None
+
+    @staticmethod
+    def power_mw(current_ua, voltage_uv):
+        # uA * uV = 1e-12 W
+        return abs(current_ua) * voltage_uv / 1e9
+
+    def reset(self):
+        '''数据断开后重新开始，不跨断点积分
+        '''
+        self._prev = None
+
+    def add(self, timestamp, current_ua, voltage_uv):
+        '''
+        加入一个样本
+        :return: 这个样本之前已完成的桶 [开始时间, 样本数, 平均电流mA, 平均电压V, 平均功率mW, 最大功率mW, 能耗mWh, 累计能耗mWh]，没有则返回None
+        '''
+        # voltage_now 单位是uV，少数机型是mV
+        if voltage_uv < 100000:
+            voltage_uv = voltage_uv * 1000
+        power = self.power_mw(current_ua, voltage_uv)
+        finished = None
+        start = timestamp - timestamp % self.bucket
+        if self._current and self._current["start"] != start:
+            finished = self._finish()
+        if not self._current:
+            self._current = {"start": start, "samples": 0, "current": 0, "voltage": 0, "power": 0, "max_power": 0,
+                             "energy": 0, "duration": 0}
+        bucket = self._current
+        bucket["samples"] += 1
+        bucket["current"] += abs(current_ua)
+        bucket["voltage"] += voltage_uv
+        bucket["power"] += power
+        bucket["max_power"] = max(bucket["max_power"], power)
+        if self._prev:
+            prev_time, prev_power = self._prev
+            dt = timestamp - prev_time
+            if 0 < dt <= self.MAX_GAP:
+                energy = (prev_power + power) / 2.0 * dt / 3600
+                bucket["energy"] += energy
+                bucket["duration"] += dt
+                self.total_energy += energy
+        self._prev = (timestamp, power)
+        return finished
+
+    def flush(self):
+        '''结束时把最后一个桶写出
+        '''
+        return self._finish() if self._current else None
+
+    def _finish(self):
+        bucket = self._current
+        self._current = None
+        samples = bucket["samples"]
+        self.buckets.append((bucket["start"], bucket["duration"], bucket["energy"]))
+        return [bucket["start"], samples, round(bucket["current"] / samples / 1000.0, 2),
+                round(bucket["voltage"] / samples / 1e6, 3), round(bucket["power"] / samples, 2),
+                round(bucket["max_power"], 2), round(bucket["energy"], 5), round(self.total_energy, 4)]
+
+    def by_activity(self, activities):
+        '''
+        按前台页面汇总能耗，每个桶归到桶中点时刻的页面
+        :param list activities: [(时间戳, 页面)]，按时间排序，页面变化时的采样
+        :return: [[页面, 时长秒, 能耗mWh, 平均功率mW, 占比%]]，按能耗从大到小
+        '''
+        times = [t for t, activity in activities]
+        result = {}
+        for start, duration, energy in self.buckets:
+            index = bisect.bisect_right(times, start + self.bucket / 2.0) - 1
+            activity = activities[index][1] if index >= 0 and activities[index][1] else "unknown"
+            total = result.setdefault(activity, [0, 0])
+            total[0] += duration
+            total[1] += energy
+        rows = []
+        for activity, (duration, energy) in sorted(result.items(), key=lambda item: -item[1][1]):
+            rows.append([activity, round(duration, 1), round(energy, 4),
+                         round(energy * 3600 / duration, 2) if duration else 0,
+                         round(energy * 100 / self.total_energy, 2) if self.total_energy else 0])
+        return rows
+
+
+class EnergyCollector(object):
+    '''
+    在设备端循环读 /sys/class/power_supply/battery 下的 current_now 和 voltage_now（10-100Hz），
+    PC端积分能耗，按秒写 energy.csv，结束时按 DeviceMonitor 采集到的前台页面汇总到 energy_activity.csv
+    '''
+    ENERGY_TITLE = ["datetime", "samples", "current(mA)", "voltage(V)", "power(mW)", "max_power(mW)", "energy(mWh)",
+                    "total_energy(mWh)"]
+    ACTIVITY_TITLE = ["activity", "duration(s)", "energy(mWh)", "avg_power(mW)", "energy%"]
+
+    def __init__(self, device, hz=50, timeout=24 * 60 * 60, session=None):
+        '''
+        :param device: 设备
+        :param float hz: 采样频率，设备端sleep的精度有限，实际频率以 energy.csv 的 samples 列为准
+        :param timeout: 采集超时，单位秒
+        :param session: 测试上下文
+        '''
+        self.device = device
+        self.session = session if session else Session.default()
+        self.hz = min(max(float(hz), 1), 100)
+        self._timeout = timeout
+        self._stop_event = threading.Event()
+        self.integrator = EnergyIntegrator()
+        # 前台页面变化 [(时间戳, 页面)]
+        self.activities = []
+        self._pipe = None
+        self._thread = None
+
+    def start(self, start_time):
+        logger.debug("INFO: EnergyCollector start...")
+        self.session.add_sink(self._on_metric)
+        self._thread = threading.Thread(target=self._collect_energy_thread, name="energy")
+        self._thread.start()
+
+    def _on_metric(self, metric, timestamp, title, row):
+        # DeviceMonitor 每个间隔记录一次当前页面，只保留变化点
+        if metric != "current_activity":
+            return
+        activity = row[1] if len(row) > 1 else ""
+        if not self.activities or self.activities[-1][1] != activity:
+            self.activities.append((timestamp, activity))
+
+    def _write_rows(self, energy_file, rows):
+        for row in rows:
+            timestamp = row[0]
+            row[0] = TimeUtils.formatTimeStamp(timestamp)
+            self.session.emit("energy", timestamp, self.ENERGY_TITLE, row)
+        with open(energy_file, 'a+', encoding="utf-8") as writer:
+            csv.writer(writer, lineterminator='\n').writerows(rows)
+
+    def _collect_energy_thread(self):
+        end_time = time.time() + self._timeout
+        energy_file = os.path.join(self.session.package_save_path, 'energy.csv')
+        with open(energy_file, 'a+', encoding="utf-8") as writer:
+            csv.writer(writer, lineterminator='\n').writerow(self.ENERGY_TITLE)
+        deploy_agent_script(self.device.adb)
+        metrics = self.session.metrics
+        while not self._stop_event.is_set() and time.time() < end_time:
+            offset = device_clock_offset(self.device.adb, self.session.clock)
+            if offset is None:
+                self._stop_event.wait(2)
+                continue
+            self.integrator.reset()
+            self._pipe = self.device.adb.run_shell_cmd("sh %s power %s" % (AGENT_SCRIPT_PATH, round(1.0 / self.hz, 3)),
+                                                       sync=False)
+            rows = []
+            last_write = time.time()
+            for line in iter(self._pipe.stdout.readline, b""):
+                items = line.split()
+                if len(items) != 3:
+                    continue
+                try:
+                    row = self.integrator.add(float(items[0]) + offset, int(items[1]), int(items[2]))
+                except ValueError:
+                    continue
+                metrics.inc("power_samples")
+                if row:
+                    rows.append(row)
+                # 每秒写一次文件
+                if rows and time.time() - last_write >= 1:
+                    self._write_rows(energy_file, rows)
+                    rows = []
+                    last_write = time.time()
+                if self._stop_event.is_set() or time.time() >= end_time:
+                    break
+            if rows:
+                self._write_rows(energy_file, rows)
+            self.device.adb.kill_process_tree(self._pipe)
+            if not self._stop_event.is_set() and time.time() < end_time:
+                # adb断开或设备上没有 current_now，稍后重连
+                logger.warning("power sampling stream ended, restart later")
+                metrics.inc("power_stream_restart")
+                self._stop_event.wait(2)
+        row = self.integrator.flush()
+        if row:
+            self._write_rows(energy_file, [row])
+        self._save_activity_energy()
+
+    def _save_activity_energy(self):
+        activity_file = os.path.join(self.session.package_save_path, 'energy_activity.csv')
+        with open(activity_file, 'w', encoding="utf-8") as writer:
+            writer_p = csv.writer(writer, lineterminator='\n')
+            writer_p.writerow(self.ACTIVITY_TITLE)
+            writer_p.writerows(self.integrator.by_activity(self.activities))
+        logger.info("total energy %.4f mWh" % self.integrator.total_energy)
+
+    def stop(self):
+        logger.debug("INFO: EnergyCollector stop...")
+        self._stop_event.set()
+        if self._pipe and self._pipe.poll() is None:
+            # readline 阻塞在管道上，结束adb进程让它返回
+            self.device.adb.kill_process_tree(self._pipe)
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=5)
+        self.session.remove_sink(self._on_metric)
+
+
 class PowerMonitor(object):
-    def __init__(self, device_id, interval = 1.0, timeout = 24 * 60 * 60,power_queue = None):
-        self.device = AndroidDevice(device_id)
-        self.power_collector = PowerCollector(self.device, interval,timeout,power_queue)
+    def __init__(self, device_id, interval = 1.0, timeout = 24 * 60 * 60,power_queue = None, session=None, hz=None):
+        '''
+        :param float hz: 不为空时用高频电流采样模式（EnergyCollector），否则定时 dumpsys batteryproperties
+        '''
+        self.session = session if session else Session.default()
+        self.device = self.session.get_device(device_id)
+        if hz:
+            self.power_collector = EnergyCollector(self.device, hz, timeout, self.session)
+        else:
+            self.power_collector = PowerCollector(self.device, interval,timeout,power_queue,self.session)
 
     def start(self,start_time):
-        if not RuntimeData.package_save_path:
-            RuntimeData.package_save_path = os.path.join(os.path.abspath(os.path.join(os.getcwd(), "../..")),'results',self.device.adb._device_id,start_time)
-            if not os.path.exists(RuntimeData.package_save_path):
-                os.makedirs(RuntimeData.package_save_path)
+        if not self.session.package_save_path:
+            self.session.package_save_path = os.path.join(os.path.abspath(os.path.join(os.getcwd(), "../..")),'results',self.device.adb._device_id,start_time)
+            if not os.path.exists(self.session.package_save_path):
+                os.makedirs(self.session.package_save_path)
         self.start_time = start_time
         self.power_collector.start(start_time)
         logger.debug("INFO: PowerMonitor has started...")
@@ -0,0 +1,332 @@
+#encoding:utf-8
+'''
+@author:     look
+
+@copyright:  1999-2020 Alibaba.com. All rights reserved.
+
+@license:    Apache Software License 2.0
+
+@contact:    390125133@qq.com
+'''
+'''
+进程的磁盘I/O和调度延迟：每个采集周期用一条 grep 读出各测试进程的 /proc/<pid>/io，
+以及所有线程的 schedstat（运行时间、在运行队列中等待的时间）和 status 中的主动/被动上下文切换，
+按采集间隔的增量写 proc_io.csv，主线程和 RenderThread 单独列出；设备繁忙时运行队列等待往往是卡顿的真正原因
+
+/proc/<pid>/schedstat 和 status 中的切换次数只是主线程的，进程的值是所有线程的增量之和
+/proc/<pid>/io 只有root能读其他应用的，没有root时读写列为空
+'''
+import csv
+import os
+import re
+import sys
+import threading
+import time
+import traceback
+
+BaseDir=os.path.dirname(__file__)
+sys.path.append(os.path.join(BaseDir,'../..'))
+
+from mobileperf.common.utils import TimeUtils
+from mobileperf.common.log import logger
+from mobileperf.common.scheduler import gap_row, command_budget
+from mobileperf.android.globaldata import Session
+
+# 单独列出的线程：列名前缀 -> 线程名，main 是 tid 等于 pid 的主线程
+KEY_THREADS = [("main", None), ("render", "RenderThread")]
+# 没找到的关键线程（如 RenderThread 在第一帧之前还没创建）每隔这么多个周期重新查一次
+THREAD_LOOKUP_TICKS = 10
+# 每个包的列，多包时按包依次排列，package 列后面的列在汇总中带包名前缀
+PACKAGE_TITLE = ["package", "pid", "read(KB)", "write(KB)", "syscr", "syscw", "cpu(ms)", "runq_wait(ms)",
+                 "runq_wait%", "vcsw", "ivcsw"]
+for _name, _thread in KEY_THREADS:
+    PACKAGE_TITLE.extend(["%s_cpu(ms)" % _name, "%s_runq_wait(ms)" % _name])
+
+
+def proc_io_cmd(pids):
+    '''
+    读取多个进程io、schedstat和切换次数的命令，一个grep进程，只输出需要的行
+    io: /proc/<pid>/io:read_bytes: 4096
+    schedstat: /proc/<pid>/task/<tid>/schedstat:运行ns 等待ns 调度次数
+    status: /proc/<pid>/task/<tid>/status:voluntary_ctxt_switches:	12
+    '''
+    files = []
+    for pid in pids:
+        files.extend(["/proc/%s/io" % pid, "/proc/%s/task/*/schedstat" % pid, "/proc/%s/task/*/status" % pid])
+    # 模式里不用引号，整条命令还要放在 su 0 sh -c '...' 中执行
+    return "grep -H -e ^read_bytes -e ^write_bytes -e ^syscr -e ^syscw -e ^[0-9] -e ctxt_switches %s 2>/dev/null" \
+           % " ".join(files)
+
+
+def thread_names_cmd(pids):
+    return "grep -H . %s 2>/dev/null" % " ".join("/proc/%s/task/*/comm" % pid for pid in pids)
+
+
+class ProcIoSnapshot(object):
+    '''
+    解析 proc_io_cmd 的输出
+    io: {pid: {"read_bytes": , "write_bytes": , "syscr": , "syscw": }}，没有权限时没有这个pid
+    tasks: {pid: {tid: [运行ns, 等待ns, 主动切换, 被动切换]}}
+    '''
+    RE_IO = re.compile(r'/proc/(\d+)/io:(read_bytes|write_bytes|syscr|syscw):\s*(\d+)')
+    RE_SCHEDSTAT = re.compile(r'/proc/(\d+)/task/(\d+)/schedstat:(\d+) (\d+)')
+    RE_CTXT = re.compile(r'/proc/(\d+)/task/(\d+)/status:(voluntary|nonvoluntary)_ctxt_switches:\s*(\d+)')
+
+    def __init__(self, source):
+        self.source = source
+        self.io = {}
+        self.tasks = {}
+        self._parse()
+
+    def _task(self, pid, tid):
+        return self.tasks.setdefault(pid, {}).setdefault(tid, [0, 0, 0, 0])
+
+    def _parse(self):
+        for line in self.source.split("\n"):
+            match = self.RE_SCHEDSTAT.search(line)
+            if match:
+                task = self._task(match.group(1), match.group(2))
+                task[0] = int(match.group(3))
+                task[1] = int(match.group(4))
+                continue
+            match = self.RE_CTXT.search(line)
+            if match:
+                task = self._task(match.group(1), match.group(2))
+                task[2 if match.group(3) == "voluntary" else 3] = int(match.group(4))
+                continue
+            match = self.RE_IO.search(line)
+            if match:
+                self.io.setdefault(match.group(1), {})[match.group(2)] = int(match.group(3))
+
+    @staticmethod
+    def parse_thread_names(source):
+        '''
+        解析 thread_names_cmd 的输出
+        :return: {pid: {线程名: tid}}，同名线程取tid最小的
+        '''
+        result = {}
+        for line in source.split("\n"):
+            match = re.search(r'/proc/(\d+)/task/(\d+)/comm:(.*)$', line.strip())
+            if match:
+                names = result.setdefault(match.group(1), {})
+                name = match.group(3).strip()
+                if name not in names or int(match.group(2)) < int(names[name]):
+                    names[name] = match.group(2)
+        return result
+
+
+def task_delta(prev, cur):
+    '''
+    两次采样之间一组线程的增量之和，按tid对齐：期间退出的线程不计，新建的线程从0开始算
+    :return: [运行ns, 等待ns, 主动切换, 被动切换]
+    '''
+    total = [0, 0, 0, 0]
+    for tid, values in cur.items():
+        old = prev.get(tid, [0, 0, 0, 0])
+        for i in range(4):
+            # 计数器不会减少，tid复用时按新线程算
+            total[i] += values[i] - old[i] if values[i] >= old[i] else values[i]
+    return total
+
+
+class ProcIoCollector(object):
+    def __init__(self, device, packages, interval=1.0, timeout=24 * 60 * 60, session=None):
+        self.device = device
+        self.packages = packages
+        self.session = session if session else Session.default()
+        self._interval = interval
+        self._cmd_timeout = command_budget(interval)
+        self._timeout = timeout
+        self._stop_event = threading.Event()
+        # 各包的 pid、关键线程tid、上一次的采样
+        self.pids = {}
+        self.key_tids = {}
+        self._prev = {}
+        self._lookup_countdown = 0
+        self.collect_proc_io_thread = None
+
+    def start(self, start_time):
+        logger.debug("INFO: ProcIoCollector start...")
+        self.collect_proc_io_thread = threading.Thread(target=self._collect_proc_io_thread, name="proc_io")
+        self.collect_proc_io_thread.start()
+
+    def stop(self):
+        logger.debug("INFO: ProcIoCollector stop...")
+        if self.collect_proc_io_thread and self.collect_proc_io_thread.is_alive():
+            self._stop_event.set()
+            self.collect_proc_io_thread.join(timeout=2)
+            self.collect_proc_io_thread = None
+
+    def _shell(self, cmd):
+        '''
+        其他应用的 /proc/<pid>/io 需要root，shell不是root但有su时用su执行
+        整条命令加双引号，通配符和重定向在设备端执行，不被PC端的shell处理
+        '''
+        capability = self.device.adb.get_capability()
+        if not capability.shell_root and capability.su_root:
+            return self.device.adb.run_shell_cmd('"su 0 sh -c \'%s\'"' % cmd, timeout=self._cmd_timeout)
+        return self.device.adb.run_shell_cmd('"%s"' % cmd, timeout=self._cmd_timeout)
+
+    def _update_pids(self):
+        '''ps 比较慢，只在还没有pid或进程的数据读不到时重新查
+        '''
+        for package in self.packages:
+            pid = self.device.adb.get_pid_from_pck(package)
+            if pid is None:
+                self.pids.pop(package, None)
+                continue
+            # ps 解析出的pid是int，和 /proc 路径中解析出的统一成字符串
+            pid = str(pid)
+            if self.pids.get(package) != pid:
+                logger.info("proc io: %s pid %s" % (package, pid))
+                self.pids[package] = pid
+                self.key_tids.pop(package, None)
+                self._prev.pop(package, None)
+
+    def _update_key_tids(self):
+        '''新的pid立即查关键线程的tid，有线程没找到时每 THREAD_LOOKUP_TICKS 个周期再查一次
+        '''
+        missing = [package for package in self.pids if len(self.key_tids.get(package, {})) < len(KEY_THREADS)]
+        if not missing:
+            return
+        if all(package in self.key_tids for package in missing) and self._lookup_countdown > 0:
+            self._lookup_countdown -= 1
+            return
+        self._lookup_countdown = THREAD_LOOKUP_TICKS
+        out = self._shell(thread_names_cmd(self.pids.values()))
+        names = ProcIoSnapshot.parse_thread_names(out) if out else {}
+        for package, pid in self.pids.items():
+            tids = {}
+            for name, thread in KEY_THREADS:
+                tid = pid if thread is None else names.get(pid, {}).get(thread)
+                if tid:
+                    tids[name] = tid
+            self.key_tids[package] = tids
+
+    def get_snapshot(self):
+        '''
+        :return: ProcIoSnapshot，有进程的数据读不到（进程重启）时先更新pid再读一次，都读不到返回None
+        '''
+        for retry in range(2):
+            if retry or len(self.pids) < len(self.packages):
+                self._update_pids()
+            if not self.pids:
+                return None
+            self._update_key_tids()
+            out = self._shell(proc_io_cmd(self.pids.values()))
+            if not out:
+                continue
+            before = time.time()
+            snapshot = ProcIoSnapshot(out)
+            self.session.metrics.record_parse("proc_io", len(out), time.time() - before)
+            if all(pid in snapshot.tasks for pid in self.pids.values()):
+                return snapshot
+            if retry:
+                return snapshot if snapshot.tasks else None
+        return None
+
+    def _package_values(self, package, snapshot):
+        '''
+        一个包相对上一次采样的增量，和 PACKAGE_TITLE 对应（不含 package 列）
+        '''
+        pid = self.pids.get(package)
+        if not pid or pid not in snapshot.tasks:
+            return [pid if pid else ""] + [""] * (len(PACKAGE_TITLE) - 2)
+        io = snapshot.io.get(pid, {})
+        tasks = snapshot.tasks[pid]
+        prev = self._prev.get(package)
+        self._prev[package] = (io, tasks)
+        if not prev:
+            # 第一次采样或进程重启，没有增量
+            return [pid] + [""] * (len(PACKAGE_TITLE) - 2)
+        prev_io, prev_tasks = prev
+        values = [pid]
+        for key, scale in (("read_bytes", 1024.0), ("write_bytes", 1024.0), ("syscr", 1), ("syscw", 1)):
+            if key in io and key in prev_io:
+                values.append(round(max(io[key] - prev_io[key], 0) / scale, 1) if scale != 1
+                              else max(io[key] - prev_io[key], 0))
+            else:
+                values.append("")
+        run, wait, vcsw, ivcsw = task_delta(prev_tasks, tasks)
+        values.extend([round(run / 1e6, 1), round(wait / 1e6, 1),
+                       round(wait * 100.0 / (run + wait), 2) if run + wait else 0, vcsw, ivcsw])
+        tids = self.key_tids.get(package, {})
+        for name, thread in KEY_THREADS:
+            tid = tids.get(name)
+            if tid and tid in tasks:
+                run, wait, _, _ = task_delta({tid: prev_tasks[tid]} if tid in prev_tasks else {}, {tid: tasks[tid]})
+                values.extend([round(run / 1e6, 1), round(wait / 1e6, 1)])
+            else:
+                values.extend(["", ""])
+        return values
+
+    def _collect_proc_io_thread(self):
+        end_time = time.time() + self._timeout
+        title = ["datetime"]
+        for package in self.packages:
+            title.extend(PACKAGE_TITLE)
+        proc_io_file = os.path.join(self.session.package_save_path, 'proc_io.csv')
+        with open(proc_io_file, 'a+', encoding="utf-8") as writer:
+            csv.writer(writer, lineterminator='\n').writerow(title)
+        ticker = self.session.ticker("proc_io", self._interval, self._stop_event)
+        while not self._stop_event.is_set() and time.time() < end_time:
+            try:
+                collection_time = ticker.next()
+                if collection_time is None:
+                    break
+                snapshot = self.get_snapshot()
+                if not snapshot:
+                    # 进程不在或设备离线，断开后不跨断点算增量
+                    self._prev.clear()
+                    if ticker.fail("can't read proc io", self.device.adb.is_offline()):
+                        with open(proc_io_file, 'a+', encoding="utf-8") as writer:
+                            csv.writer(writer, lineterminator='\n').writerow(gap_row(collection_time, len(title)))
+                    continue
+                ticker.ok()
+                row = [TimeUtils.formatTimeStamp(collection_time)]
+                for package in self.packages:
+                    row.append(package)
+                    row.extend(self._package_values(package, snapshot))
+                with open(proc_io_file, 'a+', encoding="utf-8") as writer:
+                    csv.writer(writer, lineterminator='\n').writerow(row)
+                self.session.emit("proc_io", collection_time, title, row)
+            except Exception as e:
+                logger.error("an exception hanpend in proc io thread, reason unkown!, e:")
+                logger.error(e)
+                logger.debug(traceback.format_exc())
+                ticker.fail(str(e), self.device.adb.is_offline())
+
+
+class ProcIoMonitor(object):
+    '''
+    进程磁盘I/O、cpu运行时间、运行队列等待和上下文切换监控器
+    '''
+    def __init__(self, device_id, packages, interval=1.0, timeout=24 * 60 * 60, session=None):
+        self.session = session if session else Session.default()
+        self.device = self.session.get_device(device_id)
+        self.packages = packages
+        self.proc_io_collector = ProcIoCollector(self.device, packages, interval, timeout, self.session)
+
+    def start(self, start_time):
+        if not self.session.package_save_path:
+            self.session.package_save_path = os.path.join(os.path.abspath(os.path.join(os.getcwd(), "../..")), 'results',
+                                                          self.packages[0], start_time)
+            if not os.path.exists(self.session.package_save_path):
+                os.makedirs(self.session.package_save_path)
+        self.start_time = start_time
+        self.proc_io_collector.start(start_time)
+        logger.debug("INFO: ProcIoMonitor has started...")
+
+    def stop(self):
+        self.proc_io_collector.stop()
+        logger.debug("INFO: ProcIoMonitor has stopped...")
+
+    def save(self):
+        pass
+
+
+if __name__ == "__main__":
+    monitor = ProcIoMonitor("", ["com.taobao.taobao"], 2)
+    monitor.start(TimeUtils.getCurrentTimeUnderline())
+    time.sleep(20)
+    monitor.stop()
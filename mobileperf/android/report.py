@@ -9,16 +9,32 @@
 @contact:    390125133@qq.com
 '''
 import os
+import sys
 import csv
-from datetime import datetime
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+BaseDir=os.path.dirname(__file__)
+sys.path.append(os.path.join(BaseDir,'../..'))
 
 from mobileperf.android.excel import Excel
 from mobileperf.common.log import logger
-from mobileperf.common.utils import TimeUtils
+from mobileperf.common.utils import TimeUtils, FileUtils
+from mobileperf.common.sketch import SUMMARY_CSV
 
 class Report(object):
-    def __init__(self, csv_dir, packages=[]):
-        os.chdir(csv_dir)
+    # csv总大小超过这个值时才用进程池解析
+    PARALLEL_MIN_BYTES = 8 * 1024 * 1024
+    # csv总大小超过这个值时xlsx用最快的deflate级别，数据表大时压缩耗时比多出的文件大小更重要
+    FAST_DEFLATE_BYTES = 32 * 1024 * 1024
+
+    def __init__(self, csv_dir, packages=[], workers=None):
+        '''
+        :param str csv_dir: 结果目录，报告 summary_<时间>.xlsx 也生成在这个目录
+        :param list packages: 测试的包名
+        :param int workers: 解析csv的进程数，默认cpu核数，1表示不用进程池
+        '''
         # 需要画曲线的csv文件名
         self.summary_csf_file={"cpuinfo.csv":{"table_name":"pid_cpu",
                                           "x_axis":"datetime",  # 修正：cpuinfo.csv使用datetime
@@ -48,46 +64,133 @@ class Report(object):
                                            "x_axis": "datatime",
                                            "y_axis": "fd_count",
                                            "values": ["fd_num"]},
+                               "energy.csv": {"table_name": "energy",
+                                           "x_axis": "datetime",
+                                           "y_axis": "power(mW)",
+                                           "values": ["power(mW)"]},
+                               "thermal.csv": {"table_name": "thermal",
+                                           "x_axis": "datetime",
+                                           "y_axis": "C/%",
+                                           "values": ["max_temp(C)", "freq_cap%"]},
+                               "thermal_events.csv": {"table_name": "thermal_events",
+                                           "x_axis": "datetime",
+                                           "y_axis": "duration(s)",
+                                           "values": ["duration(s)"],
+                                           "chart_type": "column"},
+                               "proc_io.csv": {"table_name": "proc_io",
+                                           "x_axis": "datetime",
+                                           "y_axis": "ms",
+                                           "values": ["cpu(ms)", "runq_wait(ms)", "main_runq_wait(ms)",
+                                                      "render_runq_wait(ms)"]},
+                               "pressure.csv": {"table_name": "pressure",
+                                           "x_axis": "datetime",
+                                           "y_axis": "stall%",
+                                           "values": ["mem_some%", "mem_full%", "io_some%", "cpu_some%"],
+                                           "y2_axis": "pss(MB)",
+                                           "y2_values": ["pid_pss(MB)"]},
+                               "lmkd_kills.csv": {"table_name": "lmkd_kills",
+                                           "x_axis": "datetime",
+                                           "y_axis": "rss(KB)",
+                                           "values": ["rss(KB)"],
+                                           "chart_type": "column"},
+                               "energy_activity.csv": {"table_name": "energy_activity",
+                                           "x_axis": "activity",
+                                           "y_axis": "energy(mWh)",
+                                           "values": ["energy(mWh)"],
+                                           "chart_type": "column"},
+                               "activity_summary.csv": {"table_name": "activity_summary",
+                                           "x_axis": "activity",
+                                           "y_axis": "cpu%",
+                                           "values": ["cpu_mean%", "cpu_p95%"],
+                                           "chart_type": "column"},
                                }
         self.packages = packages
+        self.csv_dir = csv_dir
+        self.book_path = None
         if len(self.packages)>0:
             for package in self.packages:
-                pss_detail_dic ={"table_name":"pss_detail",
-                                          "x_axis":"datatime",
-                                          "y_axis":"mem(MB)",
-                                          "values":["pss","java_heap","native_heap","system"]
-                }
                 #        文件名太长会导致写excel失败
-                self.summary_csf_file["pss_%s.csv"%package.split(".")[-1].replace(":","_")]= pss_detail_dic
+                self.summary_csf_file["pss_%s.csv"%package.split(".")[-1].replace(":","_")]= self.pss_detail_dic()
+        # 批量重新生成时不知道包名，按目录中已有的 pss_*.csv 添加
+        for f in os.listdir(csv_dir):
+            if f.startswith("pss_") and f.endswith(".csv") and f not in self.summary_csf_file:
+                self.summary_csf_file[f] = self.pss_detail_dic()
         logger.debug(self.packages)
         logger.debug(self.summary_csf_file)
         logger.info('create report for %s' % csv_dir)
-        file_names = self.filter_file_names(csv_dir)
+        self.generate(workers)
+
+    @staticmethod
+    def pss_detail_dic():
+        return {"table_name":"pss_detail",
+                "x_axis":"datatime",
+                "y_axis":"mem(MB)",
+                "values":["pss","java_heap","native_heap","system"]}
+
+    def generate(self, workers=None):
+        '''
+        两个阶段：先并行解析各csv（大文件多时用进程池），再在当前线程按顺序写一个workbook
+        不切换工作目录，web服务等多线程场景中可以同时生成多份报告
+        '''
+        file_names = self.filter_file_names(self.csv_dir)
         logger.debug('%s' % file_names)
-        if file_names:
-            book_name = 'summary_%s.xlsx' % TimeUtils.getCurrentTimeUnderline()
-            excel = Excel(book_name)
-            for file_name in file_names:
-                logger.debug('get csv %s to excel' % file_name)
-                values = self.summary_csf_file[file_name]
-                # 读取CSV文件的实际列名，只使用存在的列
-                actual_columns = self.get_csv_columns(file_name)
-                if not actual_columns:
-                    logger.warning('Failed to read columns from %s, skipping...' % file_name)
-                    continue
-                # 过滤掉CSV中不存在的列
-                valid_values = [v for v in values["values"] if v in actual_columns]
-                if not valid_values:
-                    logger.warning('No valid columns found in %s for values: %s, actual columns: %s' % 
-                                 (file_name, values["values"], actual_columns))
-                    continue
-                logger.info('Using columns for %s: %s (requested: %s, actual: %s)' % 
-                          (file_name, valid_values, values["values"], actual_columns))
-                excel.csv_to_xlsx(file_name, values["table_name"], values["x_axis"], 
-                                values["y_axis"], valid_values)
-            logger.info('wait to save %s' % book_name)
-            excel.save()
-    
+        # 采集时流式计算的各列统计值，放在第一个sheet
+        summary_csv = os.path.join(self.csv_dir, SUMMARY_CSV)
+        has_summary = os.path.isfile(summary_csv)
+        if not file_names and not has_summary:
+            return None
+        paths = [os.path.join(self.csv_dir, file_name) for file_name in file_names]
+        if has_summary:
+            paths.append(summary_csv)
+        parsed = self.parse_files(paths, workers)
+        book_name = 'summary_%s.xlsx' % TimeUtils.getCurrentTimeUnderline()
+        self.book_path = os.path.join(self.csv_dir, book_name)
+        total = sum(os.path.getsize(path) for path in paths)
+        excel = Excel(self.book_path, 1 if total >= self.FAST_DEFLATE_BYTES else None)
+        if has_summary:
+            excel.lines_to_table(parsed[summary_csv], "Summary")
+        for file_name, path in zip(file_names, paths):
+            logger.debug('get csv %s to excel' % file_name)
+            values = self.summary_csf_file[file_name]
+            lines = parsed[path]
+            # 读取CSV文件的实际列名，只使用存在的列
+            actual_columns = lines[0] if lines else []
+            if not actual_columns:
+                logger.warning('Failed to read columns from %s, skipping...' % file_name)
+                continue
+            # 过滤掉CSV中不存在的列
+            valid_values = [v for v in values["values"] if v in actual_columns]
+            if not valid_values:
+                logger.warning('No valid columns found in %s for values: %s, actual columns: %s' %
+                             (file_name, values["values"], actual_columns))
+                continue
+            logger.info('Using columns for %s: %s (requested: %s, actual: %s)' %
+                      (file_name, valid_values, values["values"], actual_columns))
+            y2_values = [v for v in values.get("y2_values", []) if v in actual_columns]
+            excel.lines_to_xlsx(os.path.splitext(file_name)[0], lines, values["table_name"], values["x_axis"],
+                                values["y_axis"], valid_values, values.get("chart_type", "line"),
+                                values.get("y2_axis"), y2_values)
+        logger.info('wait to save %s' % self.book_path)
+        excel.save()
+        return self.book_path
+
+    def parse_files(self, paths, workers=None):
+        '''
+        解析csv，总大小超过 PARALLEL_MIN_BYTES 时用进程池，小文件起进程的开销比解析还大
+        用spawn方式起子进程，调用方（startup、web服务）有很多线程，fork出的子进程可能继承被锁住的锁
+        :return: {路径: Excel.read_csv 的结果}
+        '''
+        total = sum(os.path.getsize(path) for path in paths)
+        workers = workers if workers else cpu_count()
+        if workers > 1 and len(paths) > 1 and total >= self.PARALLEL_MIN_BYTES:
+            try:
+                context = multiprocessing.get_context("spawn")
+                with ProcessPoolExecutor(max_workers=min(workers, len(paths)), mp_context=context) as pool:
+                    return dict(zip(paths, pool.map(Excel.read_csv, paths)))
+            except Exception as e:
+                logger.warning("parse csv in process pool failed, fall back to serial: %s" % e)
+        return {path: Excel.read_csv(path) for path in paths}
+
     def get_csv_columns(self, csv_file):
         '''读取CSV文件的第一行（列名）'''
         try:
@@ -102,17 +205,96 @@ class Report(object):
     def filter_file_names(self, device):
         csv_files = []
         logger.debug(device)
-        for f in os.listdir(device):
+        for f in sorted(os.listdir(device)):
             if os.path.isfile(os.path.join(device, f)) and os.path.basename(f) in self.summary_csf_file.keys():
                logger.debug(os.path.join(device, f))
                csv_files.append(f)
         return csv_files
         #return [f for f in os.listdir(device) if os.path.isfile(os.path.join(device, f)) and os.path.basename(f) in self.summary_csf_file.keys()]
 
+
+def cpu_count():
+    '''本进程可用的cpu核数，容器或设置了亲和性时比 os.cpu_count 少
+    '''
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0)) or 1
+    return os.cpu_count() or 1
+
+
+def regenerate_run(run_dir):
+    '''重新生成一次测试的报告，成功后删除该目录中旧的报告，批量模式中每个子进程处理一个目录
+    '''
+    old_books = [f for f in os.listdir(run_dir) if f.startswith("summary_") and f.endswith(".xlsx")]
+    book_path = Report(run_dir, workers=1).book_path
+    if book_path:
+        for book in old_books:
+            if book != os.path.basename(book_path):
+                os.remove(os.path.join(run_dir, book))
+    return book_path
+
+
+def regenerate_all(results_dir, workers=None):
+    '''
+    批量重新生成 results/<包名>/<时间戳>/ 下所有测试的报告，进程池按目录并行，用满所有cpu
+    :return: (成功数, 失败数)
+    '''
+    run_dirs = []
+    for package in sorted(os.listdir(results_dir)):
+        package_dir = os.path.join(results_dir, package)
+        if not os.path.isdir(package_dir):
+            continue
+        for run in sorted(os.listdir(package_dir)):
+            run_dir = os.path.join(package_dir, run)
+            if os.path.isdir(run_dir) and any(f.endswith(".csv") for f in os.listdir(run_dir)):
+                run_dirs.append(run_dir)
+    logger.info("regenerate %d reports under %s" % (len(run_dirs), results_dir))
+    done = failed = 0
+    workers = workers if workers else cpu_count()
+    if workers == 1:
+        for run_dir in run_dirs:
+            try:
+                regenerate_run(run_dir)
+                done += 1
+            except Exception as e:
+                failed += 1
+                logger.error("regenerate report of %s failed: %s" % (run_dir, e))
+        return done, failed
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        futures = {pool.submit(regenerate_run, run_dir): run_dir for run_dir in run_dirs}
+        for future in as_completed(futures):
+            try:
+                future.result()
+                done += 1
+            except Exception as e:
+                failed += 1
+                logger.error("regenerate report of %s failed: %s" % (futures[future], e))
+    return done, failed
+
+
 if __name__ == '__main__':
-# 根据csv生成excel汇总文件
-    from mobileperf.android.globaldata import RuntimeData
-    RuntimeData.packages = ["com.alibaba.ailabs.genie.smartapp","com.alibaba.ailabs.genie.smartapp:core","com.alibaba.ailabs.genie.smartapp:business"]
-    RuntimeData.package_save_path = "/Users/look/Downloads/mobileperf-turandot-shicun-2-13/results/com.alibaba.ailabs.genie.smartapp/2020_02_13_22_58_14"
-    report = Report(RuntimeData.package_save_path,RuntimeData.packages)
-    report.filter_file_names(RuntimeData.package_save_path)
+    # 根据csv生成excel汇总文件
+    # 用法: python3 mobileperf/android/report.py [--workers N] 结果目录
+    #       python3 mobileperf/android/report.py --batch [--workers N] [results目录]
+    multiprocessing.freeze_support()
+    args = sys.argv[1:]
+    workers = None
+    batch = False
+    dirs = []
+    i = 0
+    while i < len(args):
+        if args[i] == "--workers" and i + 1 < len(args):
+            workers = int(args[i + 1])
+            i += 1
+        elif args[i] == "--batch":
+            batch = True
+        else:
+            dirs.append(args[i])
+        i += 1
+    if batch:
+        begin = time.time()
+        done, failed = regenerate_all(dirs[0] if dirs else os.path.join(FileUtils.get_top_dir(), 'results'), workers)
+        logger.info("regenerated %d reports, %d failed, %.1fs" % (done, failed, time.time() - begin))
+        sys.exit(1 if failed else 0)
+    for csv_dir in dirs:
+        Report(csv_dir, workers=workers)
@@ -16,6 +16,8 @@ import queue
 import base64
 import json
 import subprocess
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait
 from shutil import copyfile,rmtree
 # import objgraph
 from configparser import ConfigParser
@@ -26,6 +28,8 @@ sys.path.append(os.path.join(BaseDir,'../..'))
 from mobileperf.common.log import logger
 from mobileperf.android.tools.androiddevice import AndroidDevice
 from mobileperf.common.utils import TimeUtils,FileUtils,ZipUtils
+from mobileperf.common.metrics import MetricsReporter
+from mobileperf.common.sketch import SketchSink
 from mobileperf.android.cpu_top import CpuMonitor
 from mobileperf.android.meminfos import MemMonitor
 from mobileperf.android.trafficstats import TrafficMonitor
@@ -33,11 +37,15 @@ from mobileperf.android.fps import FPSMonitor
 from mobileperf.android.powerconsumption import PowerMonitor
 from mobileperf.android.thread_num import ThreadNumMonitor
 from mobileperf.android.fd import FdMonitor
+from mobileperf.android.thermal import ThermalMonitor
+from mobileperf.android.proc_io import ProcIoMonitor
+from mobileperf.android.mempressure import MemPressureMonitor
 from mobileperf.android.logcat import LogcatMonitor
 from mobileperf.android.devicemonitor import DeviceMonitor
 from mobileperf.android.monkey import Monkey
-from mobileperf.android.globaldata import RuntimeData
+from mobileperf.android.globaldata import RuntimeData, Session
 from mobileperf.android.report import Report
+from mobileperf.android.attribution import ActivityAttribution
 # 尝试导入 Web 服务器的启动函数（若不可用则忽略，不影响核心功能）
 try:
     from mobileperf.android.web.web_server import get_or_start_web_server
@@ -47,7 +55,11 @@ except Exception:
 
 class StartUp(object):
 
-    def __init__(self, device_id=None, package=None,interval=None):
+    def __init__(self, device_id=None, package=None,interval=None,result_tag=None,start_web=True):
+        '''
+        :param str result_tag: 结果目录名后缀，多设备同时测试时用于区分同一秒启动的不同设备，如设备序列号
+        :param bool start_web: 是否自动拉起Web服务，多设备调度时由调度进程统一管理，子进程不再拉起
+        '''
         RuntimeData.top_dir = os.getcwd()
         if "android" in RuntimeData.top_dir:
             RuntimeData.top_dir  = FileUtils.get_top_dir()
@@ -58,6 +70,8 @@ class StartUp(object):
         self.packages = package if package != None else self.config_dic['package']#代码中重新传入package 则会覆盖原来配置文件config.conf的值，为了debug方便
         self.frequency = interval if interval != None else self.config_dic['frequency']#代码中重新传入interval 则会覆盖原来配置文件config.conf的值，为了debug方便
         self.timeout = self.config_dic['timeout']
+        self.result_tag = result_tag
+        self.start_web = start_web
         self.exceptionlog_list = self.config_dic["exceptionlog"]
         self.device = AndroidDevice(self.serialnum)
         # 如果config文件中 packagename为空，就获取前台进程，匹配图兰朵，测的app太多，支持配置文件不传package
@@ -65,6 +79,11 @@ class StartUp(object):
             # 进程名不会有#，转化为list
             self.packages = self.device.adb.get_foreground_process().split("#")
         RuntimeData.packages = self.packages
+        # 本次测试的上下文，各monitor从session获取设备、结果目录和配置，RuntimeData保留给web服务读取
+        self.session = Session(device_id=self.serialnum, packages=self.packages, config_dic=self.config_dic,
+                               exit_event=RuntimeData.exit_event)
+        # StartUp 自己的adb操作也记到本次测试的指标里
+        self.session.set_device(self.serialnum, self.device)
 
         #与终端交互有关
         self.keycode = ''
@@ -73,6 +92,8 @@ class StartUp(object):
         self._init_queue()
         self.monitors = []
         self.logcat_monitor = None
+        self.metrics_reporter = None
+        self.metric_summary = None
 
     def _init_queue(self):
         self.cpu_queue = queue.Queue()
@@ -102,6 +123,77 @@ class StartUp(object):
     def remove_monitor(self, monitor):
         self.monitors.remove(monitor)
 
+    def _run_parallel(self, stage, tasks, timeout=None, max_workers=None):
+        '''
+        用线程池并行执行一组任务，每个任务的耗时记到指标 <stage>:<任务名>，整组耗时记到 <stage>(s)
+        :param str stage: 阶段名，如 startup teardown
+        :param list tasks: [(任务名, 无参函数)]
+        :param float timeout: 所有任务共用的截止时间，单位秒，为None时等全部完成，超时的任务不再等待
+        :param int max_workers: 最大并发数，默认每个任务一个线程
+        :return: {任务名: 返回值}，异常或超时的任务不在其中
+        '''
+        results = {}
+        if not tasks:
+            return results
+        begin = time.monotonic()
+        metrics = self.session.metrics
+
+        def _timed(name, func):
+            task_begin = time.monotonic()
+            try:
+                return func()
+            finally:
+                metrics.observe("%s:%s" % (stage, name), (time.monotonic() - task_begin) * 1000)
+
+        executor = ThreadPoolExecutor(max_workers=max_workers if max_workers else len(tasks), thread_name_prefix=stage)
+        futures = dict((executor.submit(_timed, name, func), name) for name, func in tasks)
+        done, not_done = wait(futures, timeout=timeout)
+        for future in done:
+            name = futures[future]
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                metrics.inc("%s_errors" % stage)
+                logger.error("%s %s failed: %s" % (stage, name, e))
+                logger.debug("".join(traceback.format_exception(type(e), e, e.__traceback__)))
+        for future in not_done:
+            metrics.inc("%s_timeout:%s" % (stage, futures[future]))
+            logger.warning("%s %s not finished in %ss, skip it" % (stage, futures[future], timeout))
+        # 超时的任务线程不再等待，由它自己结束
+        executor.shutdown(wait=False)
+        metrics.set_gauge("%s(s)" % stage, round(time.monotonic() - begin, 3))
+        return results
+
+    def _start_monitor(self, factory, start_time):
+        '''构造并启动一个monitor的任务，供 _run_parallel 执行
+        '''
+        def _start():
+            monitor = factory()
+            try:
+                monitor.start(start_time)
+            except Exception as e:
+                # 启动失败的monitor仍然保留，stop时统一处理
+                logger.error(e)
+            return monitor
+        return _start
+
+    def _start_logcat(self, start_time):
+        # 获取钉钉webhook配置和手机号列表
+        dingding_webhook = self.config_dic.get("dingding_webhook", "")
+        dingding_mobiles = self.config_dic.get("dingding_mobiles", [])
+        # 传入包名、钉钉webhook配置和手机号列表，用于实时异常通知
+        logcat_monitor = LogcatMonitor(self.serialnum, self.packages[0],
+                                       dingding_webhook=dingding_webhook,
+                                       dingding_mobiles=dingding_mobiles,
+                                       session=self.session)
+        # 如果有异常日志标志，才启动这个模块
+        if self.exceptionlog_list:
+            logcat_monitor.set_exception_list(self.exceptionlog_list)
+            logcat_monitor.add_log_handle(logcat_monitor.handle_exception)
+        logcat_monitor.start(start_time)
+        logger.info("Logcat monitor started")
+        return logcat_monitor
+
     def parse_data_from_config(self):
         '''
         从配置文件中解析出需要的信息，包名，时间间隔，设备的序列号等
@@ -145,6 +237,10 @@ class StartUp(object):
         config_dic = self.check_config_option(config_dic, paser, "Common", "monkey_disable_syskeys")
         # 单独的页面监控间隔时间
         config_dic = self.check_config_option(config_dic, paser, "Common", "monitor_interval")
+        # 设备端采集agent、设备端输出过滤、高频电流采样、温控降频监控、进程io监控、内存压力监控，可选，不配置时用默认值
+        for option in ["agent", "agent_interval", "agent_ring_kb", "device_filter", "power_hz", "thermal", "thermal_temp", "proc_io", "mem_pressure"]:
+            if paser.has_option("Common", option) and paser.get("Common", option).strip():
+                config_dic = self.check_config_option(config_dic, paser, "Common", option)
 
         logger.debug(config_dic)
         return config_dic
@@ -173,6 +269,17 @@ class StartUp(object):
                             config_dic[option] = []
                 if option == 'monkey_disable_syskeys':
                     config_dic[option] = parse.get(section, option).lower() == 'true'
+                if option == 'agent' or option == 'device_filter' or option == 'thermal' or option == 'proc_io' \
+                        or option == 'mem_pressure':
+                    config_dic[option] = parse.get(section, option).strip().lower()
+                if option == 'thermal_temp':#温控降频的温度阈值，单位摄氏度
+                    config_dic[option] = float(parse.get(section, option))
+                if option == 'power_hz':#电流采样频率，单位Hz
+                    config_dic[option] = float(parse.get(section, option))
+                if option == 'agent_interval':#agent 采样间隔，单位秒，可以是小数
+                    config_dic[option] = float(parse.get(section, option))
+                if option == 'agent_ring_kb':
+                    config_dic[option] = int(parse.get(section, option))
             except:#配置项中数值发生错误
                 if option != 'serialnum':
                     logger.debug("config option error:"+option)
@@ -202,7 +309,7 @@ class StartUp(object):
         # 在任何设备/应用检查之前，优先确保 Web 服务已启动，
         # 这样即使设备未连接，Web 也可用于查看历史结果、编辑配置、手动控制
         try:
-            if WEB_SERVER_AVAILABLE:
+            if WEB_SERVER_AVAILABLE and self.start_web:
                 get_or_start_web_server(port=5000)
         except Exception as e:
             logger.debug(f"Auto start web server skipped: {e}")
@@ -222,6 +329,8 @@ class StartUp(object):
         if not is_device_connect:
             logger.error("after 5 times check,device not found:" + self.serialnum)
             return
+        # 设备能力只探测一次，有缓存时直接读取，各monitor共用同一个device，不再各自探测
+        capability = self.device.adb.get_capability()
   # 对是否安装被测app的检查 只在最开始检查一次
         if not self.device.adb.is_app_installed(self.packages[0]):
             logger.error("test app not installed:" + self.packages[0])
@@ -231,64 +340,88 @@ class StartUp(object):
             if not RuntimeData.start_time:
                 start_time = TimeUtils.getCurrentTimeUnderline()
                 RuntimeData.start_time = start_time
+                dir_name = start_time
+                if self.result_tag:
+                    # 网络设备序列号形如 host:port，冒号在windows上不能作为目录名
+                    dir_name = start_time + "_" + re.sub(r"[^\w\-.]", "_", self.result_tag)
                 if self.config_dic["save_path"]:
-                    RuntimeData.package_save_path = os.path.join(self.config_dic["save_path"], self.packages[0], start_time)
+                    RuntimeData.package_save_path = os.path.join(self.config_dic["save_path"], self.packages[0], dir_name)
                 else:
-                    RuntimeData.package_save_path = os.path.join(RuntimeData.top_dir, 'results', self.packages[0], start_time)
+                    RuntimeData.package_save_path = os.path.join(RuntimeData.top_dir, 'results', self.packages[0], dir_name)
                 FileUtils.makedir(RuntimeData.package_save_path)
                 # 先写入初始设备信息文件，后续 stop() 会补充信息
                 self.save_device_info()
+            start_time = RuntimeData.start_time
+            self.session.start_time = start_time
+            self.session.package_save_path = RuntimeData.package_save_path
+            # 工具自身的开销指标，定期写 tool_metrics.csv
+            self.metrics_reporter = MetricsReporter(self.session.metrics, self.session.package_save_path,
+                                                    self.config_dic.get("metrics_interval", 5))
+            self.metrics_reporter.start()
+            # 各列数据的分位数和均值方差，随采集流式更新，定期写 metric_summary.json
+            self.metric_summary = SketchSink(self.session.package_save_path)
+            self.session.add_sink(self.metric_summary)
+            self.metric_summary.start()
             #初始化数据处理的类,将没有消息队列传递过去，以便获取数据，并处理
             # datahandle = DataWorker(self.get_queue_dic())
             # 将queue传进去，与datahandle那个线程交互
-            self.add_monitor(CpuMonitor(self.serialnum, self.packages, self.frequency, self.timeout))
-            self.add_monitor(MemMonitor(self.serialnum, self.packages, self.frequency, self.timeout))
-            self.add_monitor(TrafficMonitor(self.serialnum, self.packages, self.frequency, self.timeout))
-            # 软件方式 获取电量不准，已用硬件方案测试功耗
-            # self.add_monitor(PowerMonitor(self.serialnum, self.frequency,self.timeout))
-            self.add_monitor(FPSMonitor(self.serialnum,self.packages[0],self.frequency,self.timeout))
             # fd监控：需要root权限才能访问/proc/pid/fd（Android 4.3+都受SELinux限制）
+            # adb root 会重启adbd，要在并行启动monitor之前完成
             sdk_version = self.device.adb.get_sdk_version()
-            has_root = False
-            try:
-                # 方法1：检查当前shell用户是否是root
-                id_result = self.device.adb.run_shell_cmd("id")
-                if id_result and "uid=0(root)" in id_result:
-                    has_root = True
-                    logger.info("ADB is running as root (adb root)")
-                else:
-                    # 方法2：尝试使用su获取root权限
-                    su_id_result = self.device.adb.run_shell_cmd("su 0 id")
-                    if su_id_result and "uid=0(root)" in su_id_result:
-                        has_root = True
-                        logger.info("Su root permission available, attempting adb root...")
-                        # 尝试执行adb root以提升权限
-                        try:
-                            # adb root需要在PC端执行，不是shell命令
-                            adb_root_result = self.device.adb._run_cmd_once("root")
-                            # 等待adb root生效
-                            time.sleep(2)  # 增加等待时间，确保adb root生效
-                            id_check = self.device.adb.run_shell_cmd("id")
-                            if id_check and "uid=0(root)" in id_check:
-                                logger.info("Successfully switched to adb root mode")
-                            else:
-                                logger.info("adb root verification failed, will use su command for fd collection")
-                        except Exception as e:
-                            logger.debug(f"adb root execution failed: {e}")
+            # 方法1：当前shell用户是root（adb root）；方法2：可以用su获取root权限
+            has_root = capability.has_root
+            if capability.shell_root:
+                logger.info("ADB is running as root (adb root)")
+            elif capability.su_root:
+                logger.info("Su root permission available, attempting adb root...")
+                # 尝试执行adb root以提升权限
+                try:
+                    # adb root需要在PC端执行，不是shell命令
+                    adb_root_result = self.device.adb._run_cmd_once("root")
+                    # 等待adb root生效
+                    time.sleep(2)  # 增加等待时间，确保adb root生效
+                    id_check = self.device.adb.run_shell_cmd("id")
+                    if id_check and "uid=0(root)" in id_check:
+                        capability.shell_root = True
+                        logger.info("Successfully switched to adb root mode")
                     else:
-                        logger.info(f"No root permission available for Android {sdk_version}")
-            except Exception as e:
-                logger.debug(f"Root check failed: {e}")
-            
+                        logger.info("adb root verification failed, will use su command for fd collection")
+                except Exception as e:
+                    logger.debug(f"adb root execution failed: {e}")
+            else:
+                logger.info(f"No root permission available for Android {sdk_version}")
+
+            # 各monitor的构造函数里都有阻塞的adb操作（top、查uid、清SurfaceFlinger数据），并行构造并启动
+            factories = [
+                ("CpuMonitor", lambda: CpuMonitor(self.serialnum, self.packages, self.frequency, self.timeout, session=self.session)),
+                ("MemMonitor", lambda: MemMonitor(self.serialnum, self.packages, self.frequency, self.timeout, session=self.session)),
+                ("TrafficMonitor", lambda: TrafficMonitor(self.serialnum, self.packages, self.frequency, self.timeout, session=self.session)),
+                # 软件方式 获取电量不准，已用硬件方案测试功耗
+                # ("PowerMonitor", lambda: PowerMonitor(self.serialnum, self.frequency,self.timeout)),
+                ("FPSMonitor", lambda: FPSMonitor(self.serialnum,self.packages[0],self.frequency,self.timeout,session=self.session)),
+            ]
             if has_root:
-                self.add_monitor(FdMonitor(self.serialnum, self.packages[0], self.frequency, self.timeout))
+                factories.append(("FdMonitor", lambda: FdMonitor(self.serialnum, self.packages[0], self.frequency, self.timeout, session=self.session)))
                 logger.info(f"Added FdMonitor for Android {sdk_version}")
             else:
                 logger.warning(f"Skipping FdMonitor for Android {sdk_version} without root permission")
-            
-            self.add_monitor(ThreadNumMonitor(self.serialnum,self.packages[0],self.frequency,self.timeout))
+            # dumpsys 方式的电量数据不准，只在配置了 power_hz 时高频读 current_now 积分能耗
+            if self.config_dic.get("power_hz"):
+                factories.append(("PowerMonitor", lambda: PowerMonitor(self.serialnum, self.frequency, self.timeout,
+                                                                       session=self.session, hz=self.config_dic["power_hz"])))
+            # cpu频率和温度只读 /sys，默认开启，thermal=false 关闭
+            if self.config_dic.get("thermal", "true") != "false":
+                factories.append(("ThermalMonitor", lambda: ThermalMonitor(self.serialnum, self.frequency, self.timeout, session=self.session,
+                                                                           temp_threshold=self.config_dic.get("thermal_temp", 40.0))))
+            # 进程io、运行队列等待和上下文切换，默认开启，proc_io=false 关闭；没有root时只有io列为空
+            if self.config_dic.get("proc_io", "true") != "false":
+                factories.append(("ProcIoMonitor", lambda: ProcIoMonitor(self.serialnum, self.packages, self.frequency, self.timeout, session=self.session)))
+            # 内存压力：PSI、主缺页、swap和lmkd杀进程，默认开启，mem_pressure=false 关闭
+            if self.config_dic.get("mem_pressure", "true") != "false":
+                factories.append(("MemPressureMonitor", lambda: MemPressureMonitor(self.serialnum, self.packages, self.frequency, self.timeout, session=self.session)))
+            factories.append(("ThreadNumMonitor", lambda: ThreadNumMonitor(self.serialnum,self.packages[0],self.frequency,self.timeout,session=self.session)))
             if self.config_dic["monkey"] == "true":
-                self.add_monitor(Monkey(self.serialnum, self.packages[0], self.timeout))
+                factories.append(("Monkey", lambda: Monkey(self.serialnum, self.packages[0], self.timeout, session=self.session)))
             # 只要配置了 main_activity 就启动页面监控
             # 如果只配置 main_activity：检测应用是否在前台，不在则拉起应用
             # 如果同时配置了 activity_list：使用白名单功能，检测当前 Activity 是否在白名单中
@@ -297,35 +430,21 @@ class StartUp(object):
                 monitor_interval = self.config_dic.get("monitor_interval", 1)
                 # activity_list 如果未配置则为空列表
                 activity_list = self.config_dic.get("activity_list", [])
-                self.add_monitor(DeviceMonitor(self.serialnum, self.packages[0], monitor_interval, self.config_dic["main_activity"],
-                                               activity_list, RuntimeData.exit_event))
+                factories.append(("DeviceMonitor", lambda: DeviceMonitor(self.serialnum, self.packages[0], monitor_interval, self.config_dic["main_activity"],
+                                               activity_list, RuntimeData.exit_event, session=self.session)))
+
+            self.session.run_begin = time.monotonic()
+            tasks = [(name, self._start_monitor(factory, start_time)) for name, factory in factories]
+            # logcat的代码可能会引起死锁，单独处理，启动失败不影响其他monitor
+            tasks.append(("LogcatMonitor", lambda: self._start_logcat(start_time)))
+            started = self._run_parallel("startup", tasks)
+            # 按原来的顺序保存，stop时结果一致
+            for name, factory in factories:
+                if started.get(name):
+                    self.add_monitor(started[name])
+            self.logcat_monitor = started.get("LogcatMonitor")
 
             if len(self.monitors):
-                for monitor in self.monitors:
-                    #启动所有的monitors
-                    try:
-                        monitor.start(start_time)
-                    except Exception as e:
-                        logger.error(e)
-                # logcat的代码可能会引起死锁，拎出来单独处理logcat
-                try:
-                    # 获取钉钉webhook配置和手机号列表
-                    dingding_webhook = self.config_dic.get("dingding_webhook", "")
-                    dingding_mobiles = self.config_dic.get("dingding_mobiles", [])
-                    # 传入包名、钉钉webhook配置和手机号列表，用于实时异常通知
-                    self.logcat_monitor = LogcatMonitor(self.serialnum, self.packages[0], 
-                                                       dingding_webhook=dingding_webhook,
-                                                       dingding_mobiles=dingding_mobiles)
-                    # 如果有异常日志标志，才启动这个模块
-                    if self.exceptionlog_list:
-                        self.logcat_monitor.set_exception_list(self.exceptionlog_list)
-                        self.logcat_monitor.add_log_handle(self.logcat_monitor.handle_exception)
-                    time.sleep(1)
-                    self.logcat_monitor.start(start_time)
-                    logger.info("Logcat monitor started")
-                except Exception as e:
-                    logger.error("Failed to start logcat monitor: %s" % e)
-                
                 timeout = time_out if time_out != None else self.config_dic['timeout']
                 endtime = time.time() + timeout
                 while (time.time() < endtime):#吊着主线程防止线程中断
@@ -369,27 +488,17 @@ class StartUp(object):
     def stop(self):
         # 使用 try...finally 确保报告生成一定会执行，即使被 Ctrl+C 中断
         try:
-            for monitor in self.monitors:
-                try:
-                    monitor.stop()
-                except (KeyboardInterrupt, SystemExit):
-                    # 如果是中断信号，直接抛出，让外层处理
-                    raise
-                except Exception as e:  # 捕获所有的异常，防止其中一个monitor的stop操作发生异常退出时，影响其他的monitor的stop操作
-                    logger.error(e)
-
-            try:
-                if self.logcat_monitor:
-                    self.logcat_monitor.stop()
-            except (KeyboardInterrupt, SystemExit):
-                raise
-            except Exception as e:
-                logger.error("stop exception for logcat monitor")
-                logger.error(e)
+            # 各monitor并行停止，共用一个截止时间，个别monitor卡住不会拖住整个收尾
+            tasks = [(type(monitor).__name__, monitor.stop) for monitor in self.monitors]
+            if self.logcat_monitor:
+                tasks.append(("LogcatMonitor", self.logcat_monitor.stop))
+            self._run_parallel("teardown", tasks, self.config_dic.get("stop_timeout", 10))
+            if self.metrics_reporter:
+                self.metrics_reporter.stop()
             if self.config_dic["monkey"] =="true":
                 self.device.adb.kill_process("com.android.commands.monkey")
             # 统计测试时长
-            cost_time =round((float) (time.time() - TimeUtils.getTimeStamp(RuntimeData.start_time,TimeUtils.UnderLineFormatter))/3600,2)
+            cost_time =round((float) (time.time() - TimeUtils.getTimeStamp(self.session.start_time,TimeUtils.UnderLineFormatter))/3600,2)
             self.add_device_info("test cost time:",str(cost_time)+"h")
         except (KeyboardInterrupt, SystemExit):
             # 即使被中断，也要生成报告
@@ -398,17 +507,25 @@ class StartUp(object):
             # 根据csv生成excel汇总文件 - 无论是否中断，都要生成报告
             try:
                 # 若目录未建立，尝试兜底：使用results/<package>/最新时间目录
-                if not RuntimeData.package_save_path:
+                if not self.session.package_save_path:
                     base_dir = os.path.join(RuntimeData.top_dir, 'results', self.packages[0])
                     if os.path.isdir(base_dir):
                         # 选择时间戳最大的目录
                         candidates = [os.path.join(base_dir, d) for d in os.listdir(base_dir) if os.path.isdir(os.path.join(base_dir, d))]
                         if candidates:
                             candidates.sort(key=lambda p: os.path.getmtime(p), reverse=True)
-                            RuntimeData.package_save_path = candidates[0]
-                if RuntimeData.package_save_path and os.path.exists(RuntimeData.package_save_path):
+                            self.session.package_save_path = candidates[0]
+                if self.metric_summary:
+                    self.session.remove_sink(self.metric_summary)
+                    self.metric_summary.stop()
+                if self.session.package_save_path and os.path.exists(self.session.package_save_path):
+                    # 按前台页面汇总各项数据，生成的 activity_summary.csv 也写进报告
+                    try:
+                        ActivityAttribution(self.session.package_save_path).save()
+                    except Exception as e:
+                        logger.error("activity attribution failed: %s" % e)
                     logger.info("Generating summary report...")
-                    Report(RuntimeData.package_save_path, self.packages)
+                    Report(self.session.package_save_path, self.packages)
                     logger.info("Summary report generated successfully")
                     
                     # 检查 exception.log 是否包含包名，如果包含则发送钉钉通知
@@ -420,8 +537,11 @@ class StartUp(object):
             
             # 执行清理工作
             try:
-                self.pull_heapdump()
-                self.pull_log_files()
+                # heapdump和手机日志并行拉取
+                self._run_parallel("pull", self.pull_heapdump_tasks() + self.pull_log_tasks(), max_workers=4)
+                if self.metrics_reporter:
+                    # 拉取耗时在指标写完之后，补写一次
+                    self.metrics_reporter.flush()
             except KeyboardInterrupt:
                 logger.warning("Cleanup interrupted by user, skipping...")
             except Exception as e:
@@ -497,26 +617,45 @@ class StartUp(object):
 
     def pull_heapdump(self):
         # 把dumpheap文件拷贝出来
+        for name, task in self.pull_heapdump_tasks():
+            task()
+
+    def pull_heapdump_tasks(self):
+        '''
+        :return: [(文件名, 拉取函数)]，供 _run_parallel 并行拉取
+        '''
+        tasks = []
         filelist = self.device.adb.list_dir("/data/local/tmp")
         if filelist:
             for file in filelist:
                 if self.packages[0] in file:
-                    self.device.adb.pull_file("/data/local/tmp/%s" % file, RuntimeData.package_save_path)
+                    src_path = "/data/local/tmp/%s" % file
+                    tasks.append((file, lambda src_path=src_path: self.device.adb.pull_file(src_path, self.session.package_save_path)))
+        return tasks
 
     def pull_log_files(self):
+        for name, task in self.pull_log_tasks():
+            task()
+
+    def pull_log_tasks(self):
+        '''
+        :return: [(文件名, 拉取函数)]，供 _run_parallel 并行拉取
+        '''
+        tasks = []
         if self.config_dic["phone_log_path"]:
             for src_path in self.config_dic["phone_log_path"]:
-                self.device.adb.pull_file(src_path, RuntimeData.package_save_path)
+                tasks.append((src_path, lambda src_path=src_path: self.device.adb.pull_file(src_path, self.session.package_save_path)))
                 # self.device.adb.pull_file_between_time(src_path,RuntimeData.package_save_path,
                 #             TimeUtils.getTimeStamp(RuntimeData.start_time,TimeUtils.UnderLineFormatter),time.time())
         #         release系统pull  /sdcard/mtklog/可以  没有权限/sdcard/mtklog/mobilelog
+        return tasks
 
 
     def _check_and_notify_exception(self):
         """
         检查 exception.log 是否包含包名，如果包含则发送钉钉通知
         """
-        if not RuntimeData.package_save_path or not os.path.exists(RuntimeData.package_save_path):
+        if not self.session.package_save_path or not os.path.exists(self.session.package_save_path):
             return
         
         # 检查是否配置了钉钉 webhook
@@ -526,7 +665,7 @@ class StartUp(object):
             return
         
         # 检查 exception.log 文件是否存在
-        exception_file = os.path.join(RuntimeData.package_save_path, 'exception.log')
+        exception_file = os.path.join(self.session.package_save_path, 'exception.log')
         if not os.path.exists(exception_file):
             logger.debug("exception.log not found, skip notification")
             return
@@ -550,7 +689,7 @@ class StartUp(object):
                 notifier = DingDingNotifier(dingding_webhook)
                 # 获取手机号列表
                 dingding_mobiles = self.config_dic.get("dingding_mobiles", [])
-                success = notifier.notify_exception(package, RuntimeData.package_save_path, exception_file, at_mobiles=dingding_mobiles)
+                success = notifier.notify_exception(package, self.session.package_save_path, exception_file, at_mobiles=dingding_mobiles)
                 if success:
                     logger.info("DingDing notification sent successfully")
                     if dingding_mobiles:
@@ -579,7 +718,7 @@ class StartUp(object):
             writer.write(key+":"+value+"\n")
 
     def check_exit_signal_quit(self):
-        if(RuntimeData.exit_event.is_set()):
+        if(self.session.exit_event.is_set()):
             return True
         else:
             return False
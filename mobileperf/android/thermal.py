@@ -0,0 +1,335 @@
+#encoding:utf-8
+'''
+@author:     look
+
+@copyright:  1999-2020 Alibaba.com. All rights reserved.
+
+@license:    Apache Software License 2.0
+
+@contact:    390125133@qq.com
+'''
+'''
+cpu频率和温度：每个采集周期用一条 grep -H 读出所有核的 online、scaling_cur_freq、scaling_max_freq、cpuinfo_max_freq
+和所有 thermal_zone 的 type、temp，写 thermal.csv；频率上限被压低且温度超过阈值时记为温控降频，
+连续降频的采样合并成一次事件写 thermal_events.csv，与cpu、fps用同一个节拍采集，报告中按时间对照帧率下降的原因
+'''
+import csv
+import os
+import re
+import sys
+import threading
+import time
+import traceback
+
+BaseDir=os.path.dirname(__file__)
+sys.path.append(os.path.join(BaseDir,'../..'))
+
+from mobileperf.common.utils import TimeUtils
+from mobileperf.common.log import logger
+from mobileperf.common.scheduler import gap_row, command_budget
+from mobileperf.android.globaldata import Session
+
+CPU_DIR = "/sys/devices/system/cpu"
+THERMAL_DIR = "/sys/class/thermal"
+# grep -H 每行输出 文件名:内容，一个进程读完所有文件；离线核的 cpufreq 文件读不到，错误输出丢弃
+SYSFS_CMD = "grep -H . " + " ".join([CPU_DIR + "/cpu[0-9]*/online",
+                                     CPU_DIR + "/cpu[0-9]*/cpufreq/scaling_cur_freq",
+                                     CPU_DIR + "/cpu[0-9]*/cpufreq/scaling_max_freq",
+                                     CPU_DIR + "/cpu[0-9]*/cpufreq/cpuinfo_max_freq",
+                                     THERMAL_DIR + "/thermal_zone*/type",
+                                     THERMAL_DIR + "/thermal_zone*/temp"]) + " 2>/dev/null"
+
+
+class ThermalInfo(object):
+    '''
+    解析 SYSFS_CMD 的输出
+    cores: {核号: {"online": bool, "cur": kHz, "max": scaling_max_freq kHz, "hw_max": cpuinfo_max_freq kHz}}
+    zones: {zone号: [type, 温度℃]}，读不到或明显无效的温度为None
+    '''
+    RE_CPU = re.compile(r'/cpu(\d+)/(?:cpufreq/)?(online|scaling_cur_freq|scaling_max_freq|cpuinfo_max_freq):(.*)$')
+    RE_ZONE = re.compile(r'/thermal_zone(\d+)/(type|temp):(.*)$')
+    CPU_KEYS = {"online": "online", "scaling_cur_freq": "cur", "scaling_max_freq": "max", "cpuinfo_max_freq": "hw_max"}
+
+    def __init__(self, source):
+        self.source = source
+        self.cores = {}
+        self.zones = {}
+        self._parse()
+
+    @staticmethod
+    def to_celsius(value):
+        '''
+        temp 的单位大多是毫摄氏度，少数传感器直接是摄氏度或0.1摄氏度
+        :return: 不在 -40~150 范围内的值（没有接传感器的zone常读到负数或0xffff）返回None
+        '''
+        value = float(value)
+        if abs(value) >= 1000:
+            value = value / 1000.0
+        elif abs(value) > 200:
+            value = value / 10.0
+        if value < -40 or value > 150:
+            return None
+        return round(value, 1)
+
+    def _parse(self):
+        for line in self.source.split("\n"):
+            line = line.strip()
+            match = self.RE_CPU.search(line)
+            if match:
+                core = self.cores.setdefault(int(match.group(1)), {"online": True, "cur": None, "max": None,
+                                                                   "hw_max": None})
+                key = self.CPU_KEYS[match.group(2)]
+                try:
+                    value = int(match.group(3))
+                except ValueError:
+                    continue
+                core[key] = value == 1 if key == "online" else value
+                continue
+            match = self.RE_ZONE.search(line)
+            if match:
+                zone = self.zones.setdefault(int(match.group(1)), ["thermal_zone" + match.group(1), None])
+                if match.group(2) == "type":
+                    zone[0] = match.group(3).strip() or zone[0]
+                else:
+                    try:
+                        zone[1] = self.to_celsius(match.group(3))
+                    except ValueError:
+                        pass
+
+    def online_cores(self):
+        # cpu0 一般没有 online 文件，能读到频率就算在线
+        return sorted(n for n, core in self.cores.items() if core["online"] and core["cur"] is not None)
+
+    def hottest_zone(self):
+        '''
+        :return: (type, 温度℃)，没有可用的温度时返回 ("", None)
+        '''
+        zones = [zone for zone in self.zones.values() if zone[1] is not None]
+        if not zones:
+            return "", None
+        return tuple(max(zones, key=lambda zone: zone[1]))
+
+    def capped_cores(self, threshold):
+        '''
+        :param float threshold: scaling_max_freq 低于 cpuinfo_max_freq 的这个百分比时算被限频
+        :return: {核号: 频率上限占硬件最高频率的百分比}
+        '''
+        result = {}
+        for n in self.online_cores():
+            core = self.cores[n]
+            if core["max"] and core["hw_max"]:
+                cap = core["max"] * 100.0 / core["hw_max"]
+                if cap < threshold:
+                    result[n] = round(cap, 1)
+        return result
+
+    def freq_cap(self):
+        '''在线核中最低的频率上限百分比，读不到时返回None
+        '''
+        caps = [self.cores[n]["max"] * 100.0 / self.cores[n]["hw_max"] for n in self.online_cores()
+                if self.cores[n]["max"] and self.cores[n]["hw_max"]]
+        return round(min(caps), 1) if caps else None
+
+    def __repr__(self):
+        return "cores: %s, zones: %s" % (self.cores, self.zones)
+
+
+class ThrottleDetector(object):
+    '''
+    温控降频事件：在线核的频率上限低于 cap_threshold% 且最高温度不低于 temp_threshold 的采样为降频，
+    连续的降频采样合并成一次事件，只限频不高温（省电模式、厂商性能模式）不算
+    事件时长从第一次降频采样算到最后一次降频采样之后一个采集间隔
+    '''
+    EVENT_TITLE = ["datetime", "end", "duration(s)", "samples", "min_freq_cap%", "max_temp(C)", "hot_zone",
+                   "capped_cores"]
+
+    def __init__(self, temp_threshold=40.0, cap_threshold=95.0, interval=0):
+        self.temp_threshold = temp_threshold
+        self.cap_threshold = cap_threshold
+        self.interval = interval
+        self.events = []
+        self._current = None
+
+    def is_throttled(self, info):
+        zone_type, temp = info.hottest_zone()
+        return temp is not None and temp >= self.temp_threshold and bool(info.capped_cores(self.cap_threshold))
+
+    def add(self, timestamp, info):
+        '''
+        加入一次采样
+        :return: (这次是否降频, 刚结束的事件行)，没有结束的事件时为None
+        '''
+        if not self.is_throttled(info):
+            return False, self._finish() if self._current else None
+        zone_type, temp = info.hottest_zone()
+        capped = info.capped_cores(self.cap_threshold)
+        cap = min(capped.values())
+        if not self._current:
+            self._current = {"start": timestamp, "end": timestamp, "samples": 0, "cap": cap, "temp": temp,
+                             "zone": zone_type, "cores": set()}
+        event = self._current
+        event["end"] = timestamp
+        event["samples"] += 1
+        event["cap"] = min(event["cap"], cap)
+        if temp > event["temp"]:
+            event["temp"] = temp
+            event["zone"] = zone_type
+        event["cores"].update(capped)
+        return True, None
+
+    def gap(self):
+        '''数据断开，进行中的事件到最后一次采样为止
+        '''
+        return self._finish() if self._current else None
+
+    def flush(self):
+        return self.gap()
+
+    def _finish(self):
+        event = self._current
+        self._current = None
+        row = [event["start"], TimeUtils.formatTimeStamp(event["end"]),
+               round(event["end"] - event["start"] + self.interval, 1), event["samples"], event["cap"], event["temp"], event["zone"],
+               " ".join(str(n) for n in sorted(event["cores"]))]
+        self.events.append(row)
+        return row
+
+
+class ThermalCollector(object):
+    def __init__(self, device, interval=1.0, timeout=24 * 60 * 60, session=None, temp_threshold=40.0):
+        self.device = device
+        self.session = session if session else Session.default()
+        self._interval = interval
+        self._cmd_timeout = command_budget(interval)
+        self._timeout = timeout
+        self._stop_event = threading.Event()
+        self.detector = ThrottleDetector(temp_threshold, interval=interval)
+        self.title = None
+        self.collect_thermal_thread = None
+
+    def start(self, start_time):
+        logger.debug("INFO: ThermalCollector start...")
+        self.collect_thermal_thread = threading.Thread(target=self._collect_thermal_thread, name="thermal")
+        self.collect_thermal_thread.start()
+
+    def stop(self):
+        logger.debug("INFO: ThermalCollector stop...")
+        if self.collect_thermal_thread and self.collect_thermal_thread.is_alive():
+            self._stop_event.set()
+            self.collect_thermal_thread.join(timeout=2)
+            self.collect_thermal_thread = None
+
+    def get_thermal_info(self):
+        # 整条命令加双引号，通配符和重定向在设备端执行，不被PC端的shell处理
+        out = self.device.adb.run_shell_cmd('"%s"' % SYSFS_CMD, timeout=self._cmd_timeout)
+        if not out:
+            return None
+        before = time.time()
+        info = ThermalInfo(out)
+        self.session.metrics.record_parse("thermal", len(out), time.time() - before)
+        if not info.cores and not info.zones:
+            return None
+        return info
+
+    def _make_title(self, info):
+        # 核数在第一次采集时确定，每个核一列当前频率
+        return ["datetime", "online_cores", "max_temp(C)", "hot_zone", "freq_cap%", "throttled"] + \
+               ["cpu%d_freq(MHz)" % n for n in sorted(info.cores)]
+
+    def _make_row(self, collection_time, info, throttled):
+        zone_type, temp = info.hottest_zone()
+        cap = info.freq_cap()
+        row = [TimeUtils.formatTimeStamp(collection_time), len(info.online_cores()),
+               temp if temp is not None else "", zone_type, cap if cap is not None else "", 1 if throttled else 0]
+        for name in self.title[6:]:
+            core = info.cores.get(int(name[3:].split("_")[0]))
+            online = core and core["online"] and core["cur"] is not None
+            row.append(round(core["cur"] / 1000.0) if online else "")
+        return row
+
+    def _write_event(self, events_file, event):
+        timestamp = event[0]
+        event[0] = TimeUtils.formatTimeStamp(timestamp)
+        logger.warning("thermal throttling %s - %s, %ss, freq cap %s%%, %s %sC"
+                       % (event[0], event[1], event[2], event[4], event[6], event[5]))
+        with open(events_file, 'a+', encoding="utf-8") as writer:
+            csv.writer(writer, lineterminator='\n').writerow(event)
+        self.session.emit("thermal_events", timestamp, ThrottleDetector.EVENT_TITLE, event)
+
+    def _collect_thermal_thread(self):
+        end_time = time.time() + self._timeout
+        thermal_file = os.path.join(self.session.package_save_path, 'thermal.csv')
+        events_file = os.path.join(self.session.package_save_path, 'thermal_events.csv')
+        with open(events_file, 'a+', encoding="utf-8") as writer:
+            csv.writer(writer, lineterminator='\n').writerow(ThrottleDetector.EVENT_TITLE)
+        ticker = self.session.ticker("thermal", self._interval, self._stop_event)
+        while not self._stop_event.is_set() and time.time() < end_time:
+            try:
+                collection_time = ticker.next()
+                if collection_time is None:
+                    break
+                info = self.get_thermal_info()
+                if not info:
+                    if ticker.fail("can't read cpufreq and thermal zones", self.device.adb.is_offline()):
+                        event = self.detector.gap()
+                        if event:
+                            self._write_event(events_file, event)
+                        if self.title:
+                            with open(thermal_file, 'a+', encoding="utf-8") as writer:
+                                csv.writer(writer, lineterminator='\n').writerow(gap_row(collection_time, len(self.title)))
+                    continue
+                ticker.ok()
+                if not self.title:
+                    self.title = self._make_title(info)
+                    with open(thermal_file, 'a+', encoding="utf-8") as writer:
+                        csv.writer(writer, lineterminator='\n').writerow(self.title)
+                throttled, event = self.detector.add(collection_time, info)
+                if event:
+                    self._write_event(events_file, event)
+                row = self._make_row(collection_time, info, throttled)
+                with open(thermal_file, 'a+', encoding="utf-8") as writer:
+                    csv.writer(writer, lineterminator='\n').writerow(row)
+                self.session.emit("thermal", collection_time, self.title, row)
+            except Exception as e:
+                logger.error("an exception hanpend in thermal thread, reason unkown!, e:")
+                logger.error(e)
+                logger.debug(traceback.format_exc())
+                ticker.fail(str(e), self.device.adb.is_offline())
+        event = self.detector.flush()
+        if event:
+            self._write_event(events_file, event)
+        logger.info("%d thermal throttling events" % len(self.detector.events))
+
+
+class ThermalMonitor(object):
+    '''
+    cpu频率、温度和温控降频监控器，只读 /sys 下的文件，不需要root
+    '''
+    def __init__(self, device_id, interval=1.0, timeout=24 * 60 * 60, session=None, temp_threshold=40.0):
+        self.session = session if session else Session.default()
+        self.device = self.session.get_device(device_id)
+        self.thermal_collector = ThermalCollector(self.device, interval, timeout, self.session, temp_threshold)
+
+    def start(self, start_time):
+        if not self.session.package_save_path:
+            self.session.package_save_path = os.path.join(os.path.abspath(os.path.join(os.getcwd(), "../..")), 'results',
+                                                          self.device.adb._device_id, start_time)
+            if not os.path.exists(self.session.package_save_path):
+                os.makedirs(self.session.package_save_path)
+        self.start_time = start_time
+        self.thermal_collector.start(start_time)
+        logger.debug("INFO: ThermalMonitor has started...")
+
+    def stop(self):
+        self.thermal_collector.stop()
+        logger.debug("INFO: ThermalMonitor has stopped...")
+
+    def save(self):
+        pass
+
+
+if __name__ == "__main__":
+    monitor = ThermalMonitor("", 2)
+    monitor.start(TimeUtils.getCurrentTimeUnderline())
+    time.sleep(20)
+    monitor.stop()
@@ -19,17 +19,19 @@ import traceback
 BaseDir=os.path.dirname(__file__)
 sys.path.append(os.path.join(BaseDir,'../..'))
 
-from mobileperf.android.tools.androiddevice import AndroidDevice
 from mobileperf.common.utils import TimeUtils
 from mobileperf.common.log import logger
-from mobileperf.android.globaldata import RuntimeData
+from mobileperf.common.scheduler import gap_row, command_budget
+from mobileperf.android.globaldata import Session
 
 
 class ThreadNumPackageCollector(object):
-    def __init__(self, device, pacakgename, interval=1.0,timeout =24 * 60 * 60, thread_queue = None):
+    def __init__(self, device, pacakgename, interval=1.0,timeout =24 * 60 * 60, thread_queue = None, session=None):
         self.device = device
+        self.session = session if session else Session.default()
         self.packagename = pacakgename
         self._interval = interval
+        self._cmd_timeout = command_budget(interval)
         self._timeout = timeout
         self._stop_event = threading.Event()
         self.thread_queue = thread_queue
@@ -50,16 +52,17 @@ class ThreadNumPackageCollector(object):
             if self.thread_queue:
                 self.thread_queue.task_done()
 
-    def get_process_thread_num(self, process):
+    def get_process_thread_num(self, process, collection_time=None):
         pid = self.device.adb.get_pid_from_pck(self.packagename)
         if pid is None:
             return []
         
-        collection_time = time.time()
+        if collection_time is None:
+            collection_time = self.session.clock()
         logger.debug("collection time in thread_num info is : " + str(collection_time))
         
         # 先尝试直接获取（适用于adb root或Android低版本）
-        out = self.device.adb.run_shell_cmd('ls /proc/%s/task 2>/dev/null' % pid)
+        out = self.device.adb.run_shell_cmd('ls /proc/%s/task 2>/dev/null' % pid, timeout=self._cmd_timeout)
         if out:
             # 统计行数（使用 splitlines() 自动处理换行符，更安全）
             lines = [line for line in out.splitlines() if line.strip()]
@@ -68,7 +71,7 @@ class ThreadNumPackageCollector(object):
             return [collection_time,self.packagename,pid,thread_num]
         
         # 如果直接获取失败，尝试使用su权限
-        out = self.device.adb.run_shell_cmd('su 0 sh -c "ls /proc/%s/task 2>/dev/null"' % pid)
+        out = self.device.adb.run_shell_cmd('su 0 sh -c "ls /proc/%s/task 2>/dev/null"' % pid, timeout=self._cmd_timeout)
         if out:
             lines = [line for line in out.splitlines() if line.strip()]
             thread_num = len(lines)
@@ -82,7 +85,7 @@ class ThreadNumPackageCollector(object):
         end_time = time.time() + self._timeout
         thread_list_titile = (
         "datatime", "packagename", "pid", "thread_num")
-        thread_num_file = os.path.join(RuntimeData.package_save_path, 'thread_num.csv')
+        thread_num_file = os.path.join(self.session.package_save_path, 'thread_num.csv')
         try:
             with open(thread_num_file, 'a+') as df:
                 csv.writer(df, lineterminator='\n').writerow(thread_list_titile)
@@ -92,18 +95,27 @@ class ThreadNumPackageCollector(object):
         except RuntimeError as e:
             logger.error(e)
 
+        ticker = self.session.ticker("thread_num", self._interval, self._stop_event)
         while not self._stop_event.is_set() and time.time() < end_time:
             try:
+                collection_time = ticker.next()
+                if collection_time is None:
+                    break
                 before = time.time()
                 logger.debug("-----------into _collect_thread_num_thread loop, thread is : " + str(threading.current_thread().name))
 
                 # 获取pakagename的thread num信息
-                thread_pck_info = self.get_process_thread_num(self.packagename)
+                thread_pck_info = self.get_process_thread_num(self.packagename, collection_time)
                 logger.debug(thread_pck_info)
                 current_time = TimeUtils.getCurrentTime()
                 if not thread_pck_info:
+                    # 进程不在或设备离线，退避后再试
+                    if ticker.fail("can't get thread num", self.device.adb.is_offline()):
+                        with open(thread_num_file, 'a+', encoding="utf-8") as df:
+                            csv.writer(df, lineterminator='\n').writerow(gap_row(collection_time, len(thread_list_titile)))
                     continue
                 else:
+                    ticker.ok()
                     logger.debug(
                         "current time: " + current_time + ", processname: " + thread_pck_info[1]+ ", pid: " + str(thread_pck_info[2]) +
                         " thread num: " + str(thread_pck_info[3]))
@@ -113,30 +125,30 @@ class ThreadNumPackageCollector(object):
                     try:
                         with open(thread_num_file, 'a+',encoding="utf-8") as thread_writer:
                             writer_p = csv.writer(thread_writer, lineterminator='\n')
-                            thread_pck_info[0] = current_time
+                            thread_pck_info[0] = TimeUtils.formatTimeStamp(collection_time)
                             writer_p.writerow(thread_pck_info)
                     except RuntimeError as e:
                         logger.error(e)
+                self.session.emit("thread_num", collection_time, thread_list_titile, thread_pck_info)
 
                 after = time.time()
                 time_consume = after - before
-                delta_inter = self._interval - time_consume
                 logger.debug("time_consume  for thread num infos: " + str(time_consume))
-                if delta_inter > 0:
-                    time.sleep(delta_inter)
             except:
                 logger.error("an exception hanpend in thread num thread, reason unkown!")
                 s = traceback.format_exc()
                 logger.debug(s)
+                ticker.fail("exception", self.device.adb.is_offline())
                 if self.thread_queue:
                     self.thread_queue.task_done()
 
 class ThreadNumMonitor(object):
-    def __init__(self, device_id, packagename, interval = 1.0, timeout=24*60*60,thread_queue = None):
-        self.device = AndroidDevice(device_id)
+    def __init__(self, device_id, packagename, interval = 1.0, timeout=24*60*60,thread_queue = None, session=None):
+        self.session = session if session else Session.default()
+        self.device = self.session.get_device(device_id)
         if not packagename:
             packagename = self.device.adb.get_foreground_process()
-        self.thread_package_collector = ThreadNumPackageCollector(self.device, packagename, interval, timeout,thread_queue)
+        self.thread_package_collector = ThreadNumPackageCollector(self.device, packagename, interval, timeout,thread_queue,self.session)
 
     def start(self,start_time):
         self.start_time = start_time
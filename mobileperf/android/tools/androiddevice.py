@@ -15,6 +15,7 @@
 import re
 import os
 import time
+import signal
 import threading
 import subprocess
 import sys
@@ -27,12 +28,97 @@ from datetime import datetime,timedelta
 from mobileperf.common.log import logger
 from mobileperf.common.utils import TimeUtils,FileUtils
 from mobileperf.android.globaldata import RuntimeData
+from mobileperf.common.metrics import default_registry, adb_cmd_name
+
+class AdbTimeout(str):
+    '''adb同步命令超时的返回值：内容为空字符串，和命令失败一样按空结果处理，调用方原有的 if not out 判断不用改；
+    不是None，run_adb_cmd 不会再重试一个已经卡住的命令。需要区分超时的调用方判断 timed_out
+    '''
+    timed_out = True
+
+    def __new__(cls, cmd, timeout):
+        obj = str.__new__(cls, "")
+        obj.cmd = cmd
+        obj.timeout = timeout
+        return obj
+
+
+class DeviceBreaker(object):
+    '''设备离线熔断器，同一设备的所有ADB对象共用一个
+    设备离线后同步adb命令直接返回空，不再启动adb进程，各collector不会因为不停fork adb占满PC的cpu；
+    每隔 probe_interval 秒用 adb devices 探测一次，设备恢复后立即放行
+    '''
+    _breakers = {}
+    _breakers_lock = threading.Lock()
+
+    def __init__(self, device_id, probe_interval=1):
+        self.device_id = device_id
+        self.probe_interval = probe_interval
+        self.is_open = False
+        self.opened_at = None
+        self.reason = ""
+        self._next_probe = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get(device_id):
+        with DeviceBreaker._breakers_lock:
+            breaker = DeviceBreaker._breakers.get(device_id)
+            if not breaker:
+                breaker = DeviceBreaker._breakers[device_id] = DeviceBreaker(device_id)
+            return breaker
+
+    def trip(self, reason):
+        with self._lock:
+            if self.is_open:
+                return
+            self.is_open = True
+            self.reason = reason
+            self.opened_at = time.time()
+            self._next_probe = self.opened_at + self.probe_interval
+        logger.error("device %s offline (%s), adb cmds are rejected until it reconnects" % (self.device_id, reason))
+
+    def reset(self):
+        with self._lock:
+            if not self.is_open:
+                return
+            self.is_open = False
+        logger.info("device %s reconnected after %.1fs" % (self.device_id, time.time() - self.opened_at))
+
+    def _probe(self):
+        if self.device_id:
+            return ADB.is_connected(self.device_id)
+        return len(ADB.list_device()) > 0
+
+    def allow(self):
+        '''
+        :return: 是否可以执行adb命令，熔断期间到了探测时间会检查设备是否恢复
+        '''
+        if not self.is_open:
+            return True
+        with self._lock:
+            if not self.is_open:
+                return True
+            if time.time() < self._next_probe:
+                return False
+            # 同一时刻只有一个线程探测，其他线程继续直接返回
+            self._next_probe = time.time() + self.probe_interval
+        if self._probe():
+            self.reset()
+            return True
+        return False
+
 
 class ADB(object):
     '''本地ADB
     '''
     os_name = None
     adb_path = None
+    # 设备能力，见 get_capability
+    _capability = None
+    _capability_lock = threading.Lock()
+    # 是否读写设备能力缓存，回放的fingerprint不是真机，不能写进缓存
+    capability_cache = True
     
     def __init__(self, device_id=None):
         self._adb_path = ADB.get_adb_path()     # adb.exe程序的绝对路径
@@ -46,7 +132,38 @@ class ADB(object):
         self._os_name = None
         self.before_connect = True
         self.after_connect = True
+        # 所属的测试session，为空时使用RuntimeData
+        self.session = None
         
+    @property
+    def breaker(self):
+        return DeviceBreaker.get(self._device_id)
+
+    def is_offline(self):
+        '''设备是否处于离线熔断状态
+        '''
+        return self.breaker.is_open
+
+    def get_capability(self, refresh=False):
+        '''设备能力（sdk版本、top -b、root、SurfaceFlinger --latency、xt_qtaguid），
+        第一次调用时按 ro.build.fingerprint 从缓存读取或并行探测，之后直接返回
+
+        :param bool refresh: 为True时忽略缓存重新探测
+        :rtype: DeviceCapability
+        '''
+        if self._capability is None or refresh:
+            with ADB._capability_lock:
+                if self._capability is None or refresh:
+                    from mobileperf.android.tools.capability import DeviceCapability
+                    self._capability = DeviceCapability.load(self, refresh)
+                    if self._capability.sdk_version:
+                        self._sdk_version = self._capability.sdk_version
+        return self._capability
+
+    @property
+    def metrics(self):
+        return self.session.metrics if self.session else default_registry
+
     @property    
     def DEVICEID(self):
         return self._device_id
@@ -191,19 +308,33 @@ class ADB(object):
             else:
                 logger.debug("don't have process occupy 5037")
 
-    def _timer(self, process, timeout):
-        '''进程超时器，监控adb同步命令执行是否超时，超时强制结束执行。当timeout<=0时，永不超时
+    @staticmethod
+    def kill_process_tree(process):
+        '''结束子进程及其下的adb进程。命令是用shell=True启动的，process只是shell，只terminate它的话adb进程还在，
+        所以启动时放到单独的进程组，超时时结束整个进程组
 
         :param Popen process: 子进程对象
-        :param int timeout: 超时时间
         '''
-        num = 0
-        while process.poll() == None and num < timeout * 10:
-            num += 1
-            time.sleep(0.1)
-        if process.poll() == None:
-            logger.warning("%d process timeout,force close" % process.pid)
-            process.terminate()
+        if process.poll() is not None:
+            return
+        try:
+            if ADB.get_os_name() == "Windows":
+                subprocess.call("taskkill /T /F /PID %d" % process.pid, stdout=subprocess.DEVNULL,
+                                stderr=subprocess.DEVNULL, shell=True)
+            else:
+                # start_new_session 后进程组id就是shell的pid
+                os.killpg(process.pid, signal.SIGKILL)
+        except Exception as e:
+            logger.debug("kill process group %d failed: %s" % (process.pid, e))
+            process.kill()
+
+    @staticmethod
+    def popen_kwds():
+        '''adb子进程放到单独的进程组，超时时能连同adb进程一起结束
+        '''
+        if ADB.get_os_name() == "Windows":
+            return {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+        return {"start_new_session": True}
 
     def _run_cmd_once(self, cmd, *argv, **kwds):
         '''执行一次adb命令：cmd
@@ -229,6 +360,11 @@ class ADB(object):
         #         logger.debug(cmdlet)
         cmdStr = " ".join(cmdlet)
         logger.debug(cmdStr)
+        is_sync = not ("sync" in kwds and kwds['sync'] == False)
+        if is_sync and not self.breaker.allow():
+            # 设备离线，不再启动adb进程
+            self.metrics.inc("adb_breaker_reject")
+            return ""
         process = None
         #       windows上 不要传cmdStr 目录有空格，会报错
         #         if ADB.os_name == "Windows":
@@ -237,18 +373,35 @@ class ADB(object):
         #         else:
         #         windows ["adb devices"] 提示没有命令 ，改为str执行
         process = subprocess.Popen(cmdStr, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                                   shell=True)
-        if "sync" in kwds and kwds['sync'] == False:
+                                   shell=True, **ADB.popen_kwds())
+        if not is_sync:
             # 异步执行命令，不等待结果，返回该子进程对象
             return process
         before = time.time()
         timeout = 10
         if "timeout" in kwds:
             timeout = kwds['timeout']
-        if timeout != None and timeout > 0:
+        if timeout != None and timeout <= 0:
             # timeout = None 或者小于等于0时，一直等待执行结果
-            threading.Thread(None, self._timer, (process, timeout))
-        (out, error) = process.communicate()
+            timeout = None
+        cmd_name = adb_cmd_name(cmd, argv)
+        try:
+            (out, error) = process.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            self.kill_process_tree(process)
+            try:
+                # 回收僵尸进程，关闭管道
+                process.communicate(timeout=2)
+            except Exception:
+                pass
+            self.metrics.record_adb(cmd_name, time.time() - before, 0, False)
+            self.metrics.inc("adb_timeouts")
+            self.metrics.inc("adb_timeouts:%s" % cmd_name)
+            logger.warning("%s timeout after %ss, process group killed" % (cmdStr, timeout))
+            return AdbTimeout(cmdStr, timeout)
+        # 出错返回前也要记录，adb异常时的耗时最需要关注
+        self.metrics.record_adb(cmd_name, time.time() - before, len(out) + len(error),
+                                process.returncode == 0)
         # 执行错误 mac  out无输出 error有输出 返回值非0
         # 执行错误 windows out有输出 error没有输出，返回值0
         if process.poll() != 0:  # 返回码为非0，表示命令未执行成功返回
@@ -257,6 +410,7 @@ class ADB(object):
                 logger.debug("adb error info:\n%s" % error)
             if "no devices/emulators found" in str(out) or "no devices/emulators found" in str(error):
                 logger.error("no devices/emulators found,please reconnect phone,make sure adb shell normal")
+                self.breaker.trip("no devices/emulators found")
                 return ""
             #               退出整个进程
             if "killing" in str(out) or "killing" in str(error):
@@ -267,9 +421,11 @@ class ADB(object):
                 logger.error("device not found,please reconnect phone,make sure adb devices normal")
                 self.before_connect = False
                 self.after_connect = False
+                self.breaker.trip("device not found")
                 return ""
             if "offline" in str(out) or "offline" in str(error):
                 logger.error("device offline,please reconnect phone,make sure adb devices normal")
+                self.breaker.trip("device offline")
                 return ""
             if "more than one" in str(out) or "more than one" in str(error):
                 logger.error("more than one device,please input device serialnum!")
@@ -315,7 +471,8 @@ class ADB(object):
         '''
         # 如果失去连接后，adb又正常连接了
         if not self.before_connect and self.after_connect:
-            cpu_uptime_file = os.path.join(RuntimeData.package_save_path, "uptime.txt")
+            save_path = self.session.package_save_path if self.session else RuntimeData.package_save_path
+            cpu_uptime_file = os.path.join(save_path, "uptime.txt")
             with open(cpu_uptime_file, "a+",encoding = "utf-8") as writer:
                 writer.write(TimeUtils.getCurrentTimeUnderline() + " /proc/uptime:" + self.run_adb_cmd("shell cat /proc/uptime") + "\n")
             self.before_connect = True
@@ -325,6 +482,28 @@ class ADB(object):
             logger.error(u'adb cmd failed:%s ' % cmd)
         return ret
 
+    def device_filter_enabled(self):
+        '''是否在设备端过滤命令输出，设备支持 grep -F 且没有配置 device_filter=false
+        '''
+        if self.session and str(self.session.config("device_filter", "true")).lower() == "false":
+            return False
+        return self.get_capability().grep
+
+    def run_filtered_shell_cmd(self, cmd, patterns, **kwds):
+        '''
+        执行 adb shell 命令，只需要输出中包含 patterns 任一字符串的行
+        设备支持时在设备端用 grep -F 过滤，只把需要的行传回PC，否则取回全部输出，调用方的解析逻辑两种情况都适用
+
+        :param str cmd: shell命令，不能包含双引号
+        :param list patterns: 固定字符串，不能包含单引号
+        :param dict kwds: 同 run_shell_cmd
+        '''
+        if patterns and self.device_filter_enabled():
+            expr = " ".join("-e '%s'" % pattern for pattern in patterns)
+            # 整条命令加双引号，管道在设备端执行
+            return self.run_shell_cmd('"%s | grep -F %s"' % (cmd, expr), **kwds)
+        return self.run_shell_cmd(cmd, **kwds)
+
     def _check_need_quote(self):
         cmd = 'su -c ls -l /data/data'
         result = self.run_shell_cmd(cmd)
@@ -378,6 +557,11 @@ class ADB(object):
                         logcat_file = os.path.join(save_dir,
                                                 'logcat_%s.log' % self.log_file_create_time)
                         self.append_log_line_num = 0
+                        # 按批统计读取的字节数，避免每行都加锁
+                        log_bytes = sum(len(line) + 1 for line in logs)
+                        self.metrics.inc("adb_bytes_read", log_bytes)
+                        self.metrics.inc("adb_bytes_read:logcat", log_bytes)
+                        self.metrics.inc("logcat_lines", len(logs))
                         self.save(logcat_file, logs)
                         logs = []
                     # 新建文件
@@ -619,8 +803,9 @@ class ADB(object):
         logger.debug(filepath + " not have match time formatter")
         return False
 
-    def start_activity(self, activity_name, action='', data_uri='', extra={}, wait=True):
+    def start_activity(self, activity_name, action='', data_uri='', extra={}, wait=True, flags=''):
         '''打开一个Activity
+        :param str flags: am start 的其他参数，如 --activity-clear-task
         '''
         if action != '':  # 指定Action
             action = '-a %s ' % action
@@ -632,13 +817,16 @@ class ADB(object):
         W = ''
         if wait: W = '-W'  # 等待启动完成才返回
 
-        result = self.run_shell_cmd('am start %s -n %s %s %s %s' % (W, activity_name, action, data_uri, extra_str),
+        result = self.run_shell_cmd('am start %s %s -n %s %s %s %s' % (W, flags, activity_name, action, data_uri, extra_str),
                                     timeout=30, retry_count=1)
+        # -W 的输出如 Status: ok、LaunchState: COLD、TotalTime: 456、WaitTime: 480
         ret_dict = {}
-        for line in result:
+        if not result:
+            return ret_dict
+        for line in result.splitlines():
             if ': ' in line:
-                key, value = line.split(': ')
-                ret_dict[key] = value
+                key, value = line.split(': ', 1)
+                ret_dict[key.strip()] = value.strip()
         return ret_dict
 
     def get_focus_activity(self):
@@ -758,7 +946,7 @@ class ADB(object):
             :param packagename: 目标包名
             :return: 返回目标包名的列表信息
             '''
-        ps_list = self.list_process()
+        ps_list = self.list_process(packagename)
         pck_list = []
         for item in ps_list:
             if item["proc_name"] == packagename:
@@ -784,13 +972,13 @@ class ADB(object):
 
     def dumpheap(self, package, save_path):
         heapfile = "/data/local/tmp/%s_dumpheap_%s.hprof" % (package, TimeUtils.getCurrentTimeUnderline())
-        self.run_shell_cmd("am dumpheap %s %s" % (package, heapfile))
+        self.run_shell_cmd("am dumpheap %s %s" % (package, heapfile), timeout=60)
         time.sleep(10)
         self.pull_file(heapfile,save_path)
 
     def dump_native_heap(self, package, save_path):
         native_heap_file = "/data/local/tmp/%s_native_heap_%s.txt" % (package, TimeUtils.getCurrentTimeUnderline())
-        self.run_shell_cmd("am dumpheap -n %s %s" % (package, native_heap_file))
+        self.run_shell_cmd("am dumpheap -n %s %s" % (package, native_heap_file), timeout=60)
 
     def clear_data(self, packagename):
         '''清除指定包的 用户数据
@@ -812,7 +1000,10 @@ class ADB(object):
         '''获取系统版本，如：4.1.2
         '''
         if not self._system_version:
-            self._system_version = self.run_shell_cmd("getprop ro.build.version.release")
+            if self._capability and self._capability.release:
+                self._system_version = self._capability.release
+            else:
+                self._system_version = self.run_shell_cmd("getprop ro.build.version.release")
         return self._system_version
 
     def get_genie_uuid(self):
@@ -853,14 +1044,20 @@ class ADB(object):
         '''获取手机品牌  如：Mi Samsung OnePlus
         '''
         if not self._phone_brand:
-            self._phone_brand = self.run_shell_cmd('getprop ro.product.brand')
+            if self._capability and self._capability.brand:
+                self._phone_brand = self._capability.brand
+            else:
+                self._phone_brand = self.run_shell_cmd('getprop ro.product.brand')
         return self._phone_brand
 
     def get_phone_model(self):
         '''获取手机型号  如：A0001 M2S
         '''
         if not self._phone_model:
-            self._phone_model = self.run_shell_cmd('getprop ro.product.model')
+            if self._capability and self._capability.model:
+                self._phone_model = self._capability.model
+            else:
+                self._phone_model = self.run_shell_cmd('getprop ro.product.model')
         return self._phone_model
 
     def get_screen_size(self):
@@ -906,7 +1103,7 @@ class ADB(object):
         '''查找包含指定进程名的进程PID
         '''
         pids = []
-        process_list = self.list_process()
+        process_list = self.list_process(process_name)
         for process in process_list:
             if process['proc_name'] == process_name:
                 pids.append(process['pid'])
@@ -915,7 +1112,7 @@ class ADB(object):
     def is_process_running(self, process_name):
         '''判断进程是否存活
         '''
-        process_list = self.list_process()
+        process_list = self.list_process(process_name)
         for process in process_list:
             if process['proc_name'] == process_name:
                 return True
@@ -981,15 +1178,18 @@ class ADB(object):
         logger.debug(installed_app_list)
         return installed_app_list
 
-    def list_process(self):
+    def list_process(self, process_name=None):
         '''获取进程列表
+
+        :param str process_name: 只需要这个进程时在设备端过滤，表头含PID一并保留，结果仍需按进程名精确匹配
         '''
         # <= 7.0 用ps, >=8.0 用ps -A android8.0 api level 26
         result = None
+        patterns = ["PID", process_name] if process_name else None
         if self.get_sdk_version() < 26:
-            result = self.run_shell_cmd('ps')  # 不能使用grep
+            result = self.run_filtered_shell_cmd('ps', patterns)
         else:
-            result = self.run_shell_cmd('ps -A')  # 不能使用grep
+            result = self.run_filtered_shell_cmd('ps -A', patterns)
         result = result.replace('\r', '')
         lines = result.split('\n')
         busybox = False
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+'''
+@author:     look
+
+@copyright:  1999-2020 Alibaba.com. All rights reserved.
+
+@license:    Apache Software License 2.0
+
+@contact:    390125133@qq.com
+'''
+'''
+设备能力：sdk版本、top是否支持-b、是否有root、SurfaceFlinger --latency 和 xt_qtaguid 是否可用、能否在设备端用grep过滤输出
+以前每次测试、每个monitor都要用adb重新探测一遍，现在每台设备只探测一次，各探测命令并行执行，
+结果按 ro.build.fingerprint 缓存到 cache/capability 目录，同一系统版本的设备（包括设备农场里的其他设备）直接复用
+'''
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+BaseDir=os.path.dirname(__file__)
+sys.path.append(os.path.join(BaseDir,'../../..'))
+
+from mobileperf.common.log import logger
+from mobileperf.common.utils import FileUtils
+
+# 缓存格式变化时加1，旧缓存自动失效
+CACHE_VERSION = 2
+
+# 只跟系统版本有关的能力，按 fingerprint 缓存
+BUILD_PROBES = {
+    # 不支持时输出 Invalid argument "-b"
+    "top_b": 'top -b -n 1 -d 1',
+    # 支持时没有输出，否则输出整个 dumpsys SurfaceFlinger
+    "sf_latency": 'dumpsys SurfaceFlinger --latency-clear',
+    "xt_qtaguid": 'ls /proc/net/xt_qtaguid/stats',
+    # toybox(6.0以上)和busybox支持 grep -F -e，老版本toolbox没有grep
+    "grep": '"echo mobileperf | grep -F -e perf -e none"',
+}
+# 同一系统版本的设备也可能不同（是否刷了su），按 fingerprint + 序列号缓存
+DEVICE_PROBES = {
+    "su_root": 'su 0 id',
+}
+# adb root 每次重启adbd都会变，不缓存
+RUNTIME_PROBES = {
+    "shell_root": 'id',
+}
+
+RE_PROP = re.compile(r"^\[([^\]]+)\]: \[(.*)\]$")
+
+
+def parse_getprop(out):
+    '''解析不带参数的 getprop 输出，[ro.build.version.sdk]: [29] 这样一行一个属性
+    '''
+    props = {}
+    if not out:
+        return props
+    for line in out.splitlines():
+        match = RE_PROP.match(line.strip())
+        if match:
+            props[match.group(1)] = match.group(2)
+    return props
+
+
+def _parse_probe(name, out):
+    '''探测命令的输出转成能力值，取不到输出时按原来的默认行为处理
+    '''
+    if name == "top_b":
+        return not (out and 'Invalid argument "-b"' in out)
+    if name == "sf_latency":
+        return not out
+    if name == "xt_qtaguid":
+        return not (out and "No such file" in out)
+    if name == "grep":
+        return out == "mobileperf"
+    # su_root shell_root
+    return bool(out) and "uid=0(root)" in out
+
+
+class DeviceCapability(object):
+    '''
+    一台设备的能力，通过 adb.get_capability() 获取，同一ADB对象只探测一次，
+    各monitor通过 session.get_device 共用同一个ADB对象，也就共用同一份能力
+    '''
+    cache_dir = None
+
+    def __init__(self):
+        self.fingerprint = ""
+        self.serialnum = ""
+        self.sdk_version = None
+        self.release = ""
+        self.brand = ""
+        self.model = ""
+        self.top_b = True
+        self.sf_latency = True
+        self.xt_qtaguid = True
+        self.grep = False
+        self.su_root = False
+        self.shell_root = False
+        # 是否来自缓存，探测耗时，单位秒
+        self.cached = False
+        self.probe_time = 0
+
+    @property
+    def has_root(self):
+        return self.shell_root or self.su_root
+
+    def to_dict(self):
+        return {"fingerprint": self.fingerprint, "sdk_version": self.sdk_version, "release": self.release,
+                "brand": self.brand, "model": self.model, "top_b": self.top_b, "sf_latency": self.sf_latency,
+                "xt_qtaguid": self.xt_qtaguid, "grep": self.grep, "su_root": self.su_root, "shell_root": self.shell_root}
+
+    def __repr__(self):
+        return "DeviceCapability(%s)" % json.dumps(self.to_dict(), sort_keys=True)
+
+    @staticmethod
+    def get_cache_dir():
+        if not DeviceCapability.cache_dir:
+            DeviceCapability.cache_dir = os.path.join(FileUtils.get_top_dir(), 'cache', 'capability')
+        return DeviceCapability.cache_dir
+
+    @staticmethod
+    def cache_file(fingerprint):
+        # fingerprint 里有 / : 等字符，不能直接作为文件名
+        name = hashlib.sha1(fingerprint.encode("utf-8")).hexdigest()
+        return os.path.join(DeviceCapability.get_cache_dir(), name + ".json")
+
+    @staticmethod
+    def _read_cache(fingerprint):
+        path = DeviceCapability.cache_file(fingerprint)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception as e:
+            logger.warning("read capability cache %s failed: %s" % (path, e))
+            return None
+        if data.get("version") != CACHE_VERSION or data.get("fingerprint") != fingerprint:
+            return None
+        return data
+
+    def _write_cache(self, data):
+        path = DeviceCapability.cache_file(self.fingerprint)
+        try:
+            FileUtils.makedir(os.path.dirname(path))
+            # 设备农场里多个进程可能同时写，先写临时文件再替换
+            tmp_file = "%s.%d.tmp" % (path, os.getpid())
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=1, sort_keys=True)
+            os.replace(tmp_file, path)
+        except Exception as e:
+            logger.warning("write capability cache %s failed: %s" % (path, e))
+
+    @staticmethod
+    def _run_probes(adb, probes):
+        '''并行执行探测命令
+        :return: ({能力名: 能力值}, 是否有命令超时或异常，这时结果不可信，不写缓存)
+        '''
+        with ThreadPoolExecutor(max_workers=len(probes)) as executor:
+            futures = dict((name, executor.submit(adb.run_shell_cmd, cmd)) for name, cmd in probes.items())
+            result = {}
+            incomplete = False
+            for name, future in futures.items():
+                try:
+                    out = future.result()
+                    if getattr(out, "timed_out", False):
+                        incomplete = True
+                except Exception as e:
+                    logger.debug("capability probe %s failed: %s" % (name, e))
+                    out = ""
+                    incomplete = True
+                result[name] = _parse_probe(name, out)
+            return result, incomplete
+
+    @staticmethod
+    def load(adb, refresh=False):
+        '''
+        获取设备能力，先用一次 getprop 取到 fingerprint，缓存命中时只需再探测运行时状态
+        :param ADB adb: 设备的ADB对象
+        :param bool refresh: 为True时忽略缓存重新探测
+        :rtype: DeviceCapability
+        '''
+        begin = time.time()
+        capability = DeviceCapability()
+        capability.serialnum = adb.DEVICEID if adb.DEVICEID else ""
+        props = parse_getprop(adb.run_shell_cmd("getprop"))
+        capability.fingerprint = props.get("ro.build.fingerprint", "")
+        capability.release = props.get("ro.build.version.release", "")
+        capability.brand = props.get("ro.product.brand", "")
+        capability.model = props.get("ro.product.model", "")
+        sdk = props.get("ro.build.version.sdk", "")
+        capability.sdk_version = int(sdk) if sdk.isdigit() else None
+
+        data = None
+        use_cache = getattr(adb, "capability_cache", True)
+        if capability.fingerprint and use_cache and not refresh:
+            data = DeviceCapability._read_cache(capability.fingerprint)
+        probes = dict(RUNTIME_PROBES)
+        if data:
+            build = data.get("build", {})
+            device = data.get("devices", {}).get(capability.serialnum)
+            if not device:
+                probes.update(DEVICE_PROBES)
+                device = {}
+        else:
+            probes.update(BUILD_PROBES)
+            probes.update(DEVICE_PROBES)
+            build = {}
+            device = {}
+        result, incomplete = DeviceCapability._run_probes(adb, probes)
+        for name in BUILD_PROBES:
+            build[name] = result.get(name, build.get(name))
+        for name in DEVICE_PROBES:
+            device[name] = result.get(name, device.get(name))
+        for name, value in list(build.items()) + list(device.items()) + list(result.items()):
+            if value is not None:
+                setattr(capability, name, value)
+        capability.cached = data is not None
+        capability.probe_time = time.time() - begin
+
+        if capability.fingerprint and use_cache and not incomplete and (not data or len(probes) > len(RUNTIME_PROBES)):
+            devices = data.get("devices", {}) if data else {}
+            devices[capability.serialnum] = device
+            capability._write_cache({"version": CACHE_VERSION, "fingerprint": capability.fingerprint,
+                                     "build": build, "devices": devices})
+        adb.metrics.inc("capability_cache_hit" if capability.cached else "capability_cache_miss")
+        adb.metrics.observe("capability_probe", capability.probe_time * 1000)
+        logger.info("device %s capability (%s, %.2fs): %s" % (capability.serialnum,
+                    "cached" if capability.cached else "probed", capability.probe_time, capability))
+        return capability
+
+
+if __name__ == "__main__":
+    from mobileperf.android.tools.androiddevice import ADB
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    adb = ADB(args[0] if args else None)
+    print(adb.get_capability(refresh="--refresh" in sys.argv))
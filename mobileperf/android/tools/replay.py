@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+'''
+@author:     look
+
+@copyright:  1999-2020 Alibaba.com. All rights reserved.
+
+@license:    Apache Software License 2.0
+
+@contact:    390125133@qq.com
+'''
+'''
+adb录制回放：录制真机上adb命令的输出和耗时，回放时通过 ADB 接口返回录制的结果，不需要手机即可运行各个collector
+录制文件为jsonl格式，每行一条命令记录：
+    同步命令 {"cmd": "shell top -n 1", "t": 相对录制开始的秒数, "cost": 执行耗时秒, "out": 输出}
+    异步命令 {"cmd": "shell logcat -v threadtime -b all", "t": ..., "stream": [[相对命令启动的秒数, 一行输出], ...]}
+用法: python mobileperf/android/tools/replay.py serialnum record_file [seconds] [package]
+'''
+import os
+import sys
+import json
+import time
+import threading
+
+BaseDir=os.path.dirname(__file__)
+sys.path.append(os.path.join(BaseDir,'../../..'))
+
+from mobileperf.common.log import logger
+from mobileperf.android.tools.androiddevice import ADB, AndroidDevice
+
+
+def _cmd_key(cmd, argv):
+    '''录制文件中命令的key，不带adb路径和设备号，同一份录制可以在任意设备id下回放
+    '''
+    cmdlet = [cmd]
+    for arg in argv:
+        if not isinstance(arg, str):
+            arg = arg.decode('utf8')
+        cmdlet.append(arg)
+    return " ".join(cmdlet)
+
+
+class _TeeStdout(object):
+    '''包装异步命令的stdout，读出的内容同时记录到录制文件
+    '''
+    def __init__(self, stdout, record):
+        self._stdout = stdout
+        self._record = record
+        self._begin = time.time()
+
+    def _append(self, data):
+        if data:
+            text = data if isinstance(data, str) else data.decode("utf-8", "replace")
+            self._record["stream"].append([round(time.time() - self._begin, 4), text.rstrip("\r\n")])
+        return data
+
+    def readline(self):
+        return self._append(self._stdout.readline())
+
+    def read(self, *args):
+        # top 这类一次性读完的命令，整段输出记为一条
+        return self._append(self._stdout.read(*args))
+
+    def __getattr__(self, name):
+        return getattr(self._stdout, name)
+
+
+class RecordingADB(ADB):
+    '''录制模式的ADB：正常执行adb命令，同时把命令、输出、耗时写到录制文件
+    '''
+    def __init__(self, device_id=None, record_file=None):
+        super(RecordingADB, self).__init__(device_id)
+        self.record_file = record_file
+        self._records = []
+        self._record_lock = threading.Lock()
+        self._record_begin = time.time()
+
+    def _run_cmd_once(self, cmd, *argv, **kwds):
+        key = _cmd_key(cmd, argv)
+        begin = time.time()
+        ret = super(RecordingADB, self)._run_cmd_once(cmd, *argv, **kwds)
+        record = {"cmd": key, "t": round(begin - self._record_begin, 4)}
+        if "sync" in kwds and kwds['sync'] == False:
+            record["stream"] = []
+            ret.stdout = _TeeStdout(ret.stdout, record)
+        else:
+            record["cost"] = round(time.time() - begin, 4)
+            record["out"] = ret
+        with self._record_lock:
+            self._records.append(record)
+        return ret
+
+    def save_records(self, record_file=None):
+        '''写录制文件，异步命令的输出在命令结束后才完整，所以统一在录制结束时写
+        '''
+        record_file = record_file if record_file else self.record_file
+        with self._record_lock:
+            records = list(self._records)
+        with open(record_file, "w", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        logger.info("save %d adb records to %s" % (len(records), record_file))
+        return record_file
+
+
+class _ReplayStream(object):
+    '''回放的输出流，按录制时的节奏逐行输出
+    '''
+    def __init__(self, stream, speed, process):
+        self._stream = stream
+        self._speed = speed
+        self._process = process
+        self._index = 0
+        self._begin = time.time()
+
+    def _wait(self, offset):
+        if self._speed > 0:
+            delay = offset / self._speed - (time.time() - self._begin)
+            if delay > 0:
+                time.sleep(delay)
+
+    def _finish(self):
+        # stdout读完即视为进程退出
+        if self._process.stdout is self and self._process.returncode is None:
+            self._process.returncode = 0
+
+    def readline(self):
+        if self._process._terminated or self._index >= len(self._stream):
+            self._finish()
+            # 与真实进程退出后一样返回空，避免读线程空转
+            time.sleep(0.01)
+            return b""
+        offset, line = self._stream[self._index]
+        self._wait(offset)
+        self._index += 1
+        return (line + "\n").encode("utf-8")
+
+    def read(self, *args):
+        lines = []
+        while self._index < len(self._stream) and not self._process._terminated:
+            offset, line = self._stream[self._index]
+            self._wait(offset)
+            self._index += 1
+            lines.append(line)
+        self._finish()
+        return "\n".join(lines).encode("utf-8")
+
+    def close(self):
+        pass
+
+
+class ReplayProcess(object):
+    '''回放异步命令（top、logcat、monkey）时返回的伪Popen对象
+    '''
+    _next_pid = 100000
+
+    def __init__(self, stream, speed=1.0):
+        self._terminated = False
+        self.returncode = None
+        ReplayProcess._next_pid += 1
+        self.pid = ReplayProcess._next_pid
+        self.stdout = _ReplayStream(stream, speed, self)
+        self.stderr = _ReplayStream([], 0, self)
+
+    def poll(self):
+        return self.returncode
+
+    def terminate(self):
+        self._terminated = True
+        if self.returncode is None:
+            self.returncode = -15
+
+    kill = terminate
+
+    def wait(self, timeout=None):
+        return self.returncode
+
+
+class ReplayADB(ADB):
+    '''回放模式的ADB：不执行adb，按命令返回录制的输出
+    同一命令录制了多次时按录制顺序依次返回，用完后从头循环，使 top、dumpsys 这类周期采集的命令能一直回放下去
+    '''
+    capability_cache = False
+
+    def __init__(self, record_file, device_id="replay", speed=0, loop=True):
+        '''
+        :param str record_file: 录制文件路径
+        :param str device_id: 回放时使用的设备id
+        :param float speed: 回放速度，1为按录制时的耗时回放，0为不等待，用于测量解析的极限吞吐
+        :param bool loop: 同一命令的录制结果用完后是否循环回放
+        '''
+        # 不调用 ADB.__init__，避免查找adb路径时执行 adb devices
+        self._adb_path = "adb"
+        self._device_id = device_id
+        self._need_quote = None
+        self._logcat_handle = []
+        self._system_version = None
+        self._sdk_version = None
+        self._phone_brand = None
+        self._phone_model = None
+        self._os_name = None
+        self.before_connect = True
+        self.after_connect = True
+        self.session = None
+        self.record_file = record_file
+        self.speed = speed
+        self.loop = loop
+        self._replay_lock = threading.Lock()
+        self._records = {}
+        self._cursor = {}
+        # 统计信息，benchmark 用
+        self.cmd_count = 0
+        self.miss_count = 0
+        self.replay_cost = 0
+        self.missed_cmds = set()
+        self.load(record_file)
+
+    def load(self, record_file):
+        with open(record_file, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                record = json.loads(line)
+                # 同一命令可能既同步执行又异步执行（如 top），分开回放
+                self._records.setdefault((record["cmd"], "stream" in record), []).append(record)
+        logger.debug("load adb records for %d cmds from %s" % (len(self._records), record_file))
+
+    def _next_record(self, key, stream=False):
+        with self._replay_lock:
+            key = (key, stream)
+            records = self._records.get(key)
+            if not records:
+                return None
+            index = self._cursor.get(key, 0)
+            if index >= len(records):
+                if not self.loop:
+                    return None
+                index = 0
+            self._cursor[key] = index + 1
+            return records[index]
+
+    def _run_cmd_once(self, cmd, *argv, **kwds):
+        key = _cmd_key(cmd, argv)
+        stream = "sync" in kwds and kwds['sync'] == False
+        self.cmd_count += 1
+        record = self._next_record(key, stream)
+        if not record:
+            self.miss_count += 1
+            self.missed_cmds.add(key)
+            logger.debug("no adb record for: %s" % key)
+            if stream:
+                return ReplayProcess([], self.speed)
+            return ""
+        if stream:
+            return ReplayProcess(record["stream"], self.speed)
+        cost = record.get("cost", 0)
+        self.replay_cost += cost
+        if self.speed > 0 and cost > 0:
+            time.sleep(cost / self.speed)
+        return record.get("out", "")
+
+    @staticmethod
+    def kill_process_tree(process):
+        # 回放的进程是伪Popen，pid不对应真实进程，不能按进程组结束
+        process.kill()
+
+    def reset(self):
+        with self._replay_lock:
+            self._cursor = {}
+        self.cmd_count = 0
+        self.miss_count = 0
+        self.replay_cost = 0
+        self.missed_cmds = set()
+
+
+class ReplayDevice(AndroidDevice):
+    '''以录制文件为数据源的设备，可通过 Session.set_device 交给各monitor使用
+    '''
+    def __init__(self, record_file, device_id="replay", speed=0, loop=True):
+        self.is_local = True
+        self.adb = ReplayADB(record_file, device_id, speed, loop)
+
+
+class RecordingDevice(AndroidDevice):
+    def __init__(self, device_id=None, record_file=None):
+        self.is_local = True
+        self.adb = RecordingADB(device_id, record_file)
+
+
+def record(device_id, record_file, seconds=60, package=None, interval=1.0):
+    '''在真机上运行cpu、内存、流量、帧率、logcat采集，录制期间的adb命令
+    '''
+    from mobileperf.common.utils import TimeUtils
+    from mobileperf.android.globaldata import Session
+    from mobileperf.android.cpu_top import CpuMonitor
+    from mobileperf.android.meminfos import MemMonitor
+    from mobileperf.android.trafficstats import TrafficMonitor
+    from mobileperf.android.fps import FPSMonitor
+    from mobileperf.android.logcat import LogcatMonitor
+
+    device = RecordingDevice(device_id, record_file)
+    if not package:
+        package = device.adb.get_foreground_process()
+    start_time = TimeUtils.getCurrentTimeUnderline()
+    save_path = os.path.join(os.path.dirname(os.path.abspath(record_file)), "record_" + start_time)
+    os.makedirs(save_path)
+    session = Session(device_id=device_id, packages=[package], package_save_path=save_path,
+                      config_dic={"dumpheap_freq": 24 * 60 * 60, "pid_change_focus_package": []},
+                      start_time=start_time)
+    session.set_device(device_id, device)
+    monitors = [CpuMonitor(device_id, [package], interval, seconds, session=session),
+                MemMonitor(device_id, [package], interval, seconds, session=session),
+                TrafficMonitor(device_id, [package], interval, seconds, session=session),
+                FPSMonitor(device_id, package, interval, seconds, session=session),
+                LogcatMonitor(device_id, package, session=session)]
+    for monitor in monitors:
+        monitor.start(start_time)
+    try:
+        time.sleep(seconds)
+    except KeyboardInterrupt:
+        logger.info("record interrupted, save records")
+    for monitor in monitors:
+        try:
+            monitor.stop()
+        except Exception as e:
+            logger.error(e)
+    return device.adb.save_records()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("usage: python replay.py serialnum record_file [seconds] [package]")
+        sys.exit(1)
+    seconds = int(sys.argv[3]) if len(sys.argv) > 3 else 60
+    package = sys.argv[4] if len(sys.argv) > 4 else None
+    record(sys.argv[1], sys.argv[2], seconds, package)
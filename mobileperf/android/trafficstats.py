@@ -20,10 +20,11 @@ import traceback
 
 BaseDir=os.path.dirname(__file__)
 sys.path.append(os.path.join(BaseDir,'../..'))
-from mobileperf.android.tools.androiddevice import AndroidDevice
 from mobileperf.common.utils import TimeUtils
 from mobileperf.common.log import logger
-from mobileperf.android.globaldata import RuntimeData
+from mobileperf.common.scheduler import gap_row, command_budget
+from mobileperf.android.globaldata import Session
+from mobileperf.android.agent import DeviceAgent
 import sys
 
 
@@ -81,12 +82,23 @@ class TrafficSnapshot(object):
         self._parse()
 
 
+    @staticmethod
+    def filter_patterns(uid):
+        '''
+        设备端过滤 /proc/net/xt_qtaguid/stats 时保留的行：表头和含该uid的行，
+        保留表头是为了uid还没有流量时输出不为空，不会被当成采集失败
+        '''
+        return ["acct_tag_hex", str(uid)]
+
     def _parse(self):
         sp_lines = self.source.split('\n')
         for line in sp_lines:
             if self.uid and self.uid in line:
                 # logger.debug("     target uid : "+str(self.uid))
                 tart_list = line.split()
+                # 只比较 uid_tag_int 列，字节数等其他列里也可能含有这串数字
+                if len(tart_list) < 9 or tart_list[3] != str(self.uid):
+                    continue
                 tag = tart_list[2]
                 # logger.debug("         tag is： " +tag)
                 if tag == '0x0':#tag即acct_tag_hex这一列，默认是0，表示与这个uid关联的流量，有时候用户需要在自己的uid内添加一个其他
@@ -153,6 +165,9 @@ class NetDevInfo(object):
         rmnet_ims10:       0       0    0    0    0     0          0         0        0       0    0    0    0     0       0          0
 
     '''
+    # 设备端过滤时保留的行：表头（保证输出不为空）和 wifi、移动网络两个接口
+    FILTER_PATTERNS = ["Inter-", "wlan0:", "rmnet0:"]
+
     def __init__(self, source):
         self.source = source
         self.mobile_total = 0
@@ -194,10 +209,12 @@ class NetDevInfo(object):
         return "NetDevInfo "
 
 class TrafficCollecor(object):
-    def __init__(self, device, packages, interval=1.0,timeout=24*60 * 60, traffic_queue = None):
+    def __init__(self, device, packages, interval=1.0,timeout=24*60 * 60, traffic_queue = None, session=None):
         self.device = device
+        self.session = session if session else Session.default()
         self.packages = packages
         self._interval = interval
+        self._cmd_timeout = command_budget(interval)
         self._timeout = timeout
         self._stop_event = threading.Event()
         self.traffic_queue = traffic_queue
@@ -206,6 +223,9 @@ class TrafficCollecor(object):
         #是否首次启动，默认是
         self.traffic_init = True
         self.traffic_init_dic = {}
+        # 本次采集读取的字节数和解析耗时
+        self._tick_bytes = 0
+        self._tick_parse = 0
 
 
     def start(self,start_time):
@@ -214,31 +234,44 @@ class TrafficCollecor(object):
         self.collect_traffic_thread.start()
 
     def _cat_traffic_data(self, packagename, uid):
-        out = self.device.adb.run_shell_cmd("cat /proc/net/xt_qtaguid/stats")
+        out = self.device.adb.run_filtered_shell_cmd("cat /proc/net/xt_qtaguid/stats", TrafficSnapshot.filter_patterns(uid),
+                                                     timeout=self._cmd_timeout)
         out.replace('\r', '')
-        return TrafficSnapshot(out, packagename, uid)
+        before = time.time()
+        traffic_snapshot = TrafficSnapshot(out, packagename, uid)
+        self.session.metrics.record_parse("traffic_uid", len(out), time.time() - before)
+        return traffic_snapshot
+
+    def _parse_net_dev(self, out):
+        before = time.time()
+        net_info = NetDevInfo(out)
+        self._tick_parse = self._tick_parse + time.time() - before
+        self._tick_bytes = self._tick_bytes + len(out)
+        return net_info
 
     def _cat_traffic_device_dev(self):
-        out = self.device.adb.run_shell_cmd("cat /proc/net/dev")
+        out = self.device.adb.run_filtered_shell_cmd("cat /proc/net/dev", NetDevInfo.FILTER_PATTERNS,
+                                                     timeout=self._cmd_timeout)
         # traffic_file = os.path.join(RuntimeData.package_save_path, 'traffic.txt')
         # with open(traffic_file, "a+", encoding="utf-8") as writer:
         #     writer.write(TimeUtils.getCurrentTime() + " cat /proc/net/dev info:\n")
         #     writer.write(out + "\n\n")
         out.replace('\r', '')
-        return NetDevInfo(out)
+        return self._parse_net_dev(out)
 
     def _cat_traffic_pid_dev(self,pid):
-        out = self.device.adb.run_shell_cmd("cat /proc/%d/net/dev"%pid)
+        out = self.device.adb.run_filtered_shell_cmd("cat /proc/%d/net/dev"%pid, NetDevInfo.FILTER_PATTERNS,
+                                                     timeout=self._cmd_timeout)
         # traffic_file = os.path.join(RuntimeData.package_save_path, 'traffic.txt')
         # with open(traffic_file, "a+", encoding="utf-8") as writer:
         #     writer.write(TimeUtils.getCurrentTime() + " cat /proc/"+str(pid)+"/net/dev info:\n")
         #     writer.write(out + "\n\n")
         out.replace('\r', '')
-        return NetDevInfo(out)
+        return self._parse_net_dev(out)
 
     def _collect_traffic_thread(self,start_time):
-        # < android10 用/proc/net/xt_qtaguid/stats 获取uid 流量，Android10 找不到该文件
-        if self.sdk_version < 29:
+        # < android10 用/proc/net/xt_qtaguid/stats 获取uid 流量，Android10 找不到该文件，部分低版本的rom也没有
+        if self.sdk_version < 29 and self.device.adb.get_capability().xt_qtaguid:
             self.get_traffic_with_stats()
         else:
             # android 10 用 /proc/net/dev  /proc/pid/net/dev 获取整机 pid wifi流量
@@ -250,7 +283,7 @@ class TrafficCollecor(object):
         traffic_list_title = (
         "datetime", "packagename", "uid", "uid_total(KB)", "uid_total_packets", "rx(KB)", "rx_packets", "tx(KB)",
         "tx_packets", "fg(KB)", "bg(KB)", "lo(KB)")
-        traffic_file = os.path.join(RuntimeData.package_save_path, 'traffics_uid.csv')
+        traffic_file = os.path.join(self.session.package_save_path, 'traffics_uid.csv')
         try:
             with open(traffic_file, 'a+') as df:
                 csv.writer(df, lineterminator='\n').writerow(traffic_list_title)
@@ -260,14 +293,22 @@ class TrafficCollecor(object):
         except RuntimeError as e:
             logger.error(e)
 
+        ticker = self.session.ticker("traffic_uid", self._interval, self._stop_event)
         while not self._stop_event.is_set() and time.time() < end_time:
             try:
+                collection_time = ticker.next()
+                if collection_time is None:
+                    break
                 before = time.time()
                 logger.debug("----------------- into _collect_traffic_thread loop thread is : " + str(
                     threading.current_thread().name) + ", current uid is : " + str(uid))
                 traffic_snapshot = self._cat_traffic_data(self.packages[0], uid)
 
                 if traffic_snapshot.source == '' or traffic_snapshot.source == None:
+                    # 获取不到值的时候退避后再试，数据从这里断开时写入断点
+                    if ticker.fail("can't get uid traffic", self.device.adb.is_offline()):
+                        with open(traffic_file, 'a+', encoding="utf-8") as f:
+                            csv.writer(f, lineterminator='\n').writerow(gap_row(collection_time, len(traffic_list_title)))
                     continue  # 获取不到值的时候，直接不执行下面的代码了，缺一个
                     # retry_count = retry_count - 1
                     # if retry_count <= 0:
@@ -279,7 +320,6 @@ class TrafficCollecor(object):
                     self.traffic_init = False
                 traffic_snapshot = self.get_data_from_threadstart(traffic_snapshot)
 
-                collection_time = time.time()
                 logger.debug(" collection time in traffic is : " + str(collection_time))
                 traffic_list_temp = [collection_time, traffic_snapshot.packagename, traffic_snapshot.uid,
                                      TrafficUtils.byte2kb(traffic_snapshot.total_uid_bytes),
@@ -302,14 +342,12 @@ class TrafficCollecor(object):
                             writer.writerow(traffic_list_temp)
                     except RuntimeError as e:
                         logger.error(e)
+                self.session.emit("traffics_uid", collection_time, traffic_list_title, traffic_list_temp)
+                ticker.ok()
 
                 after = time.time()
                 time_consume = after - before
                 logger.debug(" -----------traffic timeconsumed: " + str(time_consume))
-                # 校准时间，由于执行命令行需要耗时，需要将这个损耗加上去
-                delta_inter = self._interval - time_consume
-                if delta_inter > 0:
-                    time.sleep(delta_inter)
             except RuntimeError as e:
                 logger.error(" trafficstats RuntimeError ")
                 logger.error(e)
@@ -317,13 +355,14 @@ class TrafficCollecor(object):
                 logger.error("an exception hanpend in traffic thread , reason unkown! e: ")
                 s = traceback.format_exc()
                 logger.debug(s)
+                ticker.fail(str(e), self.device.adb.is_offline())
                 if self.traffic_queue:
                     self.traffic_queue.task_done()
 
     def get_traffic_with_dev(self):
         end_time = time.time() + self._timeout
         traffic_title = ["datetime", "device_total(KB)", "device_receive(KB)", "device_transport(KB)"]
-        traffic_file = os.path.join(RuntimeData.package_save_path, 'traffic.csv')
+        traffic_file = os.path.join(self.session.package_save_path, 'traffic.csv')
         for i in range(0, len(self.packages)):
             traffic_title.extend(["package", "pid", "pid_rx(KB)","pid_tx(KB)","pid_total(KB)"])
         if len(self.packages) > 1:
@@ -334,43 +373,58 @@ class TrafficCollecor(object):
         except RuntimeError as e:
             logger.error(e)
         self.device_init_net = None
-        self.pck_init_net_list = []
+        self.pck_init_net = {}
+        if DeviceAgent.enabled(self.session):
+            self._collect_traffic_from_agent(traffic_file, traffic_title, end_time)
+            return
+        ticker = self.session.ticker("traffic", self._interval, self._stop_event)
         while not self._stop_event.is_set() and time.time() < end_time:
             try:
+                collection_time = ticker.next()
+                if collection_time is None:
+                    break
                 before = time.time()
                 logger.debug("--------- into _collect_traffic_thread loop thread is : " + str(threading.current_thread().name))
+                self._tick_bytes = 0
+                self._tick_parse = 0
                 device_cur_net = self._cat_traffic_device_dev()
 
                 if device_cur_net.source == '' or device_cur_net.source == None:
+                    if ticker.fail("can't get net dev", self.device.adb.is_offline()):
+                        with open(traffic_file, 'a+', encoding="utf-8") as f:
+                            csv.writer(f, lineterminator='\n').writerow(gap_row(collection_time, len(traffic_title)))
                     continue
 
                 if self.traffic_init:
                     self.device_init_net = device_cur_net
-                    # self.traffic_init = False
+                    self.traffic_init = False
                 device_grow = self.get_net_from_begin(self.device_init_net,device_cur_net)
-                collection_time = time.time()
                 logger.debug(" collection time in traffic is : " + str(collection_time))
                 net_row = [collection_time, TrafficUtils.byte2kb(device_grow.total),
                            TrafficUtils.byte2kb(device_grow.rx),
                            TrafficUtils.byte2kb(device_grow.tx)]
                 self.total_pck_net = 0
-                for i in range(0, len(self.packages)):
-                    pid = self.device.adb.get_pid_from_pck(self.packages[i])
+                for package in self.packages:
+                    pid = self.device.adb.get_pid_from_pck(package)
+                    # 进程不在时这个包的列留空，保持列对齐，不算采集失败
+                    if pid is None:
+                        net_row.extend([package, "", "", "", ""])
+                        continue
                     pck_net_info = self._cat_traffic_pid_dev(pid)
                     if not pck_net_info.source:
-                        logger.error("package net dev failed %s:"%self.packages[i])
+                        logger.error("package net dev failed %s:"%package)
+                        net_row.extend([package, pid, "", "", ""])
                         continue
-                    if self.traffic_init:
-                        self.pck_init_net_list.append(pck_net_info)
-                        if i == len(self.packages)-1:
-                            self.traffic_init = False
-                    pck_grow = self.get_net_from_begin(self.pck_init_net_list[i],pck_net_info)
+                    if package not in self.pck_init_net:
+                        self.pck_init_net[package] = pck_net_info
+                    pck_grow = self.get_net_from_begin(self.pck_init_net[package],pck_net_info)
                     self.total_pck_net = self.total_pck_net + pck_grow.wifi_total
-                    net_row.extend([self.packages[i],pid,TrafficUtils.byte2kb(pck_grow.rx),
+                    net_row.extend([package,pid,TrafficUtils.byte2kb(pck_grow.rx),
                                     TrafficUtils.byte2kb(pck_grow.tx),TrafficUtils.byte2kb(pck_grow.total)])
 
                 if len(self.packages)>1:
                     net_row.append(TrafficUtils.byte2kb(self.total_pck_net))
+                self.session.metrics.record_parse("traffic", self._tick_bytes, self._tick_parse)
 
                 if self.traffic_queue:
                     self.traffic_queue.put(net_row)
@@ -382,14 +436,12 @@ class TrafficCollecor(object):
                             writer.writerow(net_row)
                     except RuntimeError as e:
                         logger.error(e)
+                self.session.emit("traffic", collection_time, traffic_title, net_row)
+                ticker.ok()
                 logger.debug(net_row)
                 after = time.time()
                 time_consume = after - before
                 logger.debug(" -----------traffic timeconsumed: " + str(time_consume))
-                # 校准时间，由于执行命令行需要耗时，需要将这个损耗加上去
-                delta_inter = self._interval - time_consume
-                if delta_inter > 0:
-                    time.sleep(delta_inter)
             except RuntimeError as e:
                 logger.error(" trafficstats RuntimeError ")
                 logger.error(e)
@@ -397,9 +449,61 @@ class TrafficCollecor(object):
                 logger.error("an exception hanpend in traffic thread , reason unkown! e: ")
                 s = traceback.format_exc()
                 logger.debug(s)
+                ticker.fail(str(e), self.device.adb.is_offline())
                 if self.traffic_queue:
                     self.traffic_queue.task_done()
 
+    def _collect_traffic_from_agent(self, traffic_file, traffic_title, end_time):
+        '''
+        设备端agent模式，/proc/net/dev 和 /proc/<pid>/net/dev 由agent采集，每个样本写一行
+        '''
+        agent = DeviceAgent.get(self.device, self.session, self._interval)
+        pck_init_net = {}
+
+        def on_samples(samples):
+            rows = []
+            for sample in samples:
+                if not sample.net:
+                    continue
+                device_cur_net = NetDevInfo(sample.net_dev())
+                if self.device_init_net is None:
+                    self.device_init_net = device_cur_net
+                device_grow = self.get_net_from_begin(self.device_init_net, device_cur_net)
+                net_row = [sample.timestamp, TrafficUtils.byte2kb(device_grow.total),
+                           TrafficUtils.byte2kb(device_grow.rx),
+                           TrafficUtils.byte2kb(device_grow.tx)]
+                total_pck_net = 0
+                for package in self.packages:
+                    pid_net = sample.pid_net.get(package)
+                    if not pid_net:
+                        net_row.extend([package, "", "", "", ""])
+                        continue
+                    pck_net_info = NetDevInfo(sample.pid_net_dev(package))
+                    if package not in pck_init_net:
+                        pck_init_net[package] = pck_net_info
+                    pck_grow = self.get_net_from_begin(pck_init_net[package], pck_net_info)
+                    total_pck_net = total_pck_net + pck_grow.total
+                    net_row.extend([package, pid_net[0][0], TrafficUtils.byte2kb(pck_grow.rx),
+                                    TrafficUtils.byte2kb(pck_grow.tx), TrafficUtils.byte2kb(pck_grow.total)])
+                if len(self.packages) > 1:
+                    net_row.append(TrafficUtils.byte2kb(total_pck_net))
+                if self.traffic_queue:
+                    self.traffic_queue.put(net_row)
+                else:
+                    net_row[0] = TimeUtils.formatTimeStamp(net_row[0])
+                    rows.append(net_row)
+                self.session.emit("traffic", sample.timestamp, traffic_title, net_row)
+            if rows:
+                with open(traffic_file, 'a+', encoding="utf-8") as f:
+                    csv.writer(f, lineterminator='\n').writerows(rows)
+
+        def on_gap(collection_time):
+            with open(traffic_file, 'a+', encoding="utf-8") as f:
+                csv.writer(f, lineterminator='\n').writerow(gap_row(collection_time, len(traffic_title)))
+
+        agent.collect("traffic", self._interval, self._stop_event, end_time, on_samples, on_gap)
+        logger.debug("traffic agent collect stop")
+
     def get_traffic_init_data(self,traffic_snapshot):
         #将首次启动的流量的相关的数据存放在字典中，以便将流量的起始点定位这个线
         # 程启动的时候（我们现在从手机中抓出来的数据是从手机开机作为起始点来算的）
@@ -450,17 +554,18 @@ class TrafficCollecor(object):
                 self.traffic_queue.task_done()
 
 class TrafficMonitor(object):
-    def __init__(self, device_id, packages, interval = 1.0, timeout=10 * 60, traffic_queue = None):
-        self.device = AndroidDevice(device_id)
+    def __init__(self, device_id, packages, interval = 1.0, timeout=10 * 60, traffic_queue = None, session=None):
+        self.session = session if session else Session.default()
+        self.device = self.session.get_device(device_id)
         self.stop_event = threading.Event()
         self.packages = packages
-        self.traffic_colloctor = TrafficCollecor(self.device, self.packages, interval, timeout, traffic_queue)
+        self.traffic_colloctor = TrafficCollecor(self.device, self.packages, interval, timeout, traffic_queue, self.session)
 
     def start(self,start_time):
-        if not RuntimeData.package_save_path:
-            RuntimeData.package_save_path = os.path.join(os.path.abspath(os.path.join(os.getcwd(), "../..")),'results', self.packages[0], start_time)
-            if not os.path.exists(RuntimeData.package_save_path):
-                os.makedirs(RuntimeData.package_save_path)
+        if not self.session.package_save_path:
+            self.session.package_save_path = os.path.join(os.path.abspath(os.path.join(os.getcwd(), "../..")),'results', self.packages[0], start_time)
+            if not os.path.exists(self.session.package_save_path):
+                os.makedirs(self.session.package_save_path)
         self.start_time = start_time
         self.traffic_colloctor.start(start_time)
         logger.debug("INFO: TrafficMonitor has started...")
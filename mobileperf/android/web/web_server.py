@@ -10,6 +10,7 @@ import time
 import socket
 import subprocess
 import platform
+import csv
 from datetime import datetime
 
 BaseDir = os.path.dirname(__file__)
@@ -330,6 +331,24 @@ class MobilePerfWebServer:
                 logger.warning(f"Failed to get info for xlsx file {f}: {e}")
         return info
     
+    def get_metric_summary(self, test_path, headline=False):
+        """读取采集时流式统计的 metric_summary.csv，headline 只取应用cpu、pss和帧率用于结果列表"""
+        summary_file = os.path.join(test_path, 'metric_summary.csv')
+        if not os.path.exists(summary_file):
+            return []
+        rows = []
+        try:
+            with open(summary_file, 'r', encoding='utf-8') as f:
+                for row in csv.DictReader(f):
+                    column = row['column'].split(':')[-1]
+                    if headline and not (row['metric'] in ('cpuinfo', 'meminfo', 'fps') and
+                                         column in ('pid_cpu%', 'pid_pss(MB)', 'fps')):
+                        continue
+                    rows.append(row)
+        except Exception as e:
+            logger.warning(f"Failed to read metric summary {summary_file}: {e}")
+        return rows
+    
     def setup_routes(self):
         """设置路由"""
         
@@ -571,6 +590,94 @@ class MobilePerfWebServer:
             
             return jsonify(result)
         
+        @self.app.route('/api/farm/status')
+        def api_farm_status():
+            """API: 获取多设备调度的汇总状态"""
+            if RuntimeData.top_dir is None:
+                from mobileperf.common.utils import FileUtils
+                RuntimeData.top_dir = FileUtils.get_top_dir()
+            status_file = os.path.join(RuntimeData.top_dir, 'results', 'device_farm_status.json')
+            if not os.path.exists(status_file):
+                return jsonify({'summary': {}, 'sessions': []})
+            try:
+                import json
+                with open(status_file, 'r', encoding='utf-8') as f:
+                    return jsonify(json.load(f))
+            except Exception as e:
+                logger.warning(f"Failed to read device farm status: {e}")
+                return jsonify({'error': str(e)}), 500
+        
+        @self.app.route('/api/tool_metrics/<package>/<timestamp>')
+        def api_tool_metrics(package, timestamp):
+            """API: 获取测试工具自身的开销指标（adb耗时、采集循环耗时、错过周期次数、PC端cpu/内存）"""
+            if RuntimeData.top_dir is None:
+                from mobileperf.common.utils import FileUtils
+                RuntimeData.top_dir = FileUtils.get_top_dir()
+            metrics_file = os.path.join(RuntimeData.top_dir, 'results', package, timestamp, 'tool_metrics.json')
+            if not os.path.exists(metrics_file):
+                return jsonify({'counters': {}, 'gauges': {}, 'histograms': {}})
+            try:
+                import json
+                with open(metrics_file, 'r', encoding='utf-8') as f:
+                    return jsonify(json.load(f))
+            except Exception as e:
+                logger.warning(f"Failed to read tool metrics: {e}")
+                return jsonify({'error': str(e)}), 500
+        
+        @self.app.route('/api/metric_summary/<package>/<timestamp>')
+        def api_metric_summary(package, timestamp):
+            """API: 各列数据的 count/min/mean/stdev/p50/p95/p99/max，采集时流式计算，不需要重新读csv"""
+            if RuntimeData.top_dir is None:
+                from mobileperf.common.utils import FileUtils
+                RuntimeData.top_dir = FileUtils.get_top_dir()
+            test_path = os.path.join(RuntimeData.top_dir, 'results', package, timestamp)
+            return jsonify(self.get_metric_summary(test_path))
+        
+        @self.app.route('/api/compare/<package>')
+        def api_compare(package):
+            """API: 版本对比，runs 为逗号分隔的时间戳目录，第一个是基线，如 ?runs=ts1,ts2&threshold=0.1&alpha=0.05"""
+            runs = [run for run in request.args.get('runs', '').split(',') if run]
+            if len(runs) < 2:
+                return jsonify({'error': 'need at least 2 runs'}), 400
+            try:
+                from mobileperf.android.compare import RunComparator, resolve_run_dir, COMPARE_TITLE
+                run_dirs = [resolve_run_dir(run, package) for run in runs]
+                metrics = request.args.get('metrics')
+                comparator = RunComparator([run_dirs[0]], [[run_dir] for run_dir in run_dirs[1:]],
+                                           float(request.args.get('threshold', 0.1)),
+                                           float(request.args.get('alpha', 0.05)),
+                                           metrics.split(',') if metrics else None)
+                rows = comparator.compare()
+                return jsonify({'title': COMPARE_TITLE, 'rows': [dict(zip(COMPARE_TITLE, row)) for row in rows],
+                                'regressions': len(RunComparator.regressions(rows))})
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 404
+            except Exception as e:
+                logger.warning(f"Failed to compare runs: {e}")
+                return jsonify({'error': str(e)}), 500
+        
+        @self.app.route('/api/activity_summary/<package>/<timestamp>')
+        def api_activity_summary(package, timestamp):
+            """API: 按前台页面汇总的cpu、pss、帧率、卡顿率和流量，老的结果目录没有汇总文件时现场计算"""
+            if RuntimeData.top_dir is None:
+                from mobileperf.common.utils import FileUtils
+                RuntimeData.top_dir = FileUtils.get_top_dir()
+            result_dir = os.path.join(RuntimeData.top_dir, 'results', package, timestamp)
+            if not os.path.isdir(result_dir):
+                return jsonify({'error': 'result not found'}), 404
+            summary_file = os.path.join(result_dir, 'activity_summary.json')
+            try:
+                import json
+                if os.path.exists(summary_file):
+                    with open(summary_file, 'r', encoding='utf-8') as f:
+                        return jsonify(json.load(f))
+                from mobileperf.android.attribution import ActivityAttribution, SUMMARY_TITLE
+                rows = ActivityAttribution(result_dir).summarize()
+                return jsonify({'title': SUMMARY_TITLE, 'activities': [dict(zip(SUMMARY_TITLE, row)) for row in rows]})
+            except Exception as e:
+                logger.warning(f"Failed to get activity summary: {e}")
+                return jsonify({'error': str(e)}), 500
+        
         @self.app.route('/api/config', methods=['GET'])
         def api_get_config():
             """API: 获取配置文件内容"""
@@ -885,7 +992,8 @@ class MobilePerfWebServer:
                 
                 # 获取测试时间
                 try:
-                    test_time = datetime.strptime(timestamp, '%Y_%m_%d_%H_%M_%S')
+                    # 多设备调度时目录名带设备序列号后缀，如 2020_02_13_22_58_14_9e15838
+                    test_time = datetime.strptime(timestamp[:19], '%Y_%m_%d_%H_%M_%S')
                 except:
                     test_time = datetime.fromtimestamp(os.path.getmtime(test_path))
                 
@@ -896,7 +1004,8 @@ class MobilePerfWebServer:
                     'has_exception': has_exception,
                     'has_logcat': has_logcat,
                     'has_report': has_report,
-                    'exception_contains_package': exception_contains_package  # 新增字段
+                    'exception_contains_package': exception_contains_package,  # 新增字段
+                    'summary': self.get_metric_summary(test_path, headline=True)
                 })
         
         # 按时间倒序排序
@@ -0,0 +1,4 @@
+# -*- coding: utf-8 -*-
+'''
+mobileperf自身的性能基准测试，基于录制的adb数据回放，不需要手机
+'''
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+'''
+@author:     look
+
+@copyright:  1999-2020 Alibaba.com. All rights reserved.
+
+@license:    Apache Software License 2.0
+
+@contact:    390125133@qq.com
+'''
+'''
+collector基准测试：用录制的adb数据回放，逐个运行各collector，统计PC端cpu耗时、单次采集延迟和吞吐
+'''
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import threading
+
+BaseDir=os.path.dirname(__file__)
+sys.path.append(os.path.join(BaseDir,'../..'))
+
+from mobileperf.common.log import logger
+from mobileperf.common.utils import TimeUtils
+from mobileperf.android.globaldata import Session
+from mobileperf.android.tools.replay import ReplayDevice
+
+USAGE = '''用法: python mobileperf/benchmark/collector_bench.py record_file [--package 包名] [--duration 秒]
+        [--interval 采集间隔] [--record-interval 录制时的采集间隔] [--speed 回放速度] [--output 结果json]
+        [--collectors cpu,mem,traffic,fps,logcat]
+不带手机时可以用 make_fixtures.py 生成的合成录制 mobileperf/benchmark/fixtures/replay/sdk30_session.jsonl（包名 com.taobao.taobao）
+有collector没有采集到数据时返回1'''
+
+DEVICE_ID = "replay"
+
+
+def _percentile(values, percent):
+    if not values:
+        return 0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(percent / 100.0 * (len(values) - 1))))
+    return values[index]
+
+
+def _set_interval(collector, interval):
+    '''录制的命令里带有采集间隔（如 top -d 1），monitor 需按录制时的间隔创建才能匹配上录制数据，
+    创建后再把collector的等待间隔改小，测量极限吞吐
+    '''
+    for attr in ("_interval", "frequency"):
+        if hasattr(collector, attr):
+            setattr(collector, attr, interval)
+
+
+def _cpu(session, package, record_interval, duration):
+    from mobileperf.android.cpu_top import CpuMonitor
+    monitor = CpuMonitor(DEVICE_ID, [package], record_interval, duration, session=session)
+    return monitor, monitor.cpu_collector
+
+
+def _mem(session, package, record_interval, duration):
+    from mobileperf.android.meminfos import MemMonitor
+    monitor = MemMonitor(DEVICE_ID, [package], record_interval, duration, session=session)
+    return monitor, monitor.meminfo_package_collector
+
+
+def _traffic(session, package, record_interval, duration):
+    from mobileperf.android.trafficstats import TrafficMonitor
+    monitor = TrafficMonitor(DEVICE_ID, [package], record_interval, duration, session=session)
+    return monitor, monitor.traffic_colloctor
+
+
+def _fps(session, package, record_interval, duration):
+    from mobileperf.android.fps import FPSMonitor
+    monitor = FPSMonitor(DEVICE_ID, package, record_interval, duration, session=session)
+    return monitor, monitor.fpscollector
+
+
+def _logcat(session, package, record_interval, duration):
+    from mobileperf.android.logcat import LogcatMonitor
+    monitor = LogcatMonitor(DEVICE_ID, package, session=session)
+    return monitor, None
+
+
+COLLECTORS = [("cpu", _cpu), ("mem", _mem), ("traffic", _traffic), ("fps", _fps), ("logcat", _logcat)]
+
+
+class BenchResult(object):
+    def __init__(self, name):
+        self.name = name
+        self.samples = 0
+        self.wall_time = 0
+        self.cpu_time = 0
+        self.adb_cmds = 0
+        self.adb_miss = 0
+        self.replay_cost = 0
+        self.gaps = []
+
+    def to_dict(self):
+        samples = self.samples if self.samples else 1
+        return {"collector": self.name,
+                "samples": self.samples,
+                "wall_time(s)": round(self.wall_time, 3),
+                "throughput(samples/s)": round(self.samples / self.wall_time, 2) if self.wall_time else 0,
+                "host_cpu(s)": round(self.cpu_time, 4),
+                "host_cpu_per_sample(ms)": round(self.cpu_time * 1000 / samples, 3),
+                "latency_avg(ms)": round(sum(self.gaps) * 1000 / len(self.gaps), 3) if self.gaps else 0,
+                "latency_p50(ms)": round(_percentile(self.gaps, 50) * 1000, 3),
+                "latency_p95(ms)": round(_percentile(self.gaps, 95) * 1000, 3),
+                "adb_cmds": self.adb_cmds,
+                "adb_miss": self.adb_miss,
+                "recorded_adb_cost(s)": round(self.replay_cost, 3)}
+
+
+class CollectorBench(object):
+    '''
+    每个collector单独运行 duration 秒，期间PC进程的cpu时间都记到这个collector上
+    latency 是相邻两条数据的间隔，interval为0时即单次采集+解析+写文件的耗时
+    '''
+    def __init__(self, record_file, package=None, duration=5, interval=0, record_interval=1, speed=0):
+        '''
+        :param str record_file: replay.py 录制的文件
+        :param str package: 录制时测试的包名，为空时取录制数据中的前台进程
+        :param float duration: 每个collector运行的时长，单位秒
+        :param float interval: 回放时的采集间隔，0表示采完立即采下一次
+        :param float record_interval: 录制时的采集间隔，用于匹配录制的命令
+        :param float speed: 回放速度，0为不等待录制时的adb耗时
+        '''
+        self.record_file = record_file
+        self.package = package
+        self.duration = duration
+        self.interval = interval
+        self.record_interval = record_interval
+        self.speed = speed
+        self.results = []
+
+    def _new_session(self, save_path):
+        session = Session(device_id=DEVICE_ID, package_save_path=save_path,
+                          config_dic={"dumpheap_freq": 24 * 60 * 60, "pid_change_focus_package": []},
+                          start_time=TimeUtils.getCurrentTimeUnderline())
+        device = ReplayDevice(self.record_file, DEVICE_ID, self.speed)
+        session.set_device(DEVICE_ID, device)
+        if not self.package:
+            self.package = device.adb.get_foreground_process()
+        session.packages = [self.package]
+        return session, device
+
+    def run_one(self, name, factory):
+        save_path = tempfile.mkdtemp(prefix="mobileperf_bench_%s_" % name)
+        result = BenchResult(name)
+        last_emit = [None]
+        lock = threading.Lock()
+
+        def on_sample(*args):
+            now = time.perf_counter()
+            with lock:
+                if last_emit[0] is not None:
+                    result.gaps.append(now - last_emit[0])
+                last_emit[0] = now
+                result.samples += 1
+
+        try:
+            session, device = self._new_session(save_path)
+            session.add_sink(lambda metric, timestamp, title, row: on_sample())
+            monitor, collector = factory(session, self.package, self.record_interval, self.duration + 10)
+            if collector:
+                _set_interval(collector, self.interval)
+            else:
+                # logcat没有采集间隔，按处理的日志行数统计
+                monitor.add_log_handle(lambda line: on_sample())
+            device.adb.reset()
+            cpu_begin = time.process_time()
+            wall_begin = time.perf_counter()
+            monitor.start(session.start_time)
+            time.sleep(self.duration)
+            monitor.stop()
+            result.wall_time = time.perf_counter() - wall_begin
+            result.cpu_time = time.process_time() - cpu_begin
+            result.adb_cmds = device.adb.cmd_count
+            result.adb_miss = device.adb.miss_count
+            result.replay_cost = device.adb.replay_cost
+            if device.adb.missed_cmds:
+                logger.debug("%s bench, cmds not in record: %s" % (name, sorted(device.adb.missed_cmds)))
+        except Exception as e:
+            logger.error("%s bench failed: %s" % (name, e))
+        finally:
+            shutil.rmtree(save_path, ignore_errors=True)
+        return result
+
+    def run(self, names=None):
+        self.results = []
+        for name, factory in COLLECTORS:
+            if names and name not in names:
+                continue
+            logger.info("bench collector: %s" % name)
+            self.results.append(self.run_one(name, factory))
+        return [result.to_dict() for result in self.results]
+
+    @staticmethod
+    def format_table(rows):
+        if not rows:
+            return ""
+        columns = list(rows[0].keys())
+        widths = [max(len(col), max(len(str(row[col])) for row in rows)) for col in columns]
+        lines = ["  ".join(col.ljust(w) for col, w in zip(columns, widths))]
+        for row in rows:
+            lines.append("  ".join(str(row[col]).ljust(w) for col, w in zip(columns, widths)))
+        return "\n".join(lines)
+
+
+def main(argv):
+    options = {"--package": None, "--duration": "5", "--interval": "0", "--record-interval": "1",
+               "--speed": "0", "--output": None, "--collectors": None}
+    record_file = None
+    i = 0
+    while i < len(argv):
+        if argv[i] in options and i + 1 < len(argv):
+            options[argv[i]] = argv[i + 1]
+            i += 1
+        elif argv[i].startswith("-") or record_file:
+            # 未知选项、缺少值的选项和多余的参数都不能当成录制文件
+            print(USAGE)
+            return 2
+        else:
+            record_file = argv[i]
+        i += 1
+    names = options["--collectors"].split(",") if options["--collectors"] else None
+    if not record_file or (names and set(names) - set(name for name, _ in COLLECTORS)):
+        print(USAGE)
+        return 2
+    if not os.path.isfile(record_file):
+        print("record file not found: %s" % record_file)
+        return 2
+    bench = CollectorBench(record_file, options["--package"], float(options["--duration"]),
+                           float(options["--interval"]), float(options["--record-interval"]),
+                           float(options["--speed"]))
+    rows = bench.run(names)
+    print(CollectorBench.format_table(rows))
+    if options["--output"]:
+        with open(options["--output"], "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=2)
+    # 录制里没有这个collector的命令或回放出错时全是0，不能当作通过
+    empty = [row["collector"] for row in rows if not row["samples"]]
+    if empty:
+        print("no samples from: %s" % ",".join(empty))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
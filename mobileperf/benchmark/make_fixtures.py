@@ -0,0 +1,969 @@
+# -*- coding: utf-8 -*-
+'''
+@author:     look
+
+@copyright:  1999-2020 Alibaba.com. All rights reserved.
+
+@license:    Apache Software License 2.0
+
+@contact:    390125133@qq.com
+'''
+'''
+生成 parser_bench 用的合成fixtures：top、dumpsys meminfo（整机和测试包）、/proc/net/xt_qtaguid/stats
+以及 collector_bench 用的合成录制 replay/sdk30_session.jsonl（同一台模拟设备上前台测试包的几次采集）
+注意：这些不是真机的输出。每个sdk按固定随机种子模拟一台设备的进程表，再按该版本的输出格式打印，
+所以只覆盖了各版本的格式差异（toolbox/toybox top、kB/K/swap列/RSS段在前的meminfo等），不能当作sdk19-34真机覆盖，
+有设备时应该用 mobileperf/android/tools/replay.py 录制的输出替换。
+模拟的设备保证文件内的数值自洽，golden 可以按进程表手工核对：
+1. 每个进程的用户固定，测试包是 u0_a123（uid 10123），内核线程没有内存，VIRT >= RES >= SHR
+2. top 的 Tasks 数等于进程行数，各进程cpu之和与整机的 user+nice+sys 一致
+3. meminfo 中按进程、按oom分组、按类别的PSS合计一致，Free/Used/Lost RAM 加 ZRAM 等于 Total RAM
+4. 单个包的 meminfo TOTAL 等于各行之和（N以上加上 SwapPss），App Summary 之和等于 TOTAL
+5. xt_qtaguid 每行 rx/tx 等于 tcp+udp+other，带tag的行不超过同uid的 0x0 行
+'''
+import os
+import sys
+import json
+import random
+
+BaseDir=os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BaseDir,'../..'))
+
+from mobileperf.common.log import logger
+
+USAGE = '''用法: python mobileperf/benchmark/make_fixtures.py [--output fixtures目录]
+生成后需要手工核对解析结果，再执行 parser_bench.py --update-golden --update-baseline'''
+
+FIXTURE_DIR = os.path.join(BaseDir, "fixtures")
+
+PACKAGE = "com.taobao.taobao"
+APP_UID = 10123
+
+# sdk: (cpu核数, 内存kB, 进程数, 64位)
+DEVICES = {19: (4, 1897212, 192, False),
+           23: (8, 2857340, 263, True),
+           24: (8, 2857340, 298, True),
+           25: (8, 3844384, 317, True),
+           26: (8, 3755052, 431, True),
+           28: (8, 5755052, 478, True),
+           29: (8, 5755052, 526, True),
+           30: (8, 7677856, 563, True),
+           34: (8, 7677856, 641, True)}
+
+# 本地进程：(cmdline, 用户, 最低sdk, 最高sdk, pss范围kB)
+NATIVES = [("/init", "root", 19, 99, (900, 2600)),
+           ("/sbin/ueventd", "root", 19, 28, (300, 900)),
+           ("/system/bin/ueventd", "root", 29, 99, (600, 1500)),
+           ("/system/bin/logd", "logd", 19, 99, (2500, 9000)),
+           ("/system/bin/servicemanager", "system", 19, 99, (300, 1200)),
+           ("/system/bin/hwservicemanager", "system", 26, 99, (500, 1400)),
+           ("/system/bin/vold", "root", 19, 99, (1200, 4000)),
+           ("/system/bin/healthd", "root", 19, 27, (300, 900)),
+           ("/vendor/bin/hw/android.hardware.health@2.0-service", "system", 28, 99, (600, 1600)),
+           ("/system/bin/lmkd", "root", 19, 28, (300, 900)),
+           ("/system/bin/lmkd", "lmkd", 29, 99, (600, 1500)),
+           ("/system/bin/surfaceflinger", "system", 19, 99, (18000, 42000)),
+           ("/system/bin/mediaserver", "media", 19, 23, (6000, 14000)),
+           ("/system/bin/audioserver", "audioserver", 24, 99, (3500, 9000)),
+           ("/system/bin/cameraserver", "cameraserver", 24, 99, (3000, 7000)),
+           ("media.codec", "mediacodec", 24, 99, (3000, 8000)),
+           ("media.extractor", "mediaex", 24, 99, (2500, 6000)),
+           ("/system/bin/netd", "root", 19, 99, (1500, 5000)),
+           ("/system/bin/installd", "root", 19, 99, (600, 1800)),
+           ("/system/bin/keystore", "keystore", 19, 99, (600, 2000)),
+           ("/system/bin/debuggerd", "root", 19, 25, (300, 900)),
+           ("/system/bin/tombstoned", "tombstoned", 26, 99, (300, 900)),
+           ("/system/bin/rild", "radio", 19, 99, (1500, 4000)),
+           ("/system/bin/drmserver", "drm", 19, 99, (1000, 3000)),
+           ("/system/bin/sdcard", "media_rw", 19, 28, (300, 900)),
+           ("/sbin/adbd", "shell", 19, 28, (500, 1500)),
+           ("/system/bin/adbd", "shell", 29, 29, (1000, 2500)),
+           ("/apex/com.android.adbd/bin/adbd", "shell", 30, 99, (1000, 2500)),
+           ("/vendor/bin/hw/android.hardware.graphics.composer@2.1-service", "system", 26, 99, (4000, 12000)),
+           ("/vendor/bin/hw/android.hardware.audio@2.0-service", "audioserver", 26, 99, (2500, 7000)),
+           ("/system/bin/statsd", "statsd", 28, 29, (1500, 4000)),
+           ("/apex/com.android.os.statsd/bin/statsd", "statsd", 30, 99, (1500, 4000)),
+           ("/system/bin/incidentd", "incidentd", 28, 99, (600, 1500)),
+           ("/system/bin/traced", "nobody", 28, 99, (600, 1500)),
+           ("/system/bin/gpuservice", "gpu_service", 29, 99, (1000, 2500)),
+           ("zygote", "root", 19, 99, (2000, 6000)),
+           ("zygote64", "root", 21, 99, (5000, 14000))]
+
+# java进程：(进程名, 用户, oom分组, 最低sdk, pss范围kB)
+APPS = [("system_server", "system", "System", 19, (90000, 210000)),
+        ("com.android.systemui", "u0_a30", "Persistent", 19, (60000, 160000)),
+        ("com.android.phone", "radio", "Persistent", 19, (25000, 60000)),
+        ("com.android.nfc", "nfc", "Persistent", 19, (8000, 20000)),
+        ("com.android.bluetooth", "bluetooth", "Persistent", 19, (9000, 24000)),
+        ("com.qualcomm.qti.services.secureui:sui_service", "system", "Persistent", 26, (5000, 12000)),
+        ("com.google.android.gms.persistent", "u0_a14", "Persistent Service", 19, (30000, 80000)),
+        (PACKAGE, "u0_a123", "Foreground", 19, (180000, 320000)),
+        (PACKAGE + ":channel", "u0_a123", "A Services", 19, (40000, 90000)),
+        (PACKAGE + ":sandboxed_process0", "u0_i3", "Foreground", 29, (30000, 70000)),
+        ("com.android.inputmethod.latin", "u0_a60", "Visible", 19, (20000, 50000)),
+        ("com.google.android.googlequicksearchbox:search", "u0_a50", "Visible", 19, (40000, 90000)),
+        ("com.tencent.mm:push", "u0_a201", "Perceptible", 19, (20000, 45000)),
+        ("com.google.android.gms", "u0_a14", "B Services", 19, (40000, 110000)),
+        ("com.android.launcher3", "u0_a38", "Home", 19, (40000, 90000)),
+        ("com.android.settings", "system", "Previous", 19, (20000, 50000)),
+        ("com.tencent.mm", "u0_a201", "Cached", 19, (60000, 140000)),
+        ("android.process.acore", "u0_a2", "Cached", 19, (10000, 25000)),
+        ("android.process.media", "u0_a11", "Cached", 19, (10000, 25000)),
+        ("com.android.vending", "u0_a41", "Cached", 19, (25000, 60000)),
+        ("com.android.chrome", "u0_a87", "Cached", 19, (30000, 90000)),
+        ("com.google.android.gms.unstable", "u0_a14", "Cached", 19, (15000, 40000)),
+        ("com.android.deskclock", "u0_a46", "Cached", 19, (8000, 20000)),
+        ("com.android.providers.calendar", "u0_a5", "Cached", 19, (6000, 15000)),
+        ("com.android.email", "u0_a55", "Cached", 19, (10000, 30000)),
+        ("com.android.externalstorage", "u0_a21", "Cached", 19, (5000, 12000)),
+        ("com.android.keychain", "system", "Cached", 19, (5000, 12000)),
+        ("com.android.shell", "shell", "Cached", 19, (5000, 12000)),
+        ("com.android.dialer", "u0_a17", "Cached", 19, (12000, 30000)),
+        ("com.android.camera2", "u0_a44", "Cached", 19, (12000, 30000)),
+        ("com.android.documentsui", "u0_a26", "Cached", 19, (8000, 20000)),
+        ("com.android.printspooler", "u0_a63", "Cached", 19, (6000, 15000)),
+        ("com.android.gallery3d", "u0_a42", "Cached", 19, (10000, 25000))]
+
+OOM_GROUPS = ["Native", "System", "Persistent", "Persistent Service", "Foreground", "Visible", "Perceptible",
+              "A Services", "Home", "Previous", "B Services", "Cached"]
+
+# dumpsys meminfo 按类别的PSS占比，Unknown 取余数
+CATEGORIES = [("Dalvik", 0.24), ("Native", 0.18), ("Dalvik Other", 0.04), ("Stack", 0.01), ("Cursor", 0.001),
+              ("Ashmem", 0.002), ("Gfx dev", 0.05), ("Other dev", 0.003), (".so mmap", 0.09), (".jar mmap", 0.01),
+              (".apk mmap", 0.05), (".ttf mmap", 0.003), (".dex mmap", 0.08), (".oat mmap", 0.02),
+              (".art mmap", 0.05), ("Other mmap", 0.01), ("EGL mtrack", 0.05), ("GL mtrack", 0.04)]
+
+# 单个包 meminfo 的行：(名称, pss占比, private dirty占比, private clean占比, 最低sdk)，Unknown 取余数
+PACKAGE_ROWS = [("Native Heap", 0.22, 0.99, 0.0, 19),
+                ("Dalvik Heap", 0.12, 0.99, 0.0, 19),
+                ("Dalvik Other", 0.03, 0.99, 0.0, 19),
+                ("Stack", 0.01, 1.0, 0.0, 19),
+                ("Ashmem", 0.001, 0.8, 0.0, 19),
+                ("Gfx dev", 0.06, 1.0, 0.0, 23),
+                ("Other dev", 0.0005, 0.0, 0.9, 19),
+                (".so mmap", 0.14, 0.07, 0.55, 19),
+                (".jar mmap", 0.01, 0.0, 0.4, 19),
+                (".apk mmap", 0.04, 0.0, 0.55, 19),
+                (".ttf mmap", 0.002, 0.0, 0.0, 19),
+                (".dex mmap", 0.1, 0.002, 0.9, 19),
+                (".oat mmap", 0.015, 0.0, 0.4, 23),
+                (".art mmap", 0.04, 0.9, 0.01, 23),
+                ("Other mmap", 0.004, 0.01, 0.4, 19),
+                ("Graphics", 0.06, 1.0, 0.0, 19),
+                ("GL", 0.09, 1.0, 0.0, 19),
+                ("EGL mtrack", 0.09, 1.0, 0.0, 23),
+                ("GL mtrack", 0.06, 1.0, 0.0, 23)]
+CODE_ROWS = [".so mmap", ".jar mmap", ".apk mmap", ".ttf mmap", ".dex mmap", ".oat mmap"]
+GRAPHICS_ROWS = ["Gfx dev", "EGL mtrack", "GL mtrack"]
+
+# toybox top 的 HZ，1个tick是 0.3%
+TOYBOX_HZ = 300
+TOOLBOX_HZ = 100
+
+# replay 录制用：系统版本号、60帧的刷新周期ns、logcat 第一行的时刻（当天的秒数）
+RELEASES = {19: "4.4.4", 23: "6.0.1", 24: "7.0", 25: "7.1.2", 26: "8.0.0", 28: "9", 29: "10", 30: "11", 34: "14"}
+REFRESH_PERIOD = 16666666
+LOGCAT_BEGIN = 18 * 3600 + 42 * 60 + 30
+
+
+class Process(object):
+    def __init__(self, pid, cmdline, user, kind, oom="Native"):
+        '''
+        :param str kind: kernel 内核线程，native 本地进程，app java进程
+        '''
+        self.pid = pid
+        self.cmdline = cmdline
+        self.user = user
+        self.kind = kind
+        self.oom = oom
+        self.pss = 0
+        self.rss = 0
+        self.shr = 0
+        self.vss = 0
+        self.swap = 0
+        self.threads = 1
+        self.ticks = 0
+        self.cpu_time = 0
+        self.nice = 0
+        self.rt = False
+        self.state = "S"
+        self.last_cpu = 0
+
+    @property
+    def name(self):
+        '''dumpsys meminfo 中的进程名：本地进程取cmdline的文件名，system_server 显示为 system
+        '''
+        if self.cmdline == "system_server":
+            return "system"
+        return self.cmdline.split(" ")[0].split("/")[-1]
+
+
+class Device(object):
+    '''
+    一台模拟设备某一时刻的进程表、cpu和内存状态，各种命令的输出都从这里打印
+    '''
+    def __init__(self, sdk):
+        self.sdk = sdk
+        self.rng = random.Random(sdk)
+        self.cores, self.mem_total, self.proc_count, self.is64 = DEVICES[sdk]
+        # 内存小的设备上各进程的pss按比例缩小
+        self.mem_scale = min(1.0, self.mem_total / 6000000.0)
+        self.processes = []
+        self._build_processes()
+        self._assign_memory()
+        self._assign_cpu()
+        self._assign_ram()
+
+    def process(self, cmdline):
+        for proc in self.processes:
+            if proc.cmdline == cmdline:
+                return proc
+        return None
+
+    def _build_processes(self):
+        rng = self.rng
+        kernel = ["kthreadd", "rcu_preempt", "rcu_sched", "rcu_bh"]
+        for cpu in range(self.cores):
+            kernel += ["migration/%d" % cpu, "ksoftirqd/%d" % cpu, "kworker/%d:0" % cpu, "kworker/%d:0H" % cpu,
+                       "kworker/%d:1" % cpu, "kworker/%d:1H" % cpu]
+            kernel.append("cpuhp/%d" % cpu if self.sdk >= 26 else "watchdog/%d" % cpu)
+        kernel += ["kdevtmpfs", "netns", "khungtaskd", "writeback", "kblockd", "kswapd0", "perf", "ext4-rsv-conver"]
+        if self.sdk >= 26:
+            kernel += ["kcompactd0", "oom_reaper", "jbd2/sda13-8", "ufs_clk_gating_0"]
+        else:
+            kernel += ["khelper", "mmcqd/0", "mmcqd/0rpmb", "jbd2/mmcblk0p25-8"]
+        natives = [(cmdline, user, pss) for cmdline, user, low, high, pss in NATIVES
+                   if low <= self.sdk <= high and (self.is64 or cmdline != "zygote64")]
+        apps = [(name, user, oom, pss) for name, user, oom, low, pss in APPS if self.sdk >= low]
+        top_cmd = "top -b -n 1 -d 1" if self.sdk >= 26 else "top"
+        # 剩下的是 kworker/uN:M 和 irq 线程，设备上内核线程通常占一半以上
+        fillers = self.proc_count - len(kernel) - len(natives) - len(apps) - 1
+        unbound = fillers * 2 // 3
+        kernel += ["kworker/u%d:%d" % (self.cores * 2, i) for i in range(unbound)]
+        kernel += ["irq/%d-%s" % (100 + i, rng.choice(["arm-smmu", "qcom,smd", "spdm_bw_hyp", "msm_dwc3", "synaptics"]))
+                   for i in range(fillers - unbound)]
+
+        pid = 1
+        self.processes.append(Process(pid, "/init", "root", "native"))
+        pid = 2
+        for name in kernel[:len(kernel) * 3 // 4]:
+            self.processes.append(Process(pid, name, "root", "kernel"))
+            pid += rng.randint(1, 3)
+        for cmdline, user, pss in natives:
+            if cmdline == "/init":
+                self.processes[0].pss_range = pss
+                continue
+            proc = Process(pid, cmdline, user, "native")
+            proc.pss_range = pss
+            self.processes.append(proc)
+            pid += rng.randint(1, 20)
+        # 开机后创建的内核线程和应用进程交错
+        late_kernel = kernel[len(kernel) * 3 // 4:]
+        pid = max(pid, 1400)
+        for name, user, oom, pss in apps:
+            while late_kernel and rng.random() < 0.4:
+                self.processes.append(Process(pid, late_kernel.pop(0), "root", "kernel"))
+                pid += rng.randint(1, 30)
+            proc = Process(pid, name, user, "app", oom)
+            proc.pss_range = pss
+            self.processes.append(proc)
+            pid += rng.randint(5, 400)
+        for name in late_kernel:
+            self.processes.append(Process(pid, name, "root", "kernel"))
+            pid += rng.randint(1, 300)
+        top = Process(pid + rng.randint(10, 500), top_cmd, "shell", "native")
+        top.pss_range = (1500, 3000)
+        self.processes.append(top)
+        pids = [proc.pid for proc in self.processes]
+        assert len(set(pids)) == len(pids) == self.proc_count, (self.sdk, len(set(pids)), len(pids))
+
+    def _assign_memory(self):
+        rng = self.rng
+        for proc in self.processes:
+            if proc.kind == "kernel":
+                proc.nice = -20 if proc.cmdline.endswith("H") else 0
+                proc.rt = proc.cmdline.startswith(("migration", "watchdog", "irq/"))
+                proc.cpu_time = rng.randint(0, 60000)
+                continue
+            proc.pss = int(rng.randint(*proc.pss_range) * self.mem_scale)
+            if proc.kind == "app":
+                # java进程共享zygote的内存，rss比pss大不少
+                proc.rss = proc.pss + int(proc.pss * rng.uniform(0.15, 0.35)) + rng.randint(15000, 30000)
+                proc.vss = rng.randint(1000000, 1600000) if not self.is64 else rng.randint(4200000, 6800000)
+                proc.threads = rng.randint(15, 120)
+                proc.cpu_time = rng.randint(100, 900000)
+            else:
+                proc.rss = proc.pss + int(proc.pss * rng.uniform(0.3, 0.8)) + rng.randint(800, 2500)
+                if self.is64 and not proc.cmdline.startswith(("zygote", "top")):
+                    proc.vss = rng.randint(900000, 2400000)
+                else:
+                    proc.vss = proc.rss + rng.randint(5000, 100000)
+                proc.threads = rng.randint(1, 30)
+                # top 进程是刚启动的
+                proc.cpu_time = rng.randint(2, 20) if proc.cmdline.startswith("top") else rng.randint(0, 400000)
+            proc.shr = proc.rss - int(proc.pss * rng.uniform(0.7, 0.95))
+            if self.sdk >= 24 and proc.oom in ("Cached", "B Services", "Previous"):
+                proc.swap = int(proc.pss * rng.uniform(0.1, 0.3))
+            elif self.sdk >= 24 and proc.kind == "app":
+                proc.swap = rng.randint(0, 2000)
+            assert proc.vss >= proc.rss >= proc.shr >= 0, proc.cmdline
+        app = self.process(PACKAGE)
+        app.threads = rng.randint(150, 220)
+        self.process("system_server").threads = rng.randint(180, 260)
+        for cmdline, nice in (("system_server", -2), ("/system/bin/surfaceflinger", -8), ("com.android.systemui", -2)):
+            self.process(cmdline).nice = nice
+
+    def _assign_cpu(self):
+        '''
+        采样周期内各进程的cpu tick，toybox 按 TOYBOX_HZ，toolbox 按 TOOLBOX_HZ 计
+        '''
+        rng = self.rng
+        hz = TOYBOX_HZ if self.sdk >= 26 else TOOLBOX_HZ
+        busy = {PACKAGE: (0.3, 0.9), "/system/bin/surfaceflinger": (0.04, 0.12), "system_server": (0.02, 0.08),
+                "com.android.systemui": (0.005, 0.03), PACKAGE + ":channel": (0.003, 0.02),
+                "top -b -n 1 -d 1": (0.02, 0.06), "top": (0.01, 0.04),
+                "/vendor/bin/hw/android.hardware.graphics.composer@2.1-service": (0.01, 0.04),
+                PACKAGE + ":sandboxed_process0": (0.02, 0.08), "/system/bin/logd": (0.003, 0.01),
+                "com.google.android.gms.persistent": (0.0, 0.01), "com.tencent.mm:push": (0.0, 0.01)}
+        if self.sdk == 29:
+            # 测试包退到后台，主进程几乎不占cpu，排在 :channel 和 sandboxed_process 后面
+            busy[PACKAGE] = (0.0, 0.004)
+            busy[PACKAGE + ":channel"] = (0.03, 0.06)
+        for proc in self.processes:
+            if proc.cmdline in busy:
+                low, high = busy[proc.cmdline]
+                proc.ticks = int(hz * rng.uniform(low, high))
+            elif proc.kind == "kernel" and rng.random() < 0.04:
+                proc.ticks = rng.randint(1, 2)
+            elif proc.kind != "kernel" and rng.random() < 0.05:
+                proc.ticks = 1
+            proc.last_cpu = rng.randrange(self.cores)
+            # top 采样时只有它自己在运行
+            if proc.cmdline.startswith("top"):
+                proc.state = "R"
+            elif proc.kind == "kernel" and self.sdk >= 29 and proc.cmdline.startswith("kworker"):
+                proc.state = "I"
+            elif proc.kind == "app" and rng.random() < 0.02:
+                proc.state = "D"
+        self.proc_ticks = sum(proc.ticks for proc in self.processes)
+        self.total_ticks = hz * self.cores
+        self.sys_ticks = int(self.proc_ticks * rng.uniform(0.3, 0.45))
+        self.nice_ticks = rng.randint(0, 2)
+        self.user_ticks = self.proc_ticks - self.sys_ticks - self.nice_ticks
+        self.iow_ticks = rng.randint(0, 4)
+        self.irq_ticks = rng.randint(0, hz // 30)
+        self.sirq_ticks = rng.randint(0, hz // 50)
+        self.idle_ticks = self.total_ticks - self.proc_ticks - self.iow_ticks - self.irq_ticks - self.sirq_ticks
+
+    def _assign_ram(self):
+        rng = self.rng
+        total = self.mem_total
+        self.total_pss = sum(proc.pss for proc in self.processes)
+        self.cached_pss = sum(proc.pss for proc in self.processes if proc.oom == "Cached")
+        self.kernel_used = int(total * rng.uniform(0.09, 0.13))
+        self.free = int(total * rng.uniform(0.02, 0.05))
+        self.lost = int(total * rng.uniform(0.02, 0.05))
+        self.swap_total = 2621436 if total > 2000000 else 524284
+        self.swap_used = sum(proc.swap for proc in self.processes) + rng.randint(50000, 300000)
+        self.zram = self.swap_used // 3
+        self.cached_kernel = total - self.total_pss - self.kernel_used - self.free - self.lost - self.zram
+        self.buffers = rng.randint(20000, 60000)
+        assert self.cached_kernel > 0, self.sdk
+
+    # ---------------- top ----------------
+
+    def _sorted_for_top(self):
+        return sorted(self.processes, key=lambda proc: (-proc.ticks, proc.pid))
+
+    def top_toolbox(self):
+        '''android 8.0 以下的 toolbox top -n 1 -d 1'''
+        total = self.total_ticks
+        lines = ["",
+                 "User %d%%, System %d%%, IOW %d%%, IRQ %d%%" % (
+                     (self.user_ticks + self.nice_ticks) * 100 // total, self.sys_ticks * 100 // total,
+                     self.iow_ticks * 100 // total, (self.irq_ticks + self.sirq_ticks) * 100 // total),
+                 "User %d + Nice %d + Sys %d + Idle %d + IOW %d + IRQ %d + SIRQ %d = %d" % (
+                     self.user_ticks, self.nice_ticks, self.sys_ticks, self.idle_ticks, self.iow_ticks,
+                     self.irq_ticks, self.sirq_ticks, total),
+                 "",
+                 "  PID PR CPU% S  #THR     VSS     RSS PCY UID      Name"]
+        for proc in self._sorted_for_top():
+            pcy = "bg" if proc.oom in ("Cached", "B Services", "A Services") else "fg"
+            lines.append("%5d %2d %3d%% %s %5d %6dK %6dK %3s %-8.8s %s" % (
+                proc.pid, proc.last_cpu, proc.ticks * 100 // total, proc.state, proc.threads, proc.vss, proc.rss,
+                pcy, proc.user, proc.cmdline))
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _human(kb):
+        '''toybox 的 VIRT/RES/SHR 列，最多4个字符'''
+        if kb == 0:
+            return "0"
+        value = float(kb)
+        for unit in "KMG":
+            if value < 1000:
+                break
+            value /= 1024
+        if value < 10 and unit != "K":
+            return "%.1f%s" % (value, unit)
+        return "%d%s" % (value, unit)
+
+    @staticmethod
+    def _cpu_time(hundredths):
+        return "%d:%02d.%02d" % (hundredths // 6000, hundredths // 100 % 60, hundredths % 100)
+
+    def top_toybox(self):
+        '''android 8.0 及以上的 toybox top -b -n 1 -d 1'''
+        running = len([proc for proc in self.processes if proc.state == "R"])
+        kilo = "k" if self.sdk < 29 else "K"
+        prefix = "" if self.sdk < 29 else "  "
+        percent = lambda ticks: ticks * 100 // TOYBOX_HZ
+        user, nice, sys_, iow, irq, sirq = [percent(ticks) for ticks in (
+            self.user_ticks, self.nice_ticks, self.sys_ticks, self.iow_ticks, self.irq_ticks, self.sirq_ticks)]
+        idle = self.cores * 100 - user - nice - sys_ - iow - irq - sirq
+        page_cache = self.cached_kernel + self.cached_pss
+        lines = ["Tasks: %d total, %3d running, %3d sleeping,   0 stopped,   0 zombie" % (
+                     len(self.processes), running, len(self.processes) - running),
+                 "%sMem: %9d%s total, %8d%s used, %8d%s free, %8d%s buffers" % (
+                     prefix, self.mem_total, kilo, self.mem_total - self.free, kilo, self.free, kilo, self.buffers,
+                     kilo),
+                 "%sSwap: %8d%s total, %8d%s used, %8d%s free, %8d%s cached" % (
+                     prefix[1:], self.swap_total, kilo, self.swap_used, kilo, self.swap_total - self.swap_used, kilo,
+                     page_cache, kilo),
+                 "%d%%cpu %3d%%user %3d%%nice %3d%%sys %3d%%idle %3d%%iow %3d%%irq %3d%%sirq   0%%host" % (
+                     self.cores * 100, user, nice, sys_, idle, iow, irq, sirq),
+                 "  PID USER         PR  NI VIRT  RES  SHR S[%CPU] %MEM     TIME+ ARGS"]
+        for proc in self._sorted_for_top():
+            pr = "RT" if proc.rt else "%d" % (20 + proc.nice)
+            args = "[%s]" % proc.cmdline if proc.kind == "kernel" else proc.cmdline
+            lines.append("%5d %-12s %2s %3d %4s %4s %4s %s %4.1f %5.1f %9s %s" % (
+                proc.pid, proc.user, pr, proc.nice, self._human(proc.vss), self._human(proc.rss),
+                self._human(proc.shr), proc.state, proc.ticks * 100.0 / TOYBOX_HZ,
+                proc.rss * 100.0 / self.mem_total, self._cpu_time(proc.cpu_time), args))
+        return "\n".join(lines) + "\n"
+
+    # ---------------- dumpsys meminfo ----------------
+
+    def _listed(self):
+        '''dumpsys meminfo 列出的进程，不含内核线程，按pss从大到小'''
+        return sorted([proc for proc in self.processes if proc.kind != "kernel"], key=lambda proc: (-proc.pss, proc.pid))
+
+    def meminfo_device(self, style):
+        '''
+        :param str style: kB 用 "252370 kB:"（4.4），K 用 "252,370K:"（7.0以上），swap 在pss后多一列SwapPss，
+                          rss 在 PSS 段前面先打印 RSS 段
+        '''
+        if style in ("kB", "swap"):
+            size = lambda kb, width: "%*d kB" % (width - 3, kb)
+            head = "Applications Memory Usage (kB):"
+        else:
+            size = lambda kb, width: "%*sK" % (width - 1, "{:,}".format(kb))
+            head = "Applications Memory Usage (in Kilobytes):"
+
+        def entry(proc, value, width):
+            suffix = " / activities" if proc.oom in ("Foreground", "Visible", "Home", "Previous") else ""
+            column = size(value, width)
+            if style == "swap":
+                column += ": " + size(proc.swap, 10)
+            return "%s: %s (pid %d%s)" % (column, proc.name, proc.pid, suffix)
+
+        def group(title, value, swap, width):
+            column = size(value, width)
+            if style == "swap":
+                column += ": " + size(swap, 10)
+            return "%s: %s" % (column, title)
+
+        def sections(kind, attr):
+            listed = self._listed()
+            if attr == "rss":
+                listed = sorted(listed, key=lambda proc: (-proc.rss, proc.pid))
+            lines = ["Total %s by process:" % kind]
+            lines += [entry(proc, getattr(proc, attr), 14) for proc in listed]
+            lines += ["", "Total %s by OOM adjustment:" % kind]
+            for title in OOM_GROUPS:
+                members = [proc for proc in listed if proc.oom == title]
+                if not members:
+                    continue
+                lines.append(group(title, sum(getattr(proc, attr) for proc in members),
+                                   sum(proc.swap for proc in members), 14))
+                lines += ["    " + entry(proc, getattr(proc, attr), 15) for proc in members]
+            return lines + [""]
+
+        lines = [head, "Uptime: %d Realtime: %d" % (452345678 + self.sdk, 652345678 + self.sdk), ""]
+        if style == "rss":
+            lines += sections("RSS", "rss")
+        lines += sections("PSS", "pss")
+        lines.append("Total PSS by category:")
+        total_swap = sum(proc.swap for proc in self.processes)
+        rest = self.total_pss
+        swap_rest = total_swap
+        for title, ratio in CATEGORIES:
+            value = int(self.total_pss * ratio)
+            swap = int(total_swap * ratio)
+            rest -= value
+            swap_rest -= swap
+            lines.append(group(title, value, swap, 14))
+        lines += [group("Unknown", rest, swap_rest, 14), ""]
+        free_ram = self.cached_pss + self.cached_kernel + self.free
+        used_pss = self.total_pss - self.cached_pss
+        used_ram = used_pss + self.kernel_used
+        lost_ram = self.mem_total - free_ram - used_ram - self.zram
+        kb = lambda value: size(value, 10).strip()
+        lines += ["Total RAM: %s (status normal)" % kb(self.mem_total),
+                  " Free RAM: %s (%s cached pss + %s cached kernel + %s free)" % (
+                      kb(free_ram), kb(self.cached_pss), kb(self.cached_kernel), kb(self.free)),
+                  " Used RAM: %s (%s used pss + %s kernel)" % (kb(used_ram), kb(used_pss), kb(self.kernel_used)),
+                  " Lost RAM: %s" % kb(lost_ram),
+                  "     ZRAM: %s physical used for %s in swap (%s total swap)" % (
+                      kb(self.zram), kb(self.swap_used), kb(self.swap_total)),
+                  "   Tuning: 256 (large 512), oom %s, restore limit %s (high-end-gfx)" % (kb(322560), kb(107520)),
+                  ""]
+        assert lost_ram == self.lost, (self.sdk, lost_ram, self.lost)
+        return "\n".join(lines)
+
+    def meminfo_package(self):
+        '''dumpsys meminfo 测试包'''
+        rng = random.Random(self.sdk * 7)
+        proc = self.process(PACKAGE)
+        swap_pss = self.sdk >= 24
+        with_rss = self.sdk >= 30
+        # 4.4 的显存只有 Graphics 和 GL 两行，6.0 起拆成 Gfx dev、EGL mtrack、GL mtrack
+        rows = [row for row in PACKAGE_ROWS if row[4] <= self.sdk and (self.sdk < 23 or row[0] not in ("Graphics", "GL"))]
+        rest = proc.pss - (proc.swap if swap_pss else 0)
+        swap_rest = proc.swap if swap_pss else 0
+        rss_rest = proc.rss
+        extra_rss = proc.rss - proc.pss
+        table = []
+        for name, ratio, dirty, clean, _ in rows:
+            pss = int(proc.pss * ratio)
+            priv_dirty = int(pss * dirty)
+            priv_clean = int(pss * clean)
+            swap = 0
+            if name in ("Native Heap", "Dalvik Other") and swap_rest:
+                swap = swap_rest // 3
+            rss = pss + int(extra_rss * ratio * rng.uniform(0.4, 1.0))
+            rest -= pss
+            swap_rest -= swap
+            rss_rest -= rss
+            table.append([name, pss, priv_dirty, priv_clean, swap, rss])
+        table.append(["Unknown", rest, int(rest * 0.98), 0, swap_rest, rss_rest])
+        assert rest > 0 and rss_rest > rest, (self.sdk, rest, rss_rest)
+        row = dict((item[0], item) for item in table)
+        heap = {}
+        for name, size in (("Native Heap", 0), ("Dalvik Heap", 0)):
+            alloc = int(row[name][1] * rng.uniform(1.05, 1.3))
+            free = rng.randint(2000, 30000)
+            heap[name] = (alloc + free, alloc, free)
+
+        def fmt_row(label, values, heap_values=()):
+            return "%13s" % label + "".join("%9d" % value for value in list(values) + list(heap_values))
+
+        def columns(item):
+            values = [item[1], item[2], item[3], item[4]]
+            if with_rss:
+                values.append(item[5])
+            return values
+
+        swap_title = "SwapPss" if swap_pss else "Swapped"
+        if with_rss:
+            header = ["                   Pss  Private  Private  %s      Rss     Heap     Heap     Heap" % swap_title,
+                      "                 Total    Dirty    Clean    Dirty    Total     Size    Alloc     Free",
+                      "                ------   ------   ------   ------   ------   ------   ------   ------"]
+        else:
+            header = ["                   Pss  Private  Private  %s     Heap     Heap     Heap" % swap_title,
+                      "                 Total    Dirty    Clean    Dirty     Size    Alloc     Free",
+                      "                ------   ------   ------   ------   ------   ------   ------"]
+        head = "Applications Memory Usage (kB):" if self.sdk < 23 else "Applications Memory Usage (in Kilobytes):"
+        lines = [head, "Uptime: %d Realtime: %d" % (452345678 + self.sdk, 652345678 + self.sdk), "",
+                 "** MEMINFO in pid %d [%s] **" % (proc.pid, PACKAGE)] + header
+        for item in table:
+            lines.append(fmt_row(item[0], columns(item), heap.get(item[0], ())))
+        totals = [sum(item[i] for item in table) for i in range(1, 6)]
+        total_pss = totals[0] + (totals[3] if swap_pss else 0)
+        assert total_pss == proc.pss and (not with_rss or totals[4] == proc.rss)
+        total_row = ["TOTAL", total_pss] + totals[1:]
+        heap_total = [sum(values[i] for values in heap.values()) for i in range(3)]
+        lines.append(fmt_row("TOTAL", columns(total_row), heap_total))
+        if self.sdk >= 23:
+            java = row["Dalvik Heap"][2] + row[".art mmap"][2] + row[".art mmap"][3]
+            native = row["Native Heap"][2]
+            code = sum(row[name][2] + row[name][3] for name in CODE_ROWS)
+            stack = row["Stack"][2]
+            graphics = sum(row[name][1] for name in GRAPHICS_ROWS)
+            private = totals[1] + totals[2]
+            other = private - java - native - code - stack - graphics
+            system = total_pss - private
+            lines += ["", "", " App Summary"]
+            if with_rss:
+                java_rss = row["Dalvik Heap"][5] + row[".art mmap"][5]
+                native_rss = row["Native Heap"][5]
+                code_rss = sum(row[name][5] for name in CODE_ROWS)
+                stack_rss = row["Stack"][5]
+                graphics_rss = sum(row[name][5] for name in GRAPHICS_ROWS)
+                unknown_rss = totals[4] - java_rss - native_rss - code_rss - stack_rss - graphics_rss
+                lines += ["                       Pss(KB)                        Rss(KB)",
+                          "                        ------                         ------",
+                          "           Java Heap: %8d                       %8d" % (java, java_rss),
+                          "         Native Heap: %8d                       %8d" % (native, native_rss),
+                          "                Code: %8d                       %8d" % (code, code_rss),
+                          "               Stack: %8d                       %8d" % (stack, stack_rss),
+                          "            Graphics: %8d                       %8d" % (graphics, graphics_rss),
+                          "       Private Other: %8d" % other,
+                          "              System: %8d" % system,
+                          "             Unknown:                                 %8d" % unknown_rss,
+                          "           TOTAL PSS: %8d            TOTAL RSS: %8d       TOTAL SWAP PSS: %8d" % (
+                              total_pss, totals[4], totals[3])]
+            else:
+                swap_label = "TOTAL SWAP PSS:" if swap_pss else "TOTAL SWAP (KB):"
+                lines += ["                       Pss(KB)",
+                          "                        ------",
+                          "           Java Heap: %8d" % java,
+                          "         Native Heap: %8d" % native,
+                          "                Code: %8d" % code,
+                          "               Stack: %8d" % stack,
+                          "            Graphics: %8d" % graphics,
+                          "       Private Other: %8d" % other,
+                          "              System: %8d" % system,
+                          "",
+                          "               TOTAL: %8d       %s %8d" % (total_pss, swap_label, totals[3])]
+            assert java + native + code + stack + graphics + other + system == total_pss
+        lines += ["", " Objects",
+                  "               Views: %8d         ViewRootImpl: %8d" % (rng.randint(800, 3000), 2),
+                  "         AppContexts: %8d           Activities: %8d" % (rng.randint(4, 12), 2),
+                  "              Assets: %8d        AssetManagers: %8d" % (rng.randint(4, 24), 2),
+                  "       Local Binders: %8d        Proxy Binders: %8d" % (rng.randint(40, 160), rng.randint(30, 100)),
+                  "    Death Recipients: %8d      OpenSSL Sockets: %8d" % (rng.randint(1, 8), rng.randint(0, 4)),
+                  "", " SQL",
+                  "         MEMORY_USED: %8d" % rng.randint(300, 1600),
+                  "  PAGECACHE_OVERFLOW: %8d          MALLOC_SIZE: %8d" % (rng.randint(100, 600), 117),
+                  ""]
+        return "\n".join(lines)
+
+    # ---------------- xt_qtaguid ----------------
+
+    def xt_qtaguid(self):
+        '''
+        /proc/net/xt_qtaguid/stats，rx/tx 等于 tcp+udp+other；行按 iface、tag、uid 排序，与内核输出一致
+        '''
+        rng = random.Random(self.sdk * 13)
+        mobile = "rmnet0" if self.sdk < 26 else "rmnet_data0"
+        uids = [0, 1000, 1001, 1013, 1021, 10014, 10030, 10041, 10087, APP_UID, 10201]
+        # 带tag的流量：系统服务用 0xffffff01 开头的tag，测试包自己用 setThreadStatsTag(0x3f)
+        tags = {1000: ["0xffffff0100000000"], 10014: ["0xffffff0100000000"], APP_UID: ["0x3f00000000"]}
+        stats = {}
+        for iface in ("lo", mobile, "wlan0"):
+            for uid in uids:
+                if iface == "lo" and uid not in (0, 1000, APP_UID, 10014):
+                    continue
+                scale = 4 if iface == "wlan0" else 1
+                for cnt_set in (0, 1):
+                    if uid < 10000 and cnt_set == 1 and uid != 1000:
+                        continue
+                    rx = rng.randint(10000, 60000000) * scale // 4
+                    tx = rx // rng.randint(3, 20)
+                    stats[(iface, "0x0", uid, cnt_set)] = (rx, tx)
+                    for tag in tags.get(uid, []):
+                        stats[(iface, tag, uid, cnt_set)] = (rx // rng.randint(2, 5), tx // rng.randint(2, 5))
+        # 其他uid的字节数里含有 "10123"，解析时只能按uid列匹配，不能按整行包含
+        key = ("wlan0", "0x0", 10087, 0)
+        stats[key] = (3101234567 // 100, stats[key][1])
+        assert str(APP_UID) in str(stats[key][0])
+        lines = ["idx iface acct_tag_hex uid_tag_int cnt_set rx_bytes rx_packets tx_bytes tx_packets rx_tcp_bytes "
+                 "rx_tcp_packets rx_udp_bytes rx_udp_packets rx_other_bytes rx_other_packets tx_tcp_bytes "
+                 "tx_tcp_packets tx_udp_bytes tx_udp_packets tx_other_bytes tx_other_packets"]
+        order = lambda key: (("lo", mobile, "wlan0").index(key[0]), int(key[1], 16), key[2], key[3])
+        for idx, key in enumerate(sorted(stats, key=order)):
+            rx, tx = stats[key]
+            fields = []
+            for total in (rx, tx):
+                udp = total // rng.randint(5, 20)
+                other = 0 if key[0] != "lo" else total // 50
+                tcp = total - udp - other
+                packets = [value // 1200 + (1 if value else 0) for value in (tcp, udp, other)]
+                fields.append((total, sum(packets), tcp, packets[0], udp, packets[1], other, packets[2]))
+            (rx, rx_p, rx_tcp, rx_tcp_p, rx_udp, rx_udp_p, rx_o, rx_o_p), \
+                (tx, tx_p, tx_tcp, tx_tcp_p, tx_udp, tx_udp_p, tx_o, tx_o_p) = fields
+            lines.append(" ".join(str(value) for value in (
+                idx + 2, key[0], key[1], key[2], key[3], rx, rx_p, tx, tx_p, rx_tcp, rx_tcp_p, rx_udp, rx_udp_p,
+                rx_o, rx_o_p, tx_tcp, tx_tcp_p, tx_udp, tx_udp_p, tx_o, tx_o_p)))
+        # 保留各行的真实值，手工核对解析结果时用
+        self.qtaguid = stats
+        return "\n".join(lines) + "\n"
+
+    # ---------------- replay 录制 ----------------
+
+    def getprop(self):
+        release = RELEASES[self.sdk]
+        props = [("ro.build.fingerprint", "google/redfin/redfin:%s/RQ3A.211001.001/7641976:user/release-keys" % release),
+                 ("ro.build.version.release", release),
+                 ("ro.build.version.sdk", str(self.sdk)),
+                 ("ro.product.brand", "google"),
+                 ("ro.product.model", "Pixel 5")]
+        return "\n".join("[%s]: [%s]" % prop for prop in props)
+
+    def ps(self):
+        '''toybox ps -A，java进程的父进程是 zygote64'''
+        zygote = self.process("zygote64").pid
+        lines = ["USER           PID  PPID     VSZ    RSS WCHAN            ADDR S NAME"]
+        for proc in sorted(self.processes, key=lambda proc: proc.pid):
+            if proc.kind == "kernel":
+                ppid, name = (0 if proc.cmdline == "kthreadd" else 2), "[%s]" % proc.cmdline
+            else:
+                ppid, name = (zygote if proc.kind == "app" else 1), proc.cmdline.split(" ")[0]
+            lines.append("%-10s %7d %5d %7d %6d %-16s %4s %s %s" % (
+                proc.user, proc.pid, ppid if proc.pid != 1 else 0, proc.vss, proc.rss,
+                "do_epoll_wait" if proc.kind != "kernel" else "worker_thread", 0, proc.state, name))
+        return "\n".join(lines)
+
+    def advance(self, seconds):
+        '''
+        模拟过了 seconds 秒：各进程累计cpu时间后重新分配下一个周期的cpu，wlan0 的流量增加，前台界面画了新的帧
+        '''
+        rng = self.rng
+        if not hasattr(self, "uptime"):
+            self.uptime = rng.randint(3600, 86400) * 10 ** 9
+            self.frames = []
+            self.net = {"lo": [rng.randint(10 ** 6, 10 ** 8), 0, 0, 0],
+                        "rmnet0": [0, 0, 0, 0],
+                        "wlan0": [rng.randint(10 ** 8, 10 ** 9), 0, rng.randint(10 ** 7, 10 ** 8), 0]}
+            for counters in self.net.values():
+                counters[2] = counters[2] if counters[2] else counters[0]
+                counters[1], counters[3] = counters[0] // 1300, counters[2] // 700
+        hz = TOYBOX_HZ if self.sdk >= 26 else TOOLBOX_HZ
+        for proc in self.processes:
+            proc.cpu_time += int(proc.ticks * 100 * seconds / hz)
+        self._assign_cpu()
+        rx, tx = int(rng.uniform(50, 400) * 1024 * seconds), int(rng.uniform(5, 40) * 1024 * seconds)
+        wlan = self.net["wlan0"]
+        wlan[0] += rx
+        wlan[1] += rx // 1300 + 1
+        wlan[2] += tx
+        wlan[3] += tx // 700 + 1
+        # 60帧，偶尔掉1到3帧，掉帧时实际的vsync晚于预期的vsync；每帧为 (预期vsync, 实际vsync, 绘制完成)
+        end = self.uptime + int(seconds * 10 ** 9)
+        vsync = self.frames[-1][1] if self.frames else self.uptime
+        while True:
+            intended = vsync + REFRESH_PERIOD
+            vsync += REFRESH_PERIOD * (1 if rng.random() > 0.03 else rng.randint(2, 4))
+            if vsync > end:
+                break
+            self.frames.append((intended, vsync, vsync + rng.randint(6, 14) * 10 ** 6))
+        self.uptime = end
+
+    def net_dev(self):
+        '''/proc/net/dev，Android 10 上 /proc/<pid>/net/dev 与整机同一个网络命名空间，内容相同'''
+        lines = ["Inter-|   Receive                                                |  Transmit",
+                 " face |bytes    packets errs drop fifo frame compressed multicast|"
+                 "bytes    packets errs drop fifo colls carrier compressed"]
+        for iface in ("rmnet_ipa0", "dummy0", "rmnet0", "wlan0", "lo"):
+            rx, rx_p, tx, tx_p = self.net.get(iface, [0, 0, 0, 0])
+            lines.append("%14s: %8d %7d    0    0    0     0          0         0 %8d %7d    0    0    0     0"
+                         "       0          0" % (iface, rx, rx_p, tx, tx_p))
+        return "\n".join(lines)
+
+    def window_windows(self, activity):
+        lines = ["WINDOW MANAGER WINDOWS (dumpsys window windows)",
+                 "  Window #0 Window{5e2a1d0 u0 NavigationBar0}:",
+                 "  Window #1 Window{b1f2c38 u0 StatusBar}:",
+                 "  Window #2 Window{8c1e7a2 u0 %s}:" % activity,
+                 "  Window #3 Window{33f9e05 u0 com.android.systemui.ImageWallpaper}:",
+                 "",
+                 "  mGlobalConfiguration={1.0 ?mcc?mnc [zh_CN] ldltr sw392dp w392dp h850dp 440dpi nrml long port}",
+                 "  mHasPermanentDpad=false",
+                 "  mTopFocusedDisplayId=0",
+                 "  mCurrentFocus=Window{8c1e7a2 u0 %s}" % activity,
+                 "  mFocusedApp=ActivityRecord{1d3c4b9 u0 %s t58}" % activity]
+        return "\n".join(lines)
+
+    def sf_latency(self):
+        '''
+        dumpsys SurfaceFlinger --latency，刷新周期和最近127帧的时间戳，不足127帧时前面补0
+        8.0 及以上按activity名找不到layer，只输出刷新周期，帧数据从 gfxinfo 取
+        '''
+        if self.sdk >= 26:
+            return str(REFRESH_PERIOD)
+        frames = self.frames[-127:]
+        rows = [(0, 0, 0)] * (127 - len(frames)) + frames
+        return "\n".join([str(REFRESH_PERIOD)] + ["%d\t%d\t%d" % row for row in rows])
+
+    def gfxinfo(self, activity):
+        '''dumpsys gfxinfo 测试包 framestats，只有前台activity一个窗口，PROFILEDATA 是最近120帧'''
+        rng = random.Random(len(self.frames))
+        app = self.process(PACKAGE)
+        janky = len([frame for frame in self.frames if frame[1] > frame[0]])
+        stats = ["Stats since: %dns" % self.frames[0][0],
+                 "Total frames rendered: %d" % len(self.frames),
+                 "Janky frames: %d (%.2f%%)" % (janky, janky * 100.0 / len(self.frames))]
+        lines = ["Applications Graphics Acceleration Info:",
+                 "Uptime: %d Realtime: %d" % (self.uptime // 10 ** 6, self.uptime // 10 ** 6 + 3600000),
+                 "",
+                 "** Graphics info for pid %d [%s] **" % (app.pid, PACKAGE),
+                 ""] + stats + ["",
+                 "Pipeline=Skia (OpenGL)",
+                 "",
+                 "Profile data in ms:",
+                 "",
+                 "\t%s/android.view.ViewRootImpl@a9b18fb (visibility=0)" % activity,
+                 "",
+                 "Window: %s" % activity] + stats + ["",
+                 "---PROFILEDATA---",
+                 "Flags,IntendedVsync,Vsync,OldestInputEvent,NewestInputEvent,HandleInputStart,AnimationStart,"
+                 "PerformTraversalsStart,DrawStart,SyncQueued,SyncStart,IssueDrawCommandsStart,SwapBuffers,"
+                 "FrameCompleted,DequeueBufferDuration,QueueBufferDuration,GpuCompleted,"]
+        for intended, vsync, completed in self.frames[-120:]:
+            draw = vsync + rng.randint(1, 4) * 10 ** 6
+            swap = completed - rng.randint(1, 3) * 10 ** 6
+            lines.append(",".join(str(value) for value in (
+                0, intended, vsync, 9223372036854775807, 0, vsync + 300000, vsync + 500000, vsync + 900000, draw,
+                draw + 1500000, draw + 1600000, draw + 2400000, swap, completed, rng.randint(50000, 400000),
+                rng.randint(50000, 500000), completed + rng.randint(1, 3) * 10 ** 6)) + ",")
+        lines += ["---PROFILEDATA---", "", "View hierarchy:", "", "  %s/android.view.ViewRootImpl@a9b18fb" % activity,
+                  "  %d views, %.2f kB of render nodes" % (rng.randint(300, 900), rng.uniform(100, 400)), "",
+                  "", "Total ViewRootImpl: 1", "Total Views:        %d" % rng.randint(300, 900),
+                  "Total DisplayList:  %.2f kB" % rng.uniform(100, 400)]
+        return "\n".join(lines)
+
+    def logcat(self, begin, seconds):
+        '''
+        logcat -v threadtime 在 seconds 秒内的输出，[[相对命令启动的秒数, 一行], ...]
+        :param float begin: 命令启动时相对录制开始的秒数
+        '''
+        rng = random.Random(self.sdk * 17)
+        app = self.process(PACKAGE)
+        sources = [(self.process("system_server"), ["I ActivityManager", "W ActivityManager", "D ConnectivityService"]),
+                   (self.process("/system/bin/surfaceflinger"), ["I SurfaceFlinger"]),
+                   (self.process("com.android.systemui"), ["D StatusBar"]),
+                   (app, ["I TBMainActivity", "D mtopsdk.mtop", "W libc", "I chatty"]),
+                   (self.process(PACKAGE + ":channel"), ["I ACCS", "D accs.ElectionService"])]
+        stream = []
+        offset = 0.0
+        while True:
+            offset += rng.expovariate(40)
+            if offset > seconds:
+                break
+            proc, tags = rng.choice(sources)
+            tag = rng.choice(tags)
+            tid = proc.pid if rng.random() < 0.3 else proc.pid + rng.randint(1, proc.threads)
+            millis = int((LOGCAT_BEGIN + begin + offset) * 1000)
+            stamp = "10-19 %02d:%02d:%02d.%03d" % (millis // 3600000 % 24, millis // 60000 % 60, millis // 1000 % 60,
+                                                   millis % 1000)
+            message = rng.choice(["request finished, cost=%dms" % rng.randint(20, 800),
+                                  "onTrimMemory level=%d" % rng.choice([5, 10, 15]),
+                                  "uid=%d(%s) identical %d lines" % (APP_UID, PACKAGE, rng.randint(1, 9)),
+                                  "Skipped %d frames!  The application may be doing too much work on its main thread."
+                                  % rng.randint(30, 90)])
+            stream.append([round(offset, 4), "%s %5d %5d %s: %s" % (stamp, proc.pid, tid, tag, message)])
+        return stream
+
+
+def _grep(cmd, patterns, out):
+    '''与 ADB.run_filtered_shell_cmd 一致，设备端 grep -F 过滤时录制到的命令和输出'''
+    expr = " ".join("-e '%s'" % pattern for pattern in patterns)
+    lines = [line for line in out.splitlines() if any(pattern in line for pattern in patterns)]
+    return 'shell "%s | grep -F %s"' % (cmd, expr), "\n".join(lines)
+
+
+def replay_session(sdk, samples=5, interval=1):
+    '''
+    replay.py 格式的录制文件，collector_bench 用：sdk 版本的设备上测试包在前台，
+    cpu、内存、流量、帧率按 interval 秒采集 samples 次，加上整段 logcat
+    命令和输出与真机录制的一致（设备支持 grep，没有root），同一命令的多次输出按采集顺序排列，回放时循环使用
+    '''
+    from mobileperf.android.cpu_top import PckCpuinfo
+    from mobileperf.android.meminfos import MemInfoDevice, MemInfoPackage
+    from mobileperf.android.trafficstats import NetDevInfo
+
+    device = Device(sdk)
+    rng = random.Random(sdk * 19)
+    activity = PACKAGE + "/com.taobao.tao.TBMainActivity"
+    top_cmd = "top -b -n 1 -d %d" % interval
+    records = []
+
+    def add(t, cmd, out, low=0.02, high=0.08):
+        records.append({"cmd": cmd, "t": round(t, 4), "cost": round(rng.uniform(low, high), 4), "out": out})
+
+    # 设备能力探测，RUNTIME_PROBES 以外的探测结果回放时不缓存，每个collector都会探测
+    add(0, "shell getprop ro.build.version.sdk", str(sdk))
+    add(0, "shell getprop", device.getprop())
+    add(0.1, "shell " + top_cmd, device.top_toybox().strip(), interval, interval + 0.3)
+    add(0.1, "shell dumpsys SurfaceFlinger --latency-clear", "")
+    add(0.1, "shell ls /proc/net/xt_qtaguid/stats", "ls: /proc/net/xt_qtaguid/stats: No such file or directory")
+    add(0.1, 'shell "echo mobileperf | grep -F -e perf -e none"', "mobileperf")
+    add(0.1, "shell su 0 id", "/system/bin/sh: su: inaccessible or not found")
+    add(0.1, "shell id", "uid=2000(shell) gid=2000(shell) groups=2000(shell),1004(input),1007(log),1011(adb),"
+                         "1015(sdcard_rw),1028(sdcard_r),3001(net_bt_admin),3002(net_bt),3003(inet),3006(net_bw_stats),"
+                         "3009(readproc),3011(uhid) context=u:r:shell:s0")
+    add(0.2, "shell mkdir /data/local/tmp", "mkdir: '/data/local/tmp': File exists")
+    add(0.2, "shell setenforce 0", "setenforce: Couldn't set enforcing status to '0': Permission denied")
+    add(0.2, "shell logcat -c  -b all", "")
+    records.append({"cmd": "shell logcat -v threadtime  -b all", "t": 0.3,
+                    "stream": device.logcat(0.3, samples * interval)})
+    device.advance(0.5)
+    add(0.5, "shell dumpsys window windows", device.window_windows(activity), 0.1, 0.3)
+    for i in range(samples):
+        t = 1 + i * interval
+        device.advance(interval)
+        cmd, out = _grep(top_cmd, PckCpuinfo.filter_patterns([PACKAGE]), device.top_toybox())
+        records.append({"cmd": cmd, "t": round(t, 4), "stream": [[round(interval + rng.uniform(0.01, 0.1), 4), out]]})
+        cmd, out = _grep("dumpsys meminfo %s" % PACKAGE, MemInfoPackage.FILTER_PATTERNS, device.meminfo_package())
+        add(t, cmd, out, 0.3, 0.9)
+        cmd, out = _grep("cat /proc/net/dev", NetDevInfo.FILTER_PATTERNS, device.net_dev())
+        add(t, cmd, out)
+        cmd, out = _grep("ps -A", ["PID", PACKAGE], device.ps())
+        add(t, cmd, out, 0.05, 0.15)
+        cmd, out = _grep("cat /proc/%d/net/dev" % device.process(PACKAGE).pid, NetDevInfo.FILTER_PATTERNS,
+                         device.net_dev())
+        add(t, cmd, out)
+        add(t, "shell dumpsys SurfaceFlinger --latency %s" % activity, device.sf_latency(), 0.03, 0.1)
+        if sdk >= 26:
+            add(t, "shell dumpsys gfxinfo %s framestats" % PACKAGE, device.gfxinfo(activity), 0.1, 0.3)
+        if i == 0:
+            # 第一次采集内存时清理旧的hprof、采集整机meminfo；am dumpheap 的文件名带时间，回放时匹配不上，不录制
+            add(t, "shell ls -l /data/local/tmp", "total 8\ndrwxrwxrwx 2 shell shell 4096 2021-10-19 10:12 traces")
+            cmd, out = _grep("dumpsys meminfo", MemInfoDevice.filter_patterns([PACKAGE]), device.meminfo_device("K"))
+            add(t, cmd, out, 1.0, 2.5)
+    records.sort(key=lambda record: record["t"])
+    return "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+
+
+# fixture 文件名 -> 生成函数
+FIXTURES = {"top/sdk19_toolbox.txt": lambda: Device(19).top_toolbox(),
+            "top/sdk23_toolbox.txt": lambda: Device(23).top_toolbox(),
+            "top/sdk25_toolbox.txt": lambda: Device(25).top_toolbox(),
+            "top/sdk26_toybox.txt": lambda: Device(26).top_toybox(),
+            "top/sdk29_toybox.txt": lambda: Device(29).top_toybox(),
+            "top/sdk34_toybox.txt": lambda: Device(34).top_toybox(),
+            "meminfo_device/sdk19_kb.txt": lambda: Device(19).meminfo_device("kB"),
+            "meminfo_device/sdk24_k.txt": lambda: Device(24).meminfo_device("K"),
+            "meminfo_device/sdk26_swapcol.txt": lambda: Device(26).meminfo_device("swap"),
+            "meminfo_device/sdk30_k.txt": lambda: Device(30).meminfo_device("K"),
+            "meminfo_device/sdk34_rss_first.txt": lambda: Device(34).meminfo_device("rss"),
+            "meminfo_package/sdk19.txt": lambda: Device(19).meminfo_package(),
+            "meminfo_package/sdk23.txt": lambda: Device(23).meminfo_package(),
+            "meminfo_package/sdk28.txt": lambda: Device(28).meminfo_package(),
+            "meminfo_package/sdk30_rss.txt": lambda: Device(30).meminfo_package(),
+            "meminfo_package/sdk34_rss.txt": lambda: Device(34).meminfo_package(),
+            "xt_qtaguid/sdk23.txt": lambda: Device(23).xt_qtaguid(),
+            "xt_qtaguid/sdk28.txt": lambda: Device(28).xt_qtaguid(),
+            "replay/sdk30_session.jsonl": lambda: replay_session(30)}
+
+
+def main(argv):
+    output = FIXTURE_DIR
+    if argv[:1] == ["--output"] and len(argv) == 2:
+        output = argv[1]
+    elif argv:
+        print(USAGE)
+        return 2
+    for name in sorted(FIXTURES):
+        path = os.path.join(output, name)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "w", encoding="utf-8", newline="\n") as f:
+            f.write(FIXTURES[name]())
+        logger.info("write fixture %s" % path)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
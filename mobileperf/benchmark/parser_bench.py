@@ -0,0 +1,377 @@
+# -*- coding: utf-8 -*-
+'''
+@author:     look
+
+@copyright:  1999-2020 Alibaba.com. All rights reserved.
+
+@license:    Apache Software License 2.0
+
+@contact:    390125133@qq.com
+'''
+'''
+解析器基准测试：fixtures 目录下按解析器分类存放各Android版本(sdk19-34)格式的命令输出，
+是 make_fixtures.py 生成的合成数据，不是真机录制的
+1. 校验解析结果与 golden.json 一致，防止优化解析器时改变结果
+2. 统计每MB输入的解析耗时和 tracemalloc 峰值内存，与 baseline.json 比较，超过阈值则失败
+3. --device-filter 时按collector在设备端的 grep -F 规则过滤fixture，比较过滤前后的字节数和解析耗时，
+   过滤后解析结果与过滤前不一致则失败
+'''
+import os
+import re
+import sys
+import json
+import time
+import logging
+import tracemalloc
+
+BaseDir=os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BaseDir,'../..'))
+
+from mobileperf.common.log import logger
+from mobileperf.android.cpu_top import PckCpuinfo
+from mobileperf.android.meminfos import MemInfoPackage, MemInfoDevice
+from mobileperf.android.trafficstats import TrafficSnapshot, NetDevInfo
+from mobileperf.android.powerconsumption import DevicePowerInfo
+from mobileperf.android.fps import parse_gfxinfo_framestats, parse_surfaceflinger_latency
+from mobileperf.android.thermal import ThermalInfo
+from mobileperf.android.proc_io import ProcIoSnapshot
+from mobileperf.android.mempressure import PressureSnapshot, LmkdKill
+
+USAGE = '''用法: python mobileperf/benchmark/parser_bench.py [--parser top,gfxinfo] [--min-time 0.2] [--threshold 0.3]
+        [--mem-threshold 0.2] [--update-baseline] [--update-golden] [--device-filter] [--output 结果json]'''
+
+FIXTURE_DIR = os.path.join(BaseDir, "fixtures")
+GOLDEN_FILE = os.path.join(FIXTURE_DIR, "golden.json")
+BASELINE_FILE = os.path.join(FIXTURE_DIR, "baseline.json")
+MB = 1024 * 1024
+
+# fixtures 录制时的测试包名、uid和焦点窗口
+PACKAGE = "com.taobao.taobao"
+PACKAGES = [PACKAGE, PACKAGE + ":channel"]
+UID = "10123"
+FOCUS_WINDOW = PACKAGE + "/com.taobao.tao.TBMainActivity"
+
+
+def _top(text, sdk):
+    info = PckCpuinfo(PACKAGES, text, sdk)
+    return {"device_cpu_rate": info.device_cpu_rate, "user_rate": info.user_rate, "system_rate": info.system_rate,
+            "idle_rate": info.idle_rate, "package_list": info.package_list, "total_pid_cpu": info.total_pid_cpu}
+
+
+def _meminfo_package(text, sdk):
+    info = MemInfoPackage(text)
+    return {"pid": info.pid, "processName": info.processName, "totalPSS": info.totalPSS, "javaHeap": info.javaHeap,
+            "nativeHeap": info.nativeHeap, "system": info.system, "totalAllocHeap": info.totalAllocHeap}
+
+
+def _meminfo_device(text, sdk):
+    info = MemInfoDevice(text, PACKAGES)
+    return {"totalmem": info.totalmem, "freemem": info.freemem, "usedmem": info.usedmem,
+            "package_pid_pss_list": info.package_pid_pss_list, "total_pss": info.total_pss}
+
+
+def _xt_qtaguid(text, sdk):
+    info = TrafficSnapshot(text, PACKAGE, UID)
+    return {"rx_uid_bytes": info.rx_uid_bytes, "tx_uid_bytes": info.tx_uid_bytes, "rx_uid_packets": info.rx_uid_packets,
+            "tx_uid_packets": info.tx_uid_packets, "lo_uid_bytes": info.lo_uid_bytes, "fg_bytes": info.fg_bytes,
+            "bg_bytes": info.bg_bytes}
+
+
+def _net_dev(text, sdk):
+    info = NetDevInfo(text)
+    return {"wifi_rx": info.wifi_rx, "wifi_tx": info.wifi_tx, "mobile_rx": info.mobile_rx, "mobile_tx": info.mobile_tx,
+            "total": info.total}
+
+
+def _battery(text, sdk):
+    info = DevicePowerInfo(text)
+    return {"level": info.level, "voltage": info.voltage, "temp": info.temp, "current": info.current}
+
+
+def _thermal(text, sdk):
+    info = ThermalInfo(text)
+    return {"cores": info.cores, "zones": info.zones, "online": info.online_cores(), "hottest": info.hottest_zone(),
+            "freq_cap": info.freq_cap(), "capped": info.capped_cores(95)}
+
+
+def _proc_io(text, sdk):
+    info = ProcIoSnapshot(text)
+    return {"io": info.io, "tasks": info.tasks}
+
+
+def _pressure(text, sdk):
+    info = PressureSnapshot(text)
+    return {"psi": {"%s_%s" % key: value for key, value in info.psi.items()}, "vmstat": info.vmstat,
+            "majflt": info.majflt}
+
+
+def _lmkd(text, sdk):
+    return [kill for kill in (LmkdKill.parse(line) for line in text.split("\n")) if kill]
+
+
+def _summary_timestamps(timestamps):
+    if not timestamps:
+        return {"frames": 0}
+    return {"frames": len(timestamps), "first": timestamps[0], "last": timestamps[-1]}
+
+
+def _gfxinfo(text, sdk):
+    return _summary_timestamps(parse_gfxinfo_framestats(text, FOCUS_WINDOW))
+
+
+def _sf_latency(text, sdk):
+    refresh_period, timestamps = parse_surfaceflinger_latency(text)
+    result = _summary_timestamps(timestamps)
+    result["refresh_period"] = refresh_period
+    return result
+
+
+# 各解析器对应命令在设备端过滤时保留的行，与collector中使用的一致
+FILTERS = {"top": PckCpuinfo.filter_patterns(PACKAGES),
+           "meminfo_package": MemInfoPackage.FILTER_PATTERNS,
+           "meminfo_device": MemInfoDevice.filter_patterns(PACKAGES),
+           "xt_qtaguid": TrafficSnapshot.filter_patterns(UID),
+           "net_dev": NetDevInfo.FILTER_PATTERNS}
+
+
+def device_grep(text, patterns):
+    '''模拟设备端的 grep -F -e pattern ...，输出经 run_shell_cmd strip
+    '''
+    return "\n".join(line for line in text.split("\n") if any(pattern in line for pattern in patterns)).strip()
+
+
+# 解析器名与 fixtures 下的子目录名一致
+PARSERS = {"top": _top,
+           "meminfo_package": _meminfo_package,
+           "meminfo_device": _meminfo_device,
+           "xt_qtaguid": _xt_qtaguid,
+           "net_dev": _net_dev,
+           "battery": _battery,
+           "gfxinfo": _gfxinfo,
+           "sf_latency": _sf_latency,
+           "thermal": _thermal,
+           "proc_io": _proc_io,
+           "pressure": _pressure,
+           "lmkd": _lmkd}
+
+
+def _normalize(value):
+    '''解析结果转成json可比较的形式，tuple 和 list 统一
+    '''
+    return json.loads(json.dumps(value))
+
+
+def calibrate(min_time=0.2):
+    '''测一段固定的字符串处理耗时，用来抵消不同机器的速度差异，单位ms
+    '''
+    text = "\n".join("%5d u0_a%d 10 -10 5.1G 312M 201M S %d.3 8.5 12:03.45 com.example.process%d" % (i, i, i % 10, i)
+                     for i in range(2000))
+    pattern = re.compile(r"S (\d+)\.\d+")
+    reps = 0
+    begin = time.perf_counter()
+    while True:
+        for line in text.split("\n"):
+            pattern.search(line)
+            line.split()
+        reps += 1
+        elapsed = time.perf_counter() - begin
+        if elapsed >= min_time:
+            return elapsed * 1000 / reps
+
+
+class ParserBench(object):
+    def __init__(self, parsers=None, min_time=0.2, threshold=0.3, mem_threshold=0.2):
+        '''
+        :param list parsers: 要测试的解析器，为空则测试全部
+        :param float min_time: 每个fixture至少循环解析的时长，单位秒
+        :param float threshold: 耗时超过baseline的比例阈值
+        :param float mem_threshold: 峰值内存超过baseline的比例阈值
+        '''
+        self.parsers = parsers if parsers else sorted(PARSERS.keys())
+        self.min_time = min_time
+        self.threshold = threshold
+        self.mem_threshold = mem_threshold
+        self.golden = self._load_json(GOLDEN_FILE)
+        self.baseline = self._load_json(BASELINE_FILE)
+        self.failures = []
+
+    @staticmethod
+    def _load_json(path):
+        if not os.path.exists(path):
+            return {}
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+
+    @staticmethod
+    def _save_json(path, data):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+            f.write("\n")
+
+    def fixtures(self):
+        for parser in self.parsers:
+            parser_dir = os.path.join(FIXTURE_DIR, parser)
+            if not os.path.isdir(parser_dir):
+                continue
+            for name in sorted(os.listdir(parser_dir)):
+                if name.endswith(".txt"):
+                    match = re.match(r"sdk(\d+)", name)
+                    sdk = int(match.group(1)) if match else 0
+                    yield parser, "%s/%s" % (parser, name), os.path.join(parser_dir, name), sdk
+
+    def bench_one(self, parser, path, sdk):
+        with open(path, encoding="utf-8") as f:
+            text = f.read()
+        size = len(text.encode("utf-8"))
+        func = PARSERS[parser]
+        result = _normalize(func(text, sdk))
+        reps = 0
+        begin = time.perf_counter()
+        while True:
+            func(text, sdk)
+            reps += 1
+            elapsed = time.perf_counter() - begin
+            if elapsed >= self.min_time:
+                break
+        tracemalloc.start()
+        func(text, sdk)
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return result, {"bytes": size,
+                        "reps": reps,
+                        "us_per_call": round(elapsed * 1e6 / reps, 2),
+                        "ms_per_mb": round(elapsed * 1000 / reps / (float(size) / MB), 3),
+                        "peak_kb": round(peak / 1024.0, 2),
+                        "peak_per_input": round(float(peak) / size, 3)}
+
+    def _time_parse(self, func, text, sdk):
+        reps = 0
+        begin = time.perf_counter()
+        while True:
+            func(text, sdk)
+            reps += 1
+            elapsed = time.perf_counter() - begin
+            if elapsed >= self.min_time:
+                return elapsed * 1e6 / reps
+
+    def bench_filter(self, parser, key, path, sdk):
+        '''
+        比较设备端过滤前后的数据量和解析耗时
+        :return: 结果行，不支持过滤的解析器返回None
+        '''
+        patterns = FILTERS.get(parser)
+        if not patterns:
+            return None
+        with open(path, encoding="utf-8") as f:
+            text = f.read()
+        filtered = device_grep(text, patterns)
+        func = PARSERS[parser]
+        if _normalize(func(filtered, sdk)) != _normalize(func(text, sdk)):
+            self.failures.append("%s: parse result differs after device filter" % key)
+        size = len(text.encode("utf-8"))
+        filtered_size = len(filtered.encode("utf-8"))
+        us_full = self._time_parse(func, text, sdk)
+        us_filtered = self._time_parse(func, filtered, sdk)
+        return {"fixture": key, "sdk": sdk, "bytes": size, "filtered_bytes": filtered_size,
+                "bytes_ratio": round(float(size) / max(filtered_size, 1), 1),
+                "us_per_call": round(us_full, 2), "filtered_us_per_call": round(us_filtered, 2),
+                "parse_ratio": round(us_full / max(us_filtered, 0.01), 1)}
+
+    def run_filter(self):
+        self.failures = []
+        level = logger.level
+        logger.setLevel(logging.WARNING)
+        rows = []
+        try:
+            for parser, key, path, sdk in self.fixtures():
+                row = self.bench_filter(parser, key, path, sdk)
+                if row:
+                    rows.append(row)
+        finally:
+            logger.setLevel(level)
+        return rows
+
+    def _check(self, key, result, stats, calibration):
+        if key in self.golden and self.golden[key] != result:
+            self.failures.append("%s: parse result differs from golden, expect %s, got %s" % (key, self.golden[key], result))
+        base = self.baseline.get("fixtures", {}).get(key)
+        if not base:
+            return
+        # 按校准耗时换算到baseline所在机器的速度
+        scale = self.baseline.get("calibration_ms", calibration) / calibration
+        ms_per_mb = stats["ms_per_mb"] * scale
+        stats["normalized_ms_per_mb"] = round(ms_per_mb, 3)
+        if ms_per_mb > base["ms_per_mb"] * (1 + self.threshold):
+            self.failures.append("%s: %.3f ms/MB, baseline %.3f ms/MB, regress more than %d%%"
+                                 % (key, ms_per_mb, base["ms_per_mb"], self.threshold * 100))
+        if stats["peak_kb"] > base["peak_kb"] * (1 + self.mem_threshold):
+            self.failures.append("%s: peak %.2f KB, baseline %.2f KB, regress more than %d%%"
+                                 % (key, stats["peak_kb"], base["peak_kb"], self.mem_threshold * 100))
+
+    def run(self, update_golden=False, update_baseline=False):
+        self.failures = []
+        level = logger.level
+        # 解析器里有大量debug日志，测量的是解析本身的耗时
+        logger.setLevel(logging.WARNING)
+        rows = []
+        try:
+            calibration = calibrate(max(self.min_time, 0.3))
+            results = {}
+            for parser, key, path, sdk in self.fixtures():
+                result, stats = self.bench_one(parser, path, sdk)
+                results[key] = (result, stats)
+                if not update_golden and not update_baseline:
+                    self._check(key, result, stats, calibration)
+                row = {"fixture": key, "sdk": sdk}
+                row.update(stats)
+                rows.append(row)
+        finally:
+            logger.setLevel(level)
+        if update_golden:
+            for key, (result, stats) in results.items():
+                self.golden[key] = result
+            self._save_json(GOLDEN_FILE, self.golden)
+        if update_baseline:
+            fixtures = self.baseline.get("fixtures", {})
+            for key, (result, stats) in results.items():
+                fixtures[key] = {"ms_per_mb": stats["ms_per_mb"], "peak_kb": stats["peak_kb"]}
+            self.baseline = {"calibration_ms": round(calibration, 4), "fixtures": fixtures}
+            self._save_json(BASELINE_FILE, self.baseline)
+        return rows
+
+
+def main(argv):
+    options = {"--parser": None, "--min-time": "0.2", "--threshold": "0.3", "--mem-threshold": "0.2", "--output": None}
+    flags = set()
+    i = 0
+    while i < len(argv):
+        if argv[i] in options and i + 1 < len(argv):
+            options[argv[i]] = argv[i + 1]
+            i += 1
+        elif argv[i] in ("--update-baseline", "--update-golden", "--device-filter"):
+            flags.add(argv[i])
+        else:
+            print(USAGE)
+            return 2
+        i += 1
+    parsers = options["--parser"].split(",") if options["--parser"] else None
+    bench = ParserBench(parsers, float(options["--min-time"]), float(options["--threshold"]),
+                        float(options["--mem-threshold"]))
+    if "--device-filter" in flags:
+        rows = bench.run_filter()
+    else:
+        rows = bench.run("--update-golden" in flags, "--update-baseline" in flags)
+    from mobileperf.benchmark.collector_bench import CollectorBench
+    print(CollectorBench.format_table(rows))
+    if options["--output"]:
+        with open(options["--output"], "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=2)
+    if bench.failures:
+        for failure in bench.failures:
+            print("FAIL " + failure)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+'''
+@author:     look
+
+@copyright:  1999-2020 Alibaba.com. All rights reserved.
+
+@license:    Apache Software License 2.0
+
+@contact:    390125133@qq.com
+'''
+'''
+xlsx写入基准测试：生成和 cpuinfo.csv 相同列的百万行数据，分别用逐行 write_row 和按列类型整块写入的
+write_rows 写一个sheet，统计普通模式和 constant_memory 模式下的写入速度(行/秒)和 close 耗时，
+并校验两种方式生成的sheet内容一致
+--package 时对比 close 时打包xlsx的方式：临时文件(默认)、in_memory 和直接写入zip条目的 streaming，
+以及 deflate 压缩级别，统计打包耗时、读写的字节数(/proc/self/io)和文件大小，报告大小的工作簿可用 --rows 100000 --sheets 4
+'''
+import os
+import sys
+import json
+import time
+import shutil
+import zipfile
+import tempfile
+
+BaseDir=os.path.dirname(__file__)
+sys.path.append(os.path.join(BaseDir,'../..'))
+
+from mobileperf.common.log import logger
+from mobileperf.common.utils import TimeUtils
+from mobileperf.extlib import xlsxwriter
+from mobileperf.android.excel import Excel, to_excel_date
+
+USAGE = '''用法: python mobileperf/benchmark/xlsx_bench.py [--rows 1000000] [--modes normal,constant_memory]
+        [--output 结果json]
+      python mobileperf/benchmark/xlsx_bench.py --package [--rows 100000] [--sheets 4] [--levels default,1]
+        [--output 结果json]'''
+
+TITLE = ["datetime", "device_cpu_rate%", "user%", "system%", "idle%", "package", "pid", "pid_cpu%"]
+MODES = ["normal", "constant_memory"]
+PACKAGE_MODES = ["temp_file", "in_memory", "streaming"]
+SHEET_XML = "xl/worksheets/sheet1.xml"
+
+
+def make_lines(rows, start=1577808000):
+    '''
+    和 Excel.read_csv 的结果相同：表头加数据行，时间是Excel日期序列数，数字是float，每1000行有一个断点行
+    '''
+    lines = [TITLE]
+    for i in range(rows):
+        timestamp = to_excel_date(TimeUtils.formatTimeStamp(start + i))
+        if i % 1000 == 999:
+            lines.append([timestamp] + [''] * (len(TITLE) - 1))
+            continue
+        device_cpu = float(20 + i % 60)
+        lines.append([timestamp, device_cpu, device_cpu * 0.6, device_cpu * 0.4, 100.0 - device_cpu,
+                      "com.taobao.taobao", 12345.0, round(device_cpu / 3.0, 2)])
+    return lines
+
+
+class XlsxBench(object):
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.lines = make_lines(rows)
+        self.col_types = Excel.column_types(self.lines)
+        self.results = []
+
+    def run_one(self, mode, method, xlsx_file):
+        workbook = xlsxwriter.Workbook(xlsx_file, {'constant_memory': mode == "constant_memory"})
+        worksheet = workbook.add_worksheet("cpuinfo")
+        worksheet.write_row(0, 0, self.lines[0])
+        begin = time.perf_counter()
+        if method == "write_row":
+            for l, line in enumerate(self.lines[1:], 1):
+                worksheet.write_row(l, 0, line)
+        else:
+            worksheet.write_rows(1, 0, self.lines[1:], self.col_types)
+        write_time = time.perf_counter() - begin
+        begin = time.perf_counter()
+        workbook.close()
+        close_time = time.perf_counter() - begin
+        return {"mode": mode, "method": method, "rows": self.rows,
+                "write(s)": round(write_time, 2), "rows/s": int(self.rows / write_time) if write_time else 0,
+                "close(s)": round(close_time, 2), "total(s)": round(write_time + close_time, 2),
+                "size(MB)": round(os.path.getsize(xlsx_file) / 1024.0 / 1024.0, 1)}
+
+    def run(self, modes=None):
+        self.results = []
+        tmp_dir = tempfile.mkdtemp(prefix="xlsx_bench_")
+        try:
+            for mode in modes or MODES:
+                files = []
+                for method in ("write_row", "write_rows"):
+                    logger.info("bench xlsx: %s %s %d rows" % (mode, method, self.rows))
+                    xlsx_file = os.path.join(tmp_dir, "%s_%s.xlsx" % (mode, method))
+                    self.results.append(self.run_one(mode, method, xlsx_file))
+                    files.append(xlsx_file)
+                before, after = self.results[-2:]
+                after["speedup"] = round(after["rows/s"] / float(before["rows/s"]), 2) if before["rows/s"] else 0
+                before["speedup"] = 1.0
+                after["same_xml"] = before["same_xml"] = self.same_sheet(*files)
+                for xlsx_file in files:
+                    os.remove(xlsx_file)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        return self.results
+
+    @staticmethod
+    def same_sheet(file1, file2):
+        with zipfile.ZipFile(file1) as zip1, zipfile.ZipFile(file2) as zip2:
+            return zip1.read(SHEET_XML) == zip2.read(SHEET_XML)
+
+    @staticmethod
+    def format_table(rows):
+        if not rows:
+            return ""
+        columns = list(rows[0].keys())
+        widths = [max(len(col), max(len(str(row.get(col))) for row in rows)) for col in columns]
+        lines = ["  ".join(col.ljust(w) for col, w in zip(columns, widths))]
+        for row in rows:
+            lines.append("  ".join(str(row.get(col)).ljust(w) for col, w in zip(columns, widths)))
+        return "\n".join(lines)
+
+
+def io_counters():
+    '''
+    本进程读写的字节数(rchar, wchar)，包括页缓存，没有 /proc/self/io 时返回 (0, 0)
+    '''
+    counters = {}
+    try:
+        with open("/proc/self/io", "r") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                counters[key] = int(value)
+    except (IOError, ValueError):
+        pass
+    return counters.get("rchar", 0), counters.get("wchar", 0)
+
+
+class PackageBench(object):
+    '''
+    同样的工作簿用不同的打包方式保存，只统计 close() 的耗时：临时文件方式先把每个xml写成临时文件
+    再读回写入zip，in_memory 先写到内存，streaming 直接写到zip条目中
+    '''
+
+    def __init__(self, rows, sheets):
+        self.rows = rows
+        self.sheets = sheets
+        self.lines = make_lines(rows)
+        self.col_types = Excel.column_types(self.lines)
+        self.results = []
+
+    def run_one(self, mode, level, xlsx_file, tmp_dir):
+        options = {"tmpdir": tmp_dir}
+        if mode != "temp_file":
+            options[mode] = True
+        if level is not None:
+            options["compress_level"] = level
+        workbook = xlsxwriter.Workbook(xlsx_file, options)
+        for index in range(self.sheets):
+            worksheet = workbook.add_worksheet("sheet%d" % index)
+            worksheet.write_row(0, 0, self.lines[0])
+            worksheet.write_rows(1, 0, self.lines[1:], self.col_types)
+            chart = workbook.add_chart({"type": "line"})
+            chart.add_series({"categories": [worksheet.name, 1, 0, self.rows, 0],
+                              "values": [worksheet.name, 1, 7, self.rows, 7]})
+            worksheet.insert_chart("L3", chart)
+        read_before, write_before = io_counters()
+        begin = time.perf_counter()
+        workbook.close()
+        close_time = time.perf_counter() - begin
+        read_after, write_after = io_counters()
+        return {"mode": mode, "level": "default" if level is None else level, "rows": self.rows,
+                "sheets": self.sheets, "close(s)": round(close_time, 2),
+                "read(MB)": round((read_after - read_before) / 1024.0 / 1024.0, 1),
+                "write(MB)": round((write_after - write_before) / 1024.0 / 1024.0, 1),
+                "size(MB)": round(os.path.getsize(xlsx_file) / 1024.0 / 1024.0, 1)}
+
+    def run(self, levels=None):
+        self.results = []
+        tmp_dir = tempfile.mkdtemp(prefix="xlsx_bench_")
+        try:
+            for level in levels or [None]:
+                files = []
+                for mode in PACKAGE_MODES:
+                    logger.info("bench xlsx package: %s level %s, %d sheets x %d rows"
+                                % (mode, level, self.sheets, self.rows))
+                    xlsx_file = os.path.join(tmp_dir, "%s.xlsx" % mode)
+                    self.results.append(self.run_one(mode, level, xlsx_file, tmp_dir))
+                    files.append(xlsx_file)
+                same = all(XlsxBench.same_sheet(files[0], xlsx_file) for xlsx_file in files[1:])
+                for result in self.results[-len(files):]:
+                    result["same_xml"] = same
+                for xlsx_file in files:
+                    os.remove(xlsx_file)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        return self.results
+
+
+def main(argv):
+    options = {"--rows": None, "--modes": ",".join(MODES), "--output": None,
+               "--sheets": "4", "--levels": "default,1"}
+    package = False
+    i = 0
+    while i < len(argv):
+        if argv[i] == "--package":
+            package = True
+        elif argv[i] in options and i + 1 < len(argv):
+            options[argv[i]] = argv[i + 1]
+            i += 1
+        else:
+            print(USAGE)
+            return 1
+        i += 1
+    if package:
+        levels = [None if level == "default" else int(level) for level in options["--levels"].split(",")]
+        bench = PackageBench(int(options["--rows"] or 100000), int(options["--sheets"]))
+        rows = bench.run(levels)
+        print(XlsxBench.format_table(rows))
+        if options["--output"]:
+            with open(options["--output"], "w", encoding="utf-8") as f:
+                json.dump(rows, f, indent=2)
+        return 0 if all(row["same_xml"] for row in rows) else 1
+    modes = options["--modes"].split(",")
+    for mode in modes:
+        if mode not in MODES:
+            print("unknown mode: %s, choose from %s" % (mode, ",".join(MODES)))
+            return 1
+    bench = XlsxBench(int(options["--rows"] or 1000000))
+    rows = bench.run(modes)
+    print(XlsxBench.format_table(rows))
+    if options["--output"]:
+        with open(options["--output"], "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=2)
+    return 0 if all(row["same_xml"] for row in rows) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
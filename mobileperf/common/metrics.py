@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+'''
+@author:     look
+
+@copyright:  1999-2020 Alibaba.com. All rights reserved.
+
+@license:    Apache Software License 2.0
+
+@contact:    390125133@qq.com
+'''
+'''
+工具自身的指标：adb命令耗时直方图、各collector单次循环耗时、错过采集周期次数、队列长度、从设备读取的字节数、
+PC端本进程的cpu和内存，定期写到结果目录的 tool_metrics.csv，最新快照写到 tool_metrics.json 供web服务读取，
+用来确认测试工具本身没有干扰被测设备
+'''
+import os
+import re
+import sys
+import csv
+import json
+import time
+import threading
+
+BaseDir=os.path.dirname(__file__)
+sys.path.append(os.path.join(BaseDir,'../..'))
+
+from mobileperf.common.log import logger
+from mobileperf.common.utils import TimeUtils
+
+try:
+    import resource
+except ImportError:
+    # windows 没有resource模块
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+METRICS_CSV = "tool_metrics.csv"
+METRICS_JSON = "tool_metrics.json"
+METRICS_TITLE = ["datetime", "metric", "type", "count", "value", "avg", "p50", "p95", "max"]
+
+# 直方图桶的上界，单位ms
+DEFAULT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000)
+
+
+class Histogram(object):
+    '''固定桶的直方图，分位数取所在桶的上界，超过最后一个桶的用最大值
+    '''
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def observe(self, value):
+        index = 0
+        while index < len(self.buckets) and value > self.buckets[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, percent):
+        if not self.count:
+            return 0
+        rank = percent / 100.0 * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                if index < len(self.buckets):
+                    return min(self.buckets[index], self.max)
+                return self.max
+        return self.max
+
+    def to_dict(self):
+        return {"count": self.count,
+                "sum": round(self.sum, 3),
+                "avg": round(self.sum / self.count, 3) if self.count else 0,
+                "p50": self.percentile(50),
+                "p95": self.percentile(95),
+                "max": round(self.max, 3),
+                "buckets": dict(zip([str(b) for b in self.buckets] + ["inf"], self.counts))}
+
+
+class MetricsRegistry(object):
+    '''
+    计数器、当前值、直方图三类指标，线程安全，各collector和ADB共用一个（一次测试一个）
+    指标名用冒号分隔类别和对象，如 adb_latency:shell top、loop:cpu、missed_deadline:meminfo
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self._last_cpu = None
+
+    def inc(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_gauge(self, name, value):
+        with self._lock:
+            self.gauges[name] = value
+
+    def observe(self, name, value):
+        '''
+        :param str name: 直方图名
+        :param float value: 观测值，耗时类统一用ms
+        '''
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(value)
+
+    def record_loop(self, collector, time_consume, interval):
+        '''记录collector一次采集循环，耗时超过采集间隔即错过了下一个采集周期
+
+        :param str collector: collector名，如 cpu
+        :param float time_consume: 本次循环耗时，单位秒
+        :param float interval: 采集间隔，单位秒
+        '''
+        self.observe("loop:%s" % collector, time_consume * 1000)
+        if interval and interval - time_consume < 0:
+            self.inc("missed_deadline:%s" % collector)
+
+    def record_adb(self, cmd_name, time_consume, nbytes, ok=True):
+        '''记录一次adb同步命令
+
+        :param str cmd_name: 归一化后的命令名，见 adb_cmd_name
+        :param float time_consume: 命令耗时，单位秒
+        :param int nbytes: 从设备读取的字节数
+        :param bool ok: 命令是否执行成功
+        '''
+        self.observe("adb_latency:%s" % cmd_name, time_consume * 1000)
+        self.inc("adb_bytes_read", nbytes)
+        self.inc("adb_bytes_read:%s" % cmd_name, nbytes)
+        if not ok:
+            self.inc("adb_errors:%s" % cmd_name)
+
+    def record_parse(self, collector, nbytes, time_consume):
+        '''记录collector一次采集从设备读取的字节数和PC端解析耗时，
+        bytes_per_tick 是平均每次采集读取的字节数，对比设备端过滤前后的adb数据量
+
+        :param str collector: collector名，如 cpu
+        :param int nbytes: 本次采集读取的字节数
+        :param float time_consume: 本次采集的解析耗时，单位秒
+        '''
+        self.observe("parse:%s" % collector, time_consume * 1000)
+        with self._lock:
+            total = self.counters["tick_bytes:%s" % collector] = self.counters.get("tick_bytes:%s" % collector, 0) + nbytes
+            ticks = self.counters["ticks:%s" % collector] = self.counters.get("ticks:%s" % collector, 0) + 1
+            self.gauges["bytes_per_tick:%s" % collector] = int(total / ticks)
+
+    def sample_host(self):
+        '''采集本进程的cpu占用、内存和线程数
+        '''
+        cpu_time = time.process_time()
+        now = time.time()
+        if self._last_cpu:
+            last_cpu_time, last_now = self._last_cpu
+            if now > last_now:
+                self.set_gauge("host_cpu%", round((cpu_time - last_cpu_time) * 100 / (now - last_now), 2))
+        self._last_cpu = (cpu_time, now)
+        rss = host_rss_mb()
+        if rss is not None:
+            self.set_gauge("host_rss(MB)", rss)
+        self.set_gauge("host_threads", threading.active_count())
+
+    def snapshot(self):
+        '''
+        :return: 所有指标的快照 {"counters": {}, "gauges": {}, "histograms": {名: Histogram.to_dict()}}
+        '''
+        with self._lock:
+            return {"counters": dict(self.counters),
+                    "gauges": dict(self.gauges),
+                    "histograms": dict((name, histogram.to_dict()) for name, histogram in self.histograms.items())}
+
+    def rows(self, timestamp=None):
+        '''快照转为 tool_metrics.csv 的数据行，与 METRICS_TITLE 一一对应
+        '''
+        datetime = TimeUtils.formatTimeStamp(timestamp if timestamp else time.time())
+        snapshot = self.snapshot()
+        rows = []
+        for name in sorted(snapshot["counters"]):
+            rows.append([datetime, name, "counter", "", snapshot["counters"][name], "", "", "", ""])
+        for name in sorted(snapshot["gauges"]):
+            rows.append([datetime, name, "gauge", "", snapshot["gauges"][name], "", "", "", ""])
+        for name in sorted(snapshot["histograms"]):
+            histogram = snapshot["histograms"][name]
+            rows.append([datetime, name, "histogram", histogram["count"], histogram["sum"], histogram["avg"],
+                         histogram["p50"], histogram["p95"], histogram["max"]])
+        return rows
+
+    def reset(self):
+        with self._lock:
+            self.counters = {}
+            self.gauges = {}
+            self.histograms = {}
+            self._last_cpu = None
+
+
+def host_rss_mb():
+    '''本进程的常驻内存，单位MB，取不到返回None
+    '''
+    if psutil:
+        return round(psutil.Process(os.getpid()).memory_info().rss / 1024.0 / 1024, 2)
+    status_file = "/proc/self/status"
+    if os.path.exists(status_file):
+        with open(status_file) as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024.0, 2)
+    if resource:
+        # 取不到当前值时用峰值，mac上单位是字节，linux上是KB
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == "darwin":
+            return round(maxrss / 1024.0 / 1024, 2)
+        return round(maxrss / 1024.0, 2)
+    return None
+
+
+def adb_cmd_name(cmd, argv):
+    '''
+    adb命令归一化为指标名：取前3个词，数字替换为N，避免pid、时间等参数让指标名无限增多
+    如 shell cat /proc/1234/status -> shell cat /proc/N/status
+    '''
+    words = [cmd]
+    for arg in argv:
+        if not isinstance(arg, str):
+            arg = arg.decode('utf8')
+        # 设备端过滤的命令整体带双引号，去掉后与不过滤的命令同名，方便比较读取字节数
+        words.extend(arg.replace('"', ' ').split())
+        if len(words) >= 3:
+            break
+    return re.sub(r"\d+", "N", " ".join(words[:3]))
+
+
+class MetricsReporter(object):
+    '''定期把指标写到结果目录，csv按时间追加，json只保留最新快照
+    '''
+    def __init__(self, registry, save_path, interval=5):
+        self.registry = registry
+        self.save_path = save_path
+        self.interval = interval
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        csv_file = os.path.join(self.save_path, METRICS_CSV)
+        if not os.path.exists(csv_file):
+            with open(csv_file, 'a+', encoding="utf-8") as df:
+                csv.writer(df, lineterminator='\n').writerow(METRICS_TITLE)
+        self._thread = threading.Thread(target=self._report_thread, name="tool_metrics")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=2)
+        # 停止时再写一次，包含测试结束阶段的数据
+        self.flush()
+
+    def flush(self):
+        try:
+            self.registry.sample_host()
+            with open(os.path.join(self.save_path, METRICS_CSV), 'a+', encoding="utf-8") as df:
+                csv.writer(df, lineterminator='\n').writerows(self.registry.rows())
+            json_file = os.path.join(self.save_path, METRICS_JSON)
+            with open(json_file + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(self.registry.snapshot(), f)
+            os.replace(json_file + ".tmp", json_file)
+        except Exception as e:
+            logger.error("write tool metrics failed: %s" % e)
+
+    def _report_thread(self):
+        self.registry.sample_host()
+        while not self._stop_event.wait(self.interval):
+            self.flush()
+
+
+# 没有显式session时共用的指标
+default_registry = MetricsRegistry()
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+'''
+@author:     look
+
+@copyright:  1999-2020 Alibaba.com. All rights reserved.
+
+@license:    Apache Software License 2.0
+
+@contact:    390125133@qq.com
+'''
+'''
+采集循环的调度：按单调时钟上的绝对截止时间触发，不再用 sleep(interval - time_consume)
+1. 同一次测试的collector共用一个时间原点，相同间隔的collector在同一时刻采集，各表的数据能逐行对上
+2. 某次采集超时时，只要下一个周期还没过就立即开始下一次，平均周期不漂移
+3. 连下一个周期也过了才算错过，跳过错过的周期并计数，不会补采造成数据扎堆
+4. 采集失败时按 ok/degraded/offline 状态指数退避，不再空转，恢复后立即回到正常节拍
+'''
+import os
+import sys
+import math
+import time
+
+BaseDir=os.path.dirname(__file__)
+sys.path.append(os.path.join(BaseDir,'../..'))
+
+from mobileperf.common.utils import TimeUtils
+
+# collector 健康状态
+OK = "ok"
+DEGRADED = "degraded"
+OFFLINE = "offline"
+
+
+class CollectorHealth(object):
+    '''
+    collector的健康状态：连续失败时退避的间隔按 interval*2^n 增长，最长 max_backoff
+    设备离线时ADB有熔断，命令直接失败不会启动adb进程，按 offline_probe 间隔重试，设备恢复后能很快继续采集
+    '''
+    def __init__(self, name, interval, max_backoff=30, offline_probe=1, on_change=None):
+        '''
+        :param str name: collector名
+        :param float interval: 采集间隔，单位秒
+        :param float max_backoff: 退避间隔上限，单位秒
+        :param float offline_probe: 设备离线时的重试间隔，单位秒
+        :param on_change: 状态变化回调 on_change(name, old_state, new_state, reason)
+        '''
+        self.name = name
+        self.interval = interval
+        self.max_backoff = max(max_backoff, interval)
+        self.offline_probe = offline_probe
+        self.on_change = on_change
+        self.state = OK
+        self.failures = 0
+
+    def _change(self, state, reason):
+        old_state = self.state
+        if old_state == state:
+            return
+        self.state = state
+        if self.on_change:
+            self.on_change(self.name, old_state, state, reason)
+
+    def failure(self, reason="", offline=False):
+        '''
+        记录一次采集失败
+        :return: 本次失败前是否正常，即数据从这里开始中断
+        '''
+        was_ok = self.state == OK
+        self.failures += 1
+        self._change(OFFLINE if offline else DEGRADED, reason)
+        return was_ok
+
+    def success(self):
+        '''
+        记录一次采集成功
+        :return: 是否从失败中恢复
+        '''
+        recovered = self.state != OK
+        self.failures = 0
+        self._change(OK, "")
+        return recovered
+
+    def backoff(self):
+        '''距离下一次采集至少要等待的时间，单位秒
+        '''
+        if self.state == OK:
+            return 0
+        if self.state == OFFLINE:
+            return self.offline_probe
+        interval = self.interval if self.interval > 0 else 0.1
+        return min(interval * (2 ** (self.failures - 1)), self.max_backoff)
+
+
+class DeadlineTicker(object):
+    '''
+    一个collector循环的节拍器，用法:
+        ticker = session.ticker("cpu", interval, stop_event)
+        while True:
+            collection_time = ticker.next()
+            if collection_time is None:
+                break
+            采集...
+    '''
+    def __init__(self, name, interval, epoch=None, stop_event=None, clock=time.time, metrics=None, health=None):
+        '''
+        :param str name: collector名，用于指标名
+        :param float interval: 采集间隔，单位秒，小于等于0时不等待
+        :param float epoch: time.monotonic() 上的时间原点，共用原点的ticker相位对齐
+        :param threading.Event stop_event: 停止信号，等待期间被置位时 next() 返回None
+        :param clock: 返回采集时间戳的函数，一般为 session.clock
+        :param MetricsRegistry metrics: 记录循环耗时和错过周期数
+        :param CollectorHealth health: 采集失败时的退避策略，为空时失败后按正常节拍重试
+        '''
+        self.name = name
+        self.interval = interval
+        self.epoch = epoch if epoch is not None else time.monotonic()
+        self.stop_event = stop_event
+        self.clock = clock
+        self.metrics = metrics
+        self.health = health
+        self.ticks = 0
+        self.missed = 0
+        self._index = None
+        self._tick_begin = None
+        self._not_before = None
+
+    def deadline(self):
+        '''下一次采集的截止时间（单调时钟）
+        '''
+        if self._index is None:
+            return None
+        return self.epoch + self._index * self.interval
+
+    def defer(self, delay):
+        '''下一次采集至少推迟 delay 秒，推迟跳过的周期不计入错过
+        '''
+        if delay > 0:
+            self._not_before = time.monotonic() + delay
+
+    def fail(self, reason="", offline=False):
+        '''
+        本次采集失败，按健康状态退避
+        :return: 是否刚从正常转为失败，调用方据此在数据中写入断点
+        '''
+        if not self.health:
+            return False
+        started = self.health.failure(reason, offline)
+        self.defer(self.health.backoff())
+        return started
+
+    def ok(self):
+        '''
+        本次采集成功
+        :return: 是否从失败中恢复
+        '''
+        if not self.health:
+            return False
+        return self.health.success()
+
+    def _wait(self, delay):
+        if delay <= 0:
+            return not (self.stop_event and self.stop_event.is_set())
+        if self.stop_event:
+            return not self.stop_event.wait(delay)
+        time.sleep(delay)
+        return True
+
+    def next(self):
+        '''
+        等到下一个采集时刻
+        :return: 采集时间戳（发起采集命令时的时间），收到停止信号时返回None
+        '''
+        now = time.monotonic()
+        if self._tick_begin is not None and self.metrics:
+            self.metrics.record_loop(self.name, now - self._tick_begin, self.interval)
+        if self.interval <= 0:
+            delay = 0
+        elif self._index is None:
+            # 第一次对齐到原点之后的整周期
+            self._index = int(math.ceil((now - self.epoch) / self.interval))
+            delay = self.deadline() - now
+        else:
+            self._index += 1
+            late = now - self.deadline()
+            if late >= self.interval:
+                # 下一个周期也已经过了，跳过错过的周期
+                skipped = int(late // self.interval)
+                self._index += skipped
+                self.missed += skipped
+                if self.metrics:
+                    self.metrics.inc("missed_tick:%s" % self.name, skipped)
+            delay = self.deadline() - now
+        if self._not_before is not None:
+            if self.interval > 0 and self.deadline() < self._not_before:
+                # 退避期间的周期直接跳过，对齐到退避结束后的第一个周期
+                self._index = int(math.ceil((self._not_before - self.epoch) / self.interval))
+                delay = self.deadline() - now
+            elif self.interval <= 0:
+                delay = self._not_before - now
+            self._not_before = None
+        if not self._wait(delay):
+            return None
+        self._tick_begin = time.monotonic()
+        self.ticks += 1
+        return self.clock()
+
+
+def command_budget(interval, factor=2, minimum=5, maximum=60):
+    '''
+    collector单条adb命令的超时时间：采集间隔的 factor 倍，限制在 [minimum, maximum] 秒内
+    命令卡住时按这个时间结束，不会让采集线程一直阻塞，下一个周期照常采集
+    '''
+    return min(max(interval * factor, minimum), maximum)
+
+
+def gap_row(timestamp, columns):
+    '''数据断点：只有时间、其余列为空的一行，excel曲线在这里断开，而不是把断开前后的点直接连起来
+    '''
+    return [TimeUtils.formatTimeStamp(timestamp)] + [""] * (columns - 1)
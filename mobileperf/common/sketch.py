@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+'''
+@author:     look
+
+@copyright:  1999-2020 Alibaba.com. All rights reserved.
+
+@license:    Apache Software License 2.0
+
+@contact:    390125133@qq.com
+'''
+'''
+流式汇总：每列数据一个 DDSketch（固定内存、相对误差有保证、可合并的分位数）加上均值方差等累计量，
+采集时作为 Session 的 sink 逐行更新，测试中定期写到结果目录的 metric_summary.json，
+长时间测试结束时不用重新读一遍csv就能得到 min/mean/p50/p95/p99/max
+'''
+import os
+import sys
+import csv
+import json
+import math
+import threading
+
+BaseDir=os.path.dirname(__file__)
+sys.path.append(os.path.join(BaseDir,'../..'))
+
+from mobileperf.common.log import logger
+
+SUMMARY_JSON = "metric_summary.json"
+SUMMARY_CSV = "metric_summary.csv"
+SUMMARY_TITLE = ["metric", "column", "count", "min", "mean", "stdev", "p50", "p95", "p99", "max"]
+
+# 不做统计的列：标识类的数字
+SKIP_COLUMNS = ("pid", "uid")
+
+
+class DDSketch(object):
+    '''
+    对数分桶的分位数草图，桶 i 覆盖 (gamma^(i-1), gamma^i]，分位数的相对误差不超过 relative_accuracy
+    桶数超过 max_bins 时合并最小的桶，只影响最低分位的精度
+    '''
+
+    def __init__(self, relative_accuracy=0.01, max_bins=2048):
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        # 正数、负数（按绝对值）的桶和0的个数
+        self.bins = {}
+        self.negative_bins = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def _key(self, value):
+        return int(math.ceil(math.log(value) / self._log_gamma))
+
+    def _value(self, key):
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def add(self, value, count=1):
+        if value > 0:
+            key = self._key(value)
+            self.bins[key] = self.bins.get(key, 0) + count
+            if len(self.bins) > self.max_bins:
+                self._collapse(self.bins)
+        elif value < 0:
+            key = self._key(-value)
+            self.negative_bins[key] = self.negative_bins.get(key, 0) + count
+            if len(self.negative_bins) > self.max_bins:
+                self._collapse(self.negative_bins)
+        else:
+            self.zero_count += count
+        self.count += count
+
+    def _collapse(self, bins):
+        keys = sorted(bins)
+        merged = sum(bins.pop(key) for key in keys[:len(keys) - self.max_bins + 1])
+        bins[keys[len(keys) - self.max_bins]] = bins.get(keys[len(keys) - self.max_bins], 0) + merged
+
+    def merge(self, other):
+        '''合并另一个相同精度的sketch，如多次测试或多台设备的同一指标
+        '''
+        if other.gamma != self.gamma:
+            raise ValueError("can't merge sketches with different relative accuracy")
+        for key, count in other.bins.items():
+            self.bins[key] = self.bins.get(key, 0) + count
+        for key, count in other.negative_bins.items():
+            self.negative_bins[key] = self.negative_bins.get(key, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        for bins in (self.bins, self.negative_bins):
+            if len(bins) > self.max_bins:
+                self._collapse(bins)
+
+    def quantile(self, q):
+        '''
+        :param float q: 0-1
+        :return: 没有数据时返回None
+        '''
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for key in sorted(self.negative_bins, reverse=True):
+            seen += self.negative_bins[key]
+            if seen > rank:
+                return -self._value(key)
+        seen += self.zero_count
+        if seen > rank:
+            return 0
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if seen > rank:
+                return self._value(key)
+        return self._value(max(self.bins)) if self.bins else 0
+
+    def to_dict(self):
+        # json的key只能是字符串
+        return {"relative_accuracy": self.relative_accuracy, "max_bins": self.max_bins,
+                "bins": {str(key): count for key, count in self.bins.items()},
+                "negative_bins": {str(key): count for key, count in self.negative_bins.items()},
+                "zero_count": self.zero_count, "count": self.count}
+
+    @staticmethod
+    def from_dict(data):
+        sketch = DDSketch(data["relative_accuracy"], data.get("max_bins", 2048))
+        sketch.bins = {int(key): count for key, count in data["bins"].items()}
+        sketch.negative_bins = {int(key): count for key, count in data["negative_bins"].items()}
+        sketch.zero_count = data["zero_count"]
+        sketch.count = data["count"]
+        return sketch
+
+
+class Moments(object):
+    '''个数、最小、最大、均值和方差的累计量，Welford 算法逐个更新，Chan 的公式合并
+    '''
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other):
+        if not other.count:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.mean += delta * other.count / count
+        self.count = count
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+
+    @property
+    def stdev(self):
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+    def to_dict(self):
+        return {"count": self.count, "mean": self.mean, "m2": self.m2, "min": self.min, "max": self.max}
+
+    @staticmethod
+    def from_dict(data):
+        moments = Moments()
+        moments.count = data["count"]
+        moments.mean = data["mean"]
+        moments.m2 = data["m2"]
+        moments.min = data["min"]
+        moments.max = data["max"]
+        return moments
+
+
+class StreamSummary(object):
+    '''一列数据的流式汇总
+    '''
+
+    def __init__(self, relative_accuracy=0.01):
+        self.moments = Moments()
+        self.sketch = DDSketch(relative_accuracy)
+
+    def add(self, value):
+        self.moments.add(value)
+        self.sketch.add(value)
+
+    def merge(self, other):
+        self.moments.merge(other.moments)
+        self.sketch.merge(other.sketch)
+
+    def summary(self, digits=2):
+        '''
+        :return: dict count min mean stdev p50 p95 p99 max，分位数用最小最大值截断，sketch的桶中值可能略超出实际范围
+        '''
+        moments = self.moments
+
+        def clip(value):
+            if value is None:
+                return None
+            return round(min(max(value, moments.min), moments.max), digits)
+
+        return {"count": moments.count,
+                "min": clip(moments.min),
+                "mean": round(moments.mean, digits) if moments.count else None,
+                "stdev": round(moments.stdev, digits),
+                "p50": clip(self.sketch.quantile(0.5)),
+                "p95": clip(self.sketch.quantile(0.95)),
+                "p99": clip(self.sketch.quantile(0.99)),
+                "max": clip(moments.max)}
+
+    def to_dict(self):
+        return {"moments": self.moments.to_dict(), "sketch": self.sketch.to_dict()}
+
+    @staticmethod
+    def from_dict(data):
+        summary = StreamSummary()
+        summary.moments = Moments.from_dict(data["moments"])
+        summary.sketch = DDSketch.from_dict(data["sketch"])
+        return summary
+
+
+class SketchSink(object):
+    '''
+    Session 的 sink，每行数据的每个数值列更新一个 StreamSummary，名字为 数据名/列名，多包的列带包名前缀，
+    如 cpuinfo/com.taobao.taobao:pid_cpu%；定期和停止时写 metric_summary.json（可合并的完整状态）
+    和 metric_summary.csv（报告中的 Summary 表）
+    '''
+
+    def __init__(self, save_path, interval=30, relative_accuracy=0.01):
+        self.save_path = save_path
+        self.interval = interval
+        self.relative_accuracy = relative_accuracy
+        self.summaries = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def __call__(self, metric, timestamp, title, row):
+        from mobileperf.android.globaldata import Session
+        # 第一列是时间
+        values = Session.row_to_values(title[1:], row[1:])
+        with self._lock:
+            for key, value in values.items():
+                if key.split(":")[-1] in SKIP_COLUMNS:
+                    continue
+                try:
+                    value = float(value)
+                except (TypeError, ValueError):
+                    continue
+                if math.isnan(value) or math.isinf(value):
+                    continue
+                name = "%s/%s" % (metric, key)
+                summary = self.summaries.get(name)
+                if summary is None:
+                    summary = self.summaries[name] = StreamSummary(self.relative_accuracy)
+                summary.add(value)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._save_thread, name="metric_summary")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=2)
+        self.save()
+
+    def _save_thread(self):
+        while not self._stop_event.wait(self.interval):
+            self.save()
+
+    def rows(self):
+        '''[[SUMMARY_TITLE 对应的值]]，按数据名和列名排序
+        '''
+        with self._lock:
+            items = [(name, summary.summary()) for name, summary in self.summaries.items()]
+        rows = []
+        for name, result in sorted(items):
+            metric, column = name.split("/", 1)
+            rows.append([metric, column] + [result[key] if result[key] is not None else "" for key in SUMMARY_TITLE[2:]])
+        return rows
+
+    def save(self):
+        if not self.save_path:
+            return
+        try:
+            with self._lock:
+                state = {name: summary.to_dict() for name, summary in self.summaries.items()}
+            json_file = os.path.join(self.save_path, SUMMARY_JSON)
+            with open(json_file + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(state, f)
+            os.replace(json_file + ".tmp", json_file)
+            with open(os.path.join(self.save_path, SUMMARY_CSV), "w", encoding="utf-8") as f:
+                writer = csv.writer(f, lineterminator='\n')
+                writer.writerow(SUMMARY_TITLE)
+                writer.writerows(self.rows())
+        except Exception as e:
+            logger.error("write metric summary failed: %s" % e)
+
+    @staticmethod
+    def load(json_file):
+        '''
+        读取 metric_summary.json
+        :return: {名字: StreamSummary}，多次测试的结果可以逐个 merge
+        '''
+        with open(json_file, "r", encoding="utf-8") as f:
+            return {name: StreamSummary.from_dict(data) for name, data in json.load(f).items()}
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+'''
+@author:     look
+
+@copyright:  1999-2020 Alibaba.com. All rights reserved.
+
+@license:    Apache Software License 2.0
+
+@contact:    390125133@qq.com
+'''
+'''
+性能数据的统计汇总：均值、中位数、p90、标准差、均值的95%置信区间和离群值剔除，
+样本量一般只有十几次（如启动耗时），置信区间用t分布
+'''
+import math
+import statistics
+
+# 双侧95%置信度的t分布临界值，按自由度
+T_95 = {1: 12.706, 2: 4.303, 3: 3.182, 4: 2.776, 5: 2.571, 6: 2.447, 7: 2.365, 8: 2.306, 9: 2.262, 10: 2.228,
+        11: 2.201, 12: 2.179, 13: 2.160, 14: 2.145, 15: 2.131, 16: 2.120, 17: 2.110, 18: 2.101, 19: 2.093,
+        20: 2.086, 25: 2.060, 30: 2.042, 40: 2.021, 60: 2.000, 120: 1.980}
+
+
+def percentile(values, percent):
+    '''
+    线性插值的分位数，与 numpy.percentile 默认方式一致
+    :param list values: 数据，不需要排序
+    :param float percent: 0-100
+    '''
+    if not values:
+        return None
+    values = sorted(values)
+    rank = (len(values) - 1) * percent / 100.0
+    low = int(math.floor(rank))
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+def t_critical(df):
+    '''自由度 df 的双侧95% t临界值，表中没有的取较小自由度的值（偏保守）
+    '''
+    if df < 1:
+        return None
+    if df > 120:
+        return 1.96
+    return T_95[max(key for key in T_95 if key <= df)]
+
+
+def confidence_interval(values):
+    '''
+    均值的95%置信区间
+    :return: (下限, 上限)，少于2个数据时返回 (None, None)
+    '''
+    if len(values) < 2:
+        return None, None
+    mean = statistics.mean(values)
+    half = t_critical(len(values) - 1) * statistics.stdev(values) / math.sqrt(len(values))
+    return mean - half, mean + half
+
+
+def reject_outliers(values, k=1.5):
+    '''
+    Tukey 方法剔除离群值：超出 [Q1 - k*IQR, Q3 + k*IQR] 的数据，少于4个数据时不剔除
+    :return: (保留的数据, 剔除的数据)，保持原顺序
+    '''
+    if len(values) < 4:
+        return list(values), []
+    q1 = percentile(values, 25)
+    q3 = percentile(values, 75)
+    low = q1 - k * (q3 - q1)
+    high = q3 + k * (q3 - q1)
+    kept = [value for value in values if low <= value <= high]
+    rejected = [value for value in values if value < low or value > high]
+    return kept, rejected
+
+
+def summarize(values, digits=2):
+    '''
+    :return: dict n mean median p90 stdev ci95_low ci95_high min max，没有数据时除n外都是None
+    '''
+    result = {"n": len(values), "mean": None, "median": None, "p90": None, "stdev": None,
+              "ci95_low": None, "ci95_high": None, "min": None, "max": None}
+    if not values:
+        return result
+    low, high = confidence_interval(values)
+    result.update({"mean": statistics.mean(values),
+                   "median": statistics.median(values),
+                   "p90": percentile(values, 90),
+                   "stdev": statistics.stdev(values) if len(values) > 1 else 0,
+                   "ci95_low": low,
+                   "ci95_high": high,
+                   "min": min(values),
+                   "max": max(values)})
+    for key, value in result.items():
+        if key != "n" and value is not None:
+            result[key] = round(value, digits)
+    return result
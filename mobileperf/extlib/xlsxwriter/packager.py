@@ -6,10 +6,12 @@
 #
 
 # Standard packages.
+import io
 import os
 import stat
 import tempfile
 from shutil import copy
+from zipfile import ZipInfo
 
 from .compatibility import StringIO
 from .compatibility import BytesIO
@@ -27,6 +29,7 @@ from .vml import Vml
 from .table import Table
 from .comments import Comments
 from .exceptions import EmptyChartSeries
+from .xmlwriter import XML_BUFFER_SIZE
 
 
 class Packager(object):
@@ -87,6 +90,7 @@ class Packager(object):
 
         self.tmpdir = ''
         self.in_memory = False
+        self.zip_file = None
         self.workbook = None
         self.worksheet_count = 0
         self.chartsheet_count = 0
@@ -112,6 +116,11 @@ class Packager(object):
         # Set the optional 'in_memory' mode.
         self.in_memory = in_memory
 
+    def _set_zip_file(self, zip_file):
+        # Set the optional 'streaming' mode. The parts are written directly
+        # into entries of the open ZipFile instead of temp files or streams.
+        self.zip_file = zip_file
+
     def _add_workbook(self, workbook):
         # Add the Excel::Writer::XLSX::Workbook object to the package.
         self.workbook = workbook
@@ -157,6 +166,13 @@ class Packager(object):
     def _filename(self, xml_filename):
         # Create a temp filename to write the XML data to and store the Excel
         # filename to use as the name in the Zip container.
+        if self.zip_file:
+            # In streaming mode return a text stream to the zip entry. The
+            # XML writer closes it after the part is assembled.
+            zip_stream = self.zip_file.open(self._zip_info(xml_filename), 'w')
+            zip_stream = io.BufferedWriter(zip_stream, XML_BUFFER_SIZE)
+            return io.TextIOWrapper(zip_stream, encoding='utf-8', newline='')
+
         if self.in_memory:
             os_filename = StringIO()
         else:
@@ -167,6 +183,22 @@ class Packager(object):
 
         return os_filename
 
+    def _zip_info(self, xml_filename):
+        # Zip entry with the fixed timestamp and the ZipFile compression.
+        zipinfo = ZipInfo(xml_filename, (1980, 1, 1, 0, 0, 0))
+        zipinfo.compress_type = self.zip_file.compression
+        # ZipInfo has no public compression level before Python 3.13.
+        zipinfo._compresslevel = self.zip_file.compresslevel
+        return zipinfo
+
+    def _add_binary_file(self, stream, xml_filename):
+        # Add an image or vbaProject.bin byte stream to the package.
+        if self.zip_file:
+            self.zip_file.writestr(self._zip_info(xml_filename),
+                                   stream.getvalue())
+        else:
+            self.filenames.append((stream, xml_filename, True))
+
     def _write_workbook_file(self):
         # Write the workbook.xml file.
         workbook = self.workbook
@@ -599,7 +631,7 @@ class Packager(object):
 
             xml_image_name = 'xl/media/image' + str(index) + ext
 
-            if not self.in_memory:
+            if not self.in_memory and not self.zip_file:
                 # In file mode we just write or copy the image file.
                 os_filename = self._filename(xml_image_name)
 
@@ -628,7 +660,7 @@ class Packager(object):
                     os_filename = BytesIO(image_data)
                     image_file.close()
 
-                self.filenames.append((os_filename, xml_image_name, True))
+                self._add_binary_file(os_filename, xml_image_name)
 
             index += 1
 
@@ -642,7 +674,7 @@ class Packager(object):
 
         xml_vba_name = 'xl/vbaProject.bin'
 
-        if not self.in_memory:
+        if not self.in_memory and not self.zip_file:
             # In file mode we just write or copy the VBA file.
             os_filename = self._filename(xml_vba_name)
 
@@ -665,4 +697,4 @@ class Packager(object):
                 os_filename = BytesIO(vba_data)
                 vba_file.close()
 
-            self.filenames.append((os_filename, xml_vba_name, True))
+            self._add_binary_file(os_filename, xml_vba_name)
@@ -6,7 +6,7 @@
 #
 
 # Standard packages.
-import codecs
+import io
 import sys
 
 # Standard packages in Python 2/3 compatibility mode.
@@ -52,9 +52,13 @@ class Theme(object):
         if isinstance(filename, StringIO):
             self.internal_fh = False
             self.fh = filename
+        elif isinstance(filename, io.TextIOBase):
+            # A zip entry stream in streaming mode.
+            self.internal_fh = True
+            self.fh = filename
         else:
             self.internal_fh = True
-            self.fh = codecs.open(filename, 'w', 'utf-8')
+            self.fh = io.open(filename, 'w', encoding='utf-8', newline='')
 
     ###########################################################################
     #
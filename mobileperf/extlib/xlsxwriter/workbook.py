@@ -78,6 +78,8 @@ class Workbook(xmlwriter.XMLwriter):
         self.default_date_format = options.get('default_date_format', None)
         self.constant_memory = options.get('constant_memory', False)
         self.in_memory = options.get('in_memory', False)
+        self.streaming = options.get('streaming', False)
+        self.compress_level = options.get('compress_level', None)
         self.excel2003_style = options.get('excel2003_style', False)
         self.remove_timezone = options.get('remove_timezone', False)
         self.default_format_properties = \
@@ -646,13 +648,30 @@ class Workbook(xmlwriter.XMLwriter):
         packager._add_workbook(self)
         packager._set_tmpdir(self.tmpdir)
         packager._set_in_memory(self.in_memory)
+
+        if self.streaming:
+            # Write the parts directly into the zip file.
+            xlsx_file = self._open_zip_file()
+            try:
+                packager._set_zip_file(xlsx_file)
+                packager._create_package()
+            except Exception:
+                # Don't leave a truncated xlsx behind, the same as the
+                # temp file mode which writes nothing on error.
+                xlsx_file.close()
+                if isinstance(self.filename, str_types) \
+                        and os.path.exists(self.filename):
+                    os.remove(self.filename)
+                raise
+            xlsx_file.close()
+            return
+
         xml_files = packager._create_package()
 
         # Free up the Packager object.
         packager = None
 
-        xlsx_file = ZipFile(self.filename, "w", compression=ZIP_DEFLATED,
-                            allowZip64=self.allow_zip64)
+        xlsx_file = self._open_zip_file()
 
         # Add XML sub-files to the Zip file with their Excel filename.
         for os_filename, xml_filename, is_binary in xml_files:
@@ -660,8 +679,9 @@ class Workbook(xmlwriter.XMLwriter):
 
                 zipinfo = ZipInfo(xml_filename, (1980, 1, 1, 0, 0, 0))
 
-                # Copy compression type from parent ZipFile.
+                # Copy compression type and level from parent ZipFile.
                 zipinfo.compress_type = xlsx_file.compression
+                zipinfo._compresslevel = xlsx_file.compresslevel
 
                 if is_binary:
                     xlsx_file.writestr(zipinfo, os_filename.getvalue())
@@ -679,6 +699,17 @@ class Workbook(xmlwriter.XMLwriter):
 
         xlsx_file.close()
 
+    def _open_zip_file(self):
+        # Open the output zip file with the optional compression level,
+        # 1 is the fastest deflate and 9 the smallest.
+        if self.compress_level is None:
+            return ZipFile(self.filename, "w", compression=ZIP_DEFLATED,
+                           allowZip64=self.allow_zip64)
+
+        return ZipFile(self.filename, "w", compression=ZIP_DEFLATED,
+                       allowZip64=self.allow_zip64,
+                       compresslevel=self.compress_level)
+
     def _add_sheet(self, name, worksheet_class=None):
         # Utility for shared code in add_worksheet() and add_chartsheet().
 
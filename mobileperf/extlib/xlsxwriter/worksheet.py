@@ -6,8 +6,8 @@
 #
 
 # Standard packages.
-import codecs
 import datetime
+import io
 import os
 import re
 import sys
@@ -139,6 +139,14 @@ cell_formula_tuple = namedtuple('Formula', 'formula, format, value')
 cell_arformula_tuple = namedtuple('ArrayFormula',
                                   'formula, format, value, range')
 
+# Column types for write_rows().
+COL_TYPES = ('number', 'string', None)
+
+# In-line strings that need escaping or whitespace preservation. These are
+# written via _write_cell() instead of the write_rows() fast path.
+inline_special = re.compile('[\x00-\x08\x0B-\x1F<>&￾￿]'
+                            r'|_x[0-9a-fA-F]{4}_|^\s|\s$')
+
 
 ###############################################################################
 #
@@ -1120,6 +1128,244 @@ class Worksheet(xmlwriter.XMLwriter):
 
         return 0
 
+    @convert_cell_args
+    def write_rows(self, row, col, data, col_types=None, cell_format=None):
+        """
+        Write a 2-D block of data starting from (row, col). This is a faster
+        alternative to calling write_row() for each row when the type of each
+        column is known in advance.
+
+        Args:
+            row:       The first cell row (zero indexed).
+            col:       The first cell column (zero indexed).
+            data:      An iterable of rows, each a list of tokens.
+            col_types: A list with one type per column: 'number', 'string'
+                       or None. Typed cells are stored directly, like
+                       write_number() and write_string(), without the type
+                       dispatch of write(). Tokens that don't match the
+                       column type, None columns and NaN/INF numbers fall
+                       back to write(). Empty ('' or None) tokens are blank.
+            format:    An optional cell Format object.
+        Returns:
+            0:  Success.
+            -1: Row or column is out of worksheet bounds.
+            other: Return value of write() method.
+
+        """
+        if row < 0 or col < 0:
+            return -1
+
+        col_types = list(col_types or [])
+        for col_type in col_types:
+            if col_type not in COL_TYPES:
+                raise ValueError("Unknown column type '%s' in write_rows()"
+                                 % col_type)
+
+        if self.constant_memory:
+            # Rows before the current row have already been written.
+            if row < self.previous_row:
+                return -1
+            if row > self.previous_row:
+                self._write_single_row(row)
+            return self._write_rows_inline(row, col, data, col_types,
+                                           cell_format)
+
+        table = self.table
+        get_string_index = self.str_table._get_shared_string_index
+        strmax = self.xls_strmax
+
+        for row_num, values in enumerate(data, row):
+            if (row_num >= self.xls_rowmax
+                    or col + len(values) > self.xls_colmax):
+                return -1
+
+            cells = None
+            first = None
+            last = None
+            for index, value in enumerate(values):
+                col_type = col_types[index] if index < len(col_types) else None
+                value_type = type(value)
+
+                if col_type == 'number' and (value_type is float
+                                             or value_type is int):
+                    # NaN and INF fail this test.
+                    if value - value == 0:
+                        if cells is None:
+                            cells = table[row_num]
+                        cells[col + index] = cell_number_tuple(value,
+                                                               cell_format)
+                        if first is None:
+                            first = index
+                        last = index
+                        continue
+
+                elif (col_type == 'string' and value_type is str
+                        and 0 < len(value) <= strmax):
+                    if cells is None:
+                        cells = table[row_num]
+                    cells[col + index] = cell_string_tuple(
+                        get_string_index(value), cell_format)
+                    if first is None:
+                        first = index
+                    last = index
+                    continue
+
+                if (value is None or value == '') and cell_format is None:
+                    continue
+
+                # Everything else is written cell by cell.
+                error = self._write_typed(row_num, col + index, value,
+                                          col_type, cell_format)
+                if error:
+                    if first is not None:
+                        self._update_dimensions(row_num, col + first,
+                                                col + last)
+                    return error
+
+            if first is not None:
+                self._update_dimensions(row_num, col + first, col + last)
+
+        return 0
+
+    def _write_typed(self, row, col, value, col_type, cell_format=None):
+        # Write a single cell of write_rows() that isn't on the fast path.
+        if value is None or value == '':
+            return self._write_blank(row, col, value, cell_format)
+
+        if col_type == 'string' and isinstance(value, str_types):
+            return self._write_string(row, col, value, cell_format)
+
+        return self._write(row, col, value, cell_format)
+
+    def _update_dimensions(self, row, col_min, col_max):
+        # Store the max and min values of a block written by write_rows().
+        if self.dim_rowmin is None or row < self.dim_rowmin:
+            self.dim_rowmin = row
+        if self.dim_rowmax is None or row > self.dim_rowmax:
+            self.dim_rowmax = row
+        if self.dim_colmin is None or col_min < self.dim_colmin:
+            self.dim_colmin = col_min
+        if self.dim_colmax is None or col_max > self.dim_colmax:
+            self.dim_colmax = col_max
+
+    def _write_rows_inline(self, row, col, data, col_types, cell_format):
+        # The constant_memory version of write_rows(). Rows are written to
+        # the row data file as XML directly, without building cell tuples
+        # in the data table. Rows with set_row() properties or comments, or
+        # with cells already in the table, go through _write_single_row().
+        # Rows are only written if they contain data.
+        row_attributes = ''
+        if self.default_row_height != self.original_row_height:
+            row_attributes += ' ht="%s" customHeight="1"' % \
+                self.default_row_height
+        if self.excel_version == 2010:
+            row_attributes += ' x14ac:dyDescent="0.25"'
+
+        # The cell style is the same for all cells in a column.
+        styles = []
+        col_names = []
+
+        def column(index):
+            while len(col_names) <= index:
+                col_num = col + len(col_names)
+                col_names.append(xl_col_to_name(col_num))
+                if cell_format:
+                    xf_index = cell_format._get_xf_index()
+                elif col_num in self.col_formats:
+                    xf_index = self.col_formats[col_num]._get_xf_index()
+                else:
+                    xf_index = 0
+                styles.append(' s="%d"' % xf_index if xf_index else '')
+
+        write = self.fh.write
+        strmax = self.xls_strmax
+
+        for row_num, values in enumerate(data, row):
+            if (row_num >= self.xls_rowmax
+                    or col + len(values) > self.xls_colmax):
+                return -1
+
+            if (self.table or row_num in self.set_rows
+                    or row_num in self.comments):
+                for index, value in enumerate(values):
+                    col_type = col_types[index] \
+                        if index < len(col_types) else None
+                    if (value is None or value == '') and cell_format is None:
+                        continue
+                    error = self._write_typed(row_num, col + index, value,
+                                              col_type, cell_format)
+                    if error:
+                        return error
+                self._write_single_row(row_num + 1)
+                continue
+
+            column(len(values) - 1)
+            row_str = str(row_num + 1)
+            row_tag = '<row r="%s"%s>' % (row_str, row_attributes)
+            parts = [row_tag]
+            started = False
+            first = None
+            last = None
+            error = 0
+            for index, value in enumerate(values):
+                col_type = col_types[index] if index < len(col_types) else None
+                value_type = type(value)
+
+                if col_type == 'number' and (value_type is float
+                                             or value_type is int):
+                    # NaN and INF fail this test.
+                    if value - value == 0:
+                        parts.append('<c r="%s%s"%s><v>%.16g</v></c>'
+                                     % (col_names[index], row_str,
+                                        styles[index], value))
+                        if first is None:
+                            first = index
+                        last = index
+                        continue
+
+                elif (col_type == 'string' and value_type is str
+                        and 0 < len(value) <= strmax
+                        and not inline_special.search(value)):
+                    parts.append('<c r="%s%s"%s t="inlineStr"><is><t>%s</t>'
+                                 '</is></c>' % (col_names[index], row_str,
+                                                styles[index], value))
+                    if first is None:
+                        first = index
+                    last = index
+                    continue
+
+                if (value is None or value == '') and cell_format is None:
+                    continue
+
+                # Other cells go through the table and are written in
+                # order with the fast path cells.
+                self.previous_row = row_num
+                error = self._write_typed(row_num, col + index, value,
+                                          col_type, cell_format)
+                cell = self.table[row_num].pop(col + index, None)
+                self.table.clear()
+                if cell is not None:
+                    write(''.join(parts))
+                    parts = []
+                    started = True
+                    self._write_cell(row_num, col + index, cell)
+                    if first is None:
+                        first = index
+                    last = index
+                if error:
+                    break
+
+            if len(parts) > 1 or started:
+                parts.append('</row>')
+                write(''.join(parts))
+                self._update_dimensions(row_num, col + first, col + last)
+
+            self.previous_row = row_num + 1
+            if error:
+                return error
+
+        return 0
+
     @convert_cell_args
     def insert_image(self, row, col, filename, options=None):
         """
@@ -3707,7 +3953,9 @@ class Worksheet(xmlwriter.XMLwriter):
             (fd, filename) = tempfile.mkstemp(dir=self.tmpdir)
             os.close(fd)
             self.row_data_filename = filename
-            self.row_data_fh = codecs.open(filename, 'w+', 'utf-8')
+            self.row_data_fh = io.open(filename, 'w+', encoding='utf-8',
+                                       newline='',
+                                       buffering=xmlwriter.XML_BUFFER_SIZE)
 
             # Set as the worksheet filehandle until the file is assembled.
             self.fh = self.row_data_fh
@@ -4933,7 +5181,9 @@ class Worksheet(xmlwriter.XMLwriter):
         # Reopen the row data filehandle in constant_memory mode.
         if self.row_data_fh_closed:
             filename = self.row_data_filename
-            self.row_data_fh = codecs.open(filename, 'a+', 'utf-8')
+            self.row_data_fh = io.open(filename, 'a+', encoding='utf-8',
+                                       newline='',
+                                       buffering=xmlwriter.XML_BUFFER_SIZE)
             self.row_data_fh_closed = False
             self.fh = self.row_data_fh
 
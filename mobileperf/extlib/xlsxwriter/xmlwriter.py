@@ -8,11 +8,22 @@
 #
 
 # Standard packages.
+import io
 import re
-import codecs
 
 # Standard packages in Python 2/3 compatibility mode.
 from .compatibility import StringIO
+from .compatibility import str_types
+
+# Buffer size of the XML files. Elements are written with many small
+# writes, the io text layer batches them into chunks of this size.
+XML_BUFFER_SIZE = 1024 * 1024
+
+# Single pass translation tables for the XML escapes.
+attribute_escapes = {ord('&'): u'&amp;', ord('"'): u'&quot;',
+                     ord('<'): u'&lt;', ord('>'): u'&gt;',
+                     ord('\n'): u'&#xA;'}
+data_escapes = {ord('&'): u'&amp;', ord('<'): u'&lt;', ord('>'): u'&gt;'}
 
 
 class XMLwriter(object):
@@ -36,9 +47,15 @@ class XMLwriter(object):
         if isinstance(filename, StringIO):
             self.internal_fh = False
             self.fh = filename
+        elif isinstance(filename, io.TextIOBase):
+            # A zip entry stream in streaming mode. Closing it finishes
+            # the entry.
+            self.internal_fh = True
+            self.fh = filename
         else:
             self.internal_fh = True
-            self.fh = codecs.open(filename, 'w', 'utf-8')
+            self.fh = io.open(filename, 'w', encoding='utf-8', newline='',
+                              buffering=XML_BUFFER_SIZE)
 
     def _xml_close(self):
         # Close the XML filehandle if we created it.
@@ -178,33 +195,23 @@ class XMLwriter(object):
                       (attr, string))
 
     def _escape_attributes(self, attribute):
-        # Escape XML characters in attributes.
-        try:
-            if not self.escapes.search(attribute):
-                return attribute
-        except TypeError:
+        # Escape XML characters in attributes. Most attributes are numbers
+        # or plain strings and are returned unchanged.
+        if (not isinstance(attribute, str_types)
+                or not self.escapes.search(attribute)):
             return attribute
 
-        attribute = re.sub('[&]', '&amp;', attribute)
-        attribute = re.sub('["]', '&quot;', attribute)
-        attribute = re.sub('[<]', '&lt;', attribute)
-        attribute = re.sub('[>]', '&gt;', attribute)
-        attribute = re.sub('[\n]', '&#xA;', attribute)
-
-        return attribute
+        return attribute.translate(attribute_escapes)
 
     def _escape_data(self, data):
         # Escape XML characters in data sections of tags.  Note, this
         # is different from _escape_attributes() in that double quotes
-        # are not escaped by Excel.
+        # are not escaped by Excel. Most data, such as timestamps and
+        # names, doesn't need escaping so check for that first.
         try:
-            if not self.escapes.search(data):
+            if '&' not in data and '<' not in data and '>' not in data:
                 return data
         except TypeError:
             return data
 
-        data = re.sub('[&]', '&amp;', data)
-        data = re.sub('[<]', '&lt;', data)
-        data = re.sub('[>]', '&gt;', data)
-
-        return data
+        return data.translate(data_escapes)